@@ -0,0 +1,152 @@
+"""Times loading, sorting, filtering and grouping the library in utils.library_catalog.
+
+Fills a temporary database with synthetic videos (a share of them in version
+groups, played or half watched), loads them into the catalog, then times every
+sort key, a few filters, the version grouping and an incremental sync after
+some videos changed.
+
+Usage (from the repository root):
+    python -m benchmarks.catalog_benchmark --videos 50000 --repeat 20
+"""
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from unittest import mock
+
+from utils.database import schema
+from utils.database.connection import AppDatabase
+from utils.library_catalog import LibraryCatalog, SORT_KEYS, WATCH_UNWATCHED
+
+_WORDS = ("the", "last", "night", "city", "dark", "river", "king", "love", "war", "blue", "house", "star")
+_GENRES = ("Action", "Drama", "Comedy", "Thriller", "Horror", "Romance", "Animation", "Documentary", "Crime")
+_LANGUAGES = ("English", "French", "German", "Japanese", "Spanish", "Italian", "Korean")
+
+
+def fill_database(video_count: int) -> None:
+    """Writes synthetic videos, fingerprints and watch state straight into the database"""
+    rng = random.Random(0)
+    conn = AppDatabase.get_connection()
+    videos, fingerprints, positions, watched = [], [], [], []
+    for idx in range(video_count):
+        path = f"/media/movies/{idx:06d}.mkv"
+        title = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 4))).title() + f" {idx % 5000}"
+        seconds = rng.randint(20 * 60, 180 * 60)
+        videos.append(
+            (
+                "English" if rng.random() < 0.6 else rng.choice(_LANGUAGES),
+                f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}.000",
+                "",
+                path,
+                "",
+                title,
+                "Some Director",
+                str(rng.randint(1950, 2024)),
+                "",
+                "|".join(rng.sample(_GENRES, rng.randint(1, 3))),
+                "",
+                time.time() - rng.uniform(0, 3 * 365 * 86400),
+            )
+        )
+        # One video in ten is a second version of the previous one
+        group_id = idx - 1 if idx and rng.random() < 0.1 else idx
+        fingerprints.append((path, seconds, rng.randint(700_000_000, 9_000_000_000), "[]", group_id + 1))
+        if rng.random() < 0.05:
+            positions.append((path, rng.randint(60, seconds // 2), time.time()))
+        elif rng.random() < 0.2:
+            watched.append((path, time.time()))
+
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO video_metadata (
+                language, length, image_path, full_path, full_sub_path, tmdb_title, tmdb_director,
+                tmdb_year, tmdb_overview, tmdb_genres, tmdb_poster_path, added_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """,
+            videos,
+        )
+        conn.executemany(
+            """
+            INSERT INTO video_fingerprint (full_path, duration_secs, size, frame_hashes, group_id)
+            VALUES (?, ?, ?, ?, ?);
+            """,
+            fingerprints,
+        )
+        conn.executemany(
+            "INSERT INTO playback_state (full_path, position_secs, updated_at) VALUES (?, ?, ?);", positions
+        )
+        conn.executemany("INSERT INTO video_watched (full_path, watched_at) VALUES (?, ?);", watched)
+
+
+def time_ms(func, repeat: int) -> float:
+    """Best of 'repeat' runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started_at)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=50_000, help="Videos in the synthetic library")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per timing, the best one is reported")
+    parser.add_argument("--changes", type=int, default=100, help="Videos updated before the incremental sync")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="cinenomad_catalog_bench_")
+    try:
+        with mock.patch.object(AppDatabase, "_path", os.path.join(root, "database.db")):
+            schema.create_tables()
+            fill_database(args.videos)
+
+            catalog = LibraryCatalog()
+            started_at = time.perf_counter()
+            catalog.sync()
+            print(f"Load: {len(catalog)} videos in {(time.perf_counter() - started_at) * 1000:.0f} ms")
+
+            for key in SORT_KEYS:
+                print(f"Sort by {key}: {time_ms(lambda key=key: catalog.sort(key), args.repeat):.2f} ms")
+            print(f"Sort by year, descending: {time_ms(lambda: catalog.sort('year', True), args.repeat):.2f} ms")
+
+            filters = {
+                "genres": {"genres": ["Drama", "Crime"]},
+                "language": {"languages": ["French"]},
+                "years and runtime": {"years": (1990, 2010), "max_runtime_mins": 100},
+                "unwatched": {"watch_states": [WATCH_UNWATCHED]},
+            }
+            for name, criteria in filters.items():
+                matched = len(catalog.filter(**criteria))
+                elapsed = time_ms(lambda criteria=criteria: catalog.filter(**criteria), args.repeat)
+                print(f"Filter on {name}: {elapsed:.2f} ms ({matched} videos)")
+
+            rows = catalog.sort("title")
+            heads = catalog.group_heads("version", rows)
+            elapsed = time_ms(lambda: catalog.group_heads("version", rows), args.repeat)
+            print(f"Version heads: {elapsed:.2f} ms ({len(heads)} titles)")
+            print(f"Group by language: {time_ms(lambda: catalog.group('language', rows), args.repeat):.2f} ms")
+
+            conn = AppDatabase.get_connection()
+            with conn:
+                conn.execute(
+                    "UPDATE video_metadata SET tmdb_title = tmdb_title || ' Redux' WHERE id % ? = 0;",
+                    [max(args.videos // args.changes, 1)],
+                )
+            started_at = time.perf_counter()
+            catalog.sync()
+            elapsed = (time.perf_counter() - started_at) * 1000
+            print(f"Incremental sync of about {args.changes} changes: {elapsed:.1f} ms")
+            print(f"Sort by title after it: {time_ms(lambda: catalog.sort('title'), 1):.2f} ms (title ranks rebuilt)")
+
+            AppDatabase.close_connection()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Compares the legacy os.walk based file listing with utils.directory_scanner.
+
+Builds a synthetic library tree in a temporary folder and times both walkers on it,
+once on the local disk and once with an injected per-call latency that models a
+network share (every directory listing and every stat is one round trip).
+
+Usage (from the repository root):
+    python -m benchmarks.directory_scan_benchmark --folders 200 --files 50 --latency-ms 2
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from contextlib import contextmanager
+from unittest import mock
+
+from utils.directory_scanner import scan_video_files
+from utils.config_service import ConfigService
+
+_real_scandir = os.scandir
+_real_stat = os.stat
+
+
+def build_library(root: str, folder_count: int, files_per_folder: int) -> int:
+    """Creates empty video (and some non video) files spread over nested folders
+
+    Returns:
+        int: Number of video files created
+    """
+    video_count = 0
+    for folder_idx in range(folder_count):
+        # Two levels of nesting, like Show/Season or Collection/Movie
+        folder = os.path.join(root, f"group_{folder_idx % 10}", f"folder_{folder_idx}")
+        os.makedirs(folder, exist_ok=True)
+        for file_idx in range(files_per_folder):
+            extension = ("mkv", "mp4", "srt", "nfo")[file_idx % 4]
+            with open(os.path.join(folder, f"file_{file_idx}.{extension}"), "wb"):
+                pass
+            video_count += extension in ("mkv", "mp4")
+    return video_count
+
+
+def legacy_scan(folder_path: str, accepted_extensions: list[str]) -> list[str]:
+    """The file listing VideoMetadataReader used before the scandir walker"""
+    file_names = []
+    for dirpath, _, filenames in os.walk(folder_path):
+        for file in filenames:
+            full_path = os.path.join(dirpath, file)
+            if os.path.isfile(full_path):
+                file_names.append(full_path)
+
+    return [
+        file_name
+        for file_name in file_names
+        if file_name.split(".")[-1].lower() in accepted_extensions
+    ]
+
+
+@contextmanager
+def simulated_latency(latency_seconds: float):
+    """Adds a fixed delay to every directory listing and stat call"""
+
+    def slow_scandir(*args, **kwargs):
+        time.sleep(latency_seconds)
+        return _real_scandir(*args, **kwargs)
+
+    def slow_stat(*args, **kwargs):
+        time.sleep(latency_seconds)
+        return _real_stat(*args, **kwargs)
+
+    with mock.patch("os.scandir", slow_scandir), mock.patch("os.stat", slow_stat):
+        yield
+
+
+def time_call(func) -> tuple[float, int]:
+    start = time.perf_counter()
+    count = len(list(func()))
+    return time.perf_counter() - start, count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--folders", type=int, default=200, help="Number of leaf folders")
+    parser.add_argument("--files", type=int, default=50, help="Files per leaf folder")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Simulated network round trip")
+    parser.add_argument("--workers", type=int, default=8, help="Scanner worker pool size")
+    args = parser.parse_args()
+
+    accepted_extensions = ConfigService.get("accepted_extension.yaml")
+    root = tempfile.mkdtemp(prefix="cinenomad_scan_bench_")
+    try:
+        video_count = build_library(root, args.folders, args.files)
+        print(f"Library: {args.folders} folders, {args.folders * args.files} files, {video_count} videos")
+
+        walkers = {
+            "legacy os.walk": lambda: legacy_scan(root, accepted_extensions),
+            "scandir walker": lambda: scan_video_files(root, accepted_extensions, args.workers),
+        }
+
+        for name, walker in walkers.items():
+            elapsed, count = time_call(walker)
+            print(f"[local]        {name:<16} {elapsed * 1000:9.1f} ms  ({count} files)")
+
+        with simulated_latency(args.latency_ms / 1000):
+            for name, walker in walkers.items():
+                elapsed, count = time_call(walker)
+                print(f"[{args.latency_ms:g} ms mount] {name:<16} {elapsed * 1000:9.1f} ms  ({count} files)")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
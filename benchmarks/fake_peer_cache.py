@@ -0,0 +1,243 @@
+"""Local stand-in for a LAN peer running utils.peer_cache.PeerCacheServer.
+
+Speaks the same protocol (single and batch lookups, posters, ETags and 304s) from
+canned entries instead of a database, and can inject latency and server errors.
+Every request is counted, so a node can be tested against it without a second
+indexer on the network.
+
+Standalone usage, serving made up titles for every video in a folder (then add
+http://127.0.0.1:8790 to Peers in config/peer_cache_config.yaml):
+    python -m benchmarks.fake_peer_cache --library /path/to/videos --port 8790 --latency-ms 5
+"""
+import io
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from utils.peer_cache import API_PREFIX, partial_content_hash
+
+
+def _build_poster_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (20, 30), (90, 40, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _etag(data: bytes) -> str:
+    return '"' + hashlib.sha1(data).hexdigest()[:20] + '"'
+
+
+class FakePeerCache:
+    """Threaded HTTP server answering like a peer for the entries added to it"""
+
+    def __init__(self, port: int = 0, latency_ms: float = 0, error_rate: float = 0, seed: int = 0) -> None:
+        """
+        Args:
+            port (int, optional): Port to listen on, 0 picks a free one. Defaults to 0.
+            latency_ms (float, optional): Delay added to every response. Defaults to 0.
+            error_rate (float, optional): Share of requests answered with HTTP 500. Defaults to 0.
+            seed (int, optional): Seed of the fault injection. Defaults to 0.
+        """
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+
+        self.stats = Counter()
+        self._entries: dict[str, dict] = {}
+        self._posters: dict[str, bytes] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._build_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "FakePeerCache":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-peer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats.clear()
+
+    def add_entry(self, content_hash: str, entry: dict, poster: bytes | None = None) -> None:
+        """Serves an entry in the wire format of utils.peer_cache, its ETag follows its content
+
+        Args:
+            content_hash (str): Key of the entry
+            entry (dict): Entry fields, 'length' and 'language' are required
+            poster (bytes, optional): Poster image served for the entry
+        """
+        entry = dict(entry, poster=_etag(poster) if poster is not None else None)
+        with self._lock:
+            self._entries[content_hash] = entry
+            if poster is not None:
+                self._posters[content_hash] = poster
+            else:
+                self._posters.pop(content_hash, None)
+
+    def add_file(self, video_path: str, title: str | None = None) -> str:
+        """Serves a made up TMDB style entry, and a poster, for a video file
+
+        Returns:
+            str: Content hash of the file
+        """
+        content_hash = partial_content_hash(video_path)
+        title = title or os.path.splitext(os.path.basename(video_path))[0].replace(".", " ")
+        self.add_entry(
+            content_hash,
+            {
+                "length": "00:01:00.000",
+                "language": "English",
+                "title": title,
+                "director": f"{title} Director",
+                "year": "2020",
+                "overview": f"Overview of {title}.",
+                "genres": ["Drama"],
+                "tmdb_poster_path": f"/{content_hash[:8]}.jpg",
+                "metadata_source": "tmdb",
+                "poster_source": "tmdb",
+                "duration_secs": None,
+                "frame_hashes": [],
+            },
+            _build_poster_bytes(),
+        )
+        return content_hash
+
+    def _answer(self, method: str, path: str, headers, body: bytes) -> tuple[int, dict, bytes | dict]:
+        parts = path[len(API_PREFIX):].strip("/").split("/") if path.startswith(API_PREFIX + "/") else []
+        if_none_match = headers.get("If-None-Match", "")
+
+        with self._lock:
+            entries, posters = dict(self._entries), dict(self._posters)
+
+        if method == "GET" and len(parts) == 2 and parts[0] == "entries":
+            entry = entries.get(parts[1])
+            if entry is None:
+                return 404, {}, {"error": "Unknown content hash"}
+            etag = _etag(json.dumps(entry, sort_keys=True).encode("utf-8"))
+            if etag == if_none_match:
+                return 304, {"ETag": etag}, b""
+            return 200, {"ETag": etag}, entry
+
+        if method == "POST" and parts == ["lookup"]:
+            known = json.loads(body)["hashes"]
+            if isinstance(known, list):
+                known = dict.fromkeys(known, "")
+            changed, unchanged = {}, []
+            for content_hash, known_etag in known.items():
+                entry = entries.get(content_hash)
+                if entry is None:
+                    continue
+                etag = _etag(json.dumps(entry, sort_keys=True).encode("utf-8"))
+                if etag == known_etag:
+                    unchanged.append(content_hash)
+                else:
+                    changed[content_hash] = dict(entry, etag=etag)
+            return 200, {}, {"entries": changed, "unchanged": unchanged}
+
+        if method == "GET" and len(parts) == 2 and parts[0] == "posters":
+            poster = posters.get(parts[1])
+            if poster is None:
+                return 404, {}, {"error": "No poster for this content hash"}
+            etag = _etag(poster)
+            if etag == if_none_match:
+                return 304, {"ETag": etag}, b""
+            return 200, {"ETag": etag}, poster
+
+        return 404, {}, {"error": "Unknown endpoint"}
+
+    def _build_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self, method: str) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                kind = self.path.split("/")[2] if self.path.count("/") >= 2 else "unknown"
+
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+
+                with server._lock:
+                    failed = server._random.random() < server.error_rate
+                if failed:
+                    status, headers, answer = 500, {}, {"error": "Injected failure"}
+                else:
+                    status, headers, answer = server._answer(method, self.path, self.headers, body)
+
+                with server._lock:
+                    server.stats[kind] += 1
+                    server.stats[f"status_{status}"] += 1
+                    server.stats["total"] += 1
+
+                payload = answer if isinstance(answer, bytes) else json.dumps(answer).encode("utf-8")
+                self.send_response(status)
+                content_type = "image/jpeg" if kind == "posters" and status == 200 else "application/json"
+                self.send_header("Content-Type", content_type)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                self._handle("GET")
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                self._handle("POST")
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        return _Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--library", help="Serve made up titles for every video under this folder")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    server = FakePeerCache(port=args.port, latency_ms=args.latency_ms, error_rate=args.error_rate)
+    if args.library:
+        for folder, _, file_names in os.walk(args.library):
+            for file_name in file_names:
+                if file_name.lower().endswith((".mp4", ".mkv", ".avi", ".mov", ".m4v", ".webm")):
+                    server.add_file(os.path.join(folder, file_name))
+    server.start()
+    print(f"Fake peer cache on {server.url}, {len(server._entries)} entries")
+    try:
+        while True:
+            time.sleep(60)
+            print(dict(server.stats))
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Local stand-in for the TMDB API and image CDN, so the scan pipeline can run offline.
+
+Serves canned answers for the endpoints used by utils/tmdb_utils.py (search, details,
+credits, configuration and poster images) and can inject latency, server errors and
+429 responses. Every request is counted so benchmarks can report network calls per file.
+
+Standalone usage (then set ApiBaseUrl / ImageBaseUrl in config/tmdb_settings.yaml):
+    python -m benchmarks.fake_tmdb_server --port 8765 --latency-ms 40 --rate-limit-rate 0.1
+"""
+import io
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+POSTER_SIZES = ["w92", "w154", "w185", "w342", "w500", "w780", "original"]
+
+
+def _build_poster_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (20, 30), (40, 40, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def title_to_id(title: str) -> int:
+    """Stable fake TMDB id for a title"""
+    return zlib.crc32(title.strip().lower().encode("utf-8")) % 10_000_000 + 1
+
+
+class FakeTmdbServer:
+    """Threaded HTTP server answering like TMDB for any searched title"""
+
+    def __init__(
+        self,
+        port: int = 0,
+        runtimes: dict[str, int] | None = None,
+        default_runtime: int = 1,
+        latency_ms: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        retry_after: float = 0.1,
+        seed: int = 0,
+    ) -> None:
+        """
+        Args:
+            port (int, optional): Port to listen on, 0 picks a free one. Defaults to 0.
+            runtimes (dict[str, int], optional): Lowercase title -> runtime in minutes
+            default_runtime (int, optional): Runtime of titles missing from 'runtimes'. Defaults to 1.
+            latency_ms (float, optional): Delay added to every response. Defaults to 0.
+            error_rate (float, optional): Share of API requests answered with HTTP 500. Defaults to 0.
+            rate_limit_rate (float, optional): Share of API requests answered with HTTP 429. Defaults to 0.
+            retry_after (float, optional): Retry-After header sent with 429 answers. Defaults to 0.1.
+            seed (int, optional): Seed of the fault injection. Defaults to 0.
+        """
+        self.runtimes = {title.lower(): runtime for title, runtime in (runtimes or {}).items()}
+        self.default_runtime = default_runtime
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+        self.stats = Counter()
+        self._titles_by_id: dict[int, str] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._poster_bytes = _build_poster_bytes()
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._build_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def api_base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/3"
+
+    @property
+    def image_base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/t/p"
+
+    def start(self) -> "FakeTmdbServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-tmdb", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats.clear()
+
+    def _pick_fault(self) -> int | None:
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def _answer(self, path: str, query: dict[str, list[str]]) -> tuple[int, dict | bytes]:
+        parts = [part for part in path.split("/") if part]
+
+        if parts[:2] == ["t", "p"]:
+            return 200, self._poster_bytes
+
+        if parts[:1] != ["3"]:
+            return 404, {"status_message": "The resource you requested could not be found."}
+        parts = parts[1:]
+
+        if parts == ["configuration"]:
+            return 200, {
+                "images": {
+                    "base_url": self.image_base_url + "/",
+                    "secure_base_url": self.image_base_url + "/",
+                    "poster_sizes": POSTER_SIZES,
+                }
+            }
+
+        if len(parts) == 2 and parts[0] == "search":
+            title = query.get("query", [""])[0]
+            if not title.strip():
+                return 200, {"page": 1, "results": []}
+            tmdb_id = title_to_id(title)
+            with self._lock:
+                self._titles_by_id[tmdb_id] = title
+            if parts[1] == "tv":
+                result = {"original_name": title, "name": title, "first_air_date": "2020-01-01"}
+            else:
+                result = {"original_title": title, "title": title, "release_date": "2020-01-01"}
+            result.update(
+                {
+                    "id": tmdb_id,
+                    "overview": f"Overview of {title}.",
+                    "genre_ids": [18],
+                    "poster_path": f"/{tmdb_id}.jpg",
+                    "original_language": "en",
+                }
+            )
+            return 200, {"page": 1, "results": [result]}
+
+        if len(parts) == 4 and parts[0] == "tv" and parts[1].isdigit() and parts[2] == "season" and parts[3].isdigit():
+            season = int(parts[3])
+            return 200, {
+                "id": int(parts[1]) * 100 + season,
+                "name": "Specials" if season == 0 else f"Season {season}",
+                "overview": f"Overview of season {season}.",
+                "poster_path": f"/{parts[1]}_{season}.jpg",
+                "season_number": season,
+            }
+
+        if len(parts) in (2, 3) and parts[0] in ("movie", "tv") and parts[1].isdigit():
+            tmdb_id = int(parts[1])
+            with self._lock:
+                title = self._titles_by_id.get(tmdb_id, str(tmdb_id))
+
+            if len(parts) == 3 and parts[2] == "credits":
+                job = "Producer" if parts[0] == "tv" else "Director"
+                return 200, {"id": tmdb_id, "crew": [{"job": job, "name": f"{title} {job}"}]}
+
+            runtime = self.runtimes.get(title.lower(), self.default_runtime)
+            if parts[0] == "tv":
+                return 200, {"id": tmdb_id, "name": title, "episode_run_time": [runtime]}
+            return 200, {"id": tmdb_id, "title": title, "runtime": runtime}
+
+        return 404, {"status_message": "The resource you requested could not be found."}
+
+    def _build_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                url = urlsplit(self.path)
+                kind = "image" if url.path.startswith("/t/p/") else url.path.split("/")[2]
+
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+
+                fault = None if kind == "image" else server._pick_fault()
+                if fault is not None:
+                    status, body = fault, {"status_message": "Injected failure"}
+                else:
+                    status, body = server._answer(url.path, parse_qs(url.query))
+
+                with server._lock:
+                    server.stats[kind] += 1
+                    server.stats[f"status_{status}"] += 1
+                    server.stats["total"] += 1
+
+                payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header(
+                    "Content-Type", "image/jpeg" if isinstance(body, bytes) else "application/json"
+                )
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        return _Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--default-runtime", type=int, default=1, help="Runtime (minutes) of every title")
+    args = parser.parse_args()
+
+    server = FakeTmdbServer(
+        port=args.port,
+        default_runtime=args.default_runtime,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    ).start()
+    print(f"Fake TMDB API on {server.api_base_url}, images on {server.image_base_url}")
+    try:
+        while True:
+            time.sleep(60)
+            print(dict(server.stats))
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""End-to-end scan benchmark that runs fully offline against benchmarks/fake_tmdb_server.py.
+
+Generates a synthetic library of tiny video files (1 fps, a few pixels wide), then
+indexes it into a throw-away database once per scenario (clean network, added latency,
+server errors, rate limiting, and a LAN peer from benchmarks/fake_peer_cache.py that
+knows every file) and reports:
+    - scan throughput (files/s), until the files are listed with their local metadata
+    - time to drain the TMDB enrichment queue afterwards
+    - network calls per file (API and poster downloads, as seen by the fake server)
+    - time spent in database writes
+
+Exits with status 1 if a scenario did not index every generated file or left one
+without metadata, the timings of a broken pipeline are meaningless.
+
+Usage (from the repository root):
+    python -m benchmarks.scan_benchmark --files 100 --jobs 4 --latency-ms 40
+"""
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from benchmarks.fake_tmdb_server import FakeTmdbServer
+from benchmarks.fake_peer_cache import FakePeerCache
+from utils import library_sources, tmdb_utils, video_metadata_reader, enrichment, peer_cache
+from utils.database import queries, schema
+from utils.database.connection import AppDatabase
+
+# Query functions that write to the database during a scan
+DB_WRITE_QUERIES = (
+    "insert_video",
+    "delete_video_by_path",
+    "upsert_source_files",
+    "upsert_tmdb_cache_entry",
+    "enqueue_enrichment_tasks",
+    "update_video_tmdb_metadata",
+    "delete_enrichment_task",
+    "reschedule_enrichment_task",
+)
+
+
+def build_library(root: str, file_count: int, duration_secs: int) -> list[str]:
+    """Writes one tiny video and copies it under release style names
+
+    Returns:
+        list[str]: Paths of the generated videos
+    """
+    template_path = os.path.join(root, "template.mp4")
+    writer = cv2.VideoWriter(template_path, cv2.VideoWriter_fourcc(*"mp4v"), 1, (16, 16))
+    for second in range(duration_secs):
+        writer.write(np.full((16, 16, 3), second % 255, dtype=np.uint8))
+    writer.release()
+
+    library_folder = os.path.join(root, "library")
+    paths = []
+    for idx in range(file_count):
+        # Spread over folders like a real collection, a tenth of them are episodes
+        folder = os.path.join(library_folder, f"group_{idx % 10}")
+        os.makedirs(folder, exist_ok=True)
+        if idx % 10 == 9:
+            file_name = f"Benchmark.Show.{idx:04d}.S01E{idx % 20 + 1:02d}.720p.mp4"
+        else:
+            file_name = f"Benchmark.Title.{idx:04d}.2020.720p.mp4"
+        path = os.path.join(folder, file_name)
+        shutil.copyfile(template_path, path)
+        paths.append(path)
+
+    os.remove(template_path)
+    return paths
+
+
+@contextlib.contextmanager
+def isolated_environment(work_dir: str, server: FakeTmdbServer):
+    """Points the database, the posters folder and the TMDB URLs at throw-away locations"""
+    db_path = os.path.join(work_dir, "database.db")
+    posters_folder = os.path.join(work_dir, "posters")
+    os.makedirs(posters_folder, exist_ok=True)
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(AppDatabase, "_path", db_path))
+        stack.enter_context(mock.patch.object(video_metadata_reader, "POSTERS_FOLDER", posters_folder))
+        stack.enter_context(mock.patch.object(tmdb_utils, "API_BASE_URL", server.api_base_url))
+        stack.enter_context(mock.patch.object(tmdb_utils, "IMAGE_BASE_URL", server.image_base_url))
+        stack.enter_context(mock.patch.object(enrichment, "_tmdb_configuration", None))
+        try:
+            schema.create_tables()
+            yield
+        finally:
+            # Pool threads still connected to this database reconnect to the next one on first use
+            AppDatabase.close_connection()
+
+
+@contextlib.contextmanager
+def timed_db_writes(timings: dict[str, float]):
+    """Accumulates the time spent in every database write query"""
+
+    def timed(name, func):
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings[name] = timings.get(name, 0.0) + time.perf_counter() - started_at
+
+        return wrapper
+
+    with contextlib.ExitStack() as stack:
+        for name in DB_WRITE_QUERIES:
+            stack.enter_context(mock.patch.object(queries, name, timed(name, getattr(queries, name))))
+        yield
+
+
+def run_scenario(
+    library_folder: str, server: FakeTmdbServer, jobs: int, verbose: bool, peer: FakePeerCache | None = None
+) -> dict:
+    """Indexes the library from scratch (empty database and TMDB cache), asking the peer first if given"""
+    db_timings = {}
+    peer_config = dict(peer_cache._load_config(), Peers=[peer.url] if peer is not None else [])
+    # Injected failures are retried right away, so draining the queue ends with every file matched
+    enrichment_config = dict(enrichment._load_config(), BackoffBaseSecs=0, BackoffMaxSecs=0)
+    with tempfile.TemporaryDirectory(prefix="cinenomad_bench_db_") as work_dir:
+        with isolated_environment(work_dir, server), timed_db_writes(db_timings), mock.patch.object(
+            peer_cache, "_load_config", lambda: peer_config
+        ), mock.patch.object(enrichment, "_load_config", lambda: enrichment_config):
+            peer_cache.PeerCache.clear()
+            source = library_sources.build_source(library_folder)
+            source.id = queries.insert_source(source)
+
+            server.reset_stats()
+            output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                started_at = time.perf_counter()
+                stats = library_sources.scan_source(source, index_workers=jobs)
+                elapsed = time.perf_counter() - started_at
+
+                started_at = time.perf_counter()
+                enriched = enrichment.drain_queue()
+                enrichment_elapsed = time.perf_counter() - started_at
+            with_metadata = sum(1 for video in queries.get_all_videos() if video.tmdb_title)
+
+    return {
+        "stats": stats,
+        "peer_requests": dict(peer.stats) if peer is not None else {},
+        "elapsed": elapsed,
+        "enriched": enriched,
+        "with_metadata": with_metadata,
+        "enrichment_elapsed": enrichment_elapsed,
+        "server_requests": dict(server.stats),
+        "db_write_seconds": sum(db_timings.values()),
+        "db_timings": db_timings,
+    }
+
+
+def print_result(name: str, result: dict) -> None:
+    stats = result["stats"]
+    files = max(stats.get("seen", 0), 1)
+    requests = result["server_requests"]
+    print(
+        f"{name:<13} {stats.get('added', 0):5d} indexed {stats.get('failed', 0):4d} failed "
+        f"{result['elapsed']:8.2f}s {files / result['elapsed']:8.1f} files/s "
+        f"{result['enriched']:5d} enriched in {result['enrichment_elapsed']:6.2f}s "
+        f"{requests.get('total', 0) / files:6.2f} calls/file "
+        f"(429: {requests.get('status_429', 0)}, 500: {requests.get('status_500', 0)}) "
+        f"{result['peer_requests'].get('total', 0) / files:5.2f} peer calls/file "
+        f"db writes {result['db_write_seconds'] * 1000:8.1f} ms"
+    )
+
+
+def check_result(name: str, result: dict, file_count: int) -> list[str]:
+    """Returns what a scenario got wrong, empty if it indexed every file and resolved all their metadata"""
+    added, failed = result["stats"].get("added", 0), result["stats"].get("failed", 0)
+    problems = []
+    if added != file_count or failed:
+        problems.append(f"{name}: indexed {added} of {file_count} files, {failed} failed")
+    if result["with_metadata"] != file_count:
+        problems.append(f"{name}: {result['with_metadata']} of {file_count} files have metadata")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--files", type=int, default=100, help="Number of videos in the library")
+    parser.add_argument("--duration-secs", type=int, default=60, help="Length of every video")
+    parser.add_argument("--jobs", type=int, default=4, help="Files indexed concurrently")
+    parser.add_argument("--latency-ms", type=float, default=40, help="Latency of the 'latency' scenario")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="HTTP 500 share of the 'errors' scenario")
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=0.2, help="HTTP 429 share of the 'rate_limited' scenario"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Show the scan output")
+    args = parser.parse_args()
+
+    scenarios = {
+        "clean": {},
+        "latency": {"latency_ms": args.latency_ms},
+        "errors": {"error_rate": args.error_rate},
+        "rate_limited": {"rate_limit_rate": args.rate_limit_rate, "retry_after": 0.05},
+    }
+
+    # Every synthetic title runs exactly as long as the generated videos
+    runtime_mins = max(args.duration_secs // 60, 1)
+
+    problems = []
+    root = tempfile.mkdtemp(prefix="cinenomad_scan_bench_")
+    try:
+        library_paths = build_library(root, args.files, args.duration_secs)
+        library_folder = os.path.join(root, "library")
+        print(f"Library: {args.files} videos of {args.duration_secs}s, {args.jobs} index jobs")
+
+        for name, faults in scenarios.items():
+            server = FakeTmdbServer(default_runtime=runtime_mins, **faults).start()
+            try:
+                result = run_scenario(library_folder, server, args.jobs, args.verbose)
+                print_result(name, result)
+                problems.extend(check_result(name, result, args.files))
+            finally:
+                server.stop()
+
+        # Another node indexed the same files, neither probing nor TMDB should be needed.
+        # The generated videos are copies of one file, so they share a single peer entry.
+        server, peer = FakeTmdbServer(default_runtime=runtime_mins).start(), FakePeerCache()
+        for path in library_paths:
+            peer.add_file(path)
+        peer.start()
+        try:
+            result = run_scenario(library_folder, server, args.jobs, args.verbose, peer)
+            print_result("peer", result)
+            problems.extend(check_result("peer", result, args.files))
+        finally:
+            server.stop()
+            peer.stop()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if problems:
+        print("Benchmark FAILED:\n  " + "\n  ".join(problems))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Times the import of a TMDB ID export and title lookups in utils.tmdb_id_index.
+
+Writes a synthetic gzipped export shaped like TMDB's daily 'movie_ids' file into a
+temporary folder, imports it and times lookups of titles that are in the index
+and titles that are not (those fall back to the search endpoint in the app).
+
+Usage (from the repository root):
+    python -m benchmarks.tmdb_id_index_benchmark --titles 1000000 --lookups 10000
+"""
+import os
+import gzip
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from unittest import mock
+
+from utils import tmdb_id_index
+from utils.tmdb_id_index import TmdbIdIndex
+
+_WORDS = ("the", "last", "night", "city", "dark", "river", "king", "love", "war", "blue", "house", "star")
+
+
+def write_export(path: str, title_count: int) -> list[str]:
+    """Writes a synthetic movie ID export
+
+    Returns:
+        list[str]: Titles written, a few shared by several ids like remakes
+    """
+    rng = random.Random(0)
+    titles = []
+    with gzip.open(path, "wt", encoding="utf_8") as export_f:
+        for tmdb_id in range(1, title_count + 1):
+            title = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 4))) + f" {tmdb_id % 50_000}"
+            titles.append(title)
+            record = {
+                "adult": False,
+                "id": tmdb_id,
+                "original_title": title.title(),
+                "popularity": round(rng.expovariate(0.5), 3),
+                "video": False,
+            }
+            export_f.write(json.dumps(record) + "\n")
+    return titles
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--titles", type=int, default=1_000_000, help="Titles in the synthetic export")
+    parser.add_argument("--lookups", type=int, default=10_000, help="Lookups timed, half of them misses")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="cinenomad_id_index_bench_")
+    try:
+        export_path = os.path.join(root, "movie_ids_01_01_2024.json.gz")
+        titles = write_export(export_path, args.titles)
+        print(f"Export: {args.titles} titles, {os.path.getsize(export_path) / 1e6:.1f} MB gzipped")
+
+        with mock.patch.object(tmdb_id_index, "INDEX_PATH", os.path.join(root, "tmdb_id_index.db")):
+            started_at = time.perf_counter()
+            TmdbIdIndex.import_export(export_path)
+            elapsed = time.perf_counter() - started_at
+            index_size = os.path.getsize(tmdb_id_index.INDEX_PATH)
+            print(f"Import: {elapsed:.1f}s, index {index_size / 1e6:.1f} MB")
+
+            rng = random.Random(1)
+            queries = [rng.choice(titles) for _ in range(args.lookups // 2)]
+            queries += [f"missing title {index}" for index in range(args.lookups - len(queries))]
+            rng.shuffle(queries)
+
+            started_at = time.perf_counter()
+            hits = sum(bool(TmdbIdIndex.lookup(title, is_tvshow=False)) for title in queries)
+            elapsed = time.perf_counter() - started_at
+            print(f"Lookups: {len(queries)} ({hits} hits), {elapsed / len(queries) * 1e6:.1f} us per lookup")
+    finally:
+        TmdbIdIndex.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""Headless commands, run them with 'python main.py <command> [options]'.
+
+Meant for cron jobs on the media box, so the heavy indexing work runs overnight
+and the GUI only has to read the database.
+"""
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+from utils import library_sources, library_snapshot, metrics
+from utils.database import queries
+from utils.database.connection import AppDatabase
+from utils.thumbnails import generate_all_thumbnails
+from utils.trickplay import generate_trickplay
+from utils.video_fingerprint import fingerprint_missing_videos
+from utils.audio_analysis import analyze_missing_videos
+from utils.enrichment import drain_queue
+from utils.tmdb_utils import get_request_stats, warm_tmdb_cache
+from utils.tmdb_id_index import TmdbIdIndex, KIND_MOVIE, KIND_TV
+from utils.peer_cache import PeerCacheServer
+from utils.indexer_daemon import IndexerDaemon, is_supported
+from utils.config_service import ConfigService
+
+
+def _print_scan_report(report: dict) -> None:
+    for source in report["sources"]:
+        counts = ", ".join(f"{name}: {count}" for name, count in source["files"].items())
+        print(f"Source {source['name']} ({source['path']}): {counts}")
+
+    print(
+        f"Scanned {report['files_seen']} files in {report['timings']['scan']:.1f}s "
+        f"({report['files_per_second']:.1f} files/s), indexed {report['files_indexed']}"
+    )
+    print(
+        f"Thumbnails generated: {report['thumbnails_generated']} "
+        f"in {report['timings']['thumbnails']:.1f}s"
+    )
+    print(
+        f"Videos enriched from TMDB: {report['enriched']} in {report['timings']['enrichment']:.1f}s, "
+        f"still queued: {report['enrichment_queue']['pending']}, "
+        f"given up: {report['enrichment_queue']['given_up']}"
+    )
+    print(
+        f"TMDB responses refreshed: {report['tmdb_refreshed']} "
+        f"in {report['timings']['tmdb_warm']:.1f}s, "
+        f"network requests: {report['tmdb_requests']['network']}, "
+        f"cache hits: {report['tmdb_requests']['cache']}"
+    )
+    print(
+        f"Seek preview sheets generated: {report['trickplay_generated']} "
+        f"in {report['timings']['trickplay']:.1f}s"
+    )
+    print(
+        f"Videos fingerprinted for version grouping: {report['fingerprinted']} "
+        f"in {report['timings']['fingerprint']:.1f}s"
+    )
+    print(
+        f"Audio tracks analysed: {report['audio_analyzed']} "
+        f"in {report['timings']['audio']:.1f}s"
+    )
+
+
+def scan(args: argparse.Namespace) -> int:
+    """Runs the metadata pipeline on the sources and their TMDB lookups, then pre-generates thumbnails and warms the TMDB cache
+
+    Returns:
+        int: Process exit code
+    """
+    if args.dry_run and not AppDatabase.exists():
+        print("Nothing indexed yet, run a scan without --dry-run first.")
+        return 1
+
+    sources = queries.get_sources()
+    if args.source:
+        sources = [source for source in sources if source.id in args.source]
+    if not sources:
+        print("No movie sources to scan, add one from the GUI first.")
+        return 1
+
+    timings = dict.fromkeys(
+        ("scan", "enrichment", "thumbnails", "tmdb_warm", "trickplay", "fingerprint", "audio"), 0.0
+    )
+    thumbnails_generated, tmdb_refreshed, trickplay_generated, fingerprinted, audio_analyzed = 0, 0, 0, 0, 0
+    enriched = 0
+
+    # Keep stdout clean for the JSON report, progress messages go to stderr
+    with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+        started_at = time.perf_counter()
+        results = library_sources.scan_sources(
+            sources, only_due=args.due_only, index_workers=args.jobs, dry_run=args.dry_run
+        )
+        timings["scan"] = time.perf_counter() - started_at
+
+        if not args.dry_run:
+            # TMDB lookups of the files just indexed, and due retries of earlier ones
+            started_at = time.perf_counter()
+            enriched = drain_queue()
+            timings["enrichment"] = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            thumbnails_generated = generate_all_thumbnails(
+                [video.image_path for video in queries.get_all_videos()]
+            )
+            timings["thumbnails"] = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            tmdb_refreshed = warm_tmdb_cache()
+            timings["tmdb_warm"] = time.perf_counter() - started_at
+
+            # Videos indexed before duplicate detection existed
+            started_at = time.perf_counter()
+            fingerprinted = fingerprint_missing_videos()
+            timings["fingerprint"] = time.perf_counter() - started_at
+
+            if args.trickplay:
+                started_at = time.perf_counter()
+                for video in queries.get_all_videos():
+                    trickplay_generated += generate_trickplay(video.full_path)
+                timings["trickplay"] = time.perf_counter() - started_at
+
+            if args.audio:
+                started_at = time.perf_counter()
+                audio_analyzed = analyze_missing_videos()
+                timings["audio"] = time.perf_counter() - started_at
+
+    files_seen = sum(stats.get("seen", 0) for stats in results.values())
+    report = {
+        "dry_run": args.dry_run,
+        "jobs": args.jobs,
+        "sources": [
+            {"id": source.id, "name": source.name, "path": source.path, "files": results[source.id]}
+            for source in sources
+            if source.id in results
+        ],
+        "files_seen": files_seen,
+        "files_indexed": sum(stats.get("added", 0) for stats in results.values()),
+        "files_per_second": files_seen / timings["scan"] if timings["scan"] > 0 else 0.0,
+        "enriched": enriched,
+        "enrichment_queue": queries.get_enrichment_queue_counts(),
+        "thumbnails_generated": thumbnails_generated,
+        "tmdb_refreshed": tmdb_refreshed,
+        "trickplay_generated": trickplay_generated,
+        "fingerprinted": fingerprinted,
+        "audio_analyzed": audio_analyzed,
+        "tmdb_requests": get_request_stats(),
+        "timings": timings,
+        "metrics": metrics.registry.snapshot(),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_scan_report(report)
+
+    failed = sum(stats.get("failed", 0) for stats in results.values())
+    return 0 if failed == 0 else 2
+
+
+def import_tmdb_ids(args: argparse.Namespace) -> int:
+    """Loads TMDB daily ID exports into the offline title index
+
+    Returns:
+        int: Process exit code
+    """
+    for export_path in args.exports:
+        try:
+            imported = TmdbIdIndex.import_export(export_path, args.kind)
+        except (OSError, ValueError) as exception:
+            print(f"Could not import {export_path}: {exception}")
+            return 1
+        print(f"Imported {imported} titles from {export_path}")
+    return 0
+
+
+def snapshot_export(args: argparse.Namespace) -> int:
+    """Writes the library, or a delta since an earlier snapshot, to a snapshot archive
+
+    Returns:
+        int: Process exit code
+    """
+    try:
+        manifest = library_snapshot.export_snapshot(args.archive, args.since)
+    except (OSError, ValueError) as exception:
+        print(f"Could not export the library: {exception}")
+        return 1
+
+    counts = ", ".join(f"{name}: {count}" for name, count in manifest["counts"].items())
+    print(f"Exported snapshot {manifest['snapshot_id']} to {args.archive} ({counts})")
+    return 0
+
+
+def snapshot_import(args: argparse.Namespace) -> int:
+    """Applies a snapshot archive exported by another node
+
+    Returns:
+        int: Process exit code
+    """
+    remaps = []
+    for remap in args.remap or []:
+        old, separator, new = remap.partition("=")
+        if not separator or not old:
+            print(f"Invalid --remap {remap}, expected OLD=NEW")
+            return 1
+        remaps.append((old, new))
+
+    try:
+        counts = library_snapshot.import_snapshot(args.archive, remaps)
+    except (OSError, ValueError) as exception:
+        print(f"Could not import {args.archive}: {exception}")
+        return 1
+
+    if counts is None:
+        print(f"{args.archive} was already imported")
+    else:
+        print(f"Imported {args.archive} ({', '.join(f'{name}: {count}' for name, count in counts.items())})")
+    return 0
+
+
+def serve_peer_cache(args: argparse.Namespace) -> int:
+    """Answers the other nodes about the indexed files until interrupted
+
+    Returns:
+        int: Process exit code
+    """
+    config = ConfigService.get("peer_cache_config.yaml")
+    server = PeerCacheServer(args.host or config["Host"], args.port if args.port is not None else config["Port"])
+    try:
+        server.run()
+    except OSError as exception:
+        print(f"Could not start the peer cache: {exception}")
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def indexer_daemon(args: argparse.Namespace) -> int:
+    """Indexes the library for the GUI, which starts this command itself
+
+    Returns:
+        int: Process exit code
+    """
+    if not is_supported():
+        print("The indexer daemon needs Unix sockets, which are not available here")
+        return 1
+
+    socket_path = args.socket or ConfigService.get("indexer_daemon_config.yaml")["SocketPath"]
+    try:
+        IndexerDaemon(socket_path, args.parent_pid).run()
+    except OSError as exception:
+        print(f"Could not start the indexer daemon: {exception}")
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python main.py",
+        description="cinenomad headless commands. Run without a command to start the GUI.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser(
+        "scan", help="Index the library, pre-generate thumbnails and warm the TMDB cache"
+    )
+    scan_parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of files indexed concurrently per source"
+    )
+    scan_parser.add_argument(
+        "--dry-run", action="store_true", help="Only report what would change, write nothing"
+    )
+    scan_parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    scan_parser.add_argument(
+        "--source", type=int, action="append", help="Only scan the source with this id (repeatable)"
+    )
+    scan_parser.add_argument(
+        "--due-only", action="store_true", help="Skip sources whose scan interval did not elapse"
+    )
+    scan_parser.add_argument(
+        "--trickplay", action="store_true", help="Also extract the seek preview sprite sheets"
+    )
+    scan_parser.add_argument(
+        "--audio",
+        action="store_true",
+        help="Also measure loudness and find intros / credits (decodes the audio with ffmpeg)",
+    )
+    scan_parser.set_defaults(handler=scan)
+
+    import_parser = subparsers.add_parser(
+        "import-tmdb-ids",
+        help="Load TMDB daily ID exports (e.g. movie_ids_05_15_2024.json.gz) so titles resolve offline",
+    )
+    import_parser.add_argument("exports", nargs="+", help="Export files, gzipped or not")
+    import_parser.add_argument(
+        "--kind", choices=(KIND_MOVIE, KIND_TV), help="What the exports list, guessed from TMDB's file names"
+    )
+    import_parser.set_defaults(handler=import_tmdb_ids)
+
+    export_parser = subparsers.add_parser(
+        "snapshot-export", help="Write the library, posters and thumbnails to an archive for other kiosks"
+    )
+    export_parser.add_argument("archive", help="Archive to write, e.g. library.zip")
+    export_parser.add_argument("--since", help="Only export what changed since this snapshot id")
+    export_parser.set_defaults(handler=snapshot_export)
+
+    snapshot_import_parser = subparsers.add_parser(
+        "snapshot-import", help="Apply a library snapshot exported by another kiosk"
+    )
+    snapshot_import_parser.add_argument("archive", help="Archive written by snapshot-export")
+    snapshot_import_parser.add_argument(
+        "--remap",
+        action="append",
+        metavar="OLD=NEW",
+        help="Replace the path prefix OLD of the exporting kiosk by NEW (repeatable)",
+    )
+    snapshot_import_parser.set_defaults(handler=snapshot_import)
+
+    peer_parser = subparsers.add_parser(
+        "serve-peer-cache", help="Serve the metadata and posters of the indexed files to other nodes on the LAN"
+    )
+    peer_parser.add_argument("--host", help="Address to listen on, defaults to Host in peer_cache_config.yaml")
+    peer_parser.add_argument("--port", type=int, help="Port to listen on, defaults to Port in peer_cache_config.yaml")
+    peer_parser.set_defaults(handler=serve_peer_cache)
+
+    daemon_parser = subparsers.add_parser(
+        "indexer-daemon", help="Scan, watch and enrich the library for the GUI (started by the GUI itself)"
+    )
+    daemon_parser.add_argument(
+        "--socket", help="Unix socket to listen on, defaults to SocketPath in indexer_daemon_config.yaml"
+    )
+    daemon_parser.add_argument("--parent-pid", type=int, help="Exit once the process with this id exits")
+    daemon_parser.set_defaults(handler=indexer_daemon)
+
+    return parser
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parses the command line, exits on '--help' or invalid arguments
+
+    Args:
+        argv (list[str]): Command line arguments, without the program name
+
+    Returns:
+        argparse.Namespace: Parsed arguments
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "jobs", 1) < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def is_read_only(args: argparse.Namespace) -> bool:
+    """Tells whether the command must leave the database and the disk untouched, e.g. 'scan --dry-run'"""
+    return getattr(args, "dry_run", False)
+
+
+def run(args: argparse.Namespace) -> int:
+    """Runs the requested command
+
+    Args:
+        args (argparse.Namespace): Arguments returned by 'parse_args'
+
+    Returns:
+        int: Process exit code
+    """
+    return args.handler(args)
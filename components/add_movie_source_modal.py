@@ -1,6 +1,11 @@
-import copy
+import logging
 import tkinter as tk
 
+from utils import library_sources
+from utils.indexer_daemon import IndexerClient
+
+logger = logging.getLogger(__name__)
+
 
 class AddMovieSourceModal(tk.Toplevel):
     def __init__(self, parent: tk.Widget, config_params: dict):
@@ -8,7 +13,7 @@ class AddMovieSourceModal(tk.Toplevel):
         self._parent = parent
 
         # Configure
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
         self.title(self._config_params["title"])
         self.geometry("600x300")
         self.resizable(False, False)
@@ -27,9 +32,13 @@ class AddMovieSourceModal(tk.Toplevel):
 
     def _handle_user_choice(self, choice: str) -> None:
         if choice == "Add":
-            print("Added new movie source")
+            # Scanning and watching start with the next scheduled check of the browser, or right away in the indexer daemon
+            if library_sources.add_source(self._path_entry.get().strip()) is None:
+                return
+            IndexerClient.sources_changed()
         else:
-            print("Cancel new movie source")
+            logger.debug("New movie source cancelled")
+        self._path_entry.delete(0, tk.END)
         self.close()
 
     def _center(self) -> None:
@@ -54,6 +63,17 @@ class AddMovieSourceModal(tk.Toplevel):
         self.geometry(f"{toplevel_width}x{toplevel_height}+{x}+{y}")
 
     def _init_widgets(self) -> None:
+        path_label = tk.Label(
+            self,
+            text=self._config_params["PathLabel"]["text"],
+            **self._config_params["PathLabel"]["Design"],
+        )
+        path_label.place(**self._config_params["PathLabel"]["Placement"])
+
+        self._path_entry = tk.Entry(self, **self._config_params["PathEntry"]["Design"])
+        self._path_entry.place(**self._config_params["PathEntry"]["Placement"])
+        self._path_entry.bind("<Return>", lambda event: self._handle_user_choice("Add"))
+
         add_button = tk.Button(
             self,
             text=self._config_params["AddButton"]["text"],
@@ -12,7 +12,12 @@ from components import (
     ConnectorsFrame,
     AddMovieSourceModal,
 )
-from utils.file_handling import load_yaml_file
+from utils.chrome import ChromeProcessManager
+from utils.enrichment import EnrichmentWorker
+from utils.indexer_daemon import IndexerClient
+from utils.task_scheduler import TaskScheduler
+from utils.config_service import ConfigService
+from utils.exceptions import ConfigValidationException
 from utils.database import queries
 
 from .strategy import (
@@ -26,14 +31,15 @@ from .strategy import (
 class App(tk.Tk):
     """Main app class"""
 
-    def __init__(self, config_path: str):
+    def __init__(self, config_name: str):
         super().__init__()
 
         ####### Configure #######
-        self._configs = load_yaml_file(config_path)
-        if self._configs is None:
+        try:
+            self._configs = ConfigService.get(config_name)
+        except (OSError, ConfigValidationException) as exception:
             self.close()
-            raise Exception("Cannot start application, encountered errors while loading the config file.")
+            raise Exception("Cannot start application, encountered errors while loading the config file.") from exception
 
         self.configure(**self._configs["App"])
         self.attributes("-fullscreen", True)
@@ -76,6 +82,10 @@ class App(tk.Tk):
             self.connectors_frame.place(**self._configs["ConnectorsFrame"]["Placement"])
             self._place_connectors()
 
+        # Pre-warm the kiosk browser so browser based connectors open instantly
+        if any(connector.name in ("Netflix", "Youtube") for connector in self._connector_data or []):
+            ChromeProcessManager.start()
+
         # Add new connector modal (toplevel)
         self.new_connector_modal = AddMovieSourceModal(
             self, self._configs["AddMovieSourceModal"]
@@ -136,6 +146,10 @@ class App(tk.Tk):
             event (n/a, optional): Event sent by the event handler in Tkinter. Defaults to None.
         """
         print("App closed.")
+        ChromeProcessManager.shutdown()
+        IndexerClient.stop()
+        EnrichmentWorker.stop()
+        TaskScheduler.shutdown()
         self.quit()
         self.destroy()
         
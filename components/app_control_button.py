@@ -1,5 +1,4 @@
 import tkinter as tk
-import copy
 
 from utils.file_handling import read_tk_image
 
@@ -9,10 +8,10 @@ class AppControlButton(tk.Button):
         super().__init__(parent)
 
         # Get config params
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
 
-        # Get ImageTk object
-        self._config_params["image"] = read_tk_image(self._config_params["image_path"])
-        self._config_params.pop("image_path", None)
+        # Get ImageTk object, kept on the widget so the image is rendered
+        self._image = read_tk_image(self._config_params["image_path"])
+        design = {key: value for key, value in self._config_params.items() if key != "image_path"}
 
-        self.configure(**self._config_params)
+        self.configure(image=self._image, **design)
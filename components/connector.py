@@ -1,4 +1,3 @@
-import copy
 import tkinter as tk
 
 from utils.file_handling import read_tk_image
@@ -8,25 +7,22 @@ from .strategy import ConnectorClickStrategy
 class ConnectorIcon(tk.Button):
     def __init__(self, parent: tk.Widget, config_params: dict, image_path: str, text: str, strategy: ConnectorClickStrategy):
         super().__init__(parent)
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
+        design = {**self._config_params, "text": text}
 
         # Get ImageTk object
         connector_image = read_tk_image(image_path)
         if connector_image is not None:  # TODO: In this case make the button invisible
-            self._config_params["image"] = connector_image
+            design["image"] = connector_image
             
             # Keep reference so the image is rendered
-            self._image = self._config_params["image"]
+            self._image = connector_image
 
-        # Transform list to tuple
-        self._config_params["font"] = tuple(self._config_params["font"])
-
-        self._config_params["text"] = text
         self._strategy = strategy
 
         self.configure(
             command=self._on_click,
-            **self._config_params
+            **design
         )
 
         # Controls
@@ -43,7 +39,6 @@ class ConnectorIcon(tk.Button):
                 else self._config_params["highlightbackground"]
             )
         )
-        print(event)
 
     def _on_click(self, event=None) -> None:
         self.configure(cursor="watch")
@@ -55,20 +50,15 @@ class ConnectorLabel(tk.Label):
     def __init__(self, parent: tk.Widget, config_params: dict, text: str):
         super().__init__(parent)
 
-        self._config_params = copy.deepcopy(config_params)
-
-        # Transform list to tuple
-        self._config_params["font"] = tuple(self._config_params["font"])
-        self._config_params["text"] = text
-
-        self.configure(**self._config_params)
+        self._config_params = config_params
+        self.configure(text=text, **self._config_params)
 
 
 class ConnectorsFrame(tk.Frame):
     def __init__(self, parent: tk.Widget, config_params: dict, connector_count: int):
         super().__init__(parent)
 
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
 
         self.configure(**self._config_params)
 
@@ -1,15 +1,28 @@
-import copy
+import os
 import math
+import logging
 import tkinter as tk
 
 from functools import partial
+from typing import Callable
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from components import AppControlButton
-from utils import VideoMetadataReader
+from utils import VideoMetadataReader, library_sources, metrics, tv_shows
 from utils.database import queries, models
+from utils.config_service import ConfigService
+from utils.library_watcher import LibraryWatcher
+from utils.trickplay import schedule_trickplay
+from utils.enrichment import EnrichmentWorker
+from utils.indexer_daemon import IndexerClient
+from utils.task_scheduler import TaskScheduler, RESOURCE_DISK, PRIORITY_INTERACTIVE
+from utils.library_catalog import LibraryCatalog, WATCH_UNWATCHED, WATCH_IN_PROGRESS
+from utils.recommendations import SimilarityIndex
 
 from . import ConnectorClickStrategy
-from ..vlc_player import Player
+from ..vlc_player import Player, PlaybackPrefetcher
+
+logger = logging.getLogger(__name__)
 
 
 class LocalMovieBrowserModal(tk.Toplevel):
@@ -20,17 +33,73 @@ class LocalMovieBrowserModal(tk.Toplevel):
 
         # Vars
         self._parent = parent
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
 
-        metadata_reader = VideoMetadataReader(queries.get_setting_value("LocalFolder"))
-        metadata_reader.update_metadata_db()
+        sources_config = ConfigService.get("library_sources_config.yaml")
+        self._scan_in_ui = sources_config["ScanInUi"]
+        self._schedule_check_ms = sources_config["ScheduleCheckMins"] * 60 * 1000
 
-        self._metadata_list = queries.get_all_videos()
-        self._movie_index = 0
-        self._movie_list_length = (
-            len(self._metadata_list) if self._metadata_list is not None else 0
+        # The indexer daemon scans, watches and enriches the library in its own process and pushes its changes
+        self._use_indexer_daemon = self._scan_in_ui and IndexerClient.start(
+            on_library_changed=lambda: self.after(0, self.refresh)
         )
 
+        # Otherwise reconcile every source once, then keep them current with watchers and scheduled scans
+        self._library_watchers: dict[int, LibraryWatcher] = {}
+        self._schedule_timer_id = None
+        initial_scan = None
+        initial_scan_wait_secs = ConfigService.get("indexer_daemon_config.yaml")["InitialScanWaitSecs"]
+        if self._use_indexer_daemon:
+            # A new library has nothing to browse yet, wait for its first scan
+            if not queries.get_all_videos():
+                IndexerClient.wait_for_initial_scan(initial_scan_wait_secs)
+        elif self._scan_in_ui:
+            initial_scan = TaskScheduler.submit(
+                partial(library_sources.scan_sources, only_due=False),
+                resource=RESOURCE_DISK,
+                priority=PRIORITY_INTERACTIVE,
+                name="library-scan",
+            )
+            # A new library has nothing to browse yet, wait for its first scan
+            if not queries.get_all_videos():
+                try:
+                    initial_scan.result(timeout=initial_scan_wait_secs)
+                except FutureTimeoutError:
+                    # The files found show up once the scan is done
+                    logger.warning(
+                        "The first library scan did not finish in %.0fs, not waiting for it", initial_scan_wait_secs
+                    )
+            self._start_library_watchers()
+        if not self._use_indexer_daemon:
+            self._schedule_timer_id = self.after(self._schedule_check_ms, self._run_due_scans)
+
+        # Every file in NumPy columns, sorted and filtered without rebuilding the list of titles
+        self._catalog_config = ConfigService.get("library_catalog_config.yaml")
+        self._catalog = LibraryCatalog()
+        self._catalog.sync()
+
+        # A series is one title, opened onto its seasons and then the episodes of a season.
+        # Show and season entries play the episode in '_entry_targets' and show a summary of their episodes.
+        self._drill: tuple[int, int | None] | None = None  # Show and season opened, None for the titles
+        # Levels above the one browsed, with the entry selected in each
+        self._drill_parents: list[tuple[tuple[int, int | None] | None, str]] = []
+        self._entry_targets: dict[str, str] = {}
+        self._entry_summaries: dict[str, str] = {}
+        self._load_titles()
+        self._movie_index = 0
+
+        # Powers the "more like this" strip of the movie card
+        self._recommendations_config = ConfigService.get("recommendations_config.yaml")
+        self._similarity_index = SimilarityIndex(self._recommendations_config)
+        self._similarity_index.sync(self._titles)
+
+        if not self._use_indexer_daemon:
+            # Seek previews are extracted in the background while nothing plays
+            schedule_trickplay([metadata.full_path for metadata in self._catalog.videos()])
+
+            # TMDB metadata of newly indexed files is looked up in the background, the cards update as it arrives
+            EnrichmentWorker.start(on_enriched=lambda: self.after(0, self.refresh))
+
         # Configure
         self.withdraw()  # Init in closed state
         self.focus()
@@ -43,16 +112,10 @@ class LocalMovieBrowserModal(tk.Toplevel):
         )  # Fullscreen
 
         # Widgets
-        # TODO: Check if empty
-        self._movie_card = LocalMovieCard(
-            self,
-            self._config_params["LocalMovieCard"],
-            self._metadata_list[self._movie_index],
-            self.winfo_screenheight(),
-            self.winfo_screenwidth(),
-        )
+        self._movie_card = self._create_movie_card()
         self._movie_card.pack(fill="both", expand=True)
         self._movie_card.pack_propagate(False)
+        self._prefetch_selected()
 
         self._poster_carousel = PosterCarousel(
             self,
@@ -86,8 +149,15 @@ class LocalMovieBrowserModal(tk.Toplevel):
             self.bind_all("<Left>", self._on_scroll_movies)
             self.bind_all("<Right>", self._on_scroll_movies)
 
+        for key in ("<Down>", "<Return>", "<Up>", "<BackSpace>"):
+            self.bind(key, self._on_drill)
+
         self.bind("<Escape>", self.hide)
 
+        # Files found by the first scan show up once it is done
+        if initial_scan is not None:
+            initial_scan.add_done_callback(lambda _: self.after(0, self.refresh))
+
     def hide(self, event=None) -> None:
         """Hides the modal and gives back the focus to the parent Widget
 
@@ -97,6 +167,7 @@ class LocalMovieBrowserModal(tk.Toplevel):
         self.withdraw()
         self._parent.focus()
         self.config(cursor="none")
+        PlaybackPrefetcher.cancel()
 
     def show(self) -> None:
         """Shows the modal and sets the focus"""
@@ -104,6 +175,283 @@ class LocalMovieBrowserModal(tk.Toplevel):
         self.focus()
         self.config(cursor="")
 
+    def destroy(self) -> None:
+        if self._schedule_timer_id is not None:
+            self.after_cancel(self._schedule_timer_id)
+        for library_watcher in self._library_watchers.values():
+            library_watcher.stop()
+        super().destroy()
+
+    def _start_library_watchers(self) -> None:
+        """Starts a watcher for every source that does not have one yet (e.g. newly added sources)"""
+        for source in queries.get_sources():
+            if source.id in self._library_watchers:
+                continue
+
+            metadata_reader = VideoMetadataReader(source)
+            library_watcher = LibraryWatcher(
+                source.path,
+                metadata_reader.accepted_extensions,
+                partial(self._on_library_change, metadata_reader),
+            )
+            library_watcher.start()
+            self._library_watchers[source.id] = library_watcher
+
+    def _run_due_scans(self) -> None:
+        """Scans the sources whose schedule elapsed in the background, then refreshes the UI"""
+
+        def _scan() -> None:
+            if library_sources.scan_sources(only_due=True):
+                EnrichmentWorker.wake()
+                self.after(0, self.refresh)
+
+        if self._scan_in_ui:
+            self._start_library_watchers()
+            TaskScheduler.submit(_scan, resource=RESOURCE_DISK, name="scheduled-scan", key="scheduled-scan")
+        else:
+            # The database is filled by the headless scan, only pick up its changes
+            self.refresh()
+        self._schedule_timer_id = self.after(self._schedule_check_ms, self._run_due_scans)
+
+    def _on_library_change(
+        self, metadata_reader: VideoMetadataReader, added: list[str], removed: list[str]
+    ) -> None:
+        """Called from the watcher thread, queues indexing of only the changed files then refreshes the UI"""
+
+        def _update() -> None:
+            metadata_reader.update_paths(added, removed)
+            EnrichmentWorker.wake()
+            self.after(0, self.refresh)
+
+        TaskScheduler.submit(_update, resource=RESOURCE_DISK, name="library-change")
+
+    @metrics.timed("ui.library_refresh")
+    def refresh(self) -> None:
+        """Reloads the library from the database, keeping the current selection when possible"""
+        selected_path = None
+        if self._movie_index < self._movie_list_length:
+            selected_path = self._metadata_list[self._movie_index].full_path
+
+        if not self._catalog.sync():
+            return
+
+        self._load_titles()
+        self._similarity_index.sync(self._titles)
+        if not self._use_indexer_daemon:
+            schedule_trickplay([metadata.full_path for metadata in self._catalog.videos()])
+        if self._movie_list_length == 0:
+            return
+
+        self._show_level(selected_path, min(self._movie_index, self._movie_list_length - 1))
+
+    def _load_titles(self) -> None:
+        """Orders the catalog as configured, the versions of a title and the episodes of a series share one card.
+
+        The list browsed is the titles, or the seasons or episodes of the series opened.
+        """
+        self._shows = queries.get_tv_shows()
+        self._entry_targets.clear()
+        self._entry_summaries.clear()
+
+        rows = self._catalog.all_rows()
+        if self._catalog_config["HideWatched"]:
+            rows = self._catalog.filter(rows, watch_states=[WATCH_UNWATCHED, WATCH_IN_PROGRESS])
+        rows = self._catalog.sort(self._catalog_config["SortBy"], self._catalog_config["Descending"], rows)
+        self._titles = []
+        for metadata in self._catalog.videos(self._catalog.group_heads("title", rows)):
+            show = self._shows.get(self._catalog.show_id(metadata.full_path))
+            self._titles.append(metadata if show is None else self._add_show_entry(show))
+        self._metadata_list = self._titles
+
+        if self._drill is not None:
+            show_id, season = self._drill
+            if show_id not in self._shows:
+                self._metadata_list = []
+            elif season is None:
+                show = self._shows[show_id]
+                self._metadata_list = [
+                    entry
+                    for entry in (self._add_season_entry(show, season) for season in queries.get_tv_seasons(show_id))
+                    if entry is not None
+                ]
+            else:
+                episode_rows = self._catalog.episodes(show_id, season)
+                self._metadata_list = [
+                    tv_shows.episode_entry(self._shows[show_id], episode)
+                    for episode in self._catalog.videos(self._catalog.group_heads("version", episode_rows))
+                ]
+
+            # The last episodes of what was opened are gone, back to the titles
+            if not self._metadata_list:
+                self._drill, self._drill_parents = None, []
+                self._metadata_list = self._titles
+        self._movie_list_length = len(self._metadata_list)
+
+    def _next_episode(self, next_unwatched_path: str | None, first_episode_path: str) -> str:
+        """Episode played by a show or season entry, the next unwatched one or the first once all are watched"""
+        if next_unwatched_path is not None and next_unwatched_path in self._catalog:
+            return next_unwatched_path
+        return first_episode_path
+
+    def _add_show_entry(self, show: models.TvShow) -> models.VideoMetadata:
+        first_episode = self._catalog.videos(self._catalog.episodes(show.id)[:1])[0]
+        target = self._next_episode(show.next_unwatched_path, first_episode.full_path)
+        episode = self._catalog.versions(target)[0]
+        entry = tv_shows.show_entry(show, episode)
+        self._entry_targets[entry.full_path] = target
+        self._entry_summaries[entry.full_path] = tv_shows.show_summary(
+            show, episode.parsed_name.get_episode_label() if show.next_unwatched_path else ""
+        )
+        return entry
+
+    def _add_season_entry(self, show: models.TvShow, season: models.TvSeason) -> models.VideoMetadata | None:
+        episode_rows = self._catalog.episodes(show.id, season.season)
+        if len(episode_rows) == 0:
+            return None
+        target = self._next_episode(season.next_unwatched_path, self._catalog.videos(episode_rows[:1])[0].full_path)
+        episode = self._catalog.versions(target)[0]
+        entry = tv_shows.season_entry(show, season, episode)
+        self._entry_targets[entry.full_path] = target
+        self._entry_summaries[entry.full_path] = tv_shows.season_summary(
+            season, episode.parsed_name.get_episode_label() if season.next_unwatched_path else ""
+        )
+        return entry
+
+    def _versions(self, metadata: models.VideoMetadata) -> list[models.VideoMetadata]:
+        """Files played for an entry, the versions of its title or of the next episode of a show or season"""
+        return self._catalog.versions(self._entry_targets.get(metadata.full_path, metadata.full_path))
+
+    def _index_of(self, full_path: str | None) -> int | None:
+        """Position of the entry of a path in the list browsed, also found by another version or its next episode"""
+        if full_path is None:
+            return None
+        paths = {full_path} | {version.full_path for version in self._catalog.versions(full_path)}
+        return next(
+            (
+                idx
+                for idx, metadata in enumerate(self._metadata_list)
+                if metadata.full_path in paths or self._entry_targets.get(metadata.full_path) in paths
+            ),
+            None,
+        )
+
+    def _show_level(self, selected_path: str | None, fallback_index: int = 0) -> None:
+        """Shows the list browsed after it changed, selecting the entry of a path when it is still there"""
+        selected_index = self._index_of(selected_path)
+        self._movie_index = selected_index if selected_index is not None else fallback_index
+        self._poster_carousel.set_metadata_list(self._metadata_list, self._movie_index)
+        self._show_movie_card()
+
+        if self._movie_list_length > 1:
+            self.bind_all("<Left>", self._on_scroll_movies)
+            self.bind_all("<Right>", self._on_scroll_movies)
+
+    def _on_drill(self, event) -> None:
+        """Opens the selected series or season (down arrow or Return), or goes back up (up arrow or BackSpace)"""
+        if self._movie_list_length == 0:
+            return
+        selected = self._metadata_list[self._movie_index]
+        if event.keysym in ("Down", "Return"):
+            entry = tv_shows.parse_entry_path(selected.full_path)
+            if entry is None:
+                return
+            show_id, season = entry
+            if season is None:
+                # A series of one season opens straight onto its episodes
+                seasons = queries.get_tv_seasons(show_id)
+                if len(seasons) == 1:
+                    season = seasons[0].season
+            self._drill_parents.append((self._drill, selected.full_path))
+            self._drill = (show_id, season)
+            # Lands on what Play would have played
+            selected_path = self._entry_targets.get(selected.full_path)
+        else:
+            if not self._drill_parents:
+                return
+            self._drill, selected_path = self._drill_parents.pop()
+
+        self._load_titles()
+        self._show_level(selected_path)
+
+    def _create_movie_card(self) -> tk.Frame:
+        """Builds the movie card of the currently selected movie, with its versions and similar titles"""
+        # Nothing indexed yet, e.g. the first scan is still running, 'refresh' replaces it once files show up
+        if self._movie_list_length == 0:
+            card = tk.Frame(self, **self._config_params["LocalMovieCard"]["Design"])
+            tk.Label(
+                card,
+                text="No videos yet, the library is being scanned",
+                font=("Roboto Mono", 16),
+                **self._config_params["LocalMovieCard"]["Entry"]["Design"],
+            ).place(relx=0.5, rely=0.375, anchor="center")
+            return card
+
+        metadata = self._metadata_list[self._movie_index]
+        similar = []
+        if self._recommendations_config["Enabled"]:
+            similar = self._similarity_index.similar(metadata.full_path, self._recommendations_config["Count"])
+
+        return LocalMovieCard(
+            self,
+            self._config_params["LocalMovieCard"],
+            metadata,
+            self.winfo_screenheight(),
+            self.winfo_screenwidth(),
+            self._versions(metadata),
+            similar,
+            self._on_similar_click,
+            self._entry_summaries.get(metadata.full_path),
+        )
+
+    def _on_similar_click(self, full_path: str) -> None:
+        """Jumps to a title picked in the "more like this" strip"""
+        drilled = self._drill is not None
+        if drilled:
+            # Similar titles are series and movies, back to them
+            self._drill, self._drill_parents = None, []
+            self._load_titles()
+
+        idx = next(
+            (idx for idx, metadata in enumerate(self._metadata_list) if metadata.full_path == full_path), None
+        )
+        if drilled and idx is None:
+            idx = 0
+        elif idx is None or idx == self._movie_index:
+            return
+
+        self._movie_index = idx
+        self._poster_carousel.set_metadata_list(self._metadata_list, self._movie_index)
+        # The click came from the card about to be destroyed, let its event handler return first
+        self.after_idle(self._show_movie_card)
+
+    @metrics.timed("ui.movie_card_rebuild")
+    def _show_movie_card(self) -> None:
+        """Replaces the movie card with the one for the currently selected movie"""
+        self._movie_card.destroy()
+        self._movie_card = self._create_movie_card()
+        self._movie_card.pack(fill="both", expand=True)
+        self._movie_card.pack_propagate(False)
+        self._prefetch_selected()
+
+        self._poster_carousel.lift()
+
+    def _prefetch_selected(self) -> None:
+        """Starts warming the selected title, Play on it then starts without waiting on the disk"""
+        if self._movie_list_length == 0:
+            return
+        metadata = self._versions(self._metadata_list[self._movie_index])[0]
+        PlaybackPrefetcher.schedule(
+            metadata.full_path,
+            metadata.get_length_sec(),
+            queries.get_playback_position(metadata.full_path),
+        )
+        # Still waiting on TMDB, look it up next
+        if not metadata.tmdb_title:
+            if self._use_indexer_daemon:
+                IndexerClient.prioritize(metadata.full_path)
+            else:
+                EnrichmentWorker.prioritize(metadata.full_path)
+
     def _on_scroll_movies(self, event) -> None:
         """Scroll through the movies using left/right arrow keys"""
         if event.keysym == "Left":  # Move left (decrease index)
@@ -116,18 +464,7 @@ class LocalMovieBrowserModal(tk.Toplevel):
                 self._poster_carousel.move_right()
 
         # TODO: After I finish carousel, make this functionality part of LocalMovieCard
-        self._movie_card.destroy()
-        self._movie_card = LocalMovieCard(
-            self,
-            self._config_params["LocalMovieCard"],
-            self._metadata_list[self._movie_index],
-            self.winfo_screenheight(),
-            self.winfo_screenwidth(),
-        )
-        self._movie_card.pack(fill="both", expand=True)
-        self._movie_card.pack_propagate(False)
-
-        self._poster_carousel.lift()
+        self._show_movie_card()
 
 
 class Poster(tk.Label):
@@ -165,15 +502,22 @@ class LocalMovieCard(tk.Frame):
         metadata: models.VideoMetadata,
         height: int,
         width: int,
+        versions: list[models.VideoMetadata] | None = None,
+        similar: list[models.VideoMetadata] | None = None,
+        on_similar_click: Callable[[str], None] | None = None,
+        summary: str | None = None,
     ):
         super().__init__(parent)
         self._parent = parent
         self._metadata = metadata
+        self._versions = versions or [metadata]
+        self._similar = similar or []
+        self._on_similar_click = on_similar_click
         self._player = None
         self._colors_switch = False
 
         # Configure
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
         self.configure(height=height, width=width, **self._config_params["Design"])
 
         entries_left_padx = math.floor(width * 0.02)
@@ -233,7 +577,8 @@ class LocalMovieCard(tk.Frame):
         self._length = tk.Label(
             self._entries_frame,
             font=("Roboto Mono", entries_font_size),
-            text=f"{metadata.get_length_gui_format()}",
+            # Series and seasons show their episode counts and total runtime instead
+            text=summary or f"{metadata.get_length_gui_format()}",
             **self._config_params["Entry"]["Design"],
         )
 
@@ -270,6 +615,49 @@ class LocalMovieCard(tk.Frame):
         self._play_button.bind("<Enter>", self._on_hover_switch_colors)
         self._play_button.bind("<Leave>", self._on_hover_switch_colors)
 
+        # "More like this", next to the year / language / length entries
+        similar_height = (entries_height * 3) + title_pad
+        similar_width = entries_frame_width - entries_width - (title_pad * 4)
+        similar_poster_height = similar_height - entries_height
+        similar_poster_width = math.floor(similar_poster_height * 0.66)
+        similar_count = min(len(self._similar), max(1, similar_width // (similar_poster_width + title_pad)))
+
+        self._similar_label = None
+        self._similar_posters = []
+        if self._similar:
+            self._similar_label = tk.Label(
+                self._entries_frame,
+                font=("Roboto Mono", max(10, int(entries_font_size * 0.7))),
+                **self._config_params["MoreLikeThis"]["Label"]["Design"],
+            )
+            for similar_metadata in self._similar[:similar_count]:
+                poster = Poster(
+                    self._entries_frame,
+                    self._config_params["MoreLikeThis"]["Poster"]["Design"],
+                    similar_metadata,
+                    similar_poster_height,
+                    similar_poster_width,
+                    hoverable=on_similar_click is not None,
+                )
+                if on_similar_click is not None:
+                    poster.bind("<Button-1>", partial(self._on_similar_poster_click, full_path=similar_metadata.full_path))
+                self._similar_posters.append(poster)
+
+        # Several files of the same title, the largest one is played by default
+        self._version_labels = [self._get_version_label(version) for version in self._versions]
+        self._selected_version = tk.StringVar(self, value=self._version_labels[0])
+        self._version_menu = None
+        if len(self._versions) > 1:
+            self._version_menu = tk.OptionMenu(
+                self._entries_frame, self._selected_version, *self._version_labels
+            )
+            self._version_menu.configure(
+                font=("Roboto Mono", entries_font_size), **self._config_params["VersionMenu"]["Design"]
+            )
+            self._version_menu["menu"].configure(
+                font=("Roboto Mono", entries_font_size), **self._config_params["VersionMenu"]["MenuDesign"]
+            )
+
         # Placement
         self._poster_frame.place(
             x=0, y=0, width=poster_frame_width, height=poster_frame_height
@@ -320,14 +708,48 @@ class LocalMovieCard(tk.Frame):
             width=play_button_width,
             height=play_button_height,
         )
+        if self._similar_label is not None:
+            similar_x = entries_left_padx + entries_width + title_pad
+            similar_y = title_height + (title_pad * 2)
+            self._similar_label.place(
+                x=similar_x, y=similar_y, width=similar_width, height=entries_height
+            )
+            for idx, poster in enumerate(self._similar_posters):
+                poster.place(
+                    x=similar_x + idx * (similar_poster_width + title_pad),
+                    y=similar_y + entries_height,
+                    width=similar_poster_width,
+                    height=similar_poster_height,
+                )
+        if self._version_menu is not None:
+            self._version_menu.place(
+                x=entries_left_padx + play_button_width + title_pad,
+                y=entries_frame_height - play_button_height - title_pad,
+                width=entries_frame_width - play_button_width - (title_pad * 4),
+                height=play_button_height,
+            )
+
+    @staticmethod
+    def _get_version_label(metadata: models.VideoMetadata) -> str:
+        """Resolution (when known) and file name, tells the versions of a title apart"""
+        file_name = os.path.basename(metadata.full_path)
+        if metadata.parsed_name is not None and metadata.parsed_name.resolution:
+            return f"{metadata.parsed_name.resolution} | {file_name}"
+        return file_name
+
+    def _on_similar_poster_click(self, event, full_path: str) -> None:
+        self._on_similar_click(full_path)
 
     def _open_player(self, event=None) -> None:
+        metadata = self._versions[self._version_labels.index(self._selected_version.get())]
         self._player = Player(
             self._parent,
             self._config_params["Player"],
-            self._metadata.full_path,
-            self._metadata.full_sub_path,
-            self._metadata.get_length_sec(),
+            metadata.full_path,
+            metadata.full_sub_path,
+            metadata.get_length_sec(),
+            queries.get_playback_position(metadata.full_path),
+            queries.get_audio_analysis(metadata.full_path),
         )
         self._player.play()
         self._player.setup_subtitles()
@@ -366,7 +788,7 @@ class PosterCarousel(tk.Frame):
         self._poster_count = poster_count
 
         # Configure
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
         self.configure(height=height, width=width, **self._config_params["Design"])
 
         # Posters
@@ -386,6 +808,7 @@ class PosterCarousel(tk.Frame):
         self._show_posters()
         self.lift()
 
+    @metrics.timed("ui.carousel_rebuild")
     def _update_posters(self) -> None:
         """Updates the posters list, it adds the posters around the _selected if there are any, else leaves it empty"""
         start = self._selected - (self._poster_count // 2)
@@ -412,10 +835,10 @@ class PosterCarousel(tk.Frame):
                 self._visible_posters[posters_idx] = poster
             posters_idx += 1
 
-        # Put border around currently selected poster
-        self._visible_posters[self._poster_count // 2].configure(
-            highlightthickness=3, highlightbackground="#D9D9D9"
-        )
+        # Put border around currently selected poster, there is none while the library is empty
+        selected_poster = self._visible_posters[self._poster_count // 2]
+        if selected_poster is not None:
+            selected_poster.configure(highlightthickness=3, highlightbackground="#D9D9D9")
 
     def _poster_on_click(self, event, idx: int) -> None:
         self._selected = idx
@@ -439,6 +862,18 @@ class PosterCarousel(tk.Frame):
                 )
                 poster.lift()
 
+    def set_metadata_list(self, metadata_list: list[models.VideoMetadata], selected: int) -> None:
+        """Swaps the carousel content, used when the library changes on disk
+
+        Args:
+            metadata_list (list[models.VideoMetadata]): New list of movies
+            selected (int): Index of the selected movie in the new list
+        """
+        self._metadata_list = metadata_list
+        self._selected = selected
+        self._update_posters()
+        self._show_posters()
+
     def move_right(self) -> None:
         """Moves the list 1 poster to the right"""
         if self._selected == len(self._metadata_list) - 1:
@@ -464,7 +899,7 @@ class LocalConnectorClick(ConnectorClickStrategy):
 
     def __init__(self, parent: tk.Widget, config_params: dict):
         self._parent = parent
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
         self._window = None
 
     def execute(self) -> None:
@@ -1,11 +1,13 @@
-import os
-import copy
+import logging
 import tkinter as tk
 
-from utils.chrome import open_chrome, close_chrome
-from utils.file_handling import load_yaml_file
+from concurrent.futures import Future
+
+from utils.chrome import ChromeProcessManager
 from . import ConnectorClickStrategy
 
+logger = logging.getLogger(__name__)
+
 
 class YoutubeBrowserModal(tk.Toplevel):
     def __init__(self, parent: tk.Widget, config_params: dict):
@@ -13,7 +15,7 @@ class YoutubeBrowserModal(tk.Toplevel):
         self._parent = parent
         self.withdraw()  # Init in closed state
 
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
 
         self.focus()
         self.title(self._config_params["title"])
@@ -27,25 +29,26 @@ class YoutubeBrowserModal(tk.Toplevel):
         # Controls
         self.bind("<Escape>", self.close)
 
-        self._args = load_yaml_file(os.path.join(".", "config", "chrome_process_config.yaml"))
-        self._profile = "Default"
-        self._process = None
-    
-
     def close(self, event=None) -> None:
-        close_chrome(self._process)
+        # Keep the browser process warm, only blank and hide it
+        ChromeProcessManager.submit(ChromeProcessManager.hide)
         self._parent.focus()
-        self.destroy()
 
     def show(self) -> None:
-        self._chrome_process = open_chrome(
-            "https://www.youtube.com", self._profile, *self._args
+        # Starting Chrome and DevTools block for seconds, the UI thread only gets the outcome
+        ChromeProcessManager.submit(ChromeProcessManager.navigate, "https://www.youtube.com").add_done_callback(
+            lambda future: self.after(0, self._on_navigated, future)
         )
 
+    def _on_navigated(self, future: Future) -> None:
+        if future.exception() is not None or not future.result():
+            logger.warning("Could not open https://www.youtube.com in Chrome")
+            self._parent.focus()
+
 class YoutubeConnectorClick(ConnectorClickStrategy):
     def __init__(self, parent: tk.Widget, config_params: dict):
         self._parent = parent
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
         self._window = None
 
     def execute(self) -> None:
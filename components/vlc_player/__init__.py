@@ -1 +1,2 @@
-from .player import Player
\ No newline at end of file
+from .player import Player
+from .prefetcher import PlaybackPrefetcher
\ No newline at end of file
@@ -1,7 +1,7 @@
 import os
 import time
-import copy
 import math
+import logging
 import tkinter as tk
 
 from datetime import timedelta
@@ -10,7 +10,20 @@ from typing import Callable
 import vlc
 import customtkinter as ctk
 
-from utils.file_handling import load_yaml_file, read_tk_image
+from PIL import ImageTk
+
+from utils import metrics
+from utils.database import queries, models
+from utils.file_handling import read_tk_image
+from utils.config_service import ConfigService
+from utils.trickplay import TrickplaySheet, load_trickplay
+from utils.task_scheduler import TaskScheduler
+from utils.indexer_daemon import IndexerClient
+
+from .prefetcher import PlaybackPrefetcher
+from .seek_scheduler import SeekScheduler, KeySeekAccelerator
+
+logger = logging.getLogger(__name__)
 
 
 class Player(tk.Toplevel):
@@ -23,6 +36,8 @@ class Player(tk.Toplevel):
         video_path: str,
         sub_path: str,
         total_seconds: int,
+        resume_seconds: int | None = None,
+        audio_analysis: models.AudioAnalysis | None = None,
     ):
         super().__init__(parent)
 
@@ -30,11 +45,11 @@ class Player(tk.Toplevel):
         self._parent = parent
         self._video_path = video_path
         self._sub_path = sub_path
-        self._config_params = copy.deepcopy(config_params)
-        self._vlc_player_config = load_yaml_file(os.path.join("config", "vlc_player_config.yaml"))
+        self._config_params = config_params
+        self._vlc_player_config = ConfigService.get("vlc_player_config.yaml")
         self._total_seconds = total_seconds
-        # Tracks if the scale is being updated by the player
-        self._scale_updating = False
+        # Loudness gain and intro / credits, precomputed by the scan
+        self._audio_analysis = audio_analysis
 
         # Variables used for mouse motion check
         self._cursor_prev_x, self._cursor_prev_y = None, None
@@ -67,16 +82,43 @@ class Player(tk.Toplevel):
         if not os.path.exists(video_path):
             raise FileNotFoundError(f"Video file not found: {video_path}")
 
-        print(f"Initializing Player for {video_path}")
-        self._vlc_instance = vlc.Instance(self._vlc_player_config["VlcInstanceOptions"])
-        self._player = self._vlc_instance.media_player_new()
-
-        # Set window id for the player
-        self.update_idletasks()
-        self._setup_vlc_event_callbacks()  # Set up event callbacks
-        self._player.set_xwindow(self.winfo_id())
-        self._media = self._vlc_instance.media_new(self._video_path)
-        self._player.set_media(self._media)
+        logger.info("Initializing Player for %s", video_path)
+        # Keep background work (scans, previews, lookups) off the CPU and disk while playing
+        TaskScheduler.set_playback_active(True)
+        IndexerClient.set_playback_active(True)
+        with metrics.timer("player.open"):
+            self._vlc_instance = PlaybackPrefetcher.get_vlc_instance()
+            self._player = self._vlc_instance.media_player_new()
+
+            # Set window id for the player
+            self.update_idletasks()
+            self._setup_vlc_event_callbacks()  # Set up event callbacks
+            self._player.set_xwindow(self.winfo_id())
+
+            # Use the media parsed while the card was selected, if there is one
+            self._media = PlaybackPrefetcher.take_media(self._video_path)
+            metrics.increment("player.prefetch_hit" if self._media is not None else "player.prefetch_miss")
+            PlaybackPrefetcher.cancel()
+            if self._media is None:
+                self._media = self._vlc_instance.media_new(self._video_path)
+            if resume_seconds:
+                self._media.add_option(f"start-time={resume_seconds}")
+            self._player.set_media(self._media)
+
+        # Key repeats and slider releases are merged into as few libVLC seeks as possible
+        player_properties = self._vlc_player_config["VlcPlayerProperties"]
+        self._seek_scheduler = SeekScheduler(
+            self,
+            self._player,
+            self._total_seconds,
+            player_properties["SeekMinIntervalMs"],
+            player_properties["SeekSettleMs"],
+        )
+        self._key_seek_accelerator = KeySeekAccelerator(
+            player_properties["SeekStepSecs"],
+            player_properties["SeekAcceleration"],
+            player_properties["SeekRepeatWindowMs"],
+        )
 
         # Bindings
         self.bind("<Escape>", self.close)
@@ -84,6 +126,7 @@ class Player(tk.Toplevel):
         self.bind("<Right>", self.go_forward)
         self.bind("<Left>", self.go_backward)
         self.bind("<Motion>", self.toogle_controls_visibility)
+        self.bind("<Return>", self.skip_intro)
 
         # Add controls
         self._menu = PlayerMenu(
@@ -95,6 +138,10 @@ class Player(tk.Toplevel):
             self.go_backward,
             self.seek,
             self._total_seconds,
+            load_trickplay(video_path),
+        )
+        self._skip_intro_button = SkipIntroButton(
+            self, self._config_params["SkipIntroButton"], self.skip_intro
         )
 
         # Schedule the mouse hiding function
@@ -110,17 +157,48 @@ class Player(tk.Toplevel):
 
     def _update_timeslider(self, event=None) -> None:
         """Callback for when the media player's position changes."""
+        # While seeking the slider shows the target, not the intermediate positions
+        if self._seek_scheduler.target_seconds is not None:
+            return
         seconds = self._player.get_time() // 1000
 
         # Update the time slider on the main thread
         self.after(0, self._menu.set_timeslider_value, seconds)
+        self.after(0, self._update_skip_intro, seconds)
 
     def seek(self, time_in_seconds: int) -> None:
         """Seek the player to the specified time."""
-        if not self._scale_updating:  # Avoid recursion from scale updates
-            self._scale_updating = True
-            self._player.set_time(time_in_seconds * 1000)  # Convert to milliseconds
-            self._scale_updating = False
+        target = self._seek_scheduler.seek_to(time_in_seconds)
+        self._menu.set_timeslider_value(target)
+
+    def _in_intro(self, seconds: int) -> bool:
+        analysis = self._audio_analysis
+        if analysis is None or analysis.intro_start is None:
+            return False
+        # Not worth offering during the last second of the intro
+        return analysis.intro_start <= seconds < analysis.intro_end - 1
+
+    def _update_skip_intro(self, seconds: int) -> None:
+        """Shows the skip intro button only while the intro plays"""
+        if self._in_intro(seconds):
+            self._skip_intro_button.show()
+        else:
+            self._skip_intro_button.hide()
+
+    def skip_intro(self, event=None) -> None:
+        """Jumps to the end of the intro, when the intro is playing"""
+        if not self._in_intro(self._player.get_time() // 1000):
+            return
+        self.seek(math.ceil(self._audio_analysis.intro_end))
+        self._skip_intro_button.hide()
+
+    def _apply_gain(self) -> None:
+        """Levels the volume to the target loudness measured by the scan"""
+        if self._audio_analysis is None or self._audio_analysis.gain_db == 0:
+            return
+        # libVLC volume is a percentage, up to 200
+        volume = round(100 * 10 ** (self._audio_analysis.gain_db / 20))
+        self._player.audio_set_volume(min(max(volume, 0), 200))
 
     def _reset_timer(self) -> None:
         if self._controls_hidden:
@@ -157,7 +235,7 @@ class Player(tk.Toplevel):
     def toogle_play_state(self, event=None) -> None:
         self.toogle_controls_visibility()
         state = self._player.get_state()
-        print(f"Toogle state: {state}")
+        logger.debug("Toogle state: %s", state)
         if state == vlc.State.Playing:
             self.stop()
         else:
@@ -178,55 +256,78 @@ class Player(tk.Toplevel):
                 vlc.MediaSlaveType.subtitle, self._sub_path, True
             )
         else:
-            print(
-                f"Could not find path to subtitle file: {self._sub_path}, trying to find subtitles embedded in the file."
+            logger.info(
+                "Could not find path to subtitle file: %s, trying to find subtitles embedded in the file.",
+                self._sub_path,
             )
             if self._player.video_get_spu_count() > 0:
                 eng_sub_index = extract_eng_subtitles(self._player)
-                print(f"Setting up subtitle with index: {eng_sub_index}")
+                logger.debug("Setting up subtitle with index: %s", eng_sub_index)
                 self._player.video_set_spu(eng_sub_index)
 
     def play(self) -> None:
         """Start playback."""
-        print("Starting playback...")
-        self._player.play()
+        logger.debug("Starting playback...")
+        with metrics.timer("player.play"):
+            self._player.play()
+        self._apply_gain()
         state = self._player.get_state()
-        print(f"Player state after play: {state}")
+        logger.debug("Player state after play: %s", state)
         if state != vlc.State.Playing:
-            print("Error: Playback did not start.")
+            logger.warning("Playback did not start.")
         time.sleep(1)
 
     def stop(self) -> None:
         """Pause playback."""
-        print("Pausing playback.")
+        logger.debug("Pausing playback.")
         self._player.set_pause(1)
 
     def close(self, event=None) -> None:
         """Stop the player and close the widget."""
-        print("Stopping player.")
+        logger.debug("Stopping player.")
 
         # Detach the event handler to avoid callbacks after closing
         self._player.event_manager().event_detach(vlc.EventType.MediaPlayerPositionChanged)
+        self._seek_scheduler.cancel()
 
+        self._save_resume_point()
         self._player.stop()
-        print(f"Video closed: {self._video_path}")
+        logger.info("Video closed: %s", self._video_path)
+        # The libVLC instance is shared with the prefetcher, only the player and the media are ours
+        self._player.release()
         self._media.release()
-        self._vlc_instance.release()
         self._parent.focus()  # Shift focus back to the parent
         self._menu.destroy()
+        self._skip_intro_button.destroy()
         self.destroy()
+        TaskScheduler.set_playback_active(False)
+        IndexerClient.set_playback_active(False)
+
+    def _save_resume_point(self) -> None:
+        """Remembers where playback stopped, unless the video was barely started or (nearly) finished"""
+        player_properties = self._vlc_player_config["VlcPlayerProperties"]
+        position_secs = self._player.get_time() // 1000
+        # Stopping during the credits counts as finished
+        end_secs = self._total_seconds - player_properties["ResumeEndMarginSecs"]
+        if self._audio_analysis is not None and self._audio_analysis.credits_start is not None:
+            end_secs = min(end_secs, self._audio_analysis.credits_start)
+        if position_secs > end_secs:
+            queries.mark_video_watched(self._video_path, time.time())
+        if not player_properties["ResumeMinSecs"] <= position_secs <= end_secs:
+            position_secs = None
+        queries.set_playback_position(self._video_path, position_secs, time.time())
 
     def go_forward(self, event=None) -> None:
-        """Go forward 5 sec"""
+        """Go forward, by a bigger step the longer the key is held"""
         self.toogle_controls_visibility()
-        self.seek(self._player.get_time() // 1000 + 5)
-        self._update_timeslider()
+        target = self._seek_scheduler.seek_by(self._key_seek_accelerator.step(1))
+        self._menu.set_timeslider_value(target)
 
     def go_backward(self, event=None) -> None:
-        """Go backward 5 sec"""
+        """Go backward, by a bigger step the longer the key is held"""
         self.toogle_controls_visibility()
-        self.seek(self._player.get_time() // 1000 - 5)
-        self._update_timeslider()
+        target = self._seek_scheduler.seek_by(self._key_seek_accelerator.step(-1))
+        self._menu.set_timeslider_value(target)
 
     def _hide_controls(self) -> None:
         self.config(cursor="none")
@@ -251,11 +352,15 @@ class PlayerMenu(tk.Toplevel):
         go_backwards_callback: Callable,
         timeslider_callback: Callable,
         total_seconds: int,
+        trickplay: TrickplaySheet | None = None,
     ):
         super().__init__(parent)
         self._parent = parent
-        self._config_params = copy.deepcopy(config_params)
+        self._config_params = config_params
         self._total_seconds = total_seconds
+        self._timeslider_callback = timeslider_callback
+        # While the user drags the slider the player must not move it
+        self._timeslider_dragging = False
 
         # Configure
         self.configure(**self._config_params["Design"])
@@ -312,13 +417,18 @@ class PlayerMenu(tk.Toplevel):
         )
         self._backwards_button.configure(command=go_backwards_callback)
 
+        # Dragging only previews, the player seeks once when the slider is released
         self._timeslider = ctk.CTkSlider(
             self,
             from_=0,
             to=total_seconds,
-            command=lambda value: timeslider_callback(int(value)),
+            command=self._on_timeslider_drag,
             **self._config_params["Timeslider"]["Design"],
         )
+        self._timeslider.bind("<ButtonRelease-1>", self._on_timeslider_release)
+        self._timeslider.bind("<Motion>", self._on_timeslider_hover)
+        self._timeslider.bind("<Leave>", self._on_timeslider_leave)
+        self._seek_preview = SeekPreview(self, self._config_params["SeekPreview"], trickplay)
 
         self._current_time = tk.Label(
             self,
@@ -347,11 +457,40 @@ class PlayerMenu(tk.Toplevel):
         Args:
             value (int): Value in seconds
         """
+        if self._timeslider_dragging:
+            return
+
         self._timeslider.set(value)
         self._current_time.configure(
             text=self._format_time_label(value),
         )
 
+    def _on_timeslider_drag(self, value: float) -> None:
+        self._timeslider_dragging = True
+        self._current_time.configure(text=self._format_time_label(int(value)))
+        self._seek_preview.show(int(value), self.winfo_pointerx(), self._timeslider.winfo_rooty())
+
+    def _on_timeslider_release(self, event=None) -> None:
+        if not self._timeslider_dragging:
+            return
+
+        self._timeslider_dragging = False
+        self._seek_preview.hide()
+        self._timeslider_callback(int(self._timeslider.get()))
+
+    def _on_timeslider_hover(self, event) -> None:
+        if self._timeslider_dragging:
+            return
+
+        ratio = min(max(event.x / max(self._timeslider.winfo_width(), 1), 0), 1)
+        self._seek_preview.show(
+            int(ratio * self._total_seconds), event.x_root, self._timeslider.winfo_rooty()
+        )
+
+    def _on_timeslider_leave(self, event=None) -> None:
+        if not self._timeslider_dragging:
+            self._seek_preview.hide()
+
     def _format_time_label(self, seconds: int) -> str:
         """Formats the integer number of seconds into the following: 
 
@@ -423,6 +562,85 @@ class PlayerMenu(tk.Toplevel):
         self.is_dragging = False
 
 
+class SeekPreview(tk.Toplevel):
+    """Floating frame preview shown above the time slider while hovering or dragging it"""
+
+    def __init__(self, parent: tk.Widget, config_params: dict, trickplay: TrickplaySheet | None):
+        super().__init__(parent)
+        self._config_params = config_params
+        self._trickplay = trickplay
+        self._image = None
+
+        self.configure(**self._config_params["Design"])
+        self.wm_overrideredirect(True)
+        self.attributes("-topmost", True)
+
+        self._image_label = tk.Label(self, **self._config_params["Design"])
+        if self._trickplay is not None:
+            self._image_label.pack()
+        self._time_label = tk.Label(self, **self._config_params["Timestamp"]["Design"])
+        self._time_label.pack(fill="x")
+        self.withdraw()
+
+    def show(self, seconds: int, x_root: int, y_root: int) -> None:
+        """Shows the preview of the given time centered above (x_root, y_root)
+
+        Args:
+            seconds (int): Position in the video
+            x_root (int): Screen x of the pointer
+            y_root (int): Screen y of the top of the slider
+        """
+        if self._trickplay is not None:
+            # Keep a reference so the image is rendered
+            self._image = ImageTk.PhotoImage(self._trickplay.get_tile(seconds))
+            self._image_label.configure(image=self._image)
+        self._time_label.configure(text=str(timedelta(seconds=seconds)))
+
+        self.update_idletasks()
+        width, height = self.winfo_reqwidth(), self.winfo_reqheight()
+        self.geometry(f"+{x_root - width // 2}+{y_root - height - 10}")
+        self.deiconify()
+        self.lift()
+
+    def hide(self) -> None:
+        self.withdraw()
+
+
+class SkipIntroButton(tk.Toplevel):
+    """Floating "Skip intro" button in the bottom right corner of the player"""
+
+    def __init__(self, parent: tk.Widget, config_params: dict, skip_callback: Callable) -> None:
+        super().__init__(parent)
+        self._config_params = config_params
+        self._visible = False
+
+        self.configure(**self._config_params["Design"])
+        self.wm_overrideredirect(True)
+        self.attributes("-topmost", True)
+
+        self._button = tk.Button(self, command=skip_callback, **self._config_params["Button"]["Design"])
+        self._button.pack()
+        self.withdraw()
+
+    def show(self) -> None:
+        if self._visible:
+            return
+
+        self.update_idletasks()
+        margin = self._config_params["Margin"]
+        x = self.winfo_screenwidth() - self.winfo_reqwidth() - margin
+        y = self.winfo_screenheight() - self.winfo_reqheight() - margin
+        self.geometry(f"+{x}+{y}")
+        self.deiconify()
+        self.lift()
+        self._visible = True
+
+    def hide(self) -> None:
+        if self._visible:
+            self.withdraw()
+            self._visible = False
+
+
 class SubtitleMenu(tk.Menu):
     def __init__(self, parent):
         super().__init__(parent)
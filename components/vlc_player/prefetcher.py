@@ -0,0 +1,219 @@
+import os
+import time
+import logging
+import threading
+
+import vlc
+
+from utils import metrics
+from utils.config_service import ConfigService
+from utils.task_scheduler import TaskScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def warm_file_range(
+    path: str,
+    offset: int,
+    length: int,
+    stop_event: threading.Event,
+    chunk_bytes: int,
+    read_through: bool,
+) -> int:
+    """Pulls a byte range of a file into the OS page cache
+
+    Args:
+        path (str): File to warm
+        offset (int): First byte
+        length (int): Number of bytes
+        stop_event (threading.Event): Set it to stop early
+        chunk_bytes (int): Size of every read
+        read_through (bool): Also read the bytes, for file systems that ignore the readahead hint
+
+    Returns:
+        int: Number of bytes warmed
+    """
+    if length <= 0:
+        return 0
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # Asks the kernel to start reading ahead, returns immediately
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        if not read_through:
+            return length
+
+        warmed = 0
+        while warmed < length and not stop_event.is_set():
+            data = os.pread(fd, min(chunk_bytes, length - warmed), offset + warmed)
+            if not data:
+                break
+            warmed += len(data)
+        return warmed
+    finally:
+        os.close(fd)
+
+
+class PlaybackPrefetcher:
+    """Warms the selected title while the user is browsing, so Play starts without a stall
+
+    After the selection stayed on a card for 'DwellMs', a background thread reads the
+    start of the file and the area around the resume point into the page cache (within
+    'ByteBudget') and parses a libVLC media for the player to pick up.
+    Selecting another card cancels the work in progress, and nothing is prefetched
+    while a title plays (the browser keys still move the selection behind the player).
+    """
+
+    _vlc_instance: vlc.Instance | None = None
+    _lock = threading.Lock()
+
+    _dwell_timer: threading.Timer | None = None
+    _stop_event: threading.Event | None = None
+    # Path and media parsed for the current selection, handed over to the player
+    _media_path: str | None = None
+    _media: vlc.Media | None = None
+
+    @classmethod
+    def _get_config(cls) -> dict:
+        return ConfigService.get("vlc_player_config.yaml")
+
+    @classmethod
+    def get_vlc_instance(cls) -> vlc.Instance:
+        """Returns the libVLC instance shared by the prefetcher and the player"""
+        with cls._lock:
+            if cls._vlc_instance is None:
+                cls._vlc_instance = vlc.Instance(cls._get_config()["VlcInstanceOptions"])
+            return cls._vlc_instance
+
+    @classmethod
+    def schedule(cls, video_path: str, length_secs: int, resume_secs: int | None = None) -> None:
+        """Prefetches a title once the selection dwells on it, cancelling the previous one
+
+        Args:
+            video_path (str): Full path to the video file
+            length_secs (int): Video length, used to find the resume point in the file
+            resume_secs (int, optional): Saved resume point
+        """
+        cls.cancel()
+        config = cls._get_config()["Prefetch"]
+        if not config["Enabled"] or TaskScheduler.is_playback_active():
+            return
+
+        stop_event = threading.Event()
+        timer = threading.Timer(
+            config["DwellMs"] / 1000,
+            cls._prefetch,
+            args=(video_path, length_secs, resume_secs, stop_event),
+        )
+        timer.daemon = True
+        with cls._lock:
+            cls._stop_event, cls._dwell_timer = stop_event, timer
+        timer.start()
+
+    @classmethod
+    def cancel(cls) -> None:
+        """Stops the prefetch in progress and drops a media that was not picked up"""
+        with cls._lock:
+            if cls._dwell_timer is not None:
+                cls._dwell_timer.cancel()
+            if cls._stop_event is not None:
+                cls._stop_event.set()
+            media = cls._media
+            cls._dwell_timer, cls._stop_event = None, None
+            cls._media_path, cls._media = None, None
+
+        if media is not None:
+            media.release()
+
+    @classmethod
+    def take_media(cls, video_path: str) -> vlc.Media | None:
+        """Hands the parsed media over to the player, the caller owns (and releases) it
+
+        Args:
+            video_path (str): Full path to the video about to play
+
+        Returns:
+            Optional[vlc.Media]: The parsed media, None if it was prefetched for another title or is not ready
+        """
+        with cls._lock:
+            if cls._media_path != video_path:
+                return None
+            media = cls._media
+            cls._media_path, cls._media = None, None
+        return media
+
+    @classmethod
+    def _prefetch(
+        cls, video_path: str, length_secs: int, resume_secs: int | None, stop_event: threading.Event
+    ) -> None:
+        # Playback started during the dwell, the disk belongs to the player
+        if TaskScheduler.is_playback_active():
+            return
+
+        config = cls._get_config()["Prefetch"]
+        try:
+            with metrics.timer("player.prefetch"):
+                warmed = cls._warm(video_path, length_secs, resume_secs, stop_event, config)
+                media = cls._parse_media(video_path, stop_event, config["ParseTimeoutMs"])
+        except Exception as exception:
+            logger.warning("Prefetch of %s failed: %s", video_path, exception)
+            return
+
+        metrics.increment("player.prefetch_bytes", warmed)
+        if media is None:
+            return
+
+        with cls._lock:
+            # The selection moved on while parsing
+            if stop_event.is_set():
+                media.release()
+                return
+            cls._media_path, cls._media = video_path, media
+        logger.debug("Prefetched %d bytes of %s", warmed, video_path)
+
+    @classmethod
+    def _warm(
+        cls,
+        video_path: str,
+        length_secs: int,
+        resume_secs: int | None,
+        stop_event: threading.Event,
+        config: dict,
+    ) -> int:
+        file_size = os.path.getsize(video_path)
+        budget = config["ByteBudget"]
+
+        # Head first, the resume area gets what is left of the budget
+        ranges = [(0, min(config["HeadBytes"], budget))]
+        if resume_secs and length_secs > 0:
+            # Assumes a constant bitrate, close enough for a readahead window
+            resume_offset = int(file_size * resume_secs / length_secs)
+            resume_length = min(config["ResumeBytes"], budget - ranges[0][1])
+            start = max(resume_offset - resume_length // 4, 0)
+            ranges.append((start, resume_length))
+
+        warmed = 0
+        for offset, length in ranges:
+            if stop_event.is_set():
+                break
+            length = min(length, file_size - offset)
+            warmed += warm_file_range(
+                video_path, offset, length, stop_event, config["ChunkBytes"], config["ReadThrough"]
+            )
+        return warmed
+
+    @classmethod
+    def _parse_media(cls, video_path: str, stop_event: threading.Event, timeout_ms: int) -> vlc.Media | None:
+        if stop_event.is_set():
+            return None
+
+        media = cls.get_vlc_instance().media_new(video_path)
+        media.parse_with_options(vlc.MediaParseFlag.local, timeout_ms)
+
+        deadline = time.monotonic() + timeout_ms / 1000
+        while media.get_parsed_status() == 0 and time.monotonic() < deadline:
+            if stop_event.wait(0.05):
+                media.release()
+                return None
+        return media
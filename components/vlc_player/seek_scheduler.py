@@ -0,0 +1,175 @@
+import time
+import tkinter as tk
+
+import vlc
+
+from utils import metrics
+
+
+class SeekScheduler:
+    """Coalesces seek requests (key repeats, slider releases) into as few libVLC seeks as possible
+
+    Requests only move a target position. At most one seek per frame interval is sent
+    to libVLC: fast (keyframe) seeks while the user keeps scrubbing, then one exact seek
+    to the final target once the requests stop for 'settle_ms'.
+    """
+
+    def __init__(
+        self,
+        widget: tk.Widget,
+        player: vlc.MediaPlayer,
+        total_seconds: int,
+        min_interval_ms: int,
+        settle_ms: int,
+    ) -> None:
+        """
+        Args:
+            widget (tk.Widget): Widget used to schedule the seeks on the Tk event loop
+            player (vlc.MediaPlayer): Player to seek
+            total_seconds (int): Video length, targets are clamped to it
+            min_interval_ms (int): Minimum time between two seeks, when the video fps is unknown
+            settle_ms (int): Quiet time after which the exact seek is sent
+        """
+        self._widget = widget
+        self._player = player
+        self._total_ms = total_seconds * 1000
+        self._min_interval_ms = min_interval_ms
+        self._settle_ms = settle_ms
+
+        self._target_ms: int | None = None
+        self._burst_requests = 0
+        self._last_seek_at = 0.0
+        self._last_seek_was_fast = False
+        self._flush_id = None
+        self._settle_id = None
+        # None until the first fast seek tells if the libVLC binding supports it
+        self._supports_fast_seek: bool | None = None
+
+    @property
+    def target_seconds(self) -> int | None:
+        """Position the player is heading to, None when no seek is in progress"""
+        return None if self._target_ms is None else self._target_ms // 1000
+
+    def seek_by(self, delta_seconds: float) -> int:
+        """Moves the target relative to the pending target (or the current time)
+
+        Args:
+            delta_seconds (float): Signed offset
+
+        Returns:
+            int: New target in seconds
+        """
+        base_ms = self._target_ms if self._target_ms is not None else self._player.get_time()
+        return self.seek_to((base_ms + delta_seconds * 1000) / 1000)
+
+    def seek_to(self, seconds: float) -> int:
+        """Sets the target position
+
+        Args:
+            seconds (float): Absolute position
+
+        Returns:
+            int: New target in seconds, clamped to the video length
+        """
+        self._target_ms = int(min(max(seconds * 1000, 0), max(self._total_ms - 1000, 0)))
+        self._burst_requests += 1
+        metrics.increment("player.seek_request")
+
+        if self._flush_id is None:
+            elapsed_ms = (time.monotonic() - self._last_seek_at) * 1000
+            delay_ms = max(int(self._frame_interval_ms() - elapsed_ms), 0)
+            self._flush_id = self._widget.after(delay_ms, self._flush)
+
+        if self._settle_id is not None:
+            self._widget.after_cancel(self._settle_id)
+        self._settle_id = self._widget.after(self._settle_ms, self._settle)
+        return self._target_ms // 1000
+
+    def cancel(self) -> None:
+        """Drops any pending seek, e.g. when the player closes"""
+        for after_id in (self._flush_id, self._settle_id):
+            if after_id is not None:
+                self._widget.after_cancel(after_id)
+        self._flush_id, self._settle_id, self._target_ms = None, None, None
+
+    def _frame_interval_ms(self) -> float:
+        fps = self._player.get_fps()
+        return max(1000 / fps, self._min_interval_ms) if fps and fps > 0 else self._min_interval_ms
+
+    def _flush(self) -> None:
+        self._flush_id = None
+        if self._target_ms is None:
+            return
+
+        # A lone request is a plain seek, repeated ones are scrubbing
+        self._set_time(self._target_ms, fast=self._burst_requests > 1)
+
+    def _settle(self) -> None:
+        self._settle_id = None
+        unsent = self._flush_id is not None
+        if unsent:
+            self._widget.after_cancel(self._flush_id)
+            self._flush_id = None
+
+        if self._target_ms is not None and (unsent or self._last_seek_was_fast):
+            self._set_time(self._target_ms, fast=False)
+        self._target_ms = None
+        self._burst_requests = 0
+
+    def _set_time(self, target_ms: int, fast: bool) -> None:
+        fast = fast and self._supports_fast_seek is not False
+        if fast:
+            try:
+                # libVLC 4 bindings take a 'fast' flag, libVLC 3 ones only the time
+                self._player.set_time(target_ms, True)
+                self._supports_fast_seek = True
+            except TypeError:
+                self._supports_fast_seek = False
+                fast = False
+        if not fast:
+            self._player.set_time(target_ms)
+
+        metrics.increment("player.seek_fast" if fast else "player.seek_exact")
+        self._last_seek_at = time.monotonic()
+        self._last_seek_was_fast = fast
+
+
+class KeySeekAccelerator:
+    """Grows the arrow key seek step while the key is held down"""
+
+    def __init__(self, base_step_secs: float, acceleration: list[list[float]], repeat_window_ms: int) -> None:
+        """
+        Args:
+            base_step_secs (float): Step of a single key press
+            acceleration (list[list[float]]): [held seconds, step seconds] pairs, in increasing order
+            repeat_window_ms (int): Presses closer than this count as the key being held
+        """
+        self._base_step_secs = base_step_secs
+        self._acceleration = sorted(acceleration)
+        self._repeat_window = repeat_window_ms / 1000
+
+        self._direction = 0
+        self._held_since = 0.0
+        self._last_press_at = 0.0
+
+    def step(self, direction: int) -> float:
+        """Returns the signed step for a key press
+
+        Args:
+            direction (int): 1 for forward, -1 for backward
+
+        Returns:
+            float: Seconds to seek by
+        """
+        now = time.monotonic()
+        if direction != self._direction or now - self._last_press_at > self._repeat_window:
+            self._direction = direction
+            self._held_since = now
+        self._last_press_at = now
+
+        held_secs = now - self._held_since
+        step_secs = self._base_step_secs
+        for threshold_secs, accelerated_step_secs in self._acceleration:
+            if held_secs >= threshold_secs:
+                step_secs = accelerated_step_secs
+        return direction * step_secs
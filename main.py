@@ -1,38 +1,72 @@
 import os
+import sys
 import ctypes
 
 import platform
 
+import cli
+
 from components import App
-from utils import set_proc_name
+from utils import set_proc_name, library_sources, metrics, filename_parser, enrichment
 from utils.database import schema
-from utils.file_handling import load_yaml_file
+from utils.config_service import ConfigService
+from utils.peer_cache import PeerCacheServer
+from utils import indexer_daemon
 
 
-def main():
-    if platform.system() == "Linux":
-        set_proc_name("cinenomad-alpha")
+def prepare_environment(role: str, read_only: bool = False) -> None:
+    """Creates the folders and the database needed by both the GUI and the headless commands
+
+    Args:
+        role (str): 'gui' or the headless command, names the log file of the process
+        read_only (bool, optional): Only set up logging and metrics, for commands that must not
+            write anything (e.g. 'scan --dry-run'). Defaults to False.
+    """
+    metrics.setup(ConfigService.get("metrics_config.yaml"), role)
+    if read_only:
+        return
 
-        # Ensure Xlib is thread-safe
-        ctypes.CDLL("libX11.so").XInitThreads()
-    
     # Create required folders if first run
-    required_folders = load_yaml_file(os.path.join("config", "required_folders.yaml"))
+    required_folders = ConfigService.get("required_folders.yaml")
     for folder_path in required_folders:
-        if isinstance(folder_path, list):
+        if isinstance(folder_path, (list, tuple)):
            folder_path = os.path.join(*folder_path)
         
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
 
-    config_path = os.path.join("config", "components_config.yaml")
-    
     # Ensure sqlite3 database is created along with the schema
     schema.create_tables()
     schema.seed_default()
+    library_sources.migrate_legacy_local_folder()
+    library_sources.sweep_interrupted_work()
+    filename_parser.backfill_parsed_names()
+    enrichment.enqueue_unmatched_videos()
+
+
+def main():
+    # Headless commands, e.g. 'python main.py scan --jobs 4'
+    if len(sys.argv) > 1:
+        # Parsed first, so '--help' and usage errors exit before anything is written
+        args = cli.parse_args(sys.argv[1:])
+        prepare_environment(args.command, read_only=cli.is_read_only(args))
+        sys.exit(cli.run(args))
+
+    if platform.system() == "Linux":
+        set_proc_name("cinenomad-alpha")
+
+        # Ensure Xlib is thread-safe
+        ctypes.CDLL("libX11.so").XInitThreads()
+
+    prepare_environment("gui")
+
+    # Other nodes on the LAN ask this one about the files it indexed, the indexer daemon answers them when used
+    peer_cache_config = ConfigService.get("peer_cache_config.yaml")
+    if peer_cache_config["Serve"] and not indexer_daemon.is_enabled():
+        PeerCacheServer.start_in_background(peer_cache_config["Host"], peer_cache_config["Port"])
 
     # Start app
-    app = App(config_path)
+    app = App("components_config.yaml")
     app.mainloop()
 
 
@@ -0,0 +1,441 @@
+"""Offline audio analysis: loudness for volume levelling, intros and credits shared by episodes.
+
+The audio track is decoded by an ffmpeg subprocess (mono float32 at a low sample
+rate) and streamed in chunks, so a full movie never sits in memory.
+
+- Loudness is the integrated loudness of ITU-R BS.1770: K-weighted mean square
+  per 100 ms block, 400 ms gating blocks and the absolute / relative gates. The
+  K-weighting is applied in the frequency domain, so every chunk is one FFT.
+- The first and last minutes get an audio fingerprint, one 32 bit word per frame
+  built from band energy differences. Episodes of a season are cross-correlated
+  on these words; the longest run of matching frames at one time offset is the
+  shared intro (in the heads) or credits (in the tails).
+
+All of it runs from the headless scan, the player only reads the stored results.
+"""
+import os
+import time
+import logging
+import subprocess
+
+from collections import deque
+from typing import Iterator
+
+import numpy as np
+
+from utils import metrics
+from utils.config_service import ConfigService
+from utils.database import queries, models
+
+logger = logging.getLogger(__name__)
+
+_BLOCK_SECS = 0.1
+_GATE_BLOCKS = 4  # 400 ms gating blocks, 75 % overlap
+_ABSOLUTE_GATE_LUFS = -70.0
+_RELATIVE_GATE_LU = -10.0
+_FINGERPRINT_BANDS = 33  # 32 band differences -> 32 bits per frame
+
+# Set bits of every byte value, popcount of uint32 words without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _load_config() -> dict:
+    return ConfigService.get("audio_analysis_config.yaml")
+
+
+def decode_audio(
+    video_path: str, sample_rate: int, chunk_secs: float, ffmpeg_path: str = "ffmpeg"
+) -> Iterator[np.ndarray]:
+    """Streams the audio of a video as mono float32 chunks, decoded by an ffmpeg subprocess
+
+    Args:
+        video_path (str): Full path to the video file
+        sample_rate (int): Output sample rate
+        chunk_secs (float): Length of every chunk
+        ffmpeg_path (str, optional): ffmpeg executable. Defaults to "ffmpeg".
+
+    Raises:
+        RuntimeError: If ffmpeg fails, e.g. the file has no audio track
+
+    Yields:
+        np.ndarray: Samples in [-1, 1]
+    """
+    command = [
+        ffmpeg_path, "-nostdin", "-v", "error", "-i", video_path,
+        "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "-",
+    ]
+    # Low priority, the scan shares the box with playback
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=(lambda: os.nice(10)) if os.name == "posix" else None,
+    )
+    chunk_bytes = int(sample_rate * chunk_secs) * 4
+    completed = False
+    try:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype="<f4", count=len(data) // 4)
+        completed = True
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+    if completed and process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode} on {video_path}")
+
+
+def _biquad_power_response(b: tuple, a: tuple, frequencies: np.ndarray, sample_rate: int) -> np.ndarray:
+    """|H(f)|^2 of a biquad filter at the given frequencies"""
+    z = np.exp(-2j * np.pi * frequencies / sample_rate)
+    numerator = b[0] + b[1] * z + b[2] * z**2
+    denominator = a[0] + a[1] * z + a[2] * z**2
+    return np.abs(numerator / denominator) ** 2
+
+
+def k_weighting_response(block_size: int, sample_rate: int) -> np.ndarray:
+    """Power response of the BS.1770 K-weighting filter on the rfft bins of a block
+
+    The shelf and high pass are designed for the given sample rate, like the
+    48 kHz coefficients of the standard.
+
+    Args:
+        block_size (int): Samples per block
+        sample_rate (int): Sample rate
+
+    Returns:
+        np.ndarray: One factor per rfft bin
+    """
+    frequencies = np.fft.rfftfreq(block_size, 1 / sample_rate)
+
+    # Stage 1: +4 dB high shelf modelling the head
+    gain = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / sample_rate
+    alpha = np.sin(w0) / (2 * (1 / np.sqrt(2)))
+    cos_w0, sqrt_gain = np.cos(w0), np.sqrt(gain)
+    shelf = _biquad_power_response(
+        (
+            gain * ((gain + 1) + (gain - 1) * cos_w0 + 2 * sqrt_gain * alpha),
+            -2 * gain * ((gain - 1) + (gain + 1) * cos_w0),
+            gain * ((gain + 1) + (gain - 1) * cos_w0 - 2 * sqrt_gain * alpha),
+        ),
+        (
+            (gain + 1) - (gain - 1) * cos_w0 + 2 * sqrt_gain * alpha,
+            2 * ((gain - 1) - (gain + 1) * cos_w0),
+            (gain + 1) - (gain - 1) * cos_w0 - 2 * sqrt_gain * alpha,
+        ),
+        frequencies,
+        sample_rate,
+    )
+
+    # Stage 2: high pass removing the lowest frequencies
+    w0 = 2 * np.pi * 38.0 / sample_rate
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos_w0 = np.cos(w0)
+    high_pass = _biquad_power_response(
+        ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2),
+        (1 + alpha, -2 * cos_w0, 1 - alpha),
+        frequencies,
+        sample_rate,
+    )
+    return shelf * high_pass
+
+
+class LoudnessMeter:
+    """Integrated loudness (LUFS) of a mono signal fed chunk by chunk"""
+
+    def __init__(self, sample_rate: int) -> None:
+        self._block_size = int(sample_rate * _BLOCK_SECS)
+        # Parseval on the rfft: every bin but DC and Nyquist stands for two
+        bin_weights = np.full(self._block_size // 2 + 1, 2.0)
+        bin_weights[0] = 1.0
+        if self._block_size % 2 == 0:
+            bin_weights[-1] = 1.0
+        self._weights = bin_weights * k_weighting_response(self._block_size, sample_rate) / self._block_size**2
+        self._remainder = np.zeros(0, dtype=np.float32)
+        self._block_powers: list[np.ndarray] = []
+
+    def add(self, samples: np.ndarray) -> None:
+        """Feeds the next samples of the signal"""
+        samples = np.concatenate((self._remainder, samples))
+        block_count = len(samples) // self._block_size
+        self._remainder = samples[block_count * self._block_size :]
+        if block_count == 0:
+            return
+
+        blocks = samples[: block_count * self._block_size].reshape(block_count, self._block_size)
+        spectrum = np.abs(np.fft.rfft(blocks, axis=1)) ** 2
+        self._block_powers.append(spectrum @ self._weights)
+
+    def integrated_loudness(self) -> float | None:
+        """Gated loudness of everything fed so far, None if the signal is silent or too short"""
+        if not self._block_powers:
+            return None
+        powers = np.concatenate(self._block_powers)
+        if len(powers) < _GATE_BLOCKS:
+            return None
+
+        # Mean square of every 400 ms block, one every 100 ms
+        cumulative = np.concatenate(([0.0], np.cumsum(powers)))
+        gate_powers = (cumulative[_GATE_BLOCKS:] - cumulative[:-_GATE_BLOCKS]) / _GATE_BLOCKS
+        with np.errstate(divide="ignore"):
+            gate_loudness = -0.691 + 10 * np.log10(gate_powers)
+
+        gated = gate_powers[gate_loudness > _ABSOLUTE_GATE_LUFS]
+        if len(gated) == 0:
+            return None
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) + _RELATIVE_GATE_LU
+        gated = gate_powers[(gate_loudness > _ABSOLUTE_GATE_LUFS) & (gate_loudness > relative_gate)]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def audio_fingerprint(samples: np.ndarray, sample_rate: int, frame_secs: float) -> np.ndarray:
+    """One 32 bit word per frame, from how band energies differ across bands and frames
+
+    The words only depend on the shape of the spectrum, so the same music at another
+    volume or encode gives (nearly) the same words.
+
+    Args:
+        samples (np.ndarray): Mono samples
+        sample_rate (int): Sample rate
+        frame_secs (float): Frame length, also the time resolution of matches
+
+    Returns:
+        np.ndarray: uint32 words, one per frame but the first
+    """
+    frame_size = int(sample_rate * frame_secs)
+    frame_count = len(samples) // frame_size
+    if frame_count < 2:
+        return np.zeros(0, dtype=np.uint32)
+
+    frames = samples[: frame_count * frame_size].reshape(frame_count, frame_size) * np.hanning(frame_size)
+    spectrum = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+
+    # Log spaced bands over the range where music and voices carry their energy
+    frequencies = np.fft.rfftfreq(frame_size, 1 / sample_rate)
+    edges = np.geomspace(150.0, min(4000.0, sample_rate / 2), _FINGERPRINT_BANDS + 1)
+    band_of_bin = np.digitize(frequencies, edges) - 1
+    band_matrix = np.zeros((len(frequencies), _FINGERPRINT_BANDS), dtype=np.float64)
+    in_range = (band_of_bin >= 0) & (band_of_bin < _FINGERPRINT_BANDS)
+    band_matrix[np.flatnonzero(in_range), band_of_bin[in_range]] = 1.0
+    energies = np.log(spectrum @ band_matrix + 1e-10)
+
+    band_differences = energies[:, :-1] - energies[:, 1:]
+    bits = (band_differences[1:] - band_differences[:-1]) > 0
+    return (bits.astype(np.uint64) << np.arange(32, dtype=np.uint64)).sum(axis=1).astype(np.uint32)
+
+
+def _bit_distances(words: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Differing bits between every word of 'words' and every word of 'other', shape (len(words), len(other))"""
+    differences = np.bitwise_xor(words[:, None], other[None, :])
+    return _POPCOUNT_TABLE[differences.view(np.uint8)].reshape(*differences.shape, 4).sum(axis=2, dtype=np.uint8)
+
+
+def find_shared_segment(
+    fingerprint: np.ndarray, other: np.ndarray, frame_secs: float, config: dict
+) -> tuple[tuple[float, float], tuple[float, float]] | None:
+    """Cross-correlates two fingerprints and returns the longest segment they share
+
+    Args:
+        fingerprint (np.ndarray): Words of the first audio
+        other (np.ndarray): Words of the second audio
+        frame_secs (float): Frame length of the fingerprints
+        config (dict): 'Segments' section of the audio analysis config
+
+    Returns:
+        Optional[tuple]: (start, end) seconds in the first audio and in the second one, None if nothing long enough matches
+    """
+    if len(fingerprint) == 0 or len(other) == 0:
+        return None
+
+    matches = _bit_distances(fingerprint, other) <= config["MaxBitErrors"]
+    window = max(int(config["SmoothingSecs"] / frame_secs), 1)
+    min_frames = int(config["MinSegmentSecs"] / frame_secs)
+    max_frames = int(config["MaxSegmentSecs"] / frame_secs)
+
+    best_length, best = 0, None
+    # Every diagonal is one time offset between the two audios
+    for offset in range(-(len(fingerprint) - 1), len(other)):
+        diagonal = np.diagonal(matches, offset)
+        if len(diagonal) < min_frames:
+            continue
+
+        # Tolerates isolated mismatching frames (dialogue over the theme, encoder noise)
+        matched = np.convolve(diagonal, np.ones(window), "same") >= config["MatchRatio"] * window
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], matched.astype(np.int8), [0]))))
+        if len(edges) == 0:
+            continue
+        starts, ends = edges[::2], edges[1::2]
+        lengths = ends - starts
+        idx = int(np.argmax(lengths))
+        if best_length < lengths[idx] <= max_frames:
+            best_length = int(lengths[idx])
+            start = int(starts[idx])
+            first_start = start + max(-offset, 0)
+            other_start = start + max(offset, 0)
+            best = (first_start, other_start)
+
+    if best is None or best_length < min_frames:
+        return None
+
+    # Word i describes the change between frames i and i + 1
+    first_start, other_start = best
+    return (
+        ((first_start + 1) * frame_secs, (first_start + 1 + best_length) * frame_secs),
+        ((other_start + 1) * frame_secs, (other_start + 1 + best_length) * frame_secs),
+    )
+
+
+def analyze_video(video_path: str, config: dict | None = None) -> models.AudioAnalysis:
+    """Measures the loudness of a video and fingerprints its first and last minutes, in one decode
+
+    Args:
+        video_path (str): Full path to the video file
+        config (dict, optional): Audio analysis config, loaded from 'audio_analysis_config.yaml' if None
+
+    Raises:
+        RuntimeError: If the audio could not be decoded
+
+    Returns:
+        models.AudioAnalysis: Loudness, gain and fingerprints, segments are found later across episodes
+    """
+    config = config or _load_config()
+    segments_config = config["Segments"]
+    sample_rate = config["SampleRate"]
+    head_samples = int(segments_config["IntroSearchSecs"] * sample_rate)
+    tail_samples = int(segments_config["CreditsSearchSecs"] * sample_rate)
+
+    meter = LoudnessMeter(sample_rate)
+    head, tail, tail_length, decoded = [], deque(), 0, 0
+    with metrics.timer("audio.analyze"):
+        for chunk in decode_audio(video_path, sample_rate, config["ChunkSecs"], config["FfmpegPath"]):
+            meter.add(chunk)
+            if decoded < head_samples:
+                head.append(chunk[: head_samples - decoded])
+            decoded += len(chunk)
+
+            # Only the last 'CreditsSearchSecs' are kept
+            tail.append(chunk)
+            tail_length += len(chunk)
+            while tail and tail_length - len(tail[0]) >= tail_samples:
+                tail_length -= len(tail.popleft())
+
+        if decoded == 0:
+            raise RuntimeError(f"No audio decoded from {video_path}")
+
+        tail_audio = np.concatenate(tail)[-tail_samples:]
+        frame_secs = segments_config["FrameSecs"]
+        head_fingerprint = audio_fingerprint(np.concatenate(head), sample_rate, frame_secs)
+        tail_fingerprint = audio_fingerprint(tail_audio, sample_rate, frame_secs)
+
+    loudness = meter.integrated_loudness()
+    gain_db = 0.0
+    if loudness is not None:
+        gain_db = float(np.clip(config["TargetLufs"] - loudness, -config["MaxCutDb"], config["MaxBoostDb"]))
+
+    return models.AudioAnalysis(
+        full_path=video_path,
+        loudness_lufs=loudness,
+        gain_db=gain_db,
+        head_fingerprint=head_fingerprint.tobytes(),
+        tail_fingerprint=tail_fingerprint.tobytes(),
+        tail_offset_secs=(decoded - len(tail_audio)) / sample_rate,
+    )
+
+
+def _detect_season_segments(parsed_title: str, season: int, config: dict) -> int:
+    """Pairs the unchecked episodes of a season with the others to find their intro and credits
+
+    Returns:
+        int: Number of episodes whose segments were found
+    """
+    segments_config = config["Segments"]
+    frame_secs = segments_config["FrameSecs"]
+    episodes = queries.get_season_audio_analyses(parsed_title, season)
+    found = 0
+
+    def _words(data: bytes) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.uint32)
+
+    for episode in (episode for episode in episodes if not episode.segments_checked):
+        intro, credits_start = None, None
+        for other in episodes:
+            if other.full_path == episode.full_path:
+                continue
+
+            if intro is None:
+                shared = find_shared_segment(
+                    _words(episode.head_fingerprint), _words(other.head_fingerprint), frame_secs, segments_config
+                )
+                if shared is not None:
+                    intro = shared[0]
+                    # An episode checked before this one had no partner yet
+                    if other.intro_start is None:
+                        queries.update_audio_segments(other.full_path, intro=shared[1])
+
+            if credits_start is None:
+                shared = find_shared_segment(
+                    _words(episode.tail_fingerprint), _words(other.tail_fingerprint), frame_secs, segments_config
+                )
+                if shared is not None:
+                    credits_start = episode.tail_offset_secs + shared[0][0]
+                    if other.credits_start is None:
+                        queries.update_audio_segments(
+                            other.full_path, credits_start=other.tail_offset_secs + shared[1][0]
+                        )
+
+            if intro is not None and credits_start is not None:
+                break
+
+        queries.update_audio_segments(
+            episode.full_path, intro=intro, credits_start=credits_start, segments_checked=True
+        )
+        found += intro is not None or credits_start is not None
+        # Later episodes of the loop compare against the fresh results
+        episodes = queries.get_season_audio_analyses(parsed_title, season)
+    return found
+
+
+def analyze_missing_videos(stop_event=None) -> int:
+    """Analyses the videos that were never analysed, then looks for intros and credits in their seasons
+
+    Args:
+        stop_event (threading.Event, optional): Set it to stop after the current video
+
+    Returns:
+        int: Number of videos analysed
+    """
+    config = _load_config()
+    if not config["Enabled"]:
+        return 0
+
+    analyzed = 0
+    for video_path in queries.get_video_paths_without_audio_analysis():
+        if stop_event is not None and stop_event.is_set():
+            break
+        if not os.path.exists(video_path):
+            continue
+
+        try:
+            analysis = analyze_video(video_path, config)
+        except (OSError, RuntimeError) as exception:
+            # Missing ffmpeg stops the whole stage, a broken file only itself
+            logger.warning("Audio analysis failed for %s: %s", video_path, exception)
+            if isinstance(exception, FileNotFoundError):
+                return analyzed
+            continue
+
+        queries.insert_audio_analysis(analysis, time.time())
+        analyzed += 1
+        logger.debug("Loudness of %s: %s LUFS, gain %.1f dB", video_path, analysis.loudness_lufs, analysis.gain_db)
+
+    with metrics.timer("audio.segments"):
+        for parsed_title, season in queries.get_seasons_with_unchecked_segments():
+            found = _detect_season_segments(parsed_title, season, config)
+            logger.info("Found intro or credits in %d episodes of %s season %d", found, parsed_title, season)
+    return analyzed
@@ -1,6 +1,23 @@
-import subprocess
-import signal
 import os
+import json
+import time
+import atexit
+import signal
+import asyncio
+import logging
+import platform
+import threading
+import subprocess
+
+from typing import Any, Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+import websockets
+
+from utils.config_service import ConfigService
+
+logger = logging.getLogger(__name__)
 
 
 def open_chrome(url: str, profile: str, *args) -> subprocess.Popen | None:
@@ -26,34 +43,298 @@ def open_chrome(url: str, profile: str, *args) -> subprocess.Popen | None:
 
     # Append the URL
     command.append(url)
-    print(command)
+    logger.debug("Opening Chrome: %s", command)
 
     try:
         # Run the command and return the process
         process = subprocess.Popen(command, start_new_session=True)
         return process
-    except FileNotFoundError:
-        print(f"Chrome is not installed: {exception}")
+    except FileNotFoundError as exception:
+        logger.error("Chrome is not installed: %s", exception)
     except subprocess.CalledProcessError as exception:
-        print(f"Failed to open Chrome: {exception}")
+        logger.error("Failed to open Chrome: %s", exception)
     except Exception as exception:
-        print(f"An error occurred: {exception}")
+        logger.error("Could not open Chrome: %s", exception)
     return None
 
 
-def close_chrome(process: subprocess.Popen) -> None:
-    """Closes the Chrome instance.
+def close_chrome(process: subprocess.Popen, timeout: float = 5) -> None:
+    """Closes the Chrome instance and reaps it so no zombie is left behind.
 
     Args:
         process (subprocess.Popen): The Popen process object for the Chrome instance.
+        timeout (float, optional): Seconds to wait for a graceful exit before killing. Defaults to 5.
     """
     if process:
         try:
-            # Kill the entire process group using the PGID
-            pgid = os.getpgid(process.pid)
-            os.killpg(pgid, signal.SIGTERM)
-            print("Chrome closed successfully.")
+            if platform.system() == "Windows":
+                process.terminate()
+            else:
+                # Kill the entire process group using the PGID
+                pgid = os.getpgid(process.pid)
+                os.killpg(pgid, signal.SIGTERM)
+
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                if platform.system() == "Windows":
+                    process.kill()
+                else:
+                    os.killpg(pgid, signal.SIGKILL)
+                process.wait()
+            logger.info("Chrome closed successfully")
+        except ProcessLookupError:
+            # Already gone, just collect the exit status
+            process.poll()
         except Exception as exception:
-            print(f"An error occurred while closing Chrome: {exception}")
+            logger.warning("An error occurred while closing Chrome: %s", exception)
     else:
-        print("No process found to terminate.")
+        logger.debug("No Chrome process found to terminate")
+
+
+class ChromeProcessManager:
+    """Singleton class that keeps a single pre-warmed kiosk Chrome process alive.
+
+    Chrome is launched once in the background (minimized) and every connector
+    reuses it by navigating the existing page over the DevTools protocol,
+    instead of cold-launching a new browser on every click.
+
+    Starting Chrome and talking to DevTools blocks for up to 'StartupTimeout',
+    the UI runs 'navigate' and 'hide' with 'submit' and gets the outcome back.
+    """
+
+    _process = None
+    _lock = threading.RLock()
+    _atexit_registered = False
+    # One thread, so a 'hide' never overtakes the 'navigate' submitted before it
+    _commands = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chrome")
+
+    @classmethod
+    def submit(cls, func: Callable, *args: Any) -> Future:
+        """Runs a blocking call, e.g. 'navigate' or 'hide', off the calling thread, in the order submitted
+
+        Args:
+            func (Callable): Method of this class to run
+
+        Returns:
+            Future: Result of the call
+        """
+        return cls._commands.submit(func, *args)
+
+    @classmethod
+    def _get_config(cls) -> dict:
+        return ConfigService.get("chrome_process_config.yaml")
+
+    @classmethod
+    def _devtools_url(cls, path: str) -> str:
+        return f"http://127.0.0.1:{cls._get_config()['DevToolsPort']}{path}"
+
+    @classmethod
+    def _reap(cls) -> None:
+        """Forgets the tracked process if it exited (e.g. the user closed the window)"""
+        if cls._process is not None and cls._process.poll() is not None:
+            logger.info("Chrome exited with code: %s", cls._process.returncode)
+            cls._process = None
+
+    @classmethod
+    def is_running(cls) -> bool:
+        """Returns True if the managed Chrome process is alive"""
+        with cls._lock:
+            cls._reap()
+            return cls._process is not None
+
+    @classmethod
+    def start(cls, wait: bool = False) -> bool:
+        """Launches the kiosk Chrome in the background if it is not already running.
+
+        Args:
+            wait (bool, optional): Block until the DevTools endpoint answers. Defaults to False.
+
+        Returns:
+            bool: True if a Chrome process is running (or starting)
+        """
+        with cls._lock:
+            cls._reap()
+            # Already warm, or warming up on its own thread
+            if cls._process is not None:
+                return True
+
+            config = cls._get_config()
+            user_data_dir = os.path.expanduser(config["UserDataDir"])
+            os.makedirs(user_data_dir, exist_ok=True)
+
+            cls._process = open_chrome(
+                "about:blank",
+                config["Profile"],
+                *config["ProcessArgs"],
+                f"--user-data-dir={user_data_dir}",
+                f"--remote-debugging-port={config['DevToolsPort']}",
+            )
+            if cls._process is None:
+                return False
+
+            if not cls._atexit_registered:
+                atexit.register(cls.shutdown)
+                cls._atexit_registered = True
+
+            if not wait:
+                # Hide the window as soon as DevTools is reachable, without blocking the UI
+                threading.Thread(target=cls._warm_up, daemon=True).start()
+                return True
+
+        return cls._warm_up()
+
+    @classmethod
+    def _warm_up(cls) -> bool:
+        if not cls._wait_for_devtools():
+            logger.warning("Chrome DevTools endpoint did not come up in time")
+            return False
+        cls._set_window_state("minimized")
+        return True
+
+    @classmethod
+    def _wait_for_devtools(cls) -> bool:
+        deadline = time.monotonic() + cls._get_config()["StartupTimeout"]
+        while time.monotonic() < deadline:
+            if not cls.is_running():
+                return False
+            try:
+                response = requests.get(cls._devtools_url("/json/version"), timeout=1)
+                if response.status_code == 200:
+                    return True
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+        return False
+
+    @classmethod
+    def _get_page_target(cls) -> dict | None:
+        """Returns the first page target, creating one if Chrome has none open"""
+        try:
+            response = requests.get(cls._devtools_url("/json/list"), timeout=2)
+            pages = [target for target in response.json() if target["type"] == "page"]
+            if pages:
+                return pages[0]
+
+            response = requests.put(cls._devtools_url("/json/new?about:blank"), timeout=2)
+            return response.json()
+        except Exception as exception:
+            logger.warning("Could not retrieve Chrome page target: %s", exception)
+        return None
+
+    @classmethod
+    def _send_commands(cls, ws_url: str, commands: list[tuple[str, dict]]) -> list[dict]:
+        """Sends DevTools commands over a single websocket connection and collects the results
+
+        Args:
+            ws_url (str): DevTools websocket URL of the target
+            commands (list[tuple[str, dict]]): (method, params) pairs, sent in order
+
+        Returns:
+            list[dict]: The 'result' object of every command
+        """
+
+        async def _run() -> list[dict]:
+            results = []
+            async with websockets.connect(ws_url, max_size=None) as websocket:
+                for command_id, (method, params) in enumerate(commands, start=1):
+                    await websocket.send(
+                        json.dumps({"id": command_id, "method": method, "params": params})
+                    )
+                    # Skip events until the answer for this command arrives
+                    while True:
+                        message = json.loads(await websocket.recv())
+                        if message.get("id") == command_id:
+                            if "error" in message:
+                                raise RuntimeError(f"{method} failed: {message['error']}")
+                            results.append(message.get("result", {}))
+                            break
+            return results
+
+        return asyncio.run(asyncio.wait_for(_run(), timeout=5))
+
+    @classmethod
+    def _set_window_state(cls, state: str) -> bool:
+        """Changes the Chrome window state: 'minimized', 'fullscreen', 'normal' or 'maximized'"""
+        target = cls._get_page_target()
+        if target is None:
+            return False
+
+        try:
+            browser_ws_url = requests.get(
+                cls._devtools_url("/json/version"), timeout=2
+            ).json()["webSocketDebuggerUrl"]
+            window = cls._send_commands(
+                browser_ws_url, [("Browser.getWindowForTarget", {"targetId": target["id"]})]
+            )[0]
+            cls._send_commands(
+                browser_ws_url,
+                [
+                    (
+                        "Browser.setWindowBounds",
+                        {"windowId": window["windowId"], "bounds": {"windowState": state}},
+                    )
+                ],
+            )
+            return True
+        except Exception as exception:
+            logger.warning("Could not change Chrome window state to %s: %s", state, exception)
+        return False
+
+    @classmethod
+    def navigate(cls, url: str) -> bool:
+        """Shows the kiosk window and navigates it to the given URL, starting Chrome if needed.
+        Blocks until DevTools answers, run it with 'submit' from the UI thread
+
+        Args:
+            url (str): The URL to open
+
+        Returns:
+            bool: True if navigation was sent
+        """
+        with cls._lock:
+            # A Chrome pre-warmed moments ago may not answer DevTools yet
+            if not cls.start(wait=True) or not cls._wait_for_devtools():
+                return False
+
+            target = cls._get_page_target()
+            if target is None:
+                return False
+
+            try:
+                cls._send_commands(
+                    target["webSocketDebuggerUrl"],
+                    [("Page.navigate", {"url": url}), ("Page.bringToFront", {})],
+                )
+            except Exception as exception:
+                logger.warning("Could not navigate Chrome to %s: %s", url, exception)
+                return False
+
+            return cls._set_window_state("fullscreen")
+
+    @classmethod
+    def hide(cls) -> None:
+        """Blanks the page (stops playback) and minimizes the kiosk window, keeping the process warm.
+        Blocks on DevTools, run it with 'submit' from the UI thread
+        """
+        with cls._lock:
+            if not cls.is_running():
+                return
+
+            target = cls._get_page_target()
+            if target is not None:
+                try:
+                    cls._send_commands(
+                        target["webSocketDebuggerUrl"], [("Page.navigate", {"url": "about:blank"})]
+                    )
+                except Exception as exception:
+                    logger.warning("Could not blank Chrome page: %s", exception)
+            cls._set_window_state("minimized")
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Terminates and reaps the managed Chrome process"""
+        with cls._lock:
+            if cls._process is not None:
+                close_chrome(cls._process)
+                cls._process = None
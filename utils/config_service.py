@@ -0,0 +1,335 @@
+"""Parses the YAML configs once and hands out read only views of them.
+
+A config is parsed and validated the first time it is asked for, then every
+caller shares the same frozen view (mappings become FrozenDict, lists become
+tuples), so widgets no longer need a deep copy to protect it. The parsed form
+is also pickled next to the other generated resources, keyed by the YAML file's
+mtime and size, so the next start skips YAML parsing altogether.
+"""
+import os
+import pickle
+import logging
+import threading
+
+from collections.abc import Mapping, Iterator
+from typing import Any
+
+import yaml
+
+from utils.exceptions import ConfigValidationException
+
+CONFIG_FOLDER = "config"
+CONFIG_CACHE_FOLDER = os.path.join("resources", "config_cache")
+
+logger = logging.getLogger(__name__)
+
+# Expected top level layout of the configs, keys -> type or nested layout.
+# Only listed keys are checked, configs may hold more.
+_SCHEMAS: dict[str, Any] = {
+    "accepted_extension.yaml": list,
+    "required_folders.yaml": list,
+    "app_settings.yaml": list,
+    "components_config.yaml": {
+        "App": dict,
+        "CloseButton": {"Design": dict, "Placement": dict},
+        "SleepButton": {"Design": dict, "Placement": dict},
+        "NewConnectorButton": {"Design": dict, "Placement": dict},
+        "ConnectorIcon": {"Design": dict, "Placement": dict},
+        "ConnectorLabel": {"Design": dict, "Placement": dict},
+        "ConnectorsFrame": {"Design": dict, "Placement": dict},
+        "VersionTag": {"Design": dict, "Placement": dict},
+        "AddMovieSourceModal": dict,
+        "LocalMovieBrowserModal": {"title": str, "Design": dict, "LocalMovieCard": dict},
+        "NetflixBrowserModal": {"title": str, "Design": dict},
+    },
+    "vlc_player_config.yaml": {
+        "VlcInstanceOptions": list,
+        "VlcPlayerProperties": {
+            "CursorPixelMovingThreshold": int,
+            "InactivityTimeout": int,
+            "UpdateScaleTimeInterval": int,
+            "SeekStepSecs": (int, float),
+            "SeekAcceleration": list,
+            "SeekRepeatWindowMs": int,
+            "SeekMinIntervalMs": int,
+            "SeekSettleMs": int,
+            "ResumeMinSecs": int,
+            "ResumeEndMarginSecs": int,
+        },
+        "Prefetch": {
+            "Enabled": bool,
+            "DwellMs": int,
+            "ByteBudget": int,
+            "HeadBytes": int,
+            "ResumeBytes": int,
+            "ChunkBytes": int,
+            "ReadThrough": bool,
+            "ParseTimeoutMs": int,
+        },
+    },
+    "chrome_process_config.yaml": {
+        "ProcessArgs": list,
+        "Profile": str,
+        "UserDataDir": str,
+        "DevToolsPort": int,
+        "StartupTimeout": (int, float),
+    },
+    "library_sources_config.yaml": {
+        "LocalSource": {"ScanIntervalMins": int, "MaxWorkers": int, "FingerprintTtlMins": int},
+        "NetworkSource": {"ScanIntervalMins": int, "MaxWorkers": int, "FingerprintTtlMins": int},
+        "ScanInUi": bool,
+        "ScheduleCheckMins": (int, float),
+        "SweepMinAgeMins": (int, float),
+        "QuarantineAfterCrashes": int,
+    },
+    "indexer_daemon_config.yaml": {
+        "Enabled": bool,
+        "SocketPath": str,
+        "HeartbeatSecs": (int, float),
+        "MaxStepSecs": (int, float),
+        "RestartDelaySecs": (int, float),
+        "MaxRestartDelaySecs": (int, float),
+        "StableSecs": (int, float),
+        "NotifyDelaySecs": (int, float),
+        "InitialScanWaitSecs": (int, float),
+    },
+    "library_catalog_config.yaml": {"SortBy": str, "Descending": bool, "HideWatched": bool},
+    "library_watcher_config.yaml": {
+        "SettleSeconds": (int, float),
+        "PollInterval": (int, float),
+        "NetworkFileSystems": list,
+    },
+    "metrics_config.yaml": {
+        "LogFolder": str,
+        "LogFile": str,
+        "LogMaxBytes": int,
+        "LogBackupCount": int,
+        "LogLevel": str,
+        "ConsoleLogLevel": str,
+        "SummaryIntervalSecs": (int, float),
+        "MetricsServerEnabled": bool,
+        "MetricsServerPort": int,
+    },
+    "tmdb_settings.yaml": {
+        "MovieGenreMap": dict,
+        "TvGenreMap": dict,
+        "ApiBaseUrl": str,
+        "ImageBaseUrl": str,
+        "MaxRetries": int,
+        "CacheTtlHours": (int, float),
+        "ApiHeaders": dict,
+    },
+    "api_keys.yaml": {"TmdbApiKey": str},
+    "trickplay_config.yaml": {
+        "IntervalSecs": int,
+        "MaxTiles": int,
+        "TileWidth": int,
+        "TileHeight": int,
+        "Columns": int,
+        "JpegQuality": int,
+    },
+    "duplicate_detection_config.yaml": {
+        "Enabled": bool,
+        "SampleFrames": int,
+        "DurationToleranceSecs": (int, float),
+        "MaxHammingDistance": (int, float),
+    },
+    "audio_analysis_config.yaml": {
+        "Enabled": bool,
+        "FfmpegPath": str,
+        "SampleRate": int,
+        "ChunkSecs": (int, float),
+        "TargetLufs": (int, float),
+        "MaxBoostDb": (int, float),
+        "MaxCutDb": (int, float),
+        "Segments": {
+            "IntroSearchSecs": (int, float),
+            "CreditsSearchSecs": (int, float),
+            "FrameSecs": float,
+            "MaxBitErrors": int,
+            "SmoothingSecs": (int, float),
+            "MatchRatio": float,
+            "MinSegmentSecs": (int, float),
+            "MaxSegmentSecs": (int, float),
+        },
+    },
+    "task_scheduler_config.yaml": {
+        "Pools": {
+            "Cpu": {"Workers": int, "WorkersDuringPlayback": int},
+            "Disk": {"Workers": int, "WorkersDuringPlayback": int},
+            "Network": {"Workers": int, "WorkersDuringPlayback": int},
+        },
+        "RampUpStepSecs": (int, float),
+    },
+    "enrichment_config.yaml": {
+        "BatchSize": int,
+        "ClaimSecs": (int, float),
+        "MaxAttempts": int,
+        "BackoffBaseSecs": (int, float),
+        "BackoffMaxSecs": (int, float),
+        "PollSecs": (int, float),
+        "SelectedPriority": int,
+    },
+    "metadata_providers_config.yaml": {"Providers": list, "MinConfidence": str},
+    "peer_cache_config.yaml": {
+        "Serve": bool,
+        "Host": str,
+        "Port": int,
+        "Peers": list,
+        "TimeoutSecs": (int, float),
+        "PeerRetrySecs": (int, float),
+        "CacheTtlSecs": (int, float),
+        "BatchSize": int,
+    },
+    "recommendations_config.yaml": {
+        "Enabled": bool,
+        "Count": int,
+        "Weights": {"Genres": (int, float), "Director": (int, float), "Decade": (int, float), "Language": (int, float)},
+    },
+}
+
+
+class FrozenDict(Mapping):
+    """Read only mapping, shared safely between every user of a config"""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict) -> None:
+        self._data = data
+
+    def __getitem__(self, key: Any) -> Any:
+        return self._data[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"FrozenDict({self._data!r})"
+
+
+def freeze(value: Any) -> Any:
+    """Returns a read only view of parsed YAML: mappings become FrozenDict and lists tuples"""
+    if isinstance(value, dict):
+        return FrozenDict({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def validate(value: Any, schema: Any, where: str) -> None:
+    """Checks parsed YAML against a schema from '_SCHEMAS'
+
+    Args:
+        value (Any): Parsed YAML
+        schema (Any): Expected type, tuple of types, or dict of key -> schema
+        where (str): Location reported in the error, e.g. the file name
+
+    Raises:
+        ConfigValidationException: If a key is missing or has the wrong type
+    """
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            raise ConfigValidationException(where, f"expected a mapping, got {type(value).__name__}")
+        for key, key_schema in schema.items():
+            if key not in value:
+                raise ConfigValidationException(where, f"missing key '{key}'")
+            validate(value[key], key_schema, f"{where}.{key}")
+        return
+
+    types = schema if isinstance(schema, tuple) else (schema,)
+    # YAML booleans are ints for isinstance, do not let 'true' pass as a number
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        expected = " or ".join(expected_type.__name__ for expected_type in types)
+        raise ConfigValidationException(where, f"expected {expected}, got {type(value).__name__}")
+
+
+class ConfigService:
+    """Singleton cache of the parsed configs, by file name inside the 'config' folder"""
+
+    _configs: dict[str, Any] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, file_name: str) -> Any:
+        """Returns the read only view of a config, parsing it on first use
+
+        Args:
+            file_name (str): YAML file inside the 'config' folder, e.g. 'vlc_player_config.yaml'
+
+        Raises:
+            FileNotFoundError: If the config file does not exist
+            ConfigValidationException: If the config does not match its schema
+
+        Returns:
+            Any: FrozenDict or tuple, depending on the file
+        """
+        config = cls._configs.get(file_name)
+        if config is not None:
+            return config
+
+        with cls._lock:
+            if file_name not in cls._configs:
+                cls._configs[file_name] = freeze(cls._load(file_name))
+            return cls._configs[file_name]
+
+    @classmethod
+    def reload(cls, file_name: str | None = None) -> None:
+        """Drops cached configs so the next 'get' reads them from disk again
+
+        Widgets keep the view they were built with, only code calling 'get' afterwards sees the change.
+
+        Args:
+            file_name (str, optional): Config to reload, all of them if None
+        """
+        with cls._lock:
+            if file_name is None:
+                cls._configs.clear()
+            else:
+                cls._configs.pop(file_name, None)
+
+    @classmethod
+    def _load(cls, file_name: str) -> Any:
+        """Reads a config from the compiled cache if it is up to date, else from the YAML, then validates it"""
+        yaml_path = os.path.join(CONFIG_FOLDER, file_name)
+        stat = os.stat(yaml_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cache_path = os.path.join(CONFIG_CACHE_FOLDER, f"{file_name}.pickle")
+
+        data = cls._read_compiled(cache_path, key)
+        if data is None:
+            with open(yaml_path, encoding="utf_8") as yaml_f:
+                try:
+                    data = yaml.safe_load(yaml_f)
+                except yaml.YAMLError as exception:
+                    raise ConfigValidationException(file_name, f"invalid YAML, {exception}") from exception
+            cls._write_compiled(cache_path, key, data)
+            logger.debug("Parsed %s", file_name)
+
+        # Also checked on cached configs, the schema may have changed since they were compiled
+        if file_name in _SCHEMAS:
+            validate(data, _SCHEMAS[file_name], file_name)
+        return data
+
+    @staticmethod
+    def _read_compiled(cache_path: str, key: tuple[int, int]) -> Any:
+        """Returns the pickled config if it was compiled from the current YAML file, else None"""
+        try:
+            with open(cache_path, "rb") as cache_f:
+                cached_key, data = pickle.load(cache_f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        return data if cached_key == key else None
+
+    @staticmethod
+    def _write_compiled(cache_path: str, key: tuple[int, int], data: Any) -> None:
+        # Write then rename, so a crash never leaves a truncated cache
+        try:
+            os.makedirs(CONFIG_CACHE_FOLDER, exist_ok=True)
+            with open(cache_path + ".tmp", "wb") as cache_f:
+                pickle.dump((key, data), cache_f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as exception:
+            logger.debug("Could not cache the compiled %s: %s", cache_path, exception)
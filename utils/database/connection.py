@@ -3,27 +3,58 @@ import os
 import sqlite3
 import threading
 
+# How long a write waits for the lock held by another connection (thread or process) before failing
+BUSY_TIMEOUT_SECS = 30
+
+
 class AppDatabase:
     """Singleton class that handles connections to the sqlite3 local db
+
+    Every thread gets its own connection, so the transactions of concurrent tasks
+    (index jobs, scheduler pools, the enrichment worker) never interleave. The
+    database is in WAL mode, readers never wait on a writer and writers queue up
+    for 'BUSY_TIMEOUT_SECS' instead of failing.
     """
-    _conn = None
-    _lock = threading.Lock()
+    _local = threading.local()
     _path= os.path.join("db", "database.db")
 
     @classmethod
     def get_connection(cls) -> sqlite3.Connection:
-        """Returns a connection to the sqlite database.
+        """Returns the calling thread's connection to the sqlite database.
         If it exists, else it creates a new one
 
         Returns:
             Connection: Live sqlite3 db connection
         """
-        with cls._lock:
-            if cls._conn is None:
-                try:
-                    cls._conn = sqlite3.connect(cls._path, check_same_thread=False)
-                except Exception as e:
-                    raise RuntimeError(f"Failed to connect to database: {e}") from e
-        if cls._conn is None:
-            raise RuntimeError("Database connection is None unexpectedly.")
-        return cls._conn
+        conn = getattr(cls._local, "conn", None)
+        if conn is not None:
+            # A thread that outlives a switch to another database file (e.g. between benchmark runs) reconnects
+            if cls._local.path == cls._path:
+                return conn
+            cls.close_connection()
+
+        try:
+            conn = sqlite3.connect(cls._path, timeout=BUSY_TIMEOUT_SECS)
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA foreign_keys = ON;")
+        except Exception as e:
+            raise RuntimeError(f"Failed to connect to database: {e}") from e
+        cls._local.conn, cls._local.path = conn, cls._path
+        return conn
+
+    @classmethod
+    def exists(cls) -> bool:
+        """Tells whether the database file was created, without creating it
+
+        Returns:
+            bool: True if the database file exists
+        """
+        return os.path.exists(cls._path)
+
+    @classmethod
+    def close_connection(cls) -> None:
+        """Closes the calling thread's connection, the next 'get_connection' opens a new one"""
+        conn = getattr(cls._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            cls._local.conn = None
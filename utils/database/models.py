@@ -1,10 +1,35 @@
-import re
-import os
-
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
-from PIL import Image, ImageTk
+from PIL import ImageTk
+
+from utils.thumbnails import load_thumbnail
+
+
+@dataclass(frozen=True)
+class ParsedName:
+    """Model class for what was parsed from a video file name at scan time"""
+
+    title: str
+    year: int | None = None
+    season: int | None = None
+    episode: int | None = None
+    episode_end: int | None = None  # Last episode of a multi-episode file
+    resolution: str = ""
+    release_group: str = ""
+
+    @property
+    def is_episode(self) -> bool:
+        return self.season is not None and self.episode is not None
+
+    def get_episode_label(self) -> str:
+        """Returns the season / episode label shown in the GUI, e.g. S01E02 or S01E02-E03, empty for movies"""
+        if not self.is_episode:
+            return ""
+        label = f"S{self.season:02d}E{self.episode:02d}"
+        if self.episode_end is not None and self.episode_end != self.episode:
+            label += f"-E{self.episode_end:02d}"
+        return label
 
 
 @dataclass(frozen=True)
@@ -22,6 +47,11 @@ class VideoMetadata:
     tmdb_overview: str
     tmdb_genres: list[str]
     tmdb_poster_path: str
+    source_id: int | None = None
+    parsed_name: ParsedName | None = None
+    # Where the tmdb_* fields and the poster came from, e.g. 'nfo', 'embedded', 'tmdb', 'screenshot', 'peer'
+    metadata_source: str = ""
+    poster_source: str = ""
 
     def get_length_sec(self) -> int:
         """Methods that returns the video length in seconds
@@ -66,11 +96,9 @@ class VideoMetadata:
         Returns:
             str: Title of the video
         """
-        season_episode = re.search("[sS][0-9]{1,2}[eE][0-9]{1,2}", self.full_path)
-        is_tvshow = bool(season_episode)
-
-        if is_tvshow:
-            return f"{self.tmdb_title} - {season_episode.group()}"
+        episode_label = self.parsed_name.get_episode_label() if self.parsed_name else ""
+        if episode_label:
+            return f"{self.tmdb_title} - {episode_label}"
         return self.tmdb_title
 
     def get_image_object(self, width: int, height: int) -> ImageTk.PhotoImage | None:
@@ -83,8 +111,8 @@ class VideoMetadata:
         Returns:
             Optional[ImageTk.PhotoImage]: ImageTk image object easy to embbed in the GUI
         """
-        if os.path.exists(self.image_path):
-            image = Image.open(self.image_path).resize((width, height), Image.LANCZOS)
+        image = load_thumbnail(self.image_path, width, height)
+        if image is not None:
             return ImageTk.PhotoImage(image)
         return None
 
@@ -103,3 +131,141 @@ class Setting:
 
     name: str
     value: str
+
+
+@dataclass()
+class Source:
+    """Model class for a library folder and its scanning / caching policy"""
+
+    name: str
+    path: str
+    scan_interval_mins: int
+    max_workers: int
+    fingerprint_ttl_mins: int  # How long a file's stored size / mtime is trusted without a stat
+    last_scan_at: float | None = None
+    id: int | None = None
+
+
+@dataclass(frozen=True)
+class SourceFile:
+    """Model class for the incremental scan state of a file in a source"""
+
+    full_path: str
+    size: int
+    mtime_ns: int
+    checked_at: float
+
+
+@dataclass(frozen=True)
+class VideoFingerprint:
+    """Model class for the values used to recognize versions of the same title"""
+
+    full_path: str
+    duration_secs: float
+    size: int
+    frame_hashes: list[int]  # 64 bit perceptual hash of every sampled frame
+    group_id: int | None = None  # Shared by all the versions of a title
+
+
+@dataclass(frozen=True)
+class AudioAnalysis:
+    """Model class for the audio analysis of a video, precomputed by the headless scan"""
+
+    full_path: str
+    loudness_lufs: float | None  # None for silent videos
+    gain_db: float  # Applied by the player to reach the target loudness
+    head_fingerprint: bytes = b""  # uint32 words of the first minutes, to find intros
+    tail_fingerprint: bytes = b""  # uint32 words of the last minutes, to find credits
+    tail_offset_secs: float = 0.0  # Where the tail fingerprint starts
+    intro_start: float | None = None
+    intro_end: float | None = None
+    credits_start: float | None = None
+    segments_checked: bool = False  # Compared with the other episodes of its season
+
+
+@dataclass(frozen=True)
+class EnrichmentTask:
+    """Model class for a video waiting for its TMDB metadata"""
+
+    full_path: str
+    priority: int = 0  # Higher first, e.g. the title selected in the browser
+    attempts: int = 0
+    next_attempt_at: float | None = None  # None once 'MaxAttempts' is reached
+    last_error: str = ""
+
+
+@dataclass(frozen=True)
+class ScanJournalEntry:
+    """Model class for the progress of a file through indexing and enrichment, so interrupted work resumes"""
+
+    full_path: str
+    stage: str  # Last completed stage, see utils.scan_journal.STAGES
+    data: dict  # What the completed stages produced
+    source_id: int | None = None
+    size: int | None = None  # File size and mtime when the journal started, a changed file starts over
+    mtime_ns: int | None = None
+
+
+@dataclass(frozen=True)
+class LibrarySnapshot:
+    """Model class for a library snapshot exported by this node or imported from another one"""
+
+    id: str
+    base_id: str | None  # Snapshot a delta was exported against, None for a full snapshot
+    change_seq: int  # Last library change included, deltas export the later ones
+    created_at: float
+    imported_at: float | None = None  # None for the snapshots exported by this node
+
+
+@dataclass(frozen=True)
+class CatalogRow:
+    """Model class for a video with the state the browser's catalog sorts and filters it by"""
+
+    metadata: VideoMetadata
+    added_at: float | None  # When the file was indexed, None for videos indexed before it was recorded
+    group_id: int | None  # Version group of the file, None if not fingerprinted
+    size: int | None  # File size, None if not fingerprinted
+    in_progress: bool  # Has a resume point
+    watched: bool  # Was played to the end at least once
+    show_id: int | None = None  # Show of an episode, None for movies
+
+
+@dataclass(frozen=True)
+class TvShow:
+    """Model class for a series, its metadata is fetched once and shared by all its episodes"""
+
+    id: int
+    title: str  # Parsed from the file names of its episodes
+    tmdb_id: str = ""  # Empty until TMDB matched the show
+    tmdb_title: str = ""
+    tmdb_director: str = ""
+    tmdb_year: str = ""
+    tmdb_overview: str = ""
+    tmdb_genres: list[str] = field(default_factory=list)
+    tmdb_poster_path: str = ""
+    original_language: str = ""
+    image_path: str = ""  # Downloaded poster, empty if none
+    fetched_at: float | None = None
+    # Kept current by triggers as episodes are indexed, removed or watched
+    season_count: int = 0
+    episode_count: int = 0  # Versions of an episode count once
+    watched_count: int = 0
+    runtime_secs: int = 0
+    next_unwatched_path: str | None = None  # First unwatched episode, specials last, None once all are watched
+
+
+@dataclass(frozen=True)
+class TvSeason:
+    """Model class for a season of a series, with the aggregates of its episodes"""
+
+    show_id: int
+    season: int  # 0 for specials
+    name: str = ""
+    overview: str = ""
+    tmdb_poster_path: str = ""
+    image_path: str = ""  # Downloaded poster, empty if none
+    fetched_at: float | None = None
+    episode_count: int = 0
+    watched_count: int = 0
+    runtime_secs: int = 0
+    next_unwatched_path: str | None = None
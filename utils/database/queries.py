@@ -1,12 +1,89 @@
+import os
+import json
+import logging
+
+from typing import Callable
+
+from utils import metrics
+
 from .connection import AppDatabase
-from .models import VideoMetadata, Connector, Setting
+from .models import (
+    VideoMetadata,
+    ParsedName,
+    Connector,
+    Setting,
+    Source,
+    SourceFile,
+    VideoFingerprint,
+    AudioAnalysis,
+    EnrichmentTask,
+    ScanJournalEntry,
+    LibrarySnapshot,
+    CatalogRow,
+    TvShow,
+    TvSeason,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _row_to_video(row: tuple) -> VideoMetadata:
+    """Builds a VideoMetadata object from a 'SELECT * FROM video_metadata' row"""
+    return VideoMetadata(
+        language=row[1],
+        length=row[2],
+        image_path=row[3],
+        full_path=row[4],
+        full_sub_path=row[5],
+        tmdb_title=row[6],
+        tmdb_director=row[7],
+        tmdb_year=row[8],
+        tmdb_overview=row[9],
+        tmdb_genres=list(row[10].split("|")),
+        tmdb_poster_path=row[11],
+        source_id=row[12],
+        parsed_name=_row_to_parsed_name(row[13:20]),
+        metadata_source=row[20] or "",
+        poster_source=row[21] or "",
+    )
+
+
+def _row_to_parsed_name(columns: tuple) -> ParsedName | None:
+    """Builds a ParsedName from the parsed_title ... release_group columns, None if the name was not parsed yet"""
+    if columns[0] is None:
+        return None
+    return ParsedName(
+        title=columns[0],
+        year=columns[1],
+        season=columns[2],
+        episode=columns[3],
+        episode_end=columns[4],
+        resolution=columns[5] or "",
+        release_group=columns[6] or "",
+    )
+
+
+def _parsed_name_values(parsed_name: ParsedName | None) -> tuple:
+    if parsed_name is None:
+        return (None,) * 7
+    return (
+        parsed_name.title,
+        parsed_name.year,
+        parsed_name.season,
+        parsed_name.episode,
+        parsed_name.episode_end,
+        parsed_name.resolution,
+        parsed_name.release_group,
+    )
 
 
-def insert_video(metadata: VideoMetadata) -> None:
+@metrics.timed("db.insert_video")
+def insert_video(metadata: VideoMetadata, added_at: float) -> None:
     """Inserts metadata about a video
 
     Args:
         metadata (VideoMetadata): Metadata object
+        added_at (float): Unix timestamp, when the video was indexed
     """
     conn = AppDatabase.get_connection()
 
@@ -15,8 +92,10 @@ def insert_video(metadata: VideoMetadata) -> None:
         INSERT INTO video_metadata (
             language, length, image_path, full_path, full_sub_path,
             tmdb_title, tmdb_director, tmdb_year, tmdb_overview,
-            tmdb_genres, tmdb_poster_path
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            tmdb_genres, tmdb_poster_path, source_id,
+            parsed_title, parsed_year, season, episode, episode_end, resolution, release_group,
+            metadata_source, poster_source, added_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             metadata.language,
@@ -30,11 +109,17 @@ def insert_video(metadata: VideoMetadata) -> None:
             metadata.tmdb_overview,
             "|".join(metadata.tmdb_genres),
             metadata.tmdb_poster_path,
+            metadata.source_id,
+            *_parsed_name_values(metadata.parsed_name),
+            metadata.metadata_source,
+            metadata.poster_source,
+            added_at,
         ),
     )
     conn.commit()
 
 
+@metrics.timed("db.get_all_videos")
 def get_all_videos() -> list[VideoMetadata] | None:
     """Retrieves all the video's metadatas from the database
 
@@ -54,29 +139,13 @@ def get_all_videos() -> list[VideoMetadata] | None:
 
     rows = cursor.fetchall()
     if rows is None:
-        print("Could not find any videos")
+        logger.info("Could not find any videos")
         return None
     
-    all_videos_list = []
-    for row in rows:
-        all_videos_list.append(
-            VideoMetadata(
-                language=row[1],
-                length=row[2],
-                image_path=row[3],
-                full_path=row[4],
-                full_sub_path=row[5],
-                tmdb_title=row[6],
-                tmdb_director=row[7],
-                tmdb_year=row[8],
-                tmdb_overview=row[9],
-                tmdb_genres=list(row[10].split("|")),
-                tmdb_poster_path=row[11],
-            )
-        )
-    return all_videos_list
+    return [_row_to_video(row) for row in rows]
 
 
+@metrics.timed("db.get_video_by_path")
 def get_video_by_path(path: str) -> VideoMetadata | None:
     """Retrieves a video's data given its full path
 
@@ -93,31 +162,108 @@ def get_video_by_path(path: str) -> VideoMetadata | None:
         """
         SELECT *
         FROM video_metadata
-        WHERE full_path LIKE ?;
+        WHERE full_path = ?;
         """,
-        path,
+        [path],
     )
 
     row = cursor.fetchone()
     if row is None:
-        print("Could not find any video with path: {path}")
+        logger.debug("Could not find any video with path: %s", path)
         return None
 
-    return VideoMetadata(
-        language=row[1],
-        length=row[2],
-        image_path=row[3],
-        full_path=row[4],
-        full_sub_path=row[5],
-        tmdb_title=row[6],
-        tmdb_director=row[7],
-        tmdb_year=row[8],
-        tmdb_overview=row[9],
-        tmdb_genres=list(row[10].split("|")),
-        tmdb_poster_path=row[11],
+    return _row_to_video(row)
+
+
+@metrics.timed("db.get_video_paths_by_source")
+def get_video_paths_by_source(source_id: int) -> set[str]:
+    """Retrieves the paths of all the videos that belong to a source
+
+    Args:
+        source_id (int): Id of the source
+
+    Returns:
+        set[str]: Full paths of the videos
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path
+        FROM video_metadata
+        WHERE source_id = ?;
+        """,
+        [source_id],
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+@metrics.timed("db.get_video_paths_without_parsed_name")
+def get_video_paths_without_parsed_name() -> list[str]:
+    """Retrieves the paths of the videos indexed before file name parse results were stored
+
+    Returns:
+        list[str]: Full paths of the videos
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path
+        FROM video_metadata
+        WHERE parsed_title IS NULL;
+        """
     )
+    return [row[0] for row in cursor.fetchall()]
+
+
+@metrics.timed("db.get_video_paths_parsed_as_movies")
+def get_video_paths_parsed_as_movies() -> list[str]:
+    """Retrieves the paths of the videos whose stored parse has no episode, or an episode range ending at 100 or more
+
+    Such a range is a resolution read as the last episode, e.g. 'S01E02-720p'.
+
+    Returns:
+        list[str]: Full paths of the videos
+    """
+    conn = AppDatabase.get_connection()
+    rows = conn.execute(
+        """
+        SELECT full_path
+        FROM video_metadata
+        WHERE parsed_title IS NOT NULL AND (season IS NULL OR episode_end >= 100);
+        """
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+@metrics.timed("db.update_parsed_names")
+def update_parsed_names(parsed_names: dict[str, ParsedName]) -> None:
+    """Stores file name parse results, in one transaction
+
+    Args:
+        parsed_names (dict[str, ParsedName]): Full path of the video -> parse result
+    """
+    conn = AppDatabase.get_connection()
+
+    with conn:
+        conn.executemany(
+            """
+            UPDATE video_metadata
+            SET parsed_title = ?, parsed_year = ?, season = ?, episode = ?,
+                episode_end = ?, resolution = ?, release_group = ?
+            WHERE full_path = ?;
+            """,
+            [
+                (*_parsed_name_values(parsed_name), full_path)
+                for full_path, parsed_name in parsed_names.items()
+            ],
+        )
 
 
+@metrics.timed("db.delete_video_by_path")
 def delete_video_by_path(path: str) -> None:
     """Deletes a video from video_metadata given its full path
 
@@ -129,13 +275,19 @@ def delete_video_by_path(path: str) -> None:
     conn.execute(
         """
         DELETE FROM video_metadata
-        WHERE full_path LIKE ?;
+        WHERE full_path = ?;
         """,
         [path]
     )
+    conn.execute("DELETE FROM video_fingerprint WHERE full_path = ?;", [path])
+    conn.execute("DELETE FROM audio_analysis WHERE full_path = ?;", [path])
+    conn.execute("DELETE FROM video_content_hash WHERE full_path = ?;", [path])
+    conn.execute("DELETE FROM enrichment_queue WHERE full_path = ?;", [path])
+    conn.execute("DELETE FROM scan_journal WHERE full_path = ?;", [path])
     conn.commit()
 
 
+@metrics.timed("db.get_connectors")
 def get_connectors() -> list[Connector] | None:
     """Retrieves all available connectors
 
@@ -155,7 +307,7 @@ def get_connectors() -> list[Connector] | None:
 
     rows = cursor.fetchall()
     if rows is None:
-        print("Could not find any connectors")
+        logger.warning("Could not find any connectors")
         return None
     
     connectors = []
@@ -169,6 +321,7 @@ def get_connectors() -> list[Connector] | None:
     return connectors
 
 
+@metrics.timed("db.get_setting_value")
 def get_setting_value(name: str) -> str | None:
     """Retrievs a setting's value
 
@@ -192,12 +345,13 @@ def get_setting_value(name: str) -> str | None:
 
     row = cursor.fetchone()
     if row is None:
-        print(f"Could not find setting: {name}")
+        logger.info("Could not find setting: %s", name)
         return None
     
     return row[0]
 
 
+@metrics.timed("db.get_all_settings")
 def get_all_settings() -> list[Setting] | None:
     """Retrives all settings
 
@@ -216,7 +370,7 @@ def get_all_settings() -> list[Setting] | None:
 
     rows = cursor.fetchall()
     if rows is None:
-        print("Could not find any settings")
+        logger.warning("Could not find any settings")
         return None
     
     settings = []
@@ -227,4 +381,1639 @@ def get_all_settings() -> list[Setting] | None:
                 value=row[2]
             )
         )
-    return settings
\ No newline at end of file
+    return settings
+
+
+def _row_to_source(row: tuple) -> Source:
+    return Source(
+        id=row[0],
+        name=row[1],
+        path=row[2],
+        scan_interval_mins=row[3],
+        max_workers=row[4],
+        fingerprint_ttl_mins=row[5],
+        last_scan_at=row[6],
+    )
+
+
+@metrics.timed("db.get_sources")
+def get_sources() -> list[Source]:
+    """Retrieves all library sources
+
+    Returns:
+        list[Source]: List of Source objects
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT id, name, path, scan_interval_mins, max_workers, fingerprint_ttl_mins, last_scan_at
+        FROM source
+        ORDER BY id;
+        """
+    )
+    return [_row_to_source(row) for row in cursor.fetchall()]
+
+
+@metrics.timed("db.insert_source")
+def insert_source(source: Source) -> int:
+    """Inserts a new library source
+
+    Args:
+        source (Source): Source object, its id is ignored
+
+    Returns:
+        int: Id of the inserted source
+    """
+    conn = AppDatabase.get_connection()
+
+    cursor = conn.execute(
+        """
+        INSERT INTO source (
+            name, path, scan_interval_mins, max_workers, fingerprint_ttl_mins, last_scan_at
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            source.name,
+            source.path,
+            source.scan_interval_mins,
+            source.max_workers,
+            source.fingerprint_ttl_mins,
+            source.last_scan_at,
+        ),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+@metrics.timed("db.update_source_last_scan")
+def update_source_last_scan(source_id: int, last_scan_at: float) -> None:
+    """Records when a source was last fully scanned
+
+    Args:
+        source_id (int): Id of the source
+        last_scan_at (float): Unix timestamp of the scan
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        """
+        UPDATE source
+        SET last_scan_at = ?
+        WHERE id = ?;
+        """,
+        [last_scan_at, source_id],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.adopt_videos_without_source")
+def adopt_videos_without_source(source_id: int, folder: str) -> list[str]:
+    """Assigns the videos indexed before sources existed, found under a folder, to the source of that folder
+
+    Args:
+        source_id (int): Id of the source
+        folder (str): Folder of the source
+
+    Returns:
+        list[str]: Full paths of the videos assigned
+    """
+    prefix = os.path.join(folder, "")
+    conn = AppDatabase.get_connection()
+
+    # Compared with substr, LIKE would read '_' and '%' in the folder as wildcards and ignore case
+    with conn:
+        rows = conn.execute(
+            "SELECT full_path FROM video_metadata WHERE source_id IS NULL AND substr(full_path, 1, ?) = ?;",
+            [len(prefix), prefix],
+        ).fetchall()
+        conn.execute(
+            "UPDATE video_metadata SET source_id = ? WHERE source_id IS NULL AND substr(full_path, 1, ?) = ?;",
+            [source_id, len(prefix), prefix],
+        )
+    return [row[0] for row in rows]
+
+
+@metrics.timed("db.get_source_files")
+def get_source_files(source_id: int) -> dict[str, SourceFile]:
+    """Retrieves the incremental scan state of every file in a source
+
+    Args:
+        source_id (int): Id of the source
+
+    Returns:
+        dict[str, SourceFile]: Full path -> scan state
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path, size, mtime_ns, checked_at
+        FROM source_file
+        WHERE source_id = ?;
+        """,
+        [source_id],
+    )
+    return {row[0]: SourceFile(*row) for row in cursor.fetchall()}
+
+
+@metrics.timed("db.upsert_source_files")
+def upsert_source_files(source_id: int, source_files: list[SourceFile]) -> None:
+    """Inserts or refreshes the scan state of files in a source
+
+    Args:
+        source_id (int): Id of the source
+        source_files (list[SourceFile]): Scan states to store
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.executemany(
+        """
+        INSERT INTO source_file (source_id, full_path, size, mtime_ns, checked_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (source_id, full_path) DO UPDATE SET
+            size = excluded.size,
+            mtime_ns = excluded.mtime_ns,
+            checked_at = excluded.checked_at;
+        """,
+        [
+            (source_id, file.full_path, file.size, file.mtime_ns, file.checked_at)
+            for file in source_files
+        ],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.delete_source_files")
+def delete_source_files(source_id: int, paths: list[str]) -> None:
+    """Forgets the scan state of files removed from a source
+
+    Args:
+        source_id (int): Id of the source
+        paths (list[str]): Full paths of the removed files
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.executemany(
+        """
+        DELETE FROM source_file
+        WHERE source_id = ? AND full_path = ?;
+        """,
+        [(source_id, path) for path in paths],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.get_tmdb_cache_entry")
+def get_tmdb_cache_entry(url: str) -> tuple[str, float] | None:
+    """Retrieves a cached TMDB response
+
+    Args:
+        url (str): Request URL
+
+    Returns:
+        Optional[tuple[str, float]]: Response body and the unix timestamp it was fetched at
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT response, fetched_at
+        FROM tmdb_cache
+        WHERE url = ?;
+        """,
+        [url],
+    )
+    return cursor.fetchone()
+
+
+@metrics.timed("db.upsert_tmdb_cache_entry")
+def upsert_tmdb_cache_entry(url: str, response: str, fetched_at: float) -> None:
+    """Stores or refreshes a cached TMDB response
+
+    Args:
+        url (str): Request URL
+        response (str): Response body
+        fetched_at (float): Unix timestamp of the request
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        """
+        INSERT INTO tmdb_cache (url, response, fetched_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (url) DO UPDATE SET
+            response = excluded.response,
+            fetched_at = excluded.fetched_at;
+        """,
+        [url, response, fetched_at],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.get_tmdb_cache_urls_fetched_before")
+def get_tmdb_cache_urls_fetched_before(fetched_before: float) -> list[str]:
+    """Retrieves the URLs of cached TMDB responses older than a timestamp
+
+    Args:
+        fetched_before (float): Unix timestamp
+
+    Returns:
+        list[str]: Request URLs
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT url
+        FROM tmdb_cache
+        WHERE fetched_at < ?;
+        """,
+        [fetched_before],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+
+@metrics.timed("db.get_playback_position")
+def get_playback_position(path: str) -> int | None:
+    """Retrieves where the playback of a video was left off
+
+    Args:
+        path (str): Full path to the video file
+
+    Returns:
+        Optional[int]: Resume point in seconds, None if the video was not started or was finished
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT position_secs
+        FROM playback_state
+        WHERE full_path = ?;
+        """,
+        [path],
+    )
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+@metrics.timed("db.set_playback_position")
+def set_playback_position(path: str, position_secs: int | None, updated_at: float) -> None:
+    """Stores the resume point of a video
+
+    Args:
+        path (str): Full path to the video file
+        position_secs (Optional[int]): Resume point in seconds, None to clear it
+        updated_at (float): Unix timestamp
+    """
+    conn = AppDatabase.get_connection()
+
+    if position_secs is None:
+        conn.execute("DELETE FROM playback_state WHERE full_path = ?;", [path])
+    else:
+        conn.execute(
+            """
+            INSERT INTO playback_state (full_path, position_secs, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(full_path) DO UPDATE SET
+                position_secs = excluded.position_secs,
+                updated_at = excluded.updated_at;
+            """,
+            [path, position_secs, updated_at],
+        )
+    conn.commit()
+
+
+@metrics.timed("db.mark_video_watched")
+def mark_video_watched(path: str, watched_at: float) -> None:
+    """Records that a video was played to the end
+
+    Args:
+        path (str): Full path to the video file
+        watched_at (float): Unix timestamp
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute("INSERT OR REPLACE INTO video_watched (full_path, watched_at) VALUES (?, ?);", [path, watched_at])
+    conn.commit()
+
+
+def _row_to_fingerprint(row: tuple) -> VideoFingerprint:
+    """Builds a VideoFingerprint from a 'SELECT full_path, duration_secs, size, frame_hashes, group_id' row"""
+    return VideoFingerprint(
+        full_path=row[0],
+        duration_secs=row[1],
+        size=row[2],
+        frame_hashes=[int(frame_hash, 16) for frame_hash in row[3].split(",")],
+        group_id=row[4],
+    )
+
+
+@metrics.timed("db.insert_video_fingerprint")
+def insert_video_fingerprint(fingerprint: VideoFingerprint, group_id: int | None) -> int:
+    """Stores the fingerprint of a video, replacing an older one for the same path
+
+    Args:
+        fingerprint (VideoFingerprint): Fingerprint object
+        group_id (Optional[int]): Group of the matching title, None to start a new group
+
+    Returns:
+        int: Group id of the video
+    """
+    conn = AppDatabase.get_connection()
+
+    with conn:
+        cursor = conn.execute(
+            """
+            INSERT OR REPLACE INTO video_fingerprint (full_path, duration_secs, size, frame_hashes, group_id)
+            VALUES (?, ?, ?, ?, ?);
+            """,
+            [
+                fingerprint.full_path,
+                fingerprint.duration_secs,
+                fingerprint.size,
+                ",".join(f"{frame_hash:016x}" for frame_hash in fingerprint.frame_hashes),
+                group_id,
+            ],
+        )
+        if group_id is None:
+            # A new group is named after its first member
+            group_id = cursor.lastrowid
+            conn.execute(
+                "UPDATE video_fingerprint SET group_id = ? WHERE id = ?;", [group_id, cursor.lastrowid]
+            )
+    return group_id
+
+
+@metrics.timed("db.get_fingerprints_by_duration")
+def get_fingerprints_by_duration(min_duration_secs: float, max_duration_secs: float) -> list[VideoFingerprint]:
+    """Retrieves the fingerprints of the videos whose duration is within a range
+
+    Args:
+        min_duration_secs (float): Shortest duration
+        max_duration_secs (float): Longest duration
+
+    Returns:
+        list[VideoFingerprint]: Fingerprint objects
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path, duration_secs, size, frame_hashes, group_id
+        FROM video_fingerprint
+        WHERE duration_secs BETWEEN ? AND ?;
+        """,
+        [min_duration_secs, max_duration_secs],
+    )
+    return [_row_to_fingerprint(row) for row in cursor.fetchall()]
+
+
+@metrics.timed("db.get_fingerprints_by_group")
+def get_fingerprints_by_group(group_id: int) -> list[VideoFingerprint]:
+    """Retrieves the fingerprints of all the versions of a title, in the order they were indexed
+
+    Args:
+        group_id (int): Id of the group
+
+    Returns:
+        list[VideoFingerprint]: Fingerprint objects
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path, duration_secs, size, frame_hashes, group_id
+        FROM video_fingerprint
+        WHERE group_id = ?
+        ORDER BY id;
+        """,
+        [group_id],
+    )
+    return [_row_to_fingerprint(row) for row in cursor.fetchall()]
+
+
+@metrics.timed("db.get_fingerprints_by_path")
+def get_fingerprints_by_path() -> dict[str, VideoFingerprint]:
+    """Retrieves every fingerprint
+
+    Returns:
+        dict[str, VideoFingerprint]: Full path of the video -> fingerprint object
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path, duration_secs, size, frame_hashes, group_id
+        FROM video_fingerprint;
+        """
+    )
+    return {row[0]: _row_to_fingerprint(row) for row in cursor.fetchall()}
+
+
+@metrics.timed("db.get_video_paths_without_fingerprint")
+def get_video_paths_without_fingerprint() -> list[str]:
+    """Retrieves the paths of the indexed videos that were never fingerprinted
+
+    Returns:
+        list[str]: Full paths of the videos
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path
+        FROM video_metadata
+        WHERE full_path NOT IN (SELECT full_path FROM video_fingerprint);
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Parameters per statement, older SQLite builds allow 999
+_MAX_QUERY_PARAMS = 500
+
+
+@metrics.timed("db.upsert_video_content_hash")
+def upsert_video_content_hash(path: str, content_hash: str) -> None:
+    """Stores the partial content hash of a video, the key other nodes look it up by
+
+    Args:
+        path (str): Full path to the video file
+        content_hash (str): Hash computed by 'utils.peer_cache.partial_content_hash'
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        "INSERT OR REPLACE INTO video_content_hash (full_path, content_hash) VALUES (?, ?);", [path, content_hash]
+    )
+    conn.commit()
+
+
+@metrics.timed("db.get_content_hashes")
+def get_content_hashes(paths: list[str]) -> dict[str, str]:
+    """Retrieves the partial content hashes of videos
+
+    Args:
+        paths (list[str]): Full paths to the video files
+
+    Returns:
+        dict[str, str]: Full path -> content hash, for the videos that have one
+    """
+    conn = AppDatabase.get_connection()
+
+    content_hashes = {}
+    for start in range(0, len(paths), _MAX_QUERY_PARAMS):
+        chunk = paths[start:start + _MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f"""
+            SELECT full_path, content_hash
+            FROM video_content_hash
+            WHERE full_path IN ({", ".join("?" * len(chunk))});
+            """,
+            chunk,
+        ).fetchall()
+        content_hashes.update(rows)
+    return content_hashes
+
+
+@metrics.timed("db.get_video_paths_without_content_hash")
+def get_video_paths_without_content_hash() -> list[str]:
+    """Retrieves the paths of the indexed videos whose content was never hashed
+
+    Returns:
+        list[str]: Full paths of the videos
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path
+        FROM video_metadata
+        WHERE full_path NOT IN (SELECT full_path FROM video_content_hash);
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+@metrics.timed("db.get_videos_by_content_hash")
+def get_videos_by_content_hash(
+    content_hashes: list[str],
+) -> dict[str, tuple[VideoMetadata, VideoFingerprint | None]]:
+    """Retrieves the videos, and their fingerprints, of given partial content hashes
+
+    Args:
+        content_hashes (list[str]): Content hashes to look up
+
+    Returns:
+        dict: Content hash -> (video, fingerprint or None). Of several copies, one with TMDB metadata wins.
+    """
+    conn = AppDatabase.get_connection()
+
+    videos = {}
+    for start in range(0, len(content_hashes), _MAX_QUERY_PARAMS):
+        chunk = content_hashes[start:start + _MAX_QUERY_PARAMS]
+        rows = conn.execute(
+            f"""
+            SELECT v.*, h.content_hash, f.full_path, f.duration_secs, f.size, f.frame_hashes, f.group_id
+            FROM video_content_hash h
+            JOIN video_metadata v ON v.full_path = h.full_path
+            LEFT JOIN video_fingerprint f ON f.full_path = h.full_path
+            WHERE h.content_hash IN ({", ".join("?" * len(chunk))})
+            ORDER BY v.tmdb_title = '', v.id;
+            """,
+            chunk,
+        ).fetchall()
+        for row in rows:
+            fingerprint = _row_to_fingerprint(row[-5:]) if row[-5] is not None else None
+            videos.setdefault(row[-6], (_row_to_video(row[:-6]), fingerprint))
+    return videos
+
+
+_AUDIO_ANALYSIS_COLUMNS = """
+    full_path, loudness_lufs, gain_db, head_fingerprint, tail_fingerprint, tail_offset_secs,
+    intro_start, intro_end, credits_start, segments_checked
+"""
+
+
+def _row_to_audio_analysis(row: tuple) -> AudioAnalysis:
+    """Builds an AudioAnalysis from a 'SELECT _AUDIO_ANALYSIS_COLUMNS' row"""
+    return AudioAnalysis(
+        full_path=row[0],
+        loudness_lufs=row[1],
+        gain_db=row[2],
+        head_fingerprint=row[3],
+        tail_fingerprint=row[4],
+        tail_offset_secs=row[5],
+        intro_start=row[6],
+        intro_end=row[7],
+        credits_start=row[8],
+        segments_checked=bool(row[9]),
+    )
+
+
+@metrics.timed("db.insert_audio_analysis")
+def insert_audio_analysis(analysis: AudioAnalysis, analyzed_at: float) -> None:
+    """Stores the audio analysis of a video, replacing an older one
+
+    Args:
+        analysis (AudioAnalysis): Audio analysis object
+        analyzed_at (float): Unix timestamp
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO audio_analysis (
+            full_path, loudness_lufs, gain_db, head_fingerprint, tail_fingerprint, tail_offset_secs,
+            intro_start, intro_end, credits_start, segments_checked, analyzed_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        [
+            analysis.full_path,
+            analysis.loudness_lufs,
+            analysis.gain_db,
+            analysis.head_fingerprint,
+            analysis.tail_fingerprint,
+            analysis.tail_offset_secs,
+            analysis.intro_start,
+            analysis.intro_end,
+            analysis.credits_start,
+            int(analysis.segments_checked),
+            analyzed_at,
+        ],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.get_audio_analysis")
+def get_audio_analysis(path: str) -> AudioAnalysis | None:
+    """Retrieves the audio analysis of a video
+
+    Args:
+        path (str): Full path to the video file
+
+    Returns:
+        Optional[AudioAnalysis]: Audio analysis object, None if the video was not analysed yet
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        f"""
+        SELECT {_AUDIO_ANALYSIS_COLUMNS}
+        FROM audio_analysis
+        WHERE full_path = ?;
+        """,
+        [path],
+    )
+    row = cursor.fetchone()
+    return _row_to_audio_analysis(row) if row is not None else None
+
+
+@metrics.timed("db.get_video_paths_without_audio_analysis")
+def get_video_paths_without_audio_analysis() -> list[str]:
+    """Retrieves the paths of the indexed videos that were never analysed
+
+    Returns:
+        list[str]: Full paths of the videos
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path
+        FROM video_metadata
+        WHERE full_path NOT IN (SELECT full_path FROM audio_analysis);
+        """
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+@metrics.timed("db.get_seasons_with_unchecked_segments")
+def get_seasons_with_unchecked_segments() -> list[tuple[str, int]]:
+    """Retrieves the seasons holding episodes not yet compared with the rest of their season
+
+    Returns:
+        list[tuple[str, int]]: (parsed title, season) pairs
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT DISTINCT video_metadata.parsed_title, video_metadata.season
+        FROM audio_analysis
+        JOIN video_metadata ON video_metadata.full_path = audio_analysis.full_path
+        WHERE audio_analysis.segments_checked = 0 AND video_metadata.season IS NOT NULL;
+        """
+    )
+    return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+@metrics.timed("db.get_season_audio_analyses")
+def get_season_audio_analyses(parsed_title: str, season: int) -> list[AudioAnalysis]:
+    """Retrieves the audio analyses of all the episodes of a season
+
+    Args:
+        parsed_title (str): Show title parsed from the file names
+        season (int): Season number
+
+    Returns:
+        list[AudioAnalysis]: Audio analysis objects, ordered by episode
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    columns = ", ".join(f"audio_analysis.{column.strip()}" for column in _AUDIO_ANALYSIS_COLUMNS.split(","))
+    cursor.execute(
+        f"""
+        SELECT {columns}
+        FROM audio_analysis
+        JOIN video_metadata ON video_metadata.full_path = audio_analysis.full_path
+        WHERE video_metadata.parsed_title = ? AND video_metadata.season = ?
+        ORDER BY video_metadata.episode;
+        """,
+        [parsed_title, season],
+    )
+    return [_row_to_audio_analysis(row) for row in cursor.fetchall()]
+
+
+@metrics.timed("db.update_audio_segments")
+def update_audio_segments(
+    path: str,
+    intro: tuple[float, float] | None = None,
+    credits_start: float | None = None,
+    segments_checked: bool | None = None,
+) -> None:
+    """Stores the intro / credits found for a video, values left to None are kept as they are
+
+    Args:
+        path (str): Full path to the video file
+        intro (Optional[tuple[float, float]]): Intro start and end in seconds
+        credits_start (Optional[float]): Where the credits start in seconds
+        segments_checked (Optional[bool]): Whether the video was compared with its season
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        """
+        UPDATE audio_analysis
+        SET intro_start = COALESCE(?, intro_start),
+            intro_end = COALESCE(?, intro_end),
+            credits_start = COALESCE(?, credits_start),
+            segments_checked = COALESCE(?, segments_checked)
+        WHERE full_path = ?;
+        """,
+        [
+            intro[0] if intro is not None else None,
+            intro[1] if intro is not None else None,
+            credits_start,
+            int(segments_checked) if segments_checked is not None else None,
+            path,
+        ],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.update_video_tmdb_metadata")
+def update_video_tmdb_metadata(metadata: VideoMetadata) -> None:
+    """Stores the TMDB metadata, language and poster found for an already indexed video, with their sources
+
+    Args:
+        metadata (VideoMetadata): Metadata object, matched on its full path
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        """
+        UPDATE video_metadata
+        SET language = ?, image_path = ?, tmdb_title = ?, tmdb_director = ?, tmdb_year = ?,
+            tmdb_overview = ?, tmdb_genres = ?, tmdb_poster_path = ?, metadata_source = ?, poster_source = ?
+        WHERE full_path = ?;
+        """,
+        [
+            metadata.language,
+            metadata.image_path,
+            metadata.tmdb_title,
+            metadata.tmdb_director,
+            metadata.tmdb_year,
+            metadata.tmdb_overview,
+            "|".join(metadata.tmdb_genres),
+            metadata.tmdb_poster_path,
+            metadata.metadata_source,
+            metadata.poster_source,
+            metadata.full_path,
+        ],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.enqueue_enrichment_tasks")
+def enqueue_enrichment_tasks(paths: list[str], priority: int, enqueued_at: float) -> None:
+    """Queues videos for TMDB enrichment, a video already queued starts over with a fresh attempt count
+
+    Args:
+        paths (list[str]): Full paths to the video files
+        priority (int): Higher priorities are worked on first
+        enqueued_at (float): Unix timestamp, also the time of the first attempt
+    """
+    conn = AppDatabase.get_connection()
+
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO enrichment_queue (full_path, priority, attempts, next_attempt_at, last_error, enqueued_at)
+            VALUES (?, ?, 0, ?, '', ?)
+            ON CONFLICT (full_path) DO UPDATE SET
+                priority = MAX(priority, excluded.priority),
+                attempts = 0,
+                next_attempt_at = excluded.next_attempt_at,
+                last_error = '';
+            """,
+            [(path, priority, enqueued_at, enqueued_at) for path in paths],
+        )
+
+
+@metrics.timed("db.enqueue_unmatched_videos")
+def enqueue_unmatched_videos(enqueued_at: float) -> int:
+    """Queues the indexed videos without TMDB metadata that are not queued yet
+
+    Args:
+        enqueued_at (float): Unix timestamp, also the time of the first attempt
+
+    Returns:
+        int: Number of videos queued
+    """
+    conn = AppDatabase.get_connection()
+
+    with conn:
+        cursor = conn.execute(
+            """
+            INSERT OR IGNORE INTO enrichment_queue (full_path, priority, attempts, next_attempt_at, last_error, enqueued_at)
+            SELECT full_path, 0, 0, ?, '', ?
+            FROM video_metadata
+            WHERE tmdb_title IS NULL OR tmdb_title = '';
+            """,
+            [enqueued_at, enqueued_at],
+        )
+    return cursor.rowcount
+
+
+def _row_to_enrichment_task(row: tuple) -> EnrichmentTask:
+    return EnrichmentTask(
+        full_path=row[0],
+        priority=row[1],
+        attempts=row[2],
+        next_attempt_at=row[3],
+        last_error=row[4],
+    )
+
+
+@metrics.timed("db.claim_due_enrichment_tasks")
+def claim_due_enrichment_tasks(due_at: float, limit: int, claimed_until: float) -> list[EnrichmentTask]:
+    """Claims the queued videos whose next attempt is due, highest priority then longest waiting first
+
+    The claim is taken by the same statement that picks the videos, so two workers
+    (e.g. the daemon and a headless scan) never get the same video. Videos claimed by
+    another worker are skipped until their claim expires.
+
+    Args:
+        due_at (float): Unix timestamp, usually now
+        limit (int): Maximum number of tasks
+        claimed_until (float): Unix timestamp the claim expires at, if the worker did not finish the videos by then
+
+    Returns:
+        list[EnrichmentTask]: Enrichment task objects
+    """
+    conn = AppDatabase.get_connection()
+
+    with conn:
+        cursor = conn.execute(
+            """
+            UPDATE enrichment_queue
+            SET claimed_until = ?
+            WHERE full_path IN (
+                SELECT full_path
+                FROM enrichment_queue
+                WHERE next_attempt_at IS NOT NULL AND next_attempt_at <= ?
+                    AND (claimed_until IS NULL OR claimed_until <= ?)
+                ORDER BY priority DESC, next_attempt_at
+                LIMIT ?
+            )
+            RETURNING full_path, priority, attempts, next_attempt_at, last_error;
+            """,
+            [claimed_until, due_at, due_at, limit],
+        )
+        tasks = [_row_to_enrichment_task(row) for row in cursor.fetchall()]
+    # RETURNING does not keep the order of the subquery
+    return sorted(tasks, key=lambda task: (-task.priority, task.next_attempt_at))
+
+
+@metrics.timed("db.get_next_enrichment_attempt_at")
+def get_next_enrichment_attempt_at() -> float | None:
+    """Returns when the next queued video is due or its claim expires, None if nothing is waiting for a retry"""
+    conn = AppDatabase.get_connection()
+    row = conn.execute(
+        "SELECT MIN(MAX(next_attempt_at, COALESCE(claimed_until, 0))) FROM enrichment_queue;"
+    ).fetchone()
+    return row[0]
+
+
+@metrics.timed("db.reschedule_enrichment_task")
+def reschedule_enrichment_task(
+    path: str, attempts: int, next_attempt_at: float | None, last_error: str
+) -> None:
+    """Records a failed attempt and releases the claim on the video
+
+    Args:
+        path (str): Full path to the video file
+        attempts (int): Attempts made so far
+        next_attempt_at (Optional[float]): Unix timestamp of the retry, None to stop retrying
+        last_error (str): Why the attempt failed
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        """
+        UPDATE enrichment_queue
+        SET attempts = ?, next_attempt_at = ?, last_error = ?, claimed_until = NULL
+        WHERE full_path = ?;
+        """,
+        [attempts, next_attempt_at, last_error, path],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.prioritize_enrichment_task")
+def prioritize_enrichment_task(path: str, priority: int, due_at: float) -> bool:
+    """Moves a queued video to the front, also skipping its backoff wait
+
+    Videos that ran out of attempts are left alone.
+
+    Args:
+        path (str): Full path to the video file
+        priority (int): New priority, kept if the current one is higher
+        due_at (float): Unix timestamp of the next attempt, usually now
+
+    Returns:
+        bool: True if the video is queued
+    """
+    conn = AppDatabase.get_connection()
+
+    cursor = conn.execute(
+        """
+        UPDATE enrichment_queue
+        SET priority = MAX(priority, ?), next_attempt_at = MIN(next_attempt_at, ?)
+        WHERE full_path = ? AND next_attempt_at IS NOT NULL;
+        """,
+        [priority, due_at, path],
+    )
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+@metrics.timed("db.delete_enrichment_task")
+def delete_enrichment_task(path: str) -> None:
+    """Removes a video from the enrichment queue
+
+    Args:
+        path (str): Full path to the video file
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute("DELETE FROM enrichment_queue WHERE full_path = ?;", [path])
+    conn.commit()
+
+
+@metrics.timed("db.get_enrichment_queue_counts")
+def get_enrichment_queue_counts() -> dict[str, int]:
+    """Counts the queued videos
+
+    Returns:
+        dict[str, int]: 'pending' videos still retried and 'given_up' videos out of attempts
+    """
+    conn = AppDatabase.get_connection()
+
+    row = conn.execute(
+        """
+        SELECT COUNT(next_attempt_at), COUNT(*) - COUNT(next_attempt_at)
+        FROM enrichment_queue;
+        """
+    ).fetchone()
+    return {"pending": row[0], "given_up": row[1]}
+
+
+def _row_to_scan_journal_entry(row: tuple) -> ScanJournalEntry:
+    return ScanJournalEntry(
+        full_path=row[0],
+        stage=row[1],
+        data=json.loads(row[2]),
+        source_id=row[3],
+        size=row[4],
+        mtime_ns=row[5],
+    )
+
+
+@metrics.timed("db.get_scan_journal_entry")
+def get_scan_journal_entry(path: str) -> ScanJournalEntry | None:
+    """Retrieves the journaled progress of a file
+
+    Args:
+        path (str): Full path to the video file
+
+    Returns:
+        Optional[ScanJournalEntry]: Journal entry, None if no work on the file is pending
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT full_path, stage, data, source_id, size, mtime_ns
+        FROM scan_journal
+        WHERE full_path = ?;
+        """,
+        [path],
+    )
+    row = cursor.fetchone()
+    return _row_to_scan_journal_entry(row) if row is not None else None
+
+
+@metrics.timed("db.get_scan_journal_entries")
+def get_scan_journal_entries() -> list[ScanJournalEntry]:
+    """Retrieves every journal entry, e.g. for the startup sweep
+
+    Returns:
+        list[ScanJournalEntry]: Journal entry objects
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT full_path, stage, data, source_id, size, mtime_ns FROM scan_journal;")
+    return [_row_to_scan_journal_entry(row) for row in cursor.fetchall()]
+
+
+@metrics.timed("db.upsert_scan_journal_entry")
+def upsert_scan_journal_entry(entry: ScanJournalEntry, updated_at: float) -> None:
+    """Records a completed stage, the source, size and mtime of an existing entry are kept when None
+
+    Args:
+        entry (ScanJournalEntry): Journal entry object
+        updated_at (float): Unix timestamp
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        """
+        INSERT INTO scan_journal (full_path, stage, data, source_id, size, mtime_ns, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (full_path) DO UPDATE SET
+            stage = excluded.stage,
+            data = excluded.data,
+            source_id = COALESCE(excluded.source_id, source_id),
+            size = COALESCE(excluded.size, size),
+            mtime_ns = COALESCE(excluded.mtime_ns, mtime_ns),
+            attempting = NULL,
+            updated_at = excluded.updated_at;
+        """,
+        [
+            entry.full_path,
+            entry.stage,
+            json.dumps(entry.data),
+            entry.source_id,
+            entry.size,
+            entry.mtime_ns,
+            updated_at,
+        ],
+    )
+    conn.commit()
+
+
+@metrics.timed("db.begin_scan_journal_attempt")
+def begin_scan_journal_attempt(
+    path: str, step: str, source_id: int | None, size: int | None, mtime_ns: int | None, updated_at: float
+) -> int:
+    """Marks native code as running on a file, a marker left by an earlier attempt counts as a crash
+
+    Args:
+        path (str): Full path to the video file
+        step (str): What runs, e.g. 'probe'
+        source_id (int, optional): Source of the file, kept from the existing entry if None
+        size (int, optional): File size, kept from the existing entry if None
+        mtime_ns (int, optional): File mtime, kept from the existing entry if None
+        updated_at (float): Unix timestamp
+
+    Returns:
+        int: Number of times the file took the indexer down so far
+    """
+    conn = AppDatabase.get_connection()
+
+    with conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO scan_journal (full_path, stage, data, source_id, size, mtime_ns, updated_at, attempting)
+            VALUES (?, 'attempting', '{}', ?, ?, ?, ?, ?)
+            ON CONFLICT (full_path) DO UPDATE SET
+                crashes = crashes + (attempting IS NOT NULL),
+                attempting = excluded.attempting,
+                source_id = COALESCE(excluded.source_id, source_id),
+                size = COALESCE(excluded.size, size),
+                mtime_ns = COALESCE(excluded.mtime_ns, mtime_ns),
+                updated_at = excluded.updated_at
+            RETURNING crashes;
+            """,
+            [path, source_id, size, mtime_ns, updated_at, step],
+        )
+        return cursor.fetchone()[0]
+
+
+@metrics.timed("db.end_scan_journal_attempt")
+def end_scan_journal_attempt(path: str) -> None:
+    """Clears the marker of native code that returned without recording a stage, e.g. after an exception
+
+    Args:
+        path (str): Full path to the video file
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute("UPDATE scan_journal SET attempting = NULL WHERE full_path = ?;", [path])
+    conn.commit()
+
+
+@metrics.timed("db.delete_scan_journal_entry")
+def delete_scan_journal_entry(path: str) -> None:
+    """Drops the journal entry of a file, once all its work is done
+
+    Args:
+        path (str): Full path to the video file
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute("DELETE FROM scan_journal WHERE full_path = ?;", [path])
+    conn.commit()
+
+
+def _row_to_library_snapshot(row: tuple) -> LibrarySnapshot:
+    return LibrarySnapshot(
+        id=row[0], base_id=row[1], change_seq=row[2], created_at=row[3], imported_at=row[4]
+    )
+
+
+@metrics.timed("db.get_library_snapshot")
+def get_library_snapshot(snapshot_id: str) -> LibrarySnapshot | None:
+    """Retrieves a snapshot exported by or imported into this node
+
+    Args:
+        snapshot_id (str): Id of the snapshot
+
+    Returns:
+        Optional[LibrarySnapshot]: Snapshot object, None if this node does not know it
+    """
+    conn = AppDatabase.get_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        SELECT id, base_id, change_seq, created_at, imported_at
+        FROM library_snapshot
+        WHERE id = ?;
+        """,
+        [snapshot_id],
+    )
+    row = cursor.fetchone()
+    return _row_to_library_snapshot(row) if row is not None else None
+
+
+@metrics.timed("db.insert_library_snapshot")
+def insert_library_snapshot(snapshot: LibrarySnapshot) -> None:
+    """Records a snapshot exported by this node
+
+    Args:
+        snapshot (LibrarySnapshot): Snapshot object
+    """
+    conn = AppDatabase.get_connection()
+
+    conn.execute(
+        "INSERT INTO library_snapshot (id, base_id, change_seq, created_at, imported_at) VALUES (?, ?, ?, ?, ?);",
+        [snapshot.id, snapshot.base_id, snapshot.change_seq, snapshot.created_at, snapshot.imported_at],
+    )
+    conn.commit()
+
+
+# Tables copied into a snapshot, in import order
+_SNAPSHOT_TABLES = (
+    "source", "video_metadata", "source_file", "video_fingerprint", "audio_analysis", "video_content_hash"
+)
+# Tables holding per path state that goes away with a deleted video
+_PATH_TABLES = (
+    "video_metadata",
+    "source_file",
+    "video_fingerprint",
+    "audio_analysis",
+    "video_content_hash",
+    "enrichment_queue",
+    "scan_journal",
+)
+
+
+@metrics.timed("db.export_library_rows")
+def export_library_rows(snapshot_db_path: str, since_seq: int | None) -> tuple[int, dict[str, int]]:
+    """Copies the library rows into a new database file, in one read transaction
+
+    Every source is copied. The videos, scan state, fingerprints and audio analyses
+    are copied whole, or only for the paths changed after 'since_seq' for a delta,
+    which also lists the paths deleted since then in 'deleted_path'.
+
+    Args:
+        snapshot_db_path (str): Database file to create, must not exist
+        since_seq (Optional[int]): Last change included in the base snapshot, None for a full snapshot
+
+    Returns:
+        tuple[int, dict[str, int]]: Last change included, and the number of rows copied per table
+    """
+    conn = AppDatabase.get_connection()
+
+    def _filter(column: str) -> str:
+        return f"WHERE :since IS NULL OR {column} IN (SELECT full_path FROM main.library_change WHERE seq > :since)"
+
+    conn.execute("ATTACH DATABASE ? AS snapshot;", [snapshot_db_path])
+    try:
+        with conn:
+            conn.execute("BEGIN;")
+            params = {"since": since_seq}
+            conn.execute("CREATE TABLE snapshot.source AS SELECT * FROM main.source;")
+            for table in ("video_metadata", "source_file", "audio_analysis", "video_content_hash"):
+                conn.execute(
+                    f"CREATE TABLE snapshot.{table} AS SELECT * FROM main.{table} {_filter('full_path')};", params
+                )
+            # Group ids are row ids, so the group is carried over as the path of its first member
+            conn.execute(
+                f"""
+                CREATE TABLE snapshot.video_fingerprint AS
+                SELECT f.*, (
+                    SELECT g.full_path FROM main.video_fingerprint g WHERE g.group_id = f.group_id ORDER BY g.id LIMIT 1
+                ) AS group_path
+                FROM main.video_fingerprint f
+                {_filter('f.full_path')};
+                """,
+                params,
+            )
+            conn.execute(
+                """
+                CREATE TABLE snapshot.deleted_path AS
+                SELECT c.full_path
+                FROM main.library_change c
+                WHERE :since IS NOT NULL AND c.seq > :since
+                    AND NOT EXISTS (SELECT 1 FROM main.video_metadata v WHERE v.full_path = c.full_path)
+                    AND NOT EXISTS (SELECT 1 FROM main.video_fingerprint f WHERE f.full_path = c.full_path)
+                    AND NOT EXISTS (SELECT 1 FROM main.audio_analysis a WHERE a.full_path = c.full_path);
+                """,
+                params,
+            )
+            change_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM main.library_change;").fetchone()[0]
+            counts = {
+                table: conn.execute(f"SELECT COUNT(*) FROM snapshot.{table};").fetchone()[0]
+                for table in _SNAPSHOT_TABLES + ("deleted_path",)
+            }
+    finally:
+        conn.execute("DETACH DATABASE snapshot;")
+    return change_seq, counts
+
+
+@metrics.timed("db.import_library_rows")
+def import_library_rows(
+    snapshot_db_path: str,
+    snapshot: LibrarySnapshot,
+    remap_path: Callable[[str], str],
+    poster_path: Callable[[str], str],
+    imported_at: float,
+) -> dict[str, int]:
+    """Applies the rows of a snapshot database in a single transaction, then records the snapshot
+
+    Rows replace the local rows of the same (remapped) path, the paths deleted on the
+    exporting node are deleted here too and sources are matched by their remapped path.
+
+    Args:
+        snapshot_db_path (str): Database file written by 'export_library_rows'
+        snapshot (LibrarySnapshot): Snapshot being imported, its change_seq is replaced by the local one
+        remap_path (Callable[[str], str]): Maps a path of the exporting node to the local one
+        poster_path (Callable[[str], str]): Maps a poster path of the exporting node to the local one
+        imported_at (float): Unix timestamp
+
+    Returns:
+        dict[str, int]: Number of rows imported per table, and of 'deleted_path' applied
+    """
+    conn = AppDatabase.get_connection()
+    conn.create_function("snapshot_remap_path", 1, remap_path, deterministic=True)
+    conn.create_function("snapshot_poster_path", 1, poster_path, deterministic=True)
+
+    def _columns(schema: str, table: str) -> list[str]:
+        return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table});").fetchall()]
+
+    # Local ids are not portable, they are assigned again or mapped
+    expressions = {
+        "full_path": "snapshot_remap_path(full_path)",
+        "full_sub_path": "snapshot_remap_path(full_sub_path)",
+        "image_path": "snapshot_poster_path(image_path)",
+        "source_id": "(SELECT local_id FROM temp.snapshot_source_map WHERE snapshot_id = source_id)",
+        "group_id": "NULL",
+    }
+
+    conn.execute("ATTACH DATABASE ? AS snapshot;", [snapshot_db_path])
+    try:
+        with conn:
+            conn.execute("BEGIN;")
+            conn.execute(
+                """
+                INSERT INTO main.source (name, path, scan_interval_mins, max_workers, fingerprint_ttl_mins)
+                SELECT name, snapshot_remap_path(path), scan_interval_mins, max_workers, fingerprint_ttl_mins
+                FROM snapshot.source
+                WHERE true
+                ON CONFLICT (path) DO NOTHING;
+                """
+            )
+            conn.execute(
+                """
+                CREATE TEMP TABLE snapshot_source_map AS
+                SELECT s.id AS snapshot_id, l.id AS local_id
+                FROM snapshot.source s
+                JOIN main.source l ON l.path = snapshot_remap_path(s.path);
+                """
+            )
+
+            counts = {"deleted_path": conn.execute("SELECT COUNT(*) FROM snapshot.deleted_path;").fetchone()[0]}
+            for table in _PATH_TABLES:
+                conn.execute(
+                    f"""
+                    DELETE FROM main.{table}
+                    WHERE full_path IN (SELECT snapshot_remap_path(full_path) FROM snapshot.deleted_path);
+                    """
+                )
+
+            for table in _SNAPSHOT_TABLES[1:]:
+                conn.execute(
+                    f"""
+                    DELETE FROM main.{table}
+                    WHERE full_path IN (SELECT snapshot_remap_path(full_path) FROM snapshot.{table});
+                    """
+                )
+                # Columns missing on either side, e.g. from an older version, are left to their defaults
+                snapshot_columns = set(_columns("snapshot", table))
+                columns = [column for column in _columns("main", table) if column in snapshot_columns and column != "id"]
+                cursor = conn.execute(
+                    f"""
+                    INSERT INTO main.{table} ({", ".join(columns)})
+                    SELECT {", ".join(expressions.get(column, column) for column in columns)}
+                    FROM snapshot.{table};
+                    """
+                )
+                counts[table] = cursor.rowcount
+
+            # Group heads first, then the other members join the group of their head
+            imported_fingerprints = "SELECT snapshot_remap_path(full_path) FROM snapshot.video_fingerprint"
+            conn.execute(
+                f"""
+                UPDATE main.video_fingerprint SET group_id = id
+                WHERE full_path IN ({imported_fingerprints} WHERE group_path IS NULL OR group_path = full_path);
+                """
+            )
+            conn.execute(
+                f"""
+                UPDATE main.video_fingerprint SET group_id = COALESCE(
+                    (
+                        SELECT h.group_id
+                        FROM snapshot.video_fingerprint s
+                        JOIN main.video_fingerprint h ON h.full_path = snapshot_remap_path(s.group_path)
+                        WHERE snapshot_remap_path(s.full_path) = main.video_fingerprint.full_path
+                    ),
+                    id
+                )
+                WHERE group_id IS NULL AND full_path IN ({imported_fingerprints});
+                """
+            )
+            conn.execute("DROP TABLE temp.snapshot_source_map;")
+
+            change_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM main.library_change;").fetchone()[0]
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO main.library_snapshot (id, base_id, change_seq, created_at, imported_at)
+                VALUES (?, ?, ?, ?, ?);
+                """,
+                [snapshot.id, snapshot.base_id, change_seq, snapshot.created_at, imported_at],
+            )
+    finally:
+        conn.execute("DETACH DATABASE snapshot;")
+    return counts
+
+
+@metrics.timed("db.get_change_seqs")
+def get_change_seqs() -> tuple[int, int]:
+    """Returns the last change of the 'library_change' and 'watch_change' feeds, 0 for an empty feed"""
+    conn = AppDatabase.get_connection()
+    return conn.execute(
+        "SELECT (SELECT COALESCE(MAX(seq), 0) FROM library_change), (SELECT COALESCE(MAX(seq), 0) FROM watch_change);"
+    ).fetchone()
+
+
+def _get_changes(table: str, since_seq: int) -> tuple[int, list[str]]:
+    conn = AppDatabase.get_connection()
+    rows = conn.execute(f"SELECT full_path, seq FROM {table} WHERE seq > ? ORDER BY seq;", [since_seq]).fetchall()
+    return (rows[-1][1] if rows else since_seq), [row[0] for row in rows]
+
+
+@metrics.timed("db.get_library_changes")
+def get_library_changes(since_seq: int) -> tuple[int, list[str]]:
+    """Retrieves the paths whose video, fingerprint or audio analysis changed, deletions included
+
+    Args:
+        since_seq (int): Last change already seen, 0 for every path
+
+    Returns:
+        tuple[int, list[str]]: Last change, and the paths changed after 'since_seq'
+    """
+    return _get_changes("library_change", since_seq)
+
+
+@metrics.timed("db.get_watch_changes")
+def get_watch_changes(since_seq: int) -> tuple[int, list[str]]:
+    """Retrieves the paths whose resume point or watched mark changed
+
+    Args:
+        since_seq (int): Last change already seen, 0 for every path
+
+    Returns:
+        tuple[int, list[str]]: Last change, and the paths changed after 'since_seq'
+    """
+    return _get_changes("watch_change", since_seq)
+
+
+@metrics.timed("db.get_catalog_rows")
+def get_catalog_rows(paths: list[str] | None = None) -> list[CatalogRow]:
+    """Retrieves videos with their version group, watch state and show
+
+    Args:
+        paths (list[str], optional): Full paths of the videos, those without a video are skipped. Defaults to all.
+
+    Returns:
+        list[CatalogRow]: Catalog rows, in no particular order
+    """
+    conn = AppDatabase.get_connection()
+    query = """
+        SELECT v.*, v.added_at, f.group_id, f.size, p.full_path IS NOT NULL, w.full_path IS NOT NULL, e.show_id
+        FROM video_metadata v
+        LEFT JOIN video_fingerprint f ON f.full_path = v.full_path
+        LEFT JOIN playback_state p ON p.full_path = v.full_path
+        LEFT JOIN video_watched w ON w.full_path = v.full_path
+        LEFT JOIN tv_episode e ON e.full_path = v.full_path
+    """
+
+    rows = []
+    if paths is None:
+        rows = conn.execute(query + ";").fetchall()
+    else:
+        for start in range(0, len(paths), _MAX_QUERY_PARAMS):
+            chunk = paths[start:start + _MAX_QUERY_PARAMS]
+            rows += conn.execute(query + f"WHERE v.full_path IN ({', '.join('?' * len(chunk))});", chunk).fetchall()
+
+    return [
+        CatalogRow(
+            metadata=_row_to_video(row),
+            added_at=row[-6],
+            group_id=row[-5],
+            size=row[-4],
+            in_progress=bool(row[-3]),
+            watched=bool(row[-2]),
+            show_id=row[-1],
+        )
+        for row in rows
+    ]
+
+
+_TV_SHOW_COLUMNS = """
+    id, title, tmdb_id, tmdb_title, tmdb_director, tmdb_year, tmdb_overview, tmdb_genres, tmdb_poster_path,
+    original_language, image_path, fetched_at, season_count, episode_count, watched_count, runtime_secs,
+    next_unwatched_path
+"""
+_TV_SEASON_COLUMNS = """
+    show_id, season, name, overview, tmdb_poster_path, image_path, fetched_at, episode_count, watched_count,
+    runtime_secs, next_unwatched_path
+"""
+
+
+def _row_to_tv_show(row: tuple) -> TvShow:
+    return TvShow(*row[:7], [genre for genre in row[7].split("|") if genre], *row[8:])
+
+
+@metrics.timed("db.get_tv_shows")
+def get_tv_shows() -> dict[int, TvShow]:
+    """Retrieves the shows that have at least one indexed episode
+
+    Returns:
+        dict[int, TvShow]: Show id -> show
+    """
+    conn = AppDatabase.get_connection()
+    rows = conn.execute(f"SELECT {_TV_SHOW_COLUMNS} FROM tv_show WHERE episode_count > 0;").fetchall()
+    return {row[0]: _row_to_tv_show(row) for row in rows}
+
+
+@metrics.timed("db.get_tv_show")
+def get_tv_show(show_id: int) -> TvShow | None:
+    """Retrieves a show by its id
+
+    Args:
+        show_id (int): Show id
+
+    Returns:
+        Optional[TvShow]: The show, None if there is no such show
+    """
+    conn = AppDatabase.get_connection()
+    row = conn.execute(f"SELECT {_TV_SHOW_COLUMNS} FROM tv_show WHERE id = ?;", [show_id]).fetchone()
+    return _row_to_tv_show(row) if row is not None else None
+
+
+@metrics.timed("db.get_tv_show_of_episode")
+def get_tv_show_of_episode(path: str) -> TvShow | None:
+    """Retrieves the show an indexed video is an episode of
+
+    Args:
+        path (str): Full path to the video file
+
+    Returns:
+        Optional[TvShow]: The show, None if the video is not an episode
+    """
+    conn = AppDatabase.get_connection()
+    row = conn.execute(
+        f"""
+        SELECT {_TV_SHOW_COLUMNS} FROM tv_show
+        WHERE id = (SELECT show_id FROM tv_episode WHERE full_path = ?);
+        """,
+        [path],
+    ).fetchone()
+    return _row_to_tv_show(row) if row is not None else None
+
+
+@metrics.timed("db.update_tv_show_metadata")
+def update_tv_show_metadata(show: TvShow) -> None:
+    """Stores the TMDB metadata and poster fetched for a show
+
+    Args:
+        show (TvShow): Show, matched on its id
+    """
+    conn = AppDatabase.get_connection()
+    with conn:
+        conn.execute(
+            """
+            UPDATE tv_show
+            SET tmdb_id = ?, tmdb_title = ?, tmdb_director = ?, tmdb_year = ?, tmdb_overview = ?, tmdb_genres = ?,
+                tmdb_poster_path = ?, original_language = ?, image_path = ?, fetched_at = ?
+            WHERE id = ?;
+            """,
+            [
+                show.tmdb_id,
+                show.tmdb_title,
+                show.tmdb_director,
+                show.tmdb_year,
+                show.tmdb_overview,
+                "|".join(show.tmdb_genres),
+                show.tmdb_poster_path,
+                show.original_language,
+                show.image_path,
+                show.fetched_at,
+                show.id,
+            ],
+        )
+
+
+@metrics.timed("db.get_tv_seasons")
+def get_tv_seasons(show_id: int) -> list[TvSeason]:
+    """Retrieves the seasons of a show that have at least one indexed episode
+
+    Args:
+        show_id (int): Show id
+
+    Returns:
+        list[TvSeason]: Seasons in order, specials last
+    """
+    conn = AppDatabase.get_connection()
+    rows = conn.execute(
+        f"""
+        SELECT {_TV_SEASON_COLUMNS} FROM tv_season
+        WHERE show_id = ? AND episode_count > 0
+        ORDER BY season = 0, season;
+        """,
+        [show_id],
+    ).fetchall()
+    return [TvSeason(*row) for row in rows]
+
+
+@metrics.timed("db.get_tv_season")
+def get_tv_season(show_id: int, season: int) -> TvSeason | None:
+    """Retrieves a season of a show
+
+    Args:
+        show_id (int): Show id
+        season (int): Season number
+
+    Returns:
+        Optional[TvSeason]: The season, None if no episode of it was ever indexed
+    """
+    conn = AppDatabase.get_connection()
+    row = conn.execute(
+        f"SELECT {_TV_SEASON_COLUMNS} FROM tv_season WHERE show_id = ? AND season = ?;", [show_id, season]
+    ).fetchone()
+    return TvSeason(*row) if row is not None else None
+
+
+@metrics.timed("db.update_tv_season_metadata")
+def update_tv_season_metadata(season: TvSeason) -> None:
+    """Stores the TMDB metadata and poster fetched for a season
+
+    Args:
+        season (TvSeason): Season, matched on its show id and number
+    """
+    conn = AppDatabase.get_connection()
+    with conn:
+        conn.execute(
+            """
+            UPDATE tv_season
+            SET name = ?, overview = ?, tmdb_poster_path = ?, image_path = ?, fetched_at = ?
+            WHERE show_id = ? AND season = ?;
+            """,
+            [
+                season.name,
+                season.overview,
+                season.tmdb_poster_path,
+                season.image_path,
+                season.fetched_at,
+                season.show_id,
+                season.season,
+            ],
+        )
+
+
+@metrics.timed("db.get_tv_poster_paths")
+def get_tv_poster_paths() -> list[str]:
+    """Retrieves the posters downloaded for shows and seasons, so the startup sweep keeps them"""
+    conn = AppDatabase.get_connection()
+    rows = conn.execute(
+        """
+        SELECT image_path FROM tv_show WHERE image_path != ''
+        UNION SELECT image_path FROM tv_season WHERE image_path != '';
+        """
+    ).fetchall()
+    return [row[0] for row in rows]
@@ -1,12 +1,237 @@
-import os
-
 import sqlite3
 
 from .connection import AppDatabase
-from utils.file_handling import load_yaml_file
+from utils.config_service import ConfigService
 from . import queries
 
 
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    """Adds columns introduced after a table was first created, so existing databases keep working
+
+    Args:
+        conn (sqlite3.Connection): Live connection, the caller owns the transaction
+        table (str): Table name
+        columns (dict[str, str]): Column name -> column definition
+    """
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table});")}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition};")
+
+
+# A video is an episode when its file name gave a title, a season and an episode
+_EPISODE_CONDITION = (
+    "{row}.parsed_title IS NOT NULL AND trim({row}.parsed_title) != '' "
+    "AND {row}.season IS NOT NULL AND {row}.episode IS NOT NULL"
+)
+# Seconds of a '%H:%M:%S.%f' length
+_RUNTIME_SECS = (
+    "CAST(substr({row}.length, 1, 2) AS INTEGER) * 3600 + CAST(substr({row}.length, 4, 2) AS INTEGER) * 60 "
+    "+ CAST(substr({row}.length, 7, 2) AS INTEGER)"
+)
+# Files the episode of a video, under the show of its parsed title
+_INSERT_EPISODE = """
+    INSERT OR IGNORE INTO tv_show (title_key, title)
+    SELECT lower(trim({row}.parsed_title)), trim({row}.parsed_title)
+    WHERE {episode};
+    INSERT INTO tv_episode (full_path, show_id, season, episode, runtime_secs, watched)
+    SELECT {row}.full_path, s.id, {row}.season, {row}.episode, {runtime},
+        EXISTS (SELECT 1 FROM video_watched w WHERE w.full_path = {row}.full_path)
+    FROM tv_show s
+    WHERE s.title_key = lower(trim({row}.parsed_title)) AND {episode};
+"""
+# Reads the aggregates of a season back from its episodes, then those of its show from its seasons.
+# The versions of an episode count once, an episode is watched once any of them was played to the end.
+_REFRESH_AGGREGATES = """
+    UPDATE tv_season SET
+        episode_count = (
+            SELECT COUNT(DISTINCT episode) FROM tv_episode
+            WHERE show_id = {row}.show_id AND season = {row}.season
+        ),
+        watched_count = (
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM tv_episode
+                WHERE show_id = {row}.show_id AND season = {row}.season
+                GROUP BY episode HAVING MAX(watched) = 1
+            )
+        ),
+        runtime_secs = (
+            SELECT COALESCE(SUM(runtime_secs), 0) FROM (
+                SELECT MAX(runtime_secs) AS runtime_secs FROM tv_episode
+                WHERE show_id = {row}.show_id AND season = {row}.season
+                GROUP BY episode
+            )
+        ),
+        next_unwatched_path = (
+            SELECT e.full_path FROM tv_episode e
+            WHERE e.show_id = {row}.show_id AND e.season = {row}.season AND NOT EXISTS (
+                SELECT 1 FROM tv_episode w
+                WHERE w.show_id = e.show_id AND w.season = e.season AND w.episode = e.episode AND w.watched = 1
+            )
+            ORDER BY e.episode, e.full_path LIMIT 1
+        )
+    WHERE show_id = {row}.show_id AND season = {row}.season;
+    UPDATE tv_show SET
+        season_count = (SELECT COUNT(*) FROM tv_season WHERE show_id = {row}.show_id AND episode_count > 0),
+        episode_count = (SELECT COALESCE(SUM(episode_count), 0) FROM tv_season WHERE show_id = {row}.show_id),
+        watched_count = (SELECT COALESCE(SUM(watched_count), 0) FROM tv_season WHERE show_id = {row}.show_id),
+        runtime_secs = (SELECT COALESCE(SUM(runtime_secs), 0) FROM tv_season WHERE show_id = {row}.show_id),
+        next_unwatched_path = (
+            SELECT next_unwatched_path FROM tv_season
+            WHERE show_id = {row}.show_id AND next_unwatched_path IS NOT NULL
+            ORDER BY season = 0, season LIMIT 1
+        )
+    WHERE id = {row}.show_id;
+"""
+
+
+def _create_tv_tables(conn: sqlite3.Connection) -> None:
+    """Creates the show -> season -> episode hierarchy and the triggers that keep it and its aggregates current
+
+    Args:
+        conn (sqlite3.Connection): Live connection, the caller owns the transaction
+    """
+    # Shows and seasons stay when their last episode goes, with the metadata fetched for them
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tv_show (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title_key TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            tmdb_id TEXT NOT NULL DEFAULT '',
+            tmdb_title TEXT NOT NULL DEFAULT '',
+            tmdb_director TEXT NOT NULL DEFAULT '',
+            tmdb_year TEXT NOT NULL DEFAULT '',
+            tmdb_overview TEXT NOT NULL DEFAULT '',
+            tmdb_genres TEXT NOT NULL DEFAULT '',
+            tmdb_poster_path TEXT NOT NULL DEFAULT '',
+            original_language TEXT NOT NULL DEFAULT '',
+            image_path TEXT NOT NULL DEFAULT '',
+            fetched_at REAL,
+            season_count INTEGER NOT NULL DEFAULT 0,
+            episode_count INTEGER NOT NULL DEFAULT 0,
+            watched_count INTEGER NOT NULL DEFAULT 0,
+            runtime_secs INTEGER NOT NULL DEFAULT 0,
+            next_unwatched_path TEXT
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tv_season (
+            show_id INTEGER NOT NULL REFERENCES tv_show(id) ON DELETE CASCADE,
+            season INTEGER NOT NULL,
+            name TEXT NOT NULL DEFAULT '',
+            overview TEXT NOT NULL DEFAULT '',
+            tmdb_poster_path TEXT NOT NULL DEFAULT '',
+            image_path TEXT NOT NULL DEFAULT '',
+            fetched_at REAL,
+            episode_count INTEGER NOT NULL DEFAULT 0,
+            watched_count INTEGER NOT NULL DEFAULT 0,
+            runtime_secs INTEGER NOT NULL DEFAULT 0,
+            next_unwatched_path TEXT,
+            PRIMARY KEY (show_id, season)
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tv_episode (
+            full_path TEXT PRIMARY KEY,
+            show_id INTEGER NOT NULL REFERENCES tv_show(id) ON DELETE CASCADE,
+            season INTEGER NOT NULL,
+            episode INTEGER NOT NULL,
+            runtime_secs INTEGER NOT NULL,
+            watched INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_tv_episode_season
+        ON tv_episode (show_id, season, episode);
+        """
+    )
+
+    insert_episode = _INSERT_EPISODE.format(
+        row="NEW", episode=_EPISODE_CONDITION.format(row="NEW"), runtime=_RUNTIME_SECS.format(row="NEW")
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_video_metadata_insert_tv_episode
+        AFTER INSERT ON video_metadata
+        BEGIN
+            DELETE FROM tv_episode WHERE full_path = NEW.full_path;
+            {insert_episode}
+        END;
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_video_metadata_update_tv_episode
+        AFTER UPDATE OF full_path, length, parsed_title, season, episode ON video_metadata
+        BEGIN
+            DELETE FROM tv_episode WHERE full_path = OLD.full_path;
+            {insert_episode}
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_video_metadata_delete_tv_episode
+        AFTER DELETE ON video_metadata
+        BEGIN
+            DELETE FROM tv_episode WHERE full_path = OLD.full_path;
+        END;
+        """
+    )
+    for event, watched, row in (("INSERT", 1, "NEW"), ("DELETE", 0, "OLD")):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_video_watched_{event.lower()}_tv_episode
+            AFTER {event} ON video_watched
+            BEGIN
+                UPDATE tv_episode SET watched = {watched} WHERE full_path = {row}.full_path;
+            END;
+            """
+        )
+
+    for event, row, before in (
+        ("INSERT", "NEW", "INSERT OR IGNORE INTO tv_season (show_id, season) VALUES (NEW.show_id, NEW.season);"),
+        ("DELETE", "OLD", ""),
+        ("UPDATE OF watched", "NEW", ""),
+    ):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_tv_episode_{event.split()[0].lower()}_aggregates
+            AFTER {event} ON tv_episode
+            BEGIN
+                {before}
+                {_REFRESH_AGGREGATES.format(row=row)}
+            END;
+            """
+        )
+
+    # Episodes indexed before the hierarchy existed, a no-op once they are filed
+    conn.execute(
+        f"""
+        INSERT OR IGNORE INTO tv_show (title_key, title)
+        SELECT lower(trim(v.parsed_title)), trim(v.parsed_title) FROM video_metadata v
+        WHERE {_EPISODE_CONDITION.format(row="v")};
+        """
+    )
+    conn.execute(
+        f"""
+        INSERT OR IGNORE INTO tv_episode (full_path, show_id, season, episode, runtime_secs, watched)
+        SELECT v.full_path, s.id, v.season, v.episode, {_RUNTIME_SECS.format(row="v")},
+            EXISTS (SELECT 1 FROM video_watched w WHERE w.full_path = v.full_path)
+        FROM video_metadata v JOIN tv_show s ON s.title_key = lower(trim(v.parsed_title))
+        WHERE {_EPISODE_CONDITION.format(row="v")}
+            AND NOT EXISTS (SELECT 1 FROM tv_episode e WHERE e.full_path = v.full_path);
+        """
+    )
+
+
 def create_tables() -> None:
     """Runs SQL query to create the schema"""
     conn = AppDatabase.get_connection()
@@ -27,10 +252,263 @@ def create_tables() -> None:
                     tmdb_year TEXT,
                     tmdb_overview TEXT,
                     tmdb_genres TEXT,
-                    tmdb_poster_path TEXT
+                    tmdb_poster_path TEXT,
+                    source_id INTEGER REFERENCES source(id) ON DELETE CASCADE,
+                    parsed_title TEXT,
+                    parsed_year INTEGER,
+                    season INTEGER,
+                    episode INTEGER,
+                    episode_end INTEGER,
+                    resolution TEXT,
+                    release_group TEXT,
+                    metadata_source TEXT,
+                    poster_source TEXT,
+                    added_at REAL
+                );
+                """
+            )
+            _add_missing_columns(
+                conn,
+                "video_metadata",
+                {
+                    "source_id": "INTEGER REFERENCES source(id) ON DELETE CASCADE",
+                    "parsed_title": "TEXT",
+                    "parsed_year": "INTEGER",
+                    "season": "INTEGER",
+                    "episode": "INTEGER",
+                    "episode_end": "INTEGER",
+                    "resolution": "TEXT",
+                    "release_group": "TEXT",
+                    "metadata_source": "TEXT",
+                    "poster_source": "TEXT",
+                    "added_at": "REAL",
+                },
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_video_metadata_title
+                ON video_metadata (tmdb_title);
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_video_metadata_source
+                ON video_metadata (source_id, full_path);
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS source (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    path TEXT NOT NULL UNIQUE,
+                    scan_interval_mins INTEGER NOT NULL,
+                    max_workers INTEGER NOT NULL,
+                    fingerprint_ttl_mins INTEGER NOT NULL,
+                    last_scan_at REAL
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS source_file (
+                    source_id INTEGER NOT NULL REFERENCES source(id) ON DELETE CASCADE,
+                    full_path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    checked_at REAL NOT NULL,
+                    PRIMARY KEY (source_id, full_path)
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tmdb_cache (
+                    url TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS video_fingerprint (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    full_path TEXT NOT NULL UNIQUE,
+                    duration_secs REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    frame_hashes TEXT NOT NULL,
+                    group_id INTEGER
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_video_fingerprint_duration
+                ON video_fingerprint (duration_secs);
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_video_fingerprint_group
+                ON video_fingerprint (group_id);
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS audio_analysis (
+                    full_path TEXT PRIMARY KEY,
+                    loudness_lufs REAL,
+                    gain_db REAL NOT NULL,
+                    head_fingerprint BLOB NOT NULL,
+                    tail_fingerprint BLOB NOT NULL,
+                    tail_offset_secs REAL NOT NULL,
+                    intro_start REAL,
+                    intro_end REAL,
+                    credits_start REAL,
+                    segments_checked INTEGER NOT NULL DEFAULT 0,
+                    analyzed_at REAL NOT NULL
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS enrichment_queue (
+                    full_path TEXT PRIMARY KEY,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL,
+                    last_error TEXT NOT NULL DEFAULT '',
+                    enqueued_at REAL NOT NULL,
+                    claimed_until REAL
+                );
+                """
+            )
+            # Lease of the worker working on a video, other workers skip it until it expires
+            _add_missing_columns(conn, "enrichment_queue", {"claimed_until": "REAL"})
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_enrichment_queue_due
+                ON enrichment_queue (next_attempt_at);
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scan_journal (
+                    full_path TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    source_id INTEGER,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    updated_at REAL NOT NULL
+                );
+                """
+            )
+            # Native code (MediaInfo, OpenCV) running on the file, and how often it took the indexer down
+            _add_missing_columns(
+                conn,
+                "scan_journal",
+                {"attempting": "TEXT", "crashes": "INTEGER NOT NULL DEFAULT 0"},
+            )
+            # Hash of a few chunks of every video, the key of the LAN peer cache
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS video_content_hash (
+                    full_path TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL
                 );
                 """
             )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_video_content_hash
+                ON video_content_hash (content_hash);
+                """
+            )
+            # Last change of every path shared through library snapshots, for delta exports
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS library_change (
+                    full_path TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_library_change_seq
+                ON library_change (seq);
+                """
+            )
+            for table in ("video_metadata", "video_fingerprint", "audio_analysis"):
+                for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                    conn.execute(
+                        f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_change
+                        AFTER {event} ON {table}
+                        BEGIN
+                            INSERT OR REPLACE INTO library_change (full_path, seq)
+                            VALUES ({row}.full_path, (SELECT COALESCE(MAX(seq), 0) + 1 FROM library_change));
+                        END;
+                        """
+                    )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS library_snapshot (
+                    id TEXT PRIMARY KEY,
+                    base_id TEXT,
+                    change_seq INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    imported_at REAL
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS playback_state (
+                    full_path TEXT PRIMARY KEY,
+                    position_secs INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS video_watched (
+                    full_path TEXT PRIMARY KEY,
+                    watched_at REAL NOT NULL
+                );
+                """
+            )
+            # Last change of the watch state of every path, for the in-memory catalog of the browser
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS watch_change (
+                    full_path TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL
+                );
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_watch_change_seq
+                ON watch_change (seq);
+                """
+            )
+            for table in ("playback_state", "video_watched"):
+                for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                    conn.execute(
+                        f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_watch_change
+                        AFTER {event} ON {table}
+                        BEGIN
+                            INSERT OR REPLACE INTO watch_change (full_path, seq)
+                            VALUES ({row}.full_path, (SELECT COALESCE(MAX(seq), 0) + 1 FROM watch_change));
+                        END;
+                        """
+                    )
+            _create_tv_tables(conn)
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS connector (
@@ -56,7 +534,7 @@ def create_tables() -> None:
 
 def seed_default() -> None:
     """Seeds the default values in database, mainly settings names"""
-    setting_names = load_yaml_file(os.path.join(".", "config", "app_settings.yaml"))
+    setting_names = ConfigService.get("app_settings.yaml")
     conn = AppDatabase.get_connection()
     with conn:
         for setting_name in setting_names:
@@ -0,0 +1,138 @@
+import os
+import queue
+import logging
+import threading
+
+from typing import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the walk in the results queue
+_WALK_DONE = object()
+
+
+def get_extension(file_name: str) -> str:
+    """Returns the lowercase extension of a file name, without the dot
+
+    Args:
+        file_name (str): File name or path
+
+    Returns:
+        str: Extension, empty if the file has none
+    """
+    return os.path.splitext(file_name)[1][1:].lower()
+
+
+def scan_video_files(
+    folder_path: str,
+    accepted_extensions: Iterable[str],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> Iterator[str]:
+    """Same as 'scan_video_entries' but yields the full paths only
+
+    Args:
+        folder_path (str): Root folder to walk
+        accepted_extensions (Iterable[str]): Lowercase extensions without the dot
+        max_workers (int, optional): Number of folders listed concurrently. Defaults to 8.
+
+    Yields:
+        Iterator[str]: Full paths of the accepted files
+    """
+    for entry in scan_video_entries(folder_path, accepted_extensions, max_workers):
+        yield entry.path
+
+
+def scan_video_entries(
+    folder_path: str,
+    accepted_extensions: Iterable[str],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> Iterator[os.DirEntry]:
+    """Walks a folder tree in parallel and streams the entries of the accepted video files.
+
+    Every folder is listed once with os.scandir, whose DirEntry objects carry the file
+    type from the directory listing itself, so no extra stat is needed per file.
+    Subfolders are listed concurrently by a worker pool, which hides the round trip
+    latency of network shares. Paths are yielded as soon as a folder is listed so the
+    caller can start working before the walk is over. Order is not guaranteed.
+
+    Args:
+        folder_path (str): Root folder to walk
+        accepted_extensions (Iterable[str]): Lowercase extensions without the dot
+        max_workers (int, optional): Number of folders listed concurrently. Defaults to 8.
+
+    Yields:
+        Iterator[os.DirEntry]: Entries of the accepted files, 'stat()' results are cached on them
+
+    Raises:
+        Exception: What failed in a worker, other than an unreadable folder or entry
+    """
+    if not os.path.isdir(folder_path):
+        logger.warning("Folder path: %s not found or is not a folder", folder_path)
+        return
+
+    extensions = frozenset(accepted_extensions)
+    results = queue.Queue()
+    stop_event = threading.Event()
+    pending_lock = threading.Lock()
+    pending_folders = 1
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan")
+
+    def _scan_folder(path: str) -> None:
+        nonlocal pending_folders
+        files, subfolders = [], []
+
+        try:
+            if not stop_event.is_set():
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    subfolders.append(entry.path)
+                                elif get_extension(entry.name) in extensions and entry.is_file():
+                                    files.append(entry)
+                            except OSError as exception:
+                                logger.warning("Could not read entry: %s, exception: %s", entry.path, exception)
+                except OSError as exception:
+                    logger.warning("Could not list folder: %s, exception: %s", path, exception)
+
+            if files:
+                results.put(files)
+        except Exception as exception:
+            # Not an unreadable folder but a bug, raised to the caller instead of lost in the pool
+            results.put(exception)
+        finally:
+            # Always counted, the caller waits on the queue until the last folder is done
+            with pending_lock:
+                pending_folders += len(subfolders) - 1
+                walk_done = pending_folders == 0
+
+            for subfolder in subfolders:
+                if stop_event.is_set():
+                    break
+                try:
+                    executor.submit(_scan_folder, subfolder)
+                except RuntimeError:
+                    # The executor was shut down, the caller stopped iterating
+                    break
+
+            if walk_done:
+                results.put(_WALK_DONE)
+
+    executor.submit(_scan_folder, folder_path)
+    try:
+        while True:
+            batch = results.get()
+            if batch is _WALK_DONE:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        # Also reached when the caller stops iterating early
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
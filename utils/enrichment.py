@@ -0,0 +1,511 @@
+"""Deferred TMDB enrichment of the indexed videos.
+
+Indexing a file only stores what can be read locally (MediaInfo, the parsed file
+name, what the local metadata providers found), so it shows up in the browser
+within seconds. Unless the providers resolved it, the TMDB lookup and the poster
+download are queued in the 'enrichment_queue' table
+and worked through in batches, either by the GUI's background worker or by the
+headless scan. A batch is claimed for 'ClaimSecs', so both can run at once
+without looking a video up twice. Failed lookups, and lookups that found no
+match, are retried with exponential backoff until 'MaxAttempts' is reached. The
+episodes of a show share one lookup, and one poster, of their show and season.
+"""
+import os
+import time
+import logging
+import sqlite3
+import threading
+import functools
+import dataclasses
+
+from typing import Callable
+
+from langcodes import Language, LanguageTagError
+
+from utils import metrics, scan_journal
+from utils.config_service import ConfigService
+from utils.database import queries, models
+from utils.task_scheduler import TaskScheduler, RESOURCE_NETWORK
+from utils.tmdb_id_index import TmdbIdIndex
+from utils.peer_cache import PeerCache, PeerEntry
+from .filename_parser import parse_file_name
+from .tmdb_utils import (
+    search_movie_tmbd_api_call,
+    get_tmdb_metadata,
+    get_movie_details_api_call,
+    download_tmdb_poster,
+    search_crew_tmdb_api_call,
+    get_tmdb_configuration,
+    get_tv_season_api_call,
+)
+
+logger = logging.getLogger(__name__)
+
+# Fetched once per process, only needed to build poster URLs
+_tmdb_configuration = None
+_tmdb_configuration_lock = threading.Lock()
+
+# Episodes of a show are enriched in parallel, only the first one looks the show up
+_show_locks: dict[int, threading.Lock] = {}
+_show_locks_guard = threading.Lock()
+
+
+def _load_config() -> dict:
+    return ConfigService.get("enrichment_config.yaml")
+
+
+def _get_tmdb_configuration() -> dict | list | None:
+    global _tmdb_configuration
+    with _tmdb_configuration_lock:
+        if _tmdb_configuration is None:
+            _tmdb_configuration = get_tmdb_configuration()
+        return _tmdb_configuration
+
+
+def _runtime_matches(details: dict | None, tmdb_id: int, runtime_mins: int) -> bool:
+    """Tells movies of the same title apart by their runtime, within a minute"""
+    try:
+        tmdb_runtime = details["runtime"]
+    except Exception as e:
+        logger.warning("No runtime for TMDB id %s: %s", tmdb_id, e)
+        tmdb_runtime = 0
+
+    return abs(int(tmdb_runtime) - runtime_mins) <= 1
+
+
+def _match_indexed_ids(tmdb_ids: list[int], is_tvshow: bool, runtime_mins: int) -> dict | None:
+    """Fetches the details of the offline index candidates until one matches, in the shape of a search result"""
+    for tmdb_id in tmdb_ids:
+        details = get_movie_details_api_call(tmdb_id, is_tvshow)
+        if details is None:
+            continue
+
+        if is_tvshow or _runtime_matches(details, tmdb_id, runtime_mins):
+            # Details list the genres with their names, search results only by id
+            return dict(details, genre_ids=[genre["id"] for genre in details.get("genres", [])])
+    return None
+
+
+def lookup_tmdb_metadata(parsed_name: models.ParsedName, runtime_mins: int) -> dict[str, str]:
+    """Preprocessing and API call to TMDB to retrieve data about the movie / show
+
+    The offline ID index is consulted first, so known titles skip the search request.
+
+    Args:
+        parsed_name (models.ParsedName): Title and episode parsed from the local media file name
+        runtime_mins (int): Video length in minutes
+
+    Returns:
+        dict: Extracted data from TMDB, with empty values if nothing matched
+    """
+    movie_name = parsed_name.title
+    is_tvshow = parsed_name.is_episode
+
+    movie_data = _match_indexed_ids(TmdbIdIndex.lookup(movie_name, is_tvshow), is_tvshow, runtime_mins)
+
+    # API Call to  get info about movie / show
+    movie_search_results = search_movie_tmbd_api_call(movie_name, is_tvshow) if movie_data is None else None
+
+    # Filter based on runtime
+    if movie_search_results is not None and len(movie_search_results) > 0:
+        for search_result in movie_search_results:
+            if is_tvshow:
+                movie_data = search_result
+                break
+
+            details = get_movie_details_api_call(search_result["id"], is_tvshow)
+            if _runtime_matches(details, search_result["id"], runtime_mins):
+                movie_data = search_result
+                break
+
+    # Return dict with needed data
+    metadata = get_tmdb_metadata(movie_data, is_tvshow)
+
+    # API Call for Director name
+    director = ""
+    if metadata["id"] != "":
+        director = search_crew_tmdb_api_call(metadata["id"], is_tvshow)
+
+    metadata["director"] = director or ""
+
+    return metadata
+
+
+def _show_lock(show_id: int) -> threading.Lock:
+    with _show_locks_guard:
+        return _show_locks.setdefault(show_id, threading.Lock())
+
+
+def _download_poster(tmdb_poster_path: str, image_path: str) -> str:
+    """Downloads a TMDB poster, returns where it was saved or an empty string if it was not"""
+    if not tmdb_poster_path:
+        return ""
+    with metrics.timer("enrichment.poster_download"):
+        download_tmdb_poster(tmdb_poster_path, image_path, _get_tmdb_configuration())
+    return image_path if os.path.exists(image_path) else ""
+
+
+def _fetch_season(show: models.TvShow, season_number: int, posters_folder: str) -> None:
+    """Fetches the name, overview and poster of a season of a matched show, once"""
+    season = queries.get_tv_season(show.id, season_number)
+    if season is None or season.fetched_at is not None:
+        return
+
+    details = get_tv_season_api_call(show.tmdb_id, season_number)
+    if details is None:
+        return
+    tmdb_poster_path = details.get("poster_path") or ""
+    image_path = _download_poster(
+        tmdb_poster_path, os.path.join(posters_folder, f"tv_season_{show.id}_{season_number}.jpg")
+    )
+    queries.update_tv_season_metadata(
+        dataclasses.replace(
+            season,
+            name=details.get("name") or "",
+            overview=details.get("overview") or "",
+            tmdb_poster_path=tmdb_poster_path,
+            image_path=image_path,
+            fetched_at=time.time(),
+        )
+    )
+
+
+def lookup_show_metadata(
+    show_id: int, parsed_name: models.ParsedName, runtime_mins: int, posters_folder: str
+) -> dict[str, str]:
+    """Returns the TMDB metadata of the show of an episode, looked up once and shared by all its episodes
+
+    The show poster and the metadata of the episode's season are fetched along with it, also once.
+    A show TMDB did not match is looked up again with its next episode.
+
+    Args:
+        show_id (int): Show of the episode
+        parsed_name (models.ParsedName): Title and episode parsed from the file name of the episode
+        runtime_mins (int): Episode length in minutes
+        posters_folder (str): Where the show and season posters are saved
+
+    Returns:
+        dict: Same as 'lookup_tmdb_metadata', with empty values if nothing matched
+    """
+    with _show_lock(show_id):
+        show = queries.get_tv_show(show_id)
+        if show is None:
+            return lookup_tmdb_metadata(parsed_name, runtime_mins)
+
+        if show.tmdb_id == "":
+            metadata = lookup_tmdb_metadata(parsed_name, runtime_mins)
+            if metadata["id"] == "":
+                return metadata
+
+            show = dataclasses.replace(
+                show,
+                tmdb_id=str(metadata["id"]),
+                tmdb_title=metadata["title"],
+                tmdb_director=metadata["director"],
+                tmdb_year=metadata["year"],
+                tmdb_overview=metadata["overview"],
+                tmdb_genres=metadata["genres"],
+                tmdb_poster_path=metadata["poster_path"] or "",
+                original_language=metadata["original_language"],
+                image_path=_download_poster(
+                    metadata["poster_path"], os.path.join(posters_folder, f"tv_show_{show.id}.jpg")
+                ),
+                fetched_at=time.time(),
+            )
+            queries.update_tv_show_metadata(show)
+            metrics.increment("enrichment.show_lookup")
+        else:
+            metrics.increment("enrichment.show_shared")
+
+        if parsed_name.season is not None:
+            _fetch_season(show, parsed_name.season, posters_folder)
+
+    return {
+        "title": show.tmdb_title,
+        "year": show.tmdb_year,
+        "overview": show.tmdb_overview,
+        "genres": show.tmdb_genres,
+        "poster_path": show.tmdb_poster_path,
+        "id": show.tmdb_id,
+        "original_language": show.original_language,
+        "director": show.tmdb_director,
+    }
+
+
+def enqueue(video_paths: list[str], priority: int = 0) -> None:
+    """Queues videos for TMDB enrichment
+
+    Args:
+        video_paths (list[str]): Full paths to the video files
+        priority (int, optional): Higher priorities are worked on first. Defaults to 0.
+    """
+    if video_paths:
+        queries.enqueue_enrichment_tasks(video_paths, priority, time.time())
+
+
+def enqueue_unmatched_videos() -> int:
+    """Queues the videos that have no TMDB metadata, e.g. indexed while TMDB was unreachable
+
+    Returns:
+        int: Number of videos queued
+    """
+    queued = queries.enqueue_unmatched_videos(time.time())
+    if queued:
+        logger.info("Queued %d videos without TMDB metadata for enrichment", queued)
+    return queued
+
+
+def enrich_video(video_path: str) -> bool:
+    """Looks up a video on TMDB and stores the metadata and poster found
+
+    Args:
+        video_path (str): Full path to the video file
+
+    Returns:
+        bool: True if TMDB matched the video, or if the video is no longer indexed
+    """
+    video = queries.get_video_by_path(video_path)
+    if video is None:
+        return True
+
+    # Episodes share the metadata of their show
+    show = queries.get_tv_show_of_episode(video_path)
+
+    # A lookup or download finished before an interruption is not done again
+    journal_entry = scan_journal.load(video_path)
+    progress = dict(journal_entry.data) if journal_entry is not None else {}
+
+    if scan_journal.reached(journal_entry, "matched"):
+        tmdb_metadata = progress["tmdb"]
+    else:
+        # A LAN peer may have resolved a copy of the file since it was indexed
+        peer_entry = PeerCache.lookup_video(video_path)
+        if peer_entry is not None and peer_entry.title:
+            _apply_peer_entry(video, peer_entry)
+            return True
+
+        parsed_name = video.parsed_name or parse_file_name(video_path)
+        with metrics.timer("enrichment.tmdb_lookup"):
+            if show is not None:
+                tmdb_metadata = lookup_show_metadata(
+                    show.id, parsed_name, video.get_length_sec() // 60, os.path.dirname(video.image_path)
+                )
+            else:
+                tmdb_metadata = lookup_tmdb_metadata(parsed_name, video.get_length_sec() // 60)
+        if tmdb_metadata["id"] == "":
+            return False
+        progress["tmdb"] = tmdb_metadata
+        journal_entry = scan_journal.record(video_path, "matched", progress)
+
+    # The language from the local file metadata wins over the one from TMDB
+    language = video.language
+    if language == "N/A" and tmdb_metadata["original_language"] != "":
+        try:
+            language = Language.get(tmdb_metadata["original_language"]).display_name()
+        except LanguageTagError as e:
+            logger.warning("Unknown language tag from TMDB for %s: %s", video_path, e)
+
+    # Replaces the screenshot stored at indexing time, it stays if the download fails.
+    # A poster found next to or inside the file is kept. Episodes keep their screenshot as a still,
+    # the posters of their show and season are downloaded once for all of them.
+    poster_source = video.poster_source
+    if show is None and poster_source in ("", "screenshot", "tmdb"):
+        if not scan_journal.reached(journal_entry, "poster"):
+            with metrics.timer("enrichment.poster_download"):
+                download_tmdb_poster(tmdb_metadata["poster_path"], video.image_path, _get_tmdb_configuration())
+            scan_journal.record(video_path, "poster", progress)
+        poster_source = "tmdb"
+
+    queries.update_video_tmdb_metadata(
+        dataclasses.replace(
+            video,
+            language=language,
+            tmdb_title=tmdb_metadata["title"],
+            tmdb_director=tmdb_metadata["director"],
+            tmdb_year=tmdb_metadata["year"],
+            tmdb_overview=tmdb_metadata["overview"],
+            tmdb_genres=tmdb_metadata["genres"],
+            tmdb_poster_path=tmdb_metadata["poster_path"] or "",
+            metadata_source="tmdb",
+            poster_source=poster_source,
+        )
+    )
+    scan_journal.finish(video_path)
+    return True
+
+
+def _apply_peer_entry(video: models.VideoMetadata, peer_entry: PeerEntry) -> None:
+    """Stores what a LAN peer resolved for a copy of the video, in place of a TMDB lookup"""
+    poster_source = video.poster_source
+    if poster_source in ("", "screenshot", "tmdb") and peer_entry.poster_source not in ("", "screenshot"):
+        poster = PeerCache.fetch_poster(peer_entry)
+        if poster is not None:
+            # Versions of a title share their poster, the temp file is per thread
+            temp_path = f"{video.image_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as poster_f:
+                poster_f.write(poster)
+            os.replace(temp_path, video.image_path)
+            poster_source = "peer"
+
+    queries.update_video_tmdb_metadata(
+        dataclasses.replace(
+            video,
+            language=peer_entry.language if video.language == "N/A" and peer_entry.language else video.language,
+            tmdb_title=peer_entry.title,
+            tmdb_director=peer_entry.director,
+            tmdb_year=peer_entry.year,
+            tmdb_overview=peer_entry.overview,
+            tmdb_genres=peer_entry.genres,
+            tmdb_poster_path=peer_entry.tmdb_poster_path,
+            metadata_source="peer",
+            poster_source=poster_source,
+        )
+    )
+    scan_journal.finish(video.full_path)
+    metrics.increment("enrichment.from_peer")
+
+
+def _backoff_secs(attempts: int, config: dict) -> float:
+    """Wait before the next attempt, doubling with every failed one"""
+    return min(config["BackoffBaseSecs"] * 2 ** (attempts - 1), config["BackoffMaxSecs"])
+
+
+def _run_task(task: models.EnrichmentTask, config: dict) -> bool:
+    """Enriches one queued video, then removes it from the queue or schedules the retry"""
+    try:
+        enriched, error = enrich_video(task.full_path), "no TMDB match"
+    except sqlite3.Error:
+        # Not a TMDB failure, the task keeps its attempts and is picked up again once its claim expires
+        logger.exception("Database error while enriching %s", task.full_path)
+        raise
+    except Exception as exception:
+        enriched, error = False, str(exception)
+
+    if enriched:
+        queries.delete_enrichment_task(task.full_path)
+        metrics.increment("enrichment.enriched")
+        return True
+
+    attempts = task.attempts + 1
+    next_attempt_at = None
+    if attempts < config["MaxAttempts"]:
+        next_attempt_at = time.time() + _backoff_secs(attempts, config)
+        logger.debug("Enrichment of %s failed (%s), attempt %d", task.full_path, error, attempts)
+    else:
+        logger.info("Giving up on TMDB enrichment of %s after %d attempts: %s", task.full_path, attempts, error)
+        scan_journal.finish(task.full_path)
+    queries.reschedule_enrichment_task(task.full_path, attempts, next_attempt_at, error)
+    metrics.increment("enrichment.failed")
+    return False
+
+
+def process_due_batch(config: dict | None = None) -> tuple[int, int]:
+    """Claims the due videos of highest priority and enriches them on the scheduler's network pool
+
+    Args:
+        config (dict, optional): Enrichment config, loaded from 'enrichment_config.yaml' if None
+
+    Returns:
+        tuple[int, int]: Videos processed, videos enriched
+    """
+    config = config or _load_config()
+    now = time.time()
+    tasks = queries.claim_due_enrichment_tasks(now, config["BatchSize"], now + config["ClaimSecs"])
+    if not tasks:
+        return 0, 0
+
+    # One batch request per peer, the lookups of the tasks are then answered from memory
+    PeerCache.prefetch([task.full_path for task in tasks])
+
+    with metrics.timer("enrichment.batch"):
+        results = TaskScheduler.map(
+            functools.partial(_run_task, config=config), tasks, RESOURCE_NETWORK, name="enrichment"
+        )
+    return len(tasks), sum(results)
+
+
+def drain_queue(stop_event: threading.Event | None = None) -> int:
+    """Works through every due video, for the headless scan. Retries scheduled later are left for the next run
+
+    Args:
+        stop_event (threading.Event, optional): Set to stop between batches
+
+    Returns:
+        int: Number of videos enriched
+    """
+    config = _load_config()
+    enriched = 0
+    while stop_event is None or not stop_event.is_set():
+        processed, batch_enriched = process_due_batch(config)
+        enriched += batch_enriched
+        if processed == 0:
+            break
+    return enriched
+
+
+class EnrichmentWorker:
+    """Background thread that claims batches from the enrichment queue while the GUI runs
+
+    The lookups themselves run on the scheduler's network pool, throttled during playback.
+    """
+
+    _wake_event = threading.Event()
+    _stop_event = threading.Event()
+    _thread: threading.Thread | None = None
+    _on_enriched: Callable[[], None] | None = None
+
+    @classmethod
+    def start(cls, on_enriched: Callable[[], None] | None = None) -> None:
+        """Starts the worker thread, if not already running
+
+        Args:
+            on_enriched (Callable, optional): Called from the worker thread after a batch enriched videos
+        """
+        cls._on_enriched = on_enriched
+        if cls._thread is not None and cls._thread.is_alive():
+            return
+
+        cls._stop_event.clear()
+        cls._thread = threading.Thread(target=cls._run, name="enrichment", daemon=True)
+        cls._thread.start()
+
+    @classmethod
+    def stop(cls) -> None:
+        cls._stop_event.set()
+        cls._wake_event.set()
+
+    @classmethod
+    def wake(cls) -> None:
+        """Checks the queue right away, e.g. after new files were indexed"""
+        cls._wake_event.set()
+
+    @classmethod
+    def prioritize(cls, video_path: str) -> None:
+        """Moves a queued video to the front of the queue, e.g. when it is selected in the browser
+
+        Args:
+            video_path (str): Full path to the video file
+        """
+        if queries.prioritize_enrichment_task(video_path, _load_config()["SelectedPriority"], time.time()):
+            cls.wake()
+
+    @classmethod
+    def _run(cls) -> None:
+        config = _load_config()
+        while not cls._stop_event.is_set():
+            cls._wake_event.clear()
+            try:
+                processed, enriched = process_due_batch(config)
+            except Exception as exception:
+                logger.error("Enrichment batch failed: %s", exception)
+                processed, enriched = 0, 0
+
+            if enriched and cls._on_enriched is not None:
+                cls._on_enriched()
+            if processed == 0:
+                # Sleep until the next retry is due, new work wakes the thread up earlier
+                next_attempt_at = queries.get_next_enrichment_attempt_at()
+                timeout = config["PollSecs"]
+                if next_attempt_at is not None:
+                    timeout = min(timeout, max(next_attempt_at - time.time(), 0.1))
+                cls._wake_event.wait(timeout)
@@ -1 +1 @@
-from .custom_exceptions import FolderNotFoundException
\ No newline at end of file
+from .custom_exceptions import FolderNotFoundException, ConfigValidationException, QuarantinedFileException
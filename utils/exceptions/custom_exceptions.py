@@ -8,3 +8,29 @@ class FolderNotFoundException(Exception):
     def __init__(self, folder_path: str):
         self.message = f"Path: {folder_path} is not found or is not a folder path, please check your settings."
         super().__init__(self.message)
+
+
+class ConfigValidationException(Exception):
+    """Exception raised for when a config file does not match its expected layout
+
+    Args:
+        location (str): Config file, or key path inside it, that caused the error
+        reason (str): What is wrong with it
+    """
+
+    def __init__(self, location: str, reason: str):
+        self.message = f"Config {location}: {reason}, please check your config files."
+        super().__init__(self.message)
+
+
+class QuarantinedFileException(Exception):
+    """Exception raised for when a file is skipped because indexing it kept crashing the indexer
+
+    Args:
+        file_path (str): Path of the skipped file
+        crashes (int): Number of crashes it caused
+    """
+
+    def __init__(self, file_path: str, crashes: int):
+        self.message = f"File: {file_path} crashed the indexer {crashes} times, it is skipped until it changes."
+        super().__init__(self.message)
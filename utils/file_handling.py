@@ -1,8 +1,13 @@
 import json
+import logging
 
 from PIL import Image, ImageTk, UnidentifiedImageError
 import yaml
 
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
 
 def read_tk_image(image_path: str) -> ImageTk.PhotoImage | None:
     """Given a path reads an image that can be used in any place that an image object is expected in Tkinter
@@ -14,14 +19,15 @@ def read_tk_image(image_path: str) -> ImageTk.PhotoImage | None:
         Optional[ImageTk.PhotoImage]: Tkinter image object
     """
     try:
-        with Image.open(image_path) as img:
-            pill_img = img.convert("RGBA")
+        with metrics.timer("image.decode"):
+            with Image.open(image_path) as img:
+                pill_img = img.convert("RGBA")
 
-        return ImageTk.PhotoImage(pill_img)
+            return ImageTk.PhotoImage(pill_img)
     except UnidentifiedImageError as exception:
-        print(f"Error while trying to open image ({image_path}) using PIL: {exception}")
+        logger.warning("Error while trying to open image (%s) using PIL: %s", image_path, exception)
     except Exception as exception:
-        print(f"An unexpected error occurred on image ({image_path}): {exception}")
+        logger.warning("An unexpected error occurred on image (%s): %s", image_path, exception)
     return None
 
 
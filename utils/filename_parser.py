@@ -0,0 +1,183 @@
+import os
+import re
+import time
+import logging
+import datetime
+import threading
+
+from functools import lru_cache
+
+from torrent_name_parser import TorrentNameParser as TNP
+
+from utils.database import queries, models
+
+logger = logging.getLogger(__name__)
+
+# Not '\b', that never matches after the '_' of 'The_Office_S02E03'
+_MARKER_START = r"(?<![A-Za-z0-9])"
+# A bare '-' continues a multi-episode file only with 1-2 digits, so 'S01E02-720p' is not episodes 2-720
+_DASH_EPISODE_END = r"-(?=\d{1,2}(?![\dpi]))"
+# S01E02, s01.e02, S01E02E03, S01E02-E03 and S01E02-03
+EPISODE_PATTERN = re.compile(
+    _MARKER_START + r"S(\d{1,2})[ ._-]?E(\d{1,3})(?:(?:[ ._-]?E|" + _DASH_EPISODE_END + r")(\d{1,3}))*(?!\d)",
+    re.IGNORECASE,
+)
+# 1x02, 1x02x03, 1x02-03 and 1x02-1x03
+CROSS_EPISODE_PATTERN = re.compile(
+    _MARKER_START + r"(\d{1,2})x(\d{2,3})(?:(?:-\d{1,2}x|" + _DASH_EPISODE_END + r"|x)(\d{2,3}))*(?!\d)",
+    re.IGNORECASE,
+)
+YEAR_PATTERN = re.compile(r"\b(19\d{2}|20\d{2})\b")
+RESOLUTION_PATTERN = re.compile(r"\b(\d{3,4}[pi]|4k|uhd)\b", re.IGNORECASE)
+# 'Movie.2020.1080p.x264-GROUP', optionally followed by a '[site]' tag
+RELEASE_GROUP_PATTERN = re.compile(r"-((?=[A-Za-z0-9]*[A-Za-z])[A-Za-z0-9]+)(?:\s*\[[^\]]*\])?$")
+# 'Show/Season 1/S01E01.mkv', the show is the folder above
+SEASON_FOLDER_PATTERN = re.compile(r"season[ ._-]*\d+", re.IGNORECASE)
+
+# TorrentNameParser keeps state between calls, so every thread gets its own instance
+_thread_local = threading.local()
+
+
+def _get_name_parser() -> TNP:
+    parser = getattr(_thread_local, "name_parser", None)
+    if parser is None:
+        parser = _thread_local.name_parser = TNP()
+    return parser
+
+
+def _clean_title(text: str) -> str:
+    return " ".join(re.split(r"[._\s]+", text)).strip(" -")
+
+
+def _parse_title(text: str, file_name: str) -> str:
+    try:
+        title = _get_name_parser().parse(text).title or ""
+    except Exception as exception:
+        logger.debug("Could not parse title of %s: %s", file_name, exception)
+        title = ""
+    return _clean_title(title) or _clean_title(text)
+
+
+def _folder_title(file_name: str) -> str:
+    """Title of an episode named after its marker only, from the show folder"""
+    folders = os.path.normpath(os.path.dirname(file_name)).split(os.sep)
+    if folders and SEASON_FOLDER_PATTERN.fullmatch(folders[-1]):
+        folders.pop()
+    folder = folders[-1] if folders else ""
+    return _parse_title(folder, file_name) if folder not in ("", ".", "..") else ""
+
+
+@lru_cache(maxsize=8192)
+def parse_file_name(file_name: str) -> models.ParsedName:
+    """Parses the title, year, season / episode, resolution and release group from a video file name
+
+    Results are memoized, a file name is only parsed once per run.
+
+    Examples:
+        >>> parsed = parse_file_name("The_Office_S02E03.mkv")
+        >>> parsed.title, parsed.season, parsed.episode
+        ('The Office', 2, 3)
+        >>> parsed = parse_file_name("Show_1x02.mkv")
+        >>> parsed.title, parsed.season, parsed.episode
+        ('Show', 1, 2)
+        >>> parsed = parse_file_name("Show.S01E02-720p.mkv")
+        >>> parsed.episode, parsed.episode_end, parsed.resolution, parsed.release_group
+        (2, None, '720p', '')
+        >>> parsed = parse_file_name("Show.S01E02-03.1080i.mkv")
+        >>> parsed.episode, parsed.episode_end, parsed.resolution
+        (2, 3, '1080i')
+        >>> parsed = parse_file_name("Show/Season 1/S01E01.mkv")
+        >>> parsed.title, parsed.season, parsed.episode
+        ('Show', 1, 1)
+
+    Args:
+        file_name (str): File name or full path, the folders only give the title of episodes
+            named after their episode marker
+
+    Returns:
+        models.ParsedName: Parsed values, None / empty when not present in the name
+    """
+    name = os.path.splitext(os.path.basename(file_name))[0]
+
+    season, episode, episode_end = None, None, None
+    episode_match = EPISODE_PATTERN.search(name) or CROSS_EPISODE_PATTERN.search(name)
+    if episode_match:
+        season, episode = int(episode_match.group(1)), int(episode_match.group(2))
+        if episode_match.group(3) is not None:
+            episode_end = int(episode_match.group(3))
+
+    # Everything after the episode marker is the episode title or release info
+    title_part = name[: episode_match.start()] if episode_match and episode_match.start() > 0 else name
+    title = _parse_title(title_part, file_name)
+    # 'S01E01.mkv' has no title of its own
+    if not title or (episode_match and episode_match.start() == 0):
+        title = _folder_title(file_name) or title
+
+    # The last plausible year wins, so '2001.A.Space.Odyssey.1968' gives 1968
+    max_year = datetime.date.today().year + 1
+    years = [int(year) for year in YEAR_PATTERN.findall(name) if int(year) <= max_year]
+    # A lone year that is the whole title ('1917.1080p') is not a release year
+    year = years[-1] if years and not (len(years) == 1 and title == str(years[0])) else None
+
+    resolution_match = RESOLUTION_PATTERN.search(name)
+    # Searched after the episode marker, so 'S01E02-E03' is not read as group 'E03'
+    release_group_match = RELEASE_GROUP_PATTERN.search(name[episode_match.end():] if episode_match else name)
+    # 'Show.S01E02-720p' ends on its resolution, not a group
+    if release_group_match and RESOLUTION_PATTERN.fullmatch(release_group_match.group(1)):
+        release_group_match = None
+
+    return models.ParsedName(
+        title=title,
+        year=year,
+        season=season,
+        episode=episode,
+        episode_end=episode_end,
+        resolution=resolution_match.group(1).lower() if resolution_match else "",
+        release_group=release_group_match.group(1) if release_group_match else "",
+    )
+
+
+def parse_file_names(file_names: list[str]) -> dict[str, models.ParsedName]:
+    """Parses a batch of file names
+
+    Args:
+        file_names (list[str]): File names or full paths
+
+    Returns:
+        dict[str, models.ParsedName]: File name -> parse result
+    """
+    return {file_name: parse_file_name(file_name) for file_name in file_names}
+
+
+def _has_episode_marker(file_name: str) -> bool:
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    return bool(EPISODE_PATTERN.search(name) or CROSS_EPISODE_PATTERN.search(name))
+
+
+def backfill_parsed_names() -> int:
+    """Parses the videos indexed before parse results were stored, in one batch
+
+    Episodes an older parser missed ('The_Office_S02E03') or gave a range ending at their resolution
+    ('S01E02-720p') are parsed again, and queued for enrichment so they are looked up as episodes.
+
+    Returns:
+        int: Number of videos updated
+    """
+    paths = queries.get_video_paths_without_parsed_name()
+    if paths:
+        queries.update_parsed_names(parse_file_names(paths))
+        logger.info("Stored parsed file names for %d videos", len(paths))
+
+    # A genuine range past episode 99 parses the same again, it is left alone
+    reparsed = {
+        path: parsed_name
+        for path, parsed_name in parse_file_names(
+            [path for path in queries.get_video_paths_parsed_as_movies() if _has_episode_marker(path)]
+        ).items()
+        if parsed_name.is_episode and (parsed_name.episode_end or 0) < 100
+    }
+    if reparsed:
+        queries.update_parsed_names(reparsed)
+        queries.enqueue_enrichment_tasks(list(reparsed), 0, time.time())
+        logger.info("Parsed the file names of %d episodes again", len(reparsed))
+    return len(paths) + len(reparsed)
@@ -0,0 +1,516 @@
+"""Indexer daemon, keeps the scanning, the TMDB lookups and their database writes out of the GUI.
+
+The daemon ('python main.py indexer-daemon') runs the first scan of every source,
+the library watchers, the scheduled scans, the enrichment worker and the seek
+preview extraction. The GUI starts and supervises it with 'IndexerClient', they
+talk over a Unix socket, one JSON object per line:
+    GUI -> daemon: {"op": "ping"}, {"op": "prioritize", "path": ...},
+                   {"op": "playback", "active": true}, {"op": "sources_changed"}
+    daemon -> GUI: {"event": "status", "initial_scan_done": false},
+                   {"event": "library_changed"},
+                   {"event": "pong", "busy": {"path": ..., "step": "probe", "secs": 12.5}}
+
+A MediaInfo or OpenCV crash on a corrupt file only takes down the daemon. The
+client starts it again, waiting longer after every crash, and the scan journal
+resumes the interrupted files. A hang does not stop the daemon from answering
+pings, so every pong carries the oldest probe or screenshot still running and
+the client restarts a daemon stuck on one for too long. Either way the journal
+counts a crash against the file, and quarantines a file that keeps crashing.
+The GUI only reads the database.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import threading
+import subprocess
+
+from functools import partial
+from typing import Callable
+
+from utils import library_sources, scan_journal
+from utils.database import queries
+from utils.config_service import ConfigService
+from utils.enrichment import EnrichmentWorker
+from utils.library_watcher import LibraryWatcher
+from utils.peer_cache import PeerCacheServer
+from utils.task_scheduler import TaskScheduler, RESOURCE_DISK, PRIORITY_INTERACTIVE
+from utils.trickplay import schedule_trickplay
+from utils.video_metadata_reader import VideoMetadataReader
+
+_MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+# How often the daemon checks that the GUI which started it is still running
+_PARENT_CHECK_SECS = 2
+# How long the client waits for a freshly started daemon to listen
+_CONNECT_TIMEOUT_SECS = 30
+
+logger = logging.getLogger(__name__)
+
+
+def is_supported() -> bool:
+    """Unix sockets are missing on Windows before Python 3.11 and on some builds"""
+    return hasattr(socket, "AF_UNIX") and hasattr(asyncio, "start_unix_server")
+
+
+def is_enabled() -> bool:
+    """Indicates whether the GUI leaves its indexing to the daemon
+
+    The daemon only replaces indexing in the GUI, it is not used when a headless
+    scan fills the database ('ScanInUi: false').
+    """
+    return (
+        ConfigService.get("indexer_daemon_config.yaml")["Enabled"]
+        and ConfigService.get("library_sources_config.yaml")["ScanInUi"]
+        and is_supported()
+    )
+
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+
+class IndexerDaemon:
+    """Owns every indexing task and pushes a notification to the connected GUIs when the library changed"""
+
+    def __init__(self, socket_path: str, parent_pid: int | None = None) -> None:
+        """
+        Args:
+            socket_path (str): Unix socket to listen on, a stale one left by a crash is replaced
+            parent_pid (int, optional): Exit once this process (the GUI) is gone. Defaults to running until interrupted.
+        """
+        self._socket_path = socket_path
+        self._parent_pid = parent_pid
+        self._config = ConfigService.get("indexer_daemon_config.yaml")
+        self._sources_config = ConfigService.get("library_sources_config.yaml")
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._notify_pending = False
+        self._initial_scan_done = False
+
+        self._watchers_lock = threading.Lock()
+        self._library_watchers: dict[int, LibraryWatcher] = {}
+
+    def run(self) -> None:
+        """Serves until interrupted or until the GUI exits"""
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stop_work()
+            self._exit_if_stuck()
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+        server = await asyncio.start_unix_server(self._handle_connection, path=self._socket_path)
+        logger.info("Indexer daemon listening on %s", self._socket_path)
+
+        # Other nodes on the LAN ask this one about the files it indexed
+        peer_cache_config = ConfigService.get("peer_cache_config.yaml")
+        if peer_cache_config["Serve"]:
+            try:
+                await PeerCacheServer(peer_cache_config["Host"], peer_cache_config["Port"]).start()
+            except OSError as exception:
+                logger.warning("Could not start the peer cache: %s", exception)
+
+        EnrichmentWorker.start(on_enriched=self._library_changed)
+
+        # Reconcile every source once, then keep them current with watchers and scheduled scans
+        initial_scan = TaskScheduler.submit(
+            partial(self._scan, only_due=False),
+            resource=RESOURCE_DISK,
+            priority=PRIORITY_INTERACTIVE,
+            name="library-scan",
+        )
+        initial_scan.add_done_callback(lambda _: self._call_soon(self._on_initial_scan_done))
+        await asyncio.to_thread(self._start_library_watchers)
+        await asyncio.to_thread(
+            lambda: schedule_trickplay([metadata.full_path for metadata in queries.get_all_videos()])
+        )
+
+        # Stopped by the client on exit, the running tasks get to their next checkpoint
+        terminated = asyncio.Event()
+        self._loop.add_signal_handler(signal.SIGTERM, terminated.set)
+        background_tasks = [asyncio.create_task(self._schedule_loop()), asyncio.create_task(terminated.wait())]
+        if self._parent_pid is not None:
+            background_tasks.append(asyncio.create_task(self._watch_parent()))
+
+        try:
+            async with server:
+                await asyncio.wait(background_tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            if os.path.exists(self._socket_path):
+                os.remove(self._socket_path)
+
+    def _stop_work(self) -> None:
+        EnrichmentWorker.stop()
+        TaskScheduler.shutdown()
+        with self._watchers_lock:
+            for library_watcher in self._library_watchers.values():
+                library_watcher.stop()
+            self._library_watchers.clear()
+
+    def _exit_if_stuck(self) -> None:
+        """Exits right away while native code still runs, it never reaches a checkpoint and exiting would wait on it
+
+        A step that ran past 'MaxStepSecs' keeps its journal marker and counts as a crash
+        of the file, one merely interrupted by the exit (e.g. a slow probe when the GUI closes) does not.
+        """
+        running = scan_journal.longest_attempt()
+        if running is None:
+            return
+        full_path, step, running_secs = running
+        logger.warning("Exiting while the %s of %s still runs, for %.0fs", step, full_path, running_secs)
+        if running_secs < self._config["MaxStepSecs"]:
+            queries.end_scan_journal_attempt(full_path)
+        logging.shutdown()
+        os._exit(1)
+
+    async def _schedule_loop(self) -> None:
+        """Scans the sources whose schedule elapsed and watches the sources added since the last check"""
+        while True:
+            await asyncio.sleep(self._sources_config["ScheduleCheckMins"] * 60)
+            await self._check_sources()
+
+    async def _check_sources(self) -> None:
+        await asyncio.to_thread(self._start_library_watchers)
+        TaskScheduler.submit(
+            partial(self._scan, only_due=True), resource=RESOURCE_DISK, name="scheduled-scan", key="scheduled-scan"
+        )
+
+    async def _watch_parent(self) -> None:
+        """Returns once the GUI that started the daemon exited, the daemon is reparented then"""
+        while os.getppid() == self._parent_pid:
+            await asyncio.sleep(_PARENT_CHECK_SECS)
+        logger.info("GUI process %d exited, stopping the indexer daemon", self._parent_pid)
+
+    def _scan(self, only_due: bool) -> None:
+        if library_sources.scan_sources(only_due=only_due):
+            EnrichmentWorker.wake()
+            self._library_changed()
+
+    def _start_library_watchers(self) -> None:
+        """Starts a watcher for every source that does not have one yet (e.g. newly added sources)"""
+        with self._watchers_lock:
+            for source in queries.get_sources():
+                if source.id in self._library_watchers:
+                    continue
+
+                metadata_reader = VideoMetadataReader(source)
+                library_watcher = LibraryWatcher(
+                    source.path,
+                    metadata_reader.accepted_extensions,
+                    partial(self._on_library_change, metadata_reader),
+                )
+                library_watcher.start()
+                self._library_watchers[source.id] = library_watcher
+
+    def _on_library_change(self, metadata_reader: VideoMetadataReader, added: list[str], removed: list[str]) -> None:
+        """Called from the watcher thread, queues indexing of only the changed files"""
+
+        def _update() -> None:
+            metadata_reader.update_paths(added, removed)
+            EnrichmentWorker.wake()
+            self._library_changed()
+
+        TaskScheduler.submit(_update, resource=RESOURCE_DISK, name="library-change")
+
+    def _call_soon(self, callback: Callable[[], None]) -> None:
+        """Runs a callback on the event loop from any thread, tasks finishing after shutdown are ignored"""
+        try:
+            self._loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            pass
+
+    def _library_changed(self) -> None:
+        """Called from any thread after the library was written, notifies the GUIs once per burst of changes"""
+        self._call_soon(self._schedule_notify)
+
+    def _schedule_notify(self) -> None:
+        if self._notify_pending:
+            return
+        self._notify_pending = True
+        self._loop.call_later(self._config["NotifyDelaySecs"], self._notify)
+
+    def _notify(self) -> None:
+        self._notify_pending = False
+        self._broadcast({"event": "library_changed"})
+        # Seek previews of the new files, videos already queued are skipped
+        self._loop.run_in_executor(
+            None, lambda: schedule_trickplay([metadata.full_path for metadata in queries.get_all_videos()])
+        )
+
+    def _on_initial_scan_done(self) -> None:
+        self._initial_scan_done = True
+        self._broadcast({"event": "status", "initial_scan_done": True})
+        self._schedule_notify()
+
+    def _broadcast(self, message: dict) -> None:
+        data = _encode(message)
+        for writer in list(self._writers):
+            if writer.is_closing():
+                self._writers.discard(writer)
+            else:
+                writer.write(data)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        writer.write(_encode({"event": "status", "initial_scan_done": self._initial_scan_done}))
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    await self._handle_request(request, writer)
+                except (ValueError, KeyError, TypeError) as exception:
+                    logger.warning("Ignoring malformed indexer request %r: %s", line[:200], exception)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, request: dict, writer: asyncio.StreamWriter) -> None:
+        operation = request["op"]
+        if operation == "ping":
+            pong = {"event": "pong"}
+            running = scan_journal.longest_attempt()
+            if running is not None:
+                pong["busy"] = dict(zip(("path", "step", "secs"), running))
+            writer.write(_encode(pong))
+        elif operation == "prioritize":
+            await asyncio.to_thread(EnrichmentWorker.prioritize, request["path"])
+        elif operation == "playback":
+            TaskScheduler.set_playback_active(bool(request["active"]))
+        elif operation == "sources_changed":
+            await self._check_sources()
+        else:
+            raise ValueError(f"Unknown operation {operation}")
+
+
+class IndexerClient:
+    """Singleton handle of the GUI on the indexer daemon, which it starts and restarts when it dies or hangs
+
+    The requests are fire and forget, a request sent while the daemon restarts is
+    dropped, except the playback state which is sent again to the new daemon.
+    """
+
+    _lock = threading.Lock()
+    _stop_event = threading.Event()
+    _initial_scan_done = threading.Event()
+    _thread: threading.Thread | None = None
+    _process: subprocess.Popen | None = None
+    _sock: socket.socket | None = None
+    _on_library_changed: Callable[[], None] | None = None
+    _playback_active = False
+
+    @classmethod
+    def start(cls, on_library_changed: Callable[[], None] | None = None) -> bool:
+        """Starts the daemon and its supervisor thread, if not already running
+
+        Args:
+            on_library_changed (Callable, optional): Called from the supervisor thread after the daemon changed the library
+
+        Returns:
+            bool: False if the daemon is disabled or unsupported here, the caller indexes in its own process then
+        """
+        if not is_enabled():
+            if not is_supported():
+                logger.warning("Unix sockets are not available, indexing in the GUI process")
+            return False
+
+        cls._on_library_changed = on_library_changed
+        if cls._thread is not None and cls._thread.is_alive():
+            return True
+
+        cls._stop_event.clear()
+        cls._thread = threading.Thread(target=cls._supervise, name="indexer-client", daemon=True)
+        cls._thread.start()
+        return True
+
+    @classmethod
+    def stop(cls) -> None:
+        """Stops the daemon, it also exits by itself when the GUI process is gone"""
+        cls._stop_event.set()
+        with cls._lock:
+            if cls._sock is not None:
+                try:
+                    cls._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if cls._thread is not None:
+            cls._thread.join(timeout=5)
+
+    @classmethod
+    def wait_for_initial_scan(cls, timeout: float) -> bool:
+        """Blocks until the daemon reconciled every source once, e.g. when a new library has nothing to browse yet
+
+        Args:
+            timeout (float): Seconds to wait at most, a daemon stuck or crashing on the first scan does not block the caller
+
+        Returns:
+            bool: True if the first scan finished in time
+        """
+        deadline = time.monotonic() + timeout
+        while not cls._stop_event.is_set() and not cls._initial_scan_done.wait(1):
+            if time.monotonic() >= deadline:
+                logger.warning("The first library scan did not finish in %.0fs, not waiting for it", timeout)
+                return False
+        return cls._initial_scan_done.is_set()
+
+    @classmethod
+    def prioritize(cls, video_path: str) -> None:
+        """Moves a queued video to the front of the enrichment queue, e.g. when it is selected in the browser
+
+        Args:
+            video_path (str): Full path to the video file
+        """
+        cls._send({"op": "prioritize", "path": video_path})
+
+    @classmethod
+    def set_playback_active(cls, active: bool) -> None:
+        """Throttles the daemon's background tasks while a title plays, like TaskScheduler.set_playback_active
+
+        Args:
+            active (bool): True when playback starts, False when it ends
+        """
+        cls._playback_active = active
+        cls._send({"op": "playback", "active": active})
+
+    @classmethod
+    def sources_changed(cls) -> None:
+        """Watches and scans the sources added since the last scheduled check right away"""
+        cls._send({"op": "sources_changed"})
+
+    @classmethod
+    def _send(cls, message: dict) -> bool:
+        with cls._lock:
+            if cls._sock is None:
+                return False
+            try:
+                cls._sock.sendall(_encode(message))
+            except OSError as exception:
+                logger.debug("Could not reach the indexer daemon: %s", exception)
+                return False
+        return True
+
+    @classmethod
+    def _supervise(cls) -> None:
+        config = ConfigService.get("indexer_daemon_config.yaml")
+        restart_delay = config["RestartDelaySecs"]
+        while not cls._stop_event.is_set():
+            started_at = time.monotonic()
+            cls._process = subprocess.Popen(  # pylint: disable=consider-using-with
+                [
+                    sys.executable,
+                    _MAIN_SCRIPT,
+                    "indexer-daemon",
+                    "--socket",
+                    config["SocketPath"],
+                    "--parent-pid",
+                    str(os.getpid()),
+                ]
+            )
+            logger.info("Started the indexer daemon, pid %d", cls._process.pid)
+
+            sock = cls._connect(config["SocketPath"])
+            if sock is not None:
+                cls._read_events(sock, config["HeartbeatSecs"], config["MaxStepSecs"])
+            cls._terminate()
+            if cls._stop_event.is_set():
+                break
+
+            if time.monotonic() - started_at > config["StableSecs"]:
+                restart_delay = config["RestartDelaySecs"]
+            logger.warning(
+                "Indexer daemon exited with %s, restarting it in %.0fs", cls._process.returncode, restart_delay
+            )
+            cls._stop_event.wait(restart_delay)
+            restart_delay = min(restart_delay * 2, config["MaxRestartDelaySecs"])
+
+    @classmethod
+    def _connect(cls, socket_path: str) -> socket.socket | None:
+        """Waits for the new daemon to listen, None if it exited or never did"""
+        deadline = time.monotonic() + _CONNECT_TIMEOUT_SECS
+        while time.monotonic() < deadline and cls._process.poll() is None and not cls._stop_event.is_set():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(socket_path)
+            except OSError:
+                sock.close()
+                time.sleep(0.1)
+                continue
+
+            with cls._lock:
+                cls._sock = sock
+            if cls._playback_active:
+                cls._send({"op": "playback", "active": True})
+            return sock
+        return None
+
+    @classmethod
+    def _read_events(cls, sock: socket.socket, heartbeat_secs: float, max_step_secs: float) -> None:
+        """Dispatches the daemon's events until it disconnects, misses three pings or hangs on a file"""
+        sock.settimeout(heartbeat_secs)
+        buffer = b""
+        last_heard_at = time.monotonic()
+        while not cls._stop_event.is_set():
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                if time.monotonic() - last_heard_at > heartbeat_secs * 3:
+                    logger.warning("Indexer daemon stopped answering, restarting it")
+                    return
+                cls._send({"op": "ping"})
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+
+            last_heard_at = time.monotonic()
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                event = json.loads(line)
+                busy = event.get("busy")
+                if busy is not None and busy["secs"] > max_step_secs:
+                    logger.warning(
+                        "Indexer daemon is stuck on the %s of %s for %.0fs, restarting it",
+                        busy["step"],
+                        busy["path"],
+                        busy["secs"],
+                    )
+                    return
+                cls._dispatch(event)
+
+    @classmethod
+    def _dispatch(cls, event: dict) -> None:
+        if event["event"] == "status":
+            if event["initial_scan_done"]:
+                cls._initial_scan_done.set()
+        elif event["event"] == "library_changed" and cls._on_library_changed is not None:
+            cls._on_library_changed()
+
+    @classmethod
+    def _terminate(cls) -> None:
+        with cls._lock:
+            if cls._sock is not None:
+                cls._sock.close()
+                cls._sock = None
+        if cls._process.poll() is None:
+            cls._process.terminate()
+            try:
+                cls._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                cls._process.kill()
+                cls._process.wait()
@@ -0,0 +1,426 @@
+"""Columnar in-memory catalog of the library, for sorting, filtering and grouping in the browser.
+
+Every video is one row of a few NumPy columns: title rank, year, runtime in ms,
+genre bitmask, language code, added time, watch state, version group, file size
+and, for episodes, show, season and episode. A sort is one np.lexsort over those columns, a filter is a boolean mask and
+grouping is a stable sort on the group column, so re-sorting tens of thousands of
+titles takes milliseconds and no list of VideoMetadata is rebuilt until the
+visible rows are picked. Rows are updated in place from the 'library_change' and
+'watch_change' feeds of the database, only the paths that changed are read again.
+"""
+import os
+import logging
+
+import numpy as np
+
+from utils import metrics
+from utils.database import queries, models
+from utils.tmdb_id_index import normalize_title
+
+WATCH_UNWATCHED = 0
+WATCH_IN_PROGRESS = 1
+WATCH_WATCHED = 2
+
+SORT_KEYS = ("title", "year", "runtime", "added", "language", "watch_state")
+GROUP_KEYS = ("version", "title", "year", "language", "watch_state")
+
+_INITIAL_ROWS = 256
+# Genres beyond the 64 bits of the mask are not filterable, TMDB has about twenty
+_MAX_GENRES = 64
+
+_COLUMNS = {
+    "title_rank": np.int32,
+    "year": np.int16,
+    "runtime_ms": np.int64,
+    "genres": np.uint64,
+    "language": np.int16,
+    "added_at": np.float64,
+    "watch_state": np.int8,
+    "group": np.int64,  # Version group, -1 for a file without versions
+    "size": np.int64,
+    "show": np.int64,  # Show of an episode, -1 for movies
+    "season": np.int16,
+    "episode": np.int32,
+}
+# Sort key -> column, the title is the tie breaker of every sort
+_SORT_COLUMNS = {
+    "year": "year",
+    "runtime": "runtime_ms",
+    "added": "added_at",
+    "language": "language",
+    "watch_state": "watch_state",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _grow(array: np.ndarray, rows: int) -> np.ndarray:
+    """Returns a zero padded copy of 'array' with at least 'rows' rows, sizes doubling"""
+    new_rows = len(array)
+    while new_rows < rows:
+        new_rows *= 2
+    if new_rows == len(array):
+        return array
+    grown = np.zeros(new_rows, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _title_key(metadata: models.VideoMetadata) -> str:
+    """Sort key of a title, accent and case insensitive, episodes in season / episode order"""
+    title = metadata.get_gui_title() if metadata.tmdb_title else os.path.basename(metadata.full_path)
+    return normalize_title(title)
+
+
+def _year(metadata: models.VideoMetadata) -> int:
+    year = (metadata.tmdb_year or "")[:4]
+    if year.isdigit():
+        return int(year)
+    if metadata.parsed_name is not None and metadata.parsed_name.year:
+        return metadata.parsed_name.year
+    return 0
+
+
+def _runtime_ms(length: str) -> int:
+    """Milliseconds of a '%H:%M:%S.%f' length, 0 if unknown"""
+    try:
+        hours, minutes, seconds = length.split(":")
+        return round((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+    except (AttributeError, ValueError):
+        return 0
+
+
+def _watch_state(row: models.CatalogRow) -> int:
+    if row.in_progress:
+        return WATCH_IN_PROGRESS
+    return WATCH_WATCHED if row.watched else WATCH_UNWATCHED
+
+
+class LibraryCatalog:
+    """Columns of the browsable fields of every video, kept in line with the database by 'sync'
+
+    Row numbers are only valid until the next 'sync', which moves rows around.
+    """
+
+    def __init__(self) -> None:
+        self._columns = {name: np.zeros(_INITIAL_ROWS, dtype=dtype) for name, dtype in _COLUMNS.items()}
+        self._videos: list[models.VideoMetadata] = []
+        self._rows: dict[str, int] = {}
+        self._title_keys: list[str] = []
+        self._titles_changed = False
+
+        self._genre_bits: dict[str, int] = {}
+        self._languages: dict[str, int] = {}
+
+        # Last change of each database feed already applied, None before the first sync
+        self._library_seq: int | None = None
+        self._watch_seq: int | None = None
+
+    def __len__(self) -> int:
+        return len(self._videos)
+
+    def __contains__(self, full_path: str) -> bool:
+        return full_path in self._rows
+
+    def sync(self) -> bool:
+        """Applies the changes made to the database since the last sync, the first one loads every video
+
+        Returns:
+            bool: True if any row was added, updated or removed
+        """
+        with metrics.timer("catalog.sync"):
+            if self._library_seq is None:
+                # Read first, a change made during the load is applied again by the next sync
+                self._library_seq, self._watch_seq = queries.get_change_seqs()
+                catalog_rows = queries.get_catalog_rows()
+                self._upsert(catalog_rows)
+                logger.debug("Catalog loaded %d videos", len(self._videos))
+                return bool(catalog_rows)
+
+            self._library_seq, library_paths = queries.get_library_changes(self._library_seq)
+            self._watch_seq, watch_paths = queries.get_watch_changes(self._watch_seq)
+            # Watch state of paths without a video, e.g. played from elsewhere, is irrelevant
+            changed = set(library_paths) | {path for path in watch_paths if path in self._rows}
+            if not changed:
+                return False
+
+            catalog_rows = queries.get_catalog_rows(sorted(changed))
+            found = {row.metadata.full_path for row in catalog_rows}
+            self._remove([path for path in changed if path not in found])
+            self._upsert(catalog_rows)
+        logger.debug("Catalog applied %d changes, holds %d videos", len(changed), len(self._videos))
+        return True
+
+    def _upsert(self, catalog_rows: list[models.CatalogRow]) -> None:
+        needed = len(self._videos) + len(catalog_rows)
+        for name, column in self._columns.items():
+            self._columns[name] = _grow(column, needed)
+
+        for catalog_row in catalog_rows:
+            metadata = catalog_row.metadata
+            row = self._rows.get(metadata.full_path)
+            if row is None:
+                row = len(self._videos)
+                self._rows[metadata.full_path] = row
+                self._videos.append(metadata)
+                self._title_keys.append("")
+            else:
+                self._videos[row] = metadata
+
+            title_key = _title_key(metadata)
+            if title_key != self._title_keys[row]:
+                self._title_keys[row] = title_key
+                self._titles_changed = True
+
+            language = metadata.language.strip().lower()
+            self._columns["year"][row] = _year(metadata)
+            self._columns["runtime_ms"][row] = _runtime_ms(metadata.length)
+            self._columns["genres"][row] = self._genre_mask(metadata.tmdb_genres)
+            self._columns["language"][row] = self._languages.setdefault(language, len(self._languages))
+            self._columns["added_at"][row] = catalog_row.added_at or 0.0
+            self._columns["watch_state"][row] = _watch_state(catalog_row)
+            self._columns["group"][row] = catalog_row.group_id if catalog_row.group_id is not None else -1
+            self._columns["size"][row] = catalog_row.size or 0
+            parsed_name = metadata.parsed_name
+            is_episode = catalog_row.show_id is not None and parsed_name is not None and parsed_name.is_episode
+            self._columns["show"][row] = catalog_row.show_id if is_episode else -1
+            self._columns["season"][row] = parsed_name.season if is_episode else -1
+            self._columns["episode"][row] = parsed_name.episode if is_episode else -1
+
+    def _remove(self, full_paths: list[str]) -> None:
+        for full_path in full_paths:
+            row = self._rows.pop(full_path, None)
+            if row is None:
+                continue
+
+            # The last row takes the free slot, so the used rows stay contiguous
+            last = len(self._videos) - 1
+            last_video = self._videos.pop()
+            last_title_key = self._title_keys.pop()
+            if row != last:
+                self._videos[row] = last_video
+                self._title_keys[row] = last_title_key
+                self._rows[last_video.full_path] = row
+                # Ranks move with their row, gaps left in them do not change the order
+                for column in self._columns.values():
+                    column[row] = column[last]
+
+    def _genre_mask(self, genres: list[str]) -> int:
+        mask = 0
+        for genre in genres:
+            genre = genre.strip().lower()
+            if not genre:
+                continue
+            bit = self._genre_bits.get(genre)
+            if bit is None:
+                if len(self._genre_bits) == _MAX_GENRES:
+                    logger.warning("More than %d genres, '%s' cannot be filtered on", _MAX_GENRES, genre)
+                    continue
+                bit = self._genre_bits[genre] = len(self._genre_bits)
+            mask |= 1 << bit
+        return mask
+
+    def _column(self, name: str) -> np.ndarray:
+        """Used part of a column, the title ranks are computed again after titles changed"""
+        if name == "title_rank" and self._titles_changed:
+            # Equal titles share a rank, so ties fall back on the order of the rows given
+            _, ranks = np.unique(np.array(self._title_keys, dtype=str), return_inverse=True)
+            self._columns["title_rank"][:len(ranks)] = ranks
+            self._titles_changed = False
+        return self._columns[name][:len(self._videos)]
+
+    def all_rows(self) -> np.ndarray:
+        """Every row, in no particular order"""
+        return np.arange(len(self._videos))
+
+    def filter(
+        self,
+        rows: np.ndarray | None = None,
+        genres: list[str] | None = None,
+        languages: list[str] | None = None,
+        years: tuple[int, int] | None = None,
+        max_runtime_mins: int | None = None,
+        watch_states: list[int] | None = None,
+    ) -> np.ndarray:
+        """Returns the rows matching every given criterion, keeping their order
+
+        Args:
+            rows (np.ndarray, optional): Rows to filter, e.g. the result of 'sort'. Defaults to every row.
+            genres (list[str], optional): Keep titles with any of these genres
+            languages (list[str], optional): Keep titles in any of these languages, e.g. ['english']
+            years (tuple[int, int], optional): Keep titles released in this inclusive range
+            max_runtime_mins (int, optional): Keep titles no longer than this
+            watch_states (list[int], optional): Keep titles in any of these WATCH_* states
+
+        Returns:
+            np.ndarray: Matching rows
+        """
+        rows = self.all_rows() if rows is None else rows
+        with metrics.timer("catalog.filter"):
+            mask = np.ones(len(rows), dtype=bool)
+            if genres is not None:
+                bits = [self._genre_bits[genre.lower()] for genre in genres if genre.lower() in self._genre_bits]
+                wanted = np.uint64(sum(1 << bit for bit in bits))
+                mask &= (self._column("genres")[rows] & wanted) != 0
+            if languages is not None:
+                codes = [
+                    self._languages[language.lower()] for language in languages if language.lower() in self._languages
+                ]
+                mask &= np.isin(self._column("language")[rows], codes)
+            if years is not None:
+                year = self._column("year")[rows]
+                mask &= (year >= years[0]) & (year <= years[1])
+            if max_runtime_mins is not None:
+                mask &= self._column("runtime_ms")[rows] <= max_runtime_mins * 60_000
+            if watch_states is not None:
+                mask &= np.isin(self._column("watch_state")[rows], watch_states)
+            return rows[mask]
+
+    def sort(self, key: str = "title", descending: bool = False, rows: np.ndarray | None = None) -> np.ndarray:
+        """Returns rows ordered by a SORT_KEYS field, ties ordered by title
+
+        Args:
+            key (str, optional): One of SORT_KEYS. Defaults to "title".
+            descending (bool, optional): Largest (or last alphabetically) first. Defaults to False.
+            rows (np.ndarray, optional): Rows to sort, e.g. the result of 'filter'. Defaults to every row.
+
+        Raises:
+            ValueError: If the key is not one of SORT_KEYS
+
+        Returns:
+            np.ndarray: Sorted rows
+        """
+        if key not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key {key}, expected one of {', '.join(SORT_KEYS)}")
+        rows = self.all_rows() if rows is None else rows
+
+        with metrics.timer("catalog.sort"):
+            title_ranks = self._column("title_rank")[rows]
+            if key == "title":
+                primary = title_ranks
+            elif key == "language":
+                # Codes are given in order of appearance, sort by the language names
+                names = sorted(self._languages, key=self._languages.__getitem__)
+                name_ranks = np.argsort(np.argsort(np.array(names, dtype=str)))
+                primary = name_ranks[self._column("language")[rows]] if names else title_ranks
+            else:
+                primary = self._column(_SORT_COLUMNS[key])[rows]
+            if descending:
+                primary = -primary.astype(np.float64)
+            return rows[np.lexsort((title_ranks, primary))]
+
+    def _group_keys(self, key: str, rows: np.ndarray) -> np.ndarray:
+        if key == "version":
+            groups = self._column("group")[rows]
+            # Files without versions are a group of their own
+            return np.where(groups >= 0, groups, -1 - rows)
+        if key == "title":
+            # The episodes of a show are one title, shows odd and version groups even so they never clash
+            shows = self._column("show")[rows]
+            versions = self._group_keys("version", rows)
+            return np.where(shows >= 0, shows * 2 + 1, np.where(versions >= 0, versions * 2, versions))
+        if key not in GROUP_KEYS:
+            raise ValueError(f"Unknown group key {key}, expected one of {', '.join(GROUP_KEYS)}")
+        return self._column(_SORT_COLUMNS[key])[rows]
+
+    def group(self, key: str, rows: np.ndarray | None = None) -> list[np.ndarray]:
+        """Splits rows by a GROUP_KEYS field, groups in order of their first row, rows keeping their order
+
+        Args:
+            key (str): One of GROUP_KEYS, "version" groups the files of the same title, "title" also groups
+                the episodes of a show
+            rows (np.ndarray, optional): Rows to group, e.g. the result of 'sort'. Defaults to every row.
+
+        Raises:
+            ValueError: If the key is not one of GROUP_KEYS
+
+        Returns:
+            list[np.ndarray]: Rows of every group
+        """
+        rows = self.all_rows() if rows is None else rows
+        with metrics.timer("catalog.group"):
+            keys = self._group_keys(key, rows)
+            order = np.argsort(keys, kind="stable")
+            starts = np.flatnonzero(np.diff(keys[order])) + 1
+            groups = np.split(order, starts) if len(order) else []
+            # Stable sort, so the first position of a group is its smallest one
+            firsts = order[np.concatenate(([0], starts))] if len(order) else order
+            return [rows[groups[idx]] for idx in np.argsort(firsts)]
+
+    def group_heads(self, key: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Returns the first row of every group, the same as the first rows of 'group' without splitting
+
+        Args:
+            key (str): One of GROUP_KEYS
+            rows (np.ndarray, optional): Rows to group. Defaults to every row.
+
+        Returns:
+            np.ndarray: First row of every group, in the order of 'rows'
+        """
+        rows = self.all_rows() if rows is None else rows
+        _, firsts = np.unique(self._group_keys(key, rows), return_index=True)
+        return rows[np.sort(firsts)]
+
+    def episodes(self, show_id: int, season: int | None = None) -> np.ndarray:
+        """Returns the rows of the episodes of a show, in season and episode order, specials last
+
+        The largest file comes first among the versions of an episode, so it heads its version group.
+
+        Args:
+            show_id (int): Show id
+            season (int, optional): Only the episodes of this season. Defaults to every season.
+
+        Returns:
+            np.ndarray: Episode rows
+        """
+        mask = self._column("show") == show_id
+        if season is not None:
+            mask &= self._column("season") == season
+        rows = np.flatnonzero(mask)
+        seasons = self._column("season")[rows].astype(np.int32)
+        seasons[seasons == 0] = np.iinfo(np.int32).max
+        return rows[np.lexsort((-self._column("size")[rows], self._column("episode")[rows], seasons))]
+
+    def show_id(self, full_path: str) -> int | None:
+        """Returns the show of an episode, None for movies and videos not in the catalog"""
+        row = self._rows.get(full_path)
+        if row is None or self._column("show")[row] < 0:
+            return None
+        return int(self._column("show")[row])
+
+    def versions(self, full_path: str) -> list[models.VideoMetadata]:
+        """Returns every file of the title of a video, largest file first
+
+        Args:
+            full_path (str): Full path of any version
+
+        Returns:
+            list[models.VideoMetadata]: Versions, empty if the video is not in the catalog
+        """
+        row = self._rows.get(full_path)
+        if row is None:
+            return []
+        group = self._column("group")[row]
+        if group < 0:
+            return [self._videos[row]]
+        rows = np.flatnonzero(self._column("group") == group)
+        rows = rows[np.argsort(-self._column("size")[rows], kind="stable")]
+        return self.videos(rows)
+
+    def videos(self, rows: np.ndarray | None = None) -> list[models.VideoMetadata]:
+        """Returns the videos of rows, e.g. the visible result of 'sort'
+
+        Args:
+            rows (np.ndarray, optional): Rows to return. Defaults to every row.
+
+        Returns:
+            list[models.VideoMetadata]: Videos, in the order of 'rows'
+        """
+        if rows is None:
+            return list(self._videos)
+        return [self._videos[row] for row in rows]
+
+    def watch_state(self, full_path: str) -> int | None:
+        """Returns the WATCH_* state of a video, None if it is not in the catalog"""
+        row = self._rows.get(full_path)
+        return int(self._column("watch_state")[row]) if row is not None else None
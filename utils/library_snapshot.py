@@ -0,0 +1,220 @@
+"""Portable library snapshots, to set up several kiosks from one indexed library.
+
+A snapshot is a zip archive holding 'manifest.json', the library rows in a small
+SQLite file ('library.db': sources, videos, scan state, fingerprints and audio
+analyses) and the posters and thumbnails they use. A delta snapshot only holds
+what changed since an earlier snapshot, plus the paths deleted since then, and
+can only be imported where that snapshot was imported or exported before.
+
+The media is usually mounted at another path on the importing kiosk, so paths
+are rewritten with 'OLD=NEW' prefix remaps, Windows and POSIX separators alike.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import logging
+import sqlite3
+import zipfile
+import tempfile
+import contextlib
+
+from utils.database import queries
+from utils.database.models import LibrarySnapshot
+from utils.video_metadata_reader import POSTERS_FOLDER
+from utils.thumbnails import THUMBNAILS_FOLDER, SIZES_FILE
+
+FORMAT = "cinenomad-library-snapshot"
+FORMAT_VERSION = 1
+
+_MANIFEST_NAME = "manifest.json"
+_DATABASE_NAME = "library.db"
+_POSTERS_PREFIX = "posters/"
+_THUMBNAILS_PREFIX = "thumbnails/"
+
+logger = logging.getLogger(__name__)
+
+
+def _base_name(path: str) -> str:
+    """File name of a path written on any platform"""
+    return re.split(r"[\\/]", path)[-1]
+
+
+class PathRemapper:
+    """Rewrites the paths of the exporting node, the longest matching prefix wins"""
+
+    def __init__(self, remaps: list[tuple[str, str]]) -> None:
+        """
+        Args:
+            remaps (list[tuple[str, str]]): (old prefix, new prefix) pairs, e.g. ('D:\\\\Movies', '/mnt/movies')
+        """
+        self._remaps = sorted(
+            ((old.rstrip("\\/") or old, new.rstrip("\\/") or new) for old, new in remaps),
+            key=lambda remap: -len(remap[0]),
+        )
+
+    def __call__(self, path: str | None) -> str | None:
+        if not path:
+            return path
+        for old, new in self._remaps:
+            # Only whole path components match, 'D:\Movies' is not a prefix of 'D:\MoviesOld'
+            if path == old or (path.startswith(old) and (old[-1] in "\\/" or path[len(old)] in "\\/")):
+                parts = [part for part in re.split(r"[\\/]", path[len(old):]) if part]
+                return os.path.join(new, *parts) if parts else new
+        return path
+
+
+def _write_atomically(archive: zipfile.ZipFile, member: str, destination: str) -> None:
+    with archive.open(member) as member_f, open(destination + ".tmp", "wb") as destination_f:
+        shutil.copyfileobj(member_f, destination_f)
+    os.replace(destination + ".tmp", destination)
+
+
+def export_snapshot(archive_path: str, since: str | None = None) -> dict:
+    """Writes the library, or what changed in it since an earlier snapshot, to an archive
+
+    Args:
+        archive_path (str): Zip file to write, replaced if it exists
+        since (str, optional): Id of the snapshot to export a delta against. Defaults to a full snapshot.
+
+    Raises:
+        ValueError: If the base snapshot is unknown to this node
+
+    Returns:
+        dict: Manifest of the archive
+    """
+    base = None
+    if since is not None:
+        base = queries.get_library_snapshot(since)
+        if base is None:
+            raise ValueError(f"Unknown snapshot {since}, deltas are exported against a snapshot this node knows")
+
+    work_dir = tempfile.mkdtemp(prefix="cinenomad_snapshot_")
+    try:
+        database_path = os.path.join(work_dir, _DATABASE_NAME)
+        change_seq, counts = queries.export_library_rows(database_path, base.change_seq if base else None)
+
+        with contextlib.closing(sqlite3.connect(database_path)) as snapshot_conn:
+            image_paths = {row[0] for row in snapshot_conn.execute("SELECT image_path FROM video_metadata;")}
+        posters = sorted(path for path in image_paths if path and os.path.isfile(path))
+
+        # Thumbnails are named '<poster name>_<width>x<height>.png'
+        poster_names = {os.path.splitext(os.path.basename(path))[0] for path in posters}
+        thumbnails = []
+        if os.path.isdir(THUMBNAILS_FOLDER):
+            thumbnails = sorted(
+                os.path.join(THUMBNAILS_FOLDER, name)
+                for name in os.listdir(THUMBNAILS_FOLDER)
+                if name.rsplit("_", 1)[0] in poster_names
+            )
+
+        snapshot = LibrarySnapshot(
+            id=uuid.uuid4().hex, base_id=base.id if base else None, change_seq=change_seq, created_at=time.time()
+        )
+        manifest = {
+            "format": FORMAT,
+            "version": FORMAT_VERSION,
+            "snapshot_id": snapshot.id,
+            "base_snapshot_id": snapshot.base_id,
+            "created_at": snapshot.created_at,
+            "counts": {**counts, "posters": len(posters), "thumbnails": len(thumbnails)},
+        }
+
+        # Images are compressed already, only the database is worth deflating
+        with zipfile.ZipFile(archive_path + ".tmp", "w") as archive:
+            archive.writestr(_MANIFEST_NAME, json.dumps(manifest, indent=2), zipfile.ZIP_DEFLATED)
+            archive.write(database_path, _DATABASE_NAME, zipfile.ZIP_DEFLATED)
+            for path in posters:
+                archive.write(path, _POSTERS_PREFIX + os.path.basename(path), zipfile.ZIP_STORED)
+            for path in thumbnails:
+                archive.write(path, _THUMBNAILS_PREFIX + os.path.basename(path), zipfile.ZIP_STORED)
+        os.replace(archive_path + ".tmp", archive_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    queries.insert_library_snapshot(snapshot)
+    logger.info("Exported snapshot %s to %s: %s", snapshot.id, archive_path, manifest["counts"])
+    return manifest
+
+
+def import_snapshot(archive_path: str, remaps: list[tuple[str, str]] | None = None) -> dict | None:
+    """Applies a snapshot archive to the local library
+
+    The posters and thumbnails are extracted first, then all the rows are applied in
+    one transaction, so an interrupted import leaves the library as it was (the
+    startup sweep removes the posters nothing refers to).
+
+    Args:
+        archive_path (str): Zip file written by 'export_snapshot'
+        remaps (list[tuple[str, str]], optional): (old prefix, new prefix) pairs for the video paths
+
+    Raises:
+        ValueError: If the archive is not a snapshot, is from a newer version or is a delta whose base is missing
+        OSError: If the archive cannot be read
+
+    Returns:
+        Optional[dict]: Number of rows, posters and thumbnails imported, None if the snapshot was imported before
+    """
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile as exception:
+        raise ValueError(f"Not a library snapshot: {archive_path}") from exception
+
+    with archive:
+        try:
+            manifest = json.loads(archive.read(_MANIFEST_NAME))
+        except (KeyError, ValueError) as exception:
+            raise ValueError(f"Not a library snapshot: {archive_path}") from exception
+        if manifest.get("format") != FORMAT:
+            raise ValueError(f"Not a library snapshot: {archive_path}")
+        if manifest.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"Snapshot format {manifest['version']} is newer than this version of cinenomad")
+
+        snapshot = LibrarySnapshot(
+            id=manifest["snapshot_id"],
+            base_id=manifest["base_snapshot_id"],
+            change_seq=0,
+            created_at=manifest["created_at"],
+        )
+        if queries.get_library_snapshot(snapshot.id) is not None:
+            logger.info("Snapshot %s was already imported", snapshot.id)
+            return None
+        if snapshot.base_id is not None and queries.get_library_snapshot(snapshot.base_id) is None:
+            raise ValueError(f"Snapshot {snapshot.id} is a delta of {snapshot.base_id}, import that one first")
+
+        counts = {"posters": 0, "thumbnails": 0}
+        # Thumbnails after the posters, a thumbnail older than its poster is generated again
+        for prefix, folder, name in (
+            (_POSTERS_PREFIX, POSTERS_FOLDER, "posters"),
+            (_THUMBNAILS_PREFIX, THUMBNAILS_FOLDER, "thumbnails"),
+        ):
+            os.makedirs(folder, exist_ok=True)
+            for member in archive.namelist():
+                file_name = os.path.basename(member)
+                if not member.startswith(prefix) or not file_name or member[len(prefix):] != file_name:
+                    continue
+                if os.path.join(folder, file_name) == SIZES_FILE:
+                    continue
+                _write_atomically(archive, member, os.path.join(folder, file_name))
+                counts[name] += 1
+
+        work_dir = tempfile.mkdtemp(prefix="cinenomad_snapshot_")
+        try:
+            database_path = os.path.join(work_dir, _DATABASE_NAME)
+            _write_atomically(archive, _DATABASE_NAME, database_path)
+            counts.update(
+                queries.import_library_rows(
+                    database_path,
+                    snapshot,
+                    remap_path=PathRemapper(remaps or []),
+                    poster_path=lambda path: os.path.join(POSTERS_FOLDER, _base_name(path)) if path else path,
+                    imported_at=time.time(),
+                )
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    logger.info("Imported snapshot %s from %s: %s", snapshot.id, archive_path, counts)
+    return counts
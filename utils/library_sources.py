@@ -0,0 +1,245 @@
+import os
+import time
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.config_service import ConfigService, CONFIG_CACHE_FOLDER
+from utils.task_scheduler import TaskScheduler
+from utils.library_watcher import is_network_path
+from utils.video_metadata_reader import VideoMetadataReader, POSTERS_FOLDER
+from utils.thumbnails import THUMBNAILS_FOLDER, SIZES_FILE
+from utils.trickplay import TRICKPLAY_FOLDER
+from utils.scan_journal import STAGES
+from utils.database import queries, models
+from utils.database.connection import AppDatabase
+
+logger = logging.getLogger(__name__)
+
+# Ids of the sources being scanned, so a scheduled scan never overlaps a running one
+_scanning_source_ids: set[int] = set()
+_scanning_lock = threading.Lock()
+
+
+def build_source(path: str, name: str | None = None) -> models.Source:
+    """Creates a source with the default scan and cache policy for the folder's file system
+
+    Args:
+        path (str): Library folder
+        name (str, optional): Display name. Defaults to the folder name.
+
+    Returns:
+        models.Source: Source object, not yet stored in the database
+    """
+    config = ConfigService.get("library_sources_config.yaml")
+    policy = config["NetworkSource"] if is_network_path(path) else config["LocalSource"]
+
+    return models.Source(
+        name=name or os.path.basename(os.path.normpath(path)),
+        path=os.path.normpath(path),
+        scan_interval_mins=policy["ScanIntervalMins"],
+        max_workers=policy["MaxWorkers"],
+        fingerprint_ttl_mins=policy["FingerprintTtlMins"],
+    )
+
+
+def add_source(path: str, name: str | None = None) -> models.Source | None:
+    """Validates and stores a new library source
+
+    Args:
+        path (str): Library folder
+        name (str, optional): Display name. Defaults to the folder name.
+
+    Returns:
+        Optional[models.Source]: The stored source, None if the path is invalid or already a source
+    """
+    if not os.path.isdir(path):
+        logger.warning("Cannot add movie source, %s is not a folder", path)
+        return None
+
+    source = build_source(path, name)
+    if any(existing.path == source.path for existing in queries.get_sources()):
+        logger.warning("Movie source already exists: %s", source.path)
+        return None
+
+    source.id = queries.insert_source(source)
+    logger.info("Added new movie source: %s", source.path)
+    return source
+
+
+def migrate_legacy_local_folder() -> None:
+    """Libraries configured with the 'LocalFolder' setting, before sources existed, become the first source
+
+    The videos already indexed from that folder are assigned to the source, and their scan state is seeded
+    from the files on disk, so the first scan keeps their metadata instead of indexing them again.
+    """
+    local_folder = queries.get_setting_value("LocalFolder")
+    if not local_folder:
+        return
+    if not queries.get_sources():
+        add_source(local_folder)
+
+    source = next((source for source in queries.get_sources() if source.path == os.path.normpath(local_folder)), None)
+    if source is None:
+        return
+    adopted = queries.adopt_videos_without_source(source.id, source.path)
+    if not adopted:
+        return
+
+    checked_at = time.time()
+    source_files = []
+    for path in adopted:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Gone or unreachable, the first scan sorts it out
+            continue
+        source_files.append(models.SourceFile(path, stat.st_size, stat.st_mtime_ns, checked_at))
+    queries.upsert_source_files(source.id, source_files)
+    logger.info("Assigned %d videos indexed before sources existed to source %s", len(adopted), source.name)
+
+
+def sweep_interrupted_work() -> dict[str, int]:
+    """Cleans up after work cut short by a crash or a power cut, run once at startup
+
+    Removes the temp files of interrupted writes, the journal entries (and fingerprints) of
+    files that disappeared before they were indexed, and the posters, with their thumbnails,
+    that no indexed video, show, season or journal entry refers to. Files younger than
+    'SweepMinAgeMins' are left alone, another process (e.g. a cron scan) may still be writing them.
+
+    Returns:
+        dict[str, int]: Counts of removed 'temp_files', 'journal_entries', 'posters' and 'thumbnails'
+    """
+    stats = dict.fromkeys(("temp_files", "journal_entries", "posters", "thumbnails"), 0)
+    cutoff = time.time() - ConfigService.get("library_sources_config.yaml")["SweepMinAgeMins"] * 60
+
+    def _stale_files(folder: str) -> list[os.DirEntry]:
+        if not os.path.isdir(folder):
+            return []
+        with os.scandir(folder) as entries:
+            return [entry for entry in entries if entry.is_file() and entry.stat().st_mtime < cutoff]
+
+    for folder in (POSTERS_FOLDER, THUMBNAILS_FOLDER, TRICKPLAY_FOLDER, CONFIG_CACHE_FOLDER):
+        for entry in _stale_files(folder):
+            if ".tmp" in entry.name:
+                os.remove(entry.path)
+                stats["temp_files"] += 1
+
+    # Only for reachable sources, an unmounted share does not mean the files are gone
+    source_paths = {source.id: source.path for source in queries.get_sources()}
+    journal_entries = queries.get_scan_journal_entries()
+    for journal_entry in journal_entries:
+        if STAGES.index(journal_entry.stage) >= STAGES.index("committed"):
+            continue
+        if os.path.isdir(source_paths.get(journal_entry.source_id, "")) and not os.path.exists(
+            journal_entry.full_path
+        ):
+            queries.delete_video_by_path(journal_entry.full_path)
+            stats["journal_entries"] += 1
+
+    referenced = {os.path.abspath(video.image_path) for video in queries.get_all_videos() or []}
+    referenced.update(
+        os.path.abspath(journal_entry.data["poster_path"])
+        for journal_entry in journal_entries
+        if "poster_path" in journal_entry.data
+    )
+    referenced.update(os.path.abspath(image_path) for image_path in queries.get_tv_poster_paths())
+    for entry in _stale_files(POSTERS_FOLDER):
+        if os.path.abspath(entry.path) not in referenced:
+            os.remove(entry.path)
+            stats["posters"] += 1
+
+    # Thumbnails are named '<poster name>_<width>x<height>.png'
+    if os.path.isdir(POSTERS_FOLDER):
+        poster_names = {os.path.splitext(name)[0] for name in os.listdir(POSTERS_FOLDER)}
+        for entry in _stale_files(THUMBNAILS_FOLDER):
+            if entry.path != SIZES_FILE and entry.name.rsplit("_", 1)[0] not in poster_names:
+                os.remove(entry.path)
+                stats["thumbnails"] += 1
+
+    if any(stats.values()):
+        logger.info("Cleaned up after interrupted work: %s", stats)
+    return stats
+
+
+def is_scan_due(source: models.Source, now: float | None = None) -> bool:
+    """Returns True if the source was never scanned or its scan interval elapsed
+
+    Args:
+        source (models.Source): Source to check
+        now (float, optional): Unix timestamp to compare against. Defaults to the current time.
+    """
+    if source.last_scan_at is None:
+        return True
+    now = time.time() if now is None else now
+    return now - source.last_scan_at >= source.scan_interval_mins * 60
+
+
+def scan_source(source: models.Source, index_workers: int = 1, dry_run: bool = False) -> dict[str, int]:
+    """Runs an incremental scan of one source
+
+    Args:
+        source (models.Source): Source to scan
+        index_workers (int, optional): Number of files indexed concurrently. Defaults to 1.
+        dry_run (bool, optional): Only count what would change. Defaults to False.
+
+    Returns:
+        dict[str, int]: File counts reported by VideoMetadataReader.update_metadata_db, empty if skipped
+    """
+    with _scanning_lock:
+        if source.id in _scanning_source_ids:
+            logger.info("Source %s is already being scanned", source.name)
+            return {}
+        _scanning_source_ids.add(source.id)
+
+    try:
+        started_at = time.perf_counter()
+        stats = VideoMetadataReader(source).update_metadata_db(index_workers, dry_run)
+        logger.info("Scanned source %s in %.1fs", source.name, time.perf_counter() - started_at)
+        return stats
+    finally:
+        with _scanning_lock:
+            _scanning_source_ids.discard(source.id)
+
+
+def scan_sources(
+    sources: list[models.Source] | None = None,
+    only_due: bool = True,
+    index_workers: int = 1,
+    dry_run: bool = False,
+) -> dict[int, dict[str, int]]:
+    """Scans several sources in parallel, each with its own worker pool and database connection
+
+    Args:
+        sources (list[models.Source], optional): Sources to scan. Defaults to all sources.
+        only_due (bool, optional): Skip sources whose scan interval did not elapse. Defaults to True.
+        index_workers (int, optional): Number of files indexed concurrently per source. Defaults to 1.
+        dry_run (bool, optional): Only count what would change. Defaults to False.
+
+    Returns:
+        dict[int, dict[str, int]]: Source id -> file counts, for the sources that were scanned
+    """
+    sources = queries.get_sources() if sources is None else sources
+    if only_due:
+        now = time.time()
+        sources = [source for source in sources if is_scan_due(source, now)]
+
+    if not sources:
+        return {}
+
+    def _scan_in_thread(source: models.Source) -> dict[str, int]:
+        try:
+            return scan_source(source, index_workers, dry_run)
+        finally:
+            AppDatabase.close_connection()
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="source") as executor:
+        futures = [(source, executor.submit(TaskScheduler.bind(_scan_in_thread), source)) for source in sources]
+        for source, future in futures:
+            try:
+                results[source.id] = future.result()
+            except Exception as exception:
+                logger.error("Scan of source %s failed: %s", source.name, exception)
+    return results
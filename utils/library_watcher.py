@@ -0,0 +1,256 @@
+import os
+import time
+import logging
+import platform
+import threading
+
+from typing import Callable
+
+from utils.config_service import ConfigService
+from utils.directory_scanner import get_extension
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_system_type(path: str) -> str | None:
+    """Returns the file system type of the mount that holds the given path (Linux only)
+
+    Args:
+        path (str): Any path on the mount
+
+    Returns:
+        Optional[str]: File system type as listed in /proc/mounts, e.g. 'ext4', 'nfs4'
+    """
+    real_path = os.path.realpath(path)
+    best_mount, best_type = "", None
+    try:
+        with open("/proc/mounts", encoding="utf_8") as mounts_f:
+            for line in mounts_f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+
+                # Spaces in mount points are octal escaped
+                mount_point = fields[1].replace("\\040", " ")
+                if (
+                    real_path == mount_point
+                    or real_path.startswith(os.path.join(mount_point, ""))
+                ) and len(mount_point) > len(best_mount):
+                    best_mount, best_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+
+def is_network_path(path: str) -> bool:
+    """Returns True if the path is on a network mount (see 'NetworkFileSystems' in the watcher config)
+
+    Args:
+        path (str): Any path on the mount
+
+    Returns:
+        bool: True for nfs, cifs, sshfs, ... mounts
+    """
+    config = ConfigService.get("library_watcher_config.yaml")
+    return get_file_system_type(path) in config["NetworkFileSystems"]
+
+
+class LibraryWatcher:
+    """Watches a library folder tree and reports settled changes in batches.
+
+    Uses inotify on Linux and falls back to periodic snapshots for network mounts
+    (which do not deliver inotify events for remote writes) and other platforms.
+    New files are only reported once their size stopped changing for 'SettleSeconds',
+    so files that are still being copied are not indexed half-written.
+    """
+
+    def __init__(
+        self,
+        folder_path: str,
+        accepted_extensions: list[str],
+        on_change: Callable[[list[str], list[str]], None],
+    ) -> None:
+        """
+        Args:
+            folder_path (str): Root of the tree to watch
+            accepted_extensions (list[str]): Video extensions to report, without the dot
+            on_change (Callable): Called from the watcher thread with (added, removed) path lists
+        """
+        self._folder_path = folder_path
+        self._accepted_extensions = frozenset(ext.lower() for ext in accepted_extensions)
+        self._on_change = on_change
+
+        config = ConfigService.get("library_watcher_config.yaml")
+        self._settle_seconds = config["SettleSeconds"]
+        self._poll_interval = config["PollInterval"]
+
+        # path -> (last seen size, monotonic time of the last size change)
+        self._pending_added: dict[str, tuple[int, float]] = {}
+        self._pending_removed: set[str] = set()
+        self._pending_lock = threading.Lock()
+
+        self._stop_event = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._notifier = None
+
+    @property
+    def uses_inotify(self) -> bool:
+        """True if change events come from inotify, False if the tree gets polled"""
+        if pyinotify is None or platform.system() != "Linux":
+            return False
+        return not is_network_path(self._folder_path)
+
+    def start(self) -> None:
+        """Starts watching in background threads"""
+        if not os.path.isdir(self._folder_path):
+            logger.warning("Cannot watch %s, it is not a folder", self._folder_path)
+            return
+
+        if self.uses_inotify:
+            self._start_inotify()
+        else:
+            logger.info("Polling %s every %ss for changes", self._folder_path, self._poll_interval)
+            self._threads.append(
+                threading.Thread(target=self._poll_loop, name="library-poll", daemon=True)
+            )
+
+        self._threads.append(
+            threading.Thread(target=self._settle_loop, name="library-settle", daemon=True)
+        )
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Stops all watcher threads"""
+        self._stop_event.set()
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        for thread in self._threads:
+            thread.join(timeout=self._settle_seconds + 1)
+        self._threads = []
+
+    def _is_video(self, path: str) -> bool:
+        return get_extension(path) in self._accepted_extensions
+
+    def _mark_added(self, path: str) -> None:
+        with self._pending_lock:
+            self._pending_removed.discard(path)
+            self._pending_added[path] = (-1, time.monotonic())
+
+    def _mark_removed(self, path: str) -> None:
+        with self._pending_lock:
+            self._pending_added.pop(path, None)
+            self._pending_removed.add(path)
+
+    def _mark_folder_added(self, folder_path: str) -> None:
+        """A folder moved into the tree produces a single event, its content has to be walked"""
+        for dirpath, _, filenames in os.walk(folder_path):
+            for file in filenames:
+                full_path = os.path.join(dirpath, file)
+                if self._is_video(full_path):
+                    self._mark_added(full_path)
+
+    def _start_inotify(self) -> None:
+        watcher = self
+
+        class _EventHandler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.dir:
+                    if event.mask & (pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE):
+                        watcher._mark_folder_added(event.pathname)
+                    elif event.mask & pyinotify.IN_MOVED_FROM:
+                        watcher._mark_removed(event.pathname)
+                    return
+
+                if not watcher._is_video(event.pathname):
+                    return
+                if event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+                    watcher._mark_removed(event.pathname)
+                else:
+                    watcher._mark_added(event.pathname)
+
+        mask = (
+            pyinotify.IN_CREATE
+            | pyinotify.IN_MODIFY
+            | pyinotify.IN_CLOSE_WRITE
+            | pyinotify.IN_MOVED_TO
+            | pyinotify.IN_MOVED_FROM
+            | pyinotify.IN_DELETE
+        )
+        watch_manager = pyinotify.WatchManager()
+        watch_manager.add_watch(self._folder_path, mask, rec=True, auto_add=True)
+
+        self._notifier = pyinotify.ThreadedNotifier(watch_manager, _EventHandler())
+        self._notifier.daemon = True
+        self._notifier.start()
+        logger.info("Watching %s with inotify", self._folder_path)
+
+    def _snapshot(self) -> dict[str, tuple[int, int]]:
+        """Returns {path: (size, mtime_ns)} for every video file in the tree"""
+        snapshot = {}
+        folders = [self._folder_path]
+        while folders:
+            try:
+                with os.scandir(folders.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(entry.path)
+                        elif entry.is_file() and self._is_video(entry.name):
+                            stat = entry.stat()
+                            snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError as exception:
+                logger.warning("Could not list folder while polling: %s", exception)
+        return snapshot
+
+    def _poll_loop(self) -> None:
+        previous = self._snapshot()
+        while not self._stop_event.wait(self._poll_interval):
+            current = self._snapshot()
+            for path, fingerprint in current.items():
+                if previous.get(path) != fingerprint:
+                    self._mark_added(path)
+            for path in previous.keys() - current.keys():
+                self._mark_removed(path)
+            previous = current
+
+    def _settle_loop(self) -> None:
+        """Flushes pending changes once every new file has a stable size"""
+        while not self._stop_event.wait(1):
+            now = time.monotonic()
+            settled = []
+
+            with self._pending_lock:
+                for path, (last_size, last_change) in list(self._pending_added.items()):
+                    try:
+                        size = os.path.getsize(path)
+                    except OSError:
+                        # Vanished before settling (temp files, aborted copies)
+                        del self._pending_added[path]
+                        continue
+
+                    if size != last_size:
+                        self._pending_added[path] = (size, now)
+                    elif now - last_change >= self._settle_seconds:
+                        settled.append(path)
+
+                # Wait for the whole burst to settle so it is reported as one batch
+                if len(settled) != len(self._pending_added):
+                    settled = []
+                if not settled and not self._pending_removed:
+                    continue
+
+                for path in settled:
+                    del self._pending_added[path]
+                removed = sorted(self._pending_removed)
+                self._pending_removed.clear()
+
+            try:
+                self._on_change(sorted(settled), removed)
+            except Exception:
+                logger.exception("Library change handler failed for %s", self._folder_path)
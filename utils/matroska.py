@@ -0,0 +1,258 @@
+"""Minimal Matroska (MKV / WebM) reader for the title, tags and attached files.
+
+mutagen does not read Matroska, so the few elements the metadata providers need
+are parsed here. The SeekHead at the start of the segment says where the Info,
+Tags and Attachments elements are, so only those are read and the clusters
+holding the audio and video are never touched, which matters on network shares.
+"""
+import os
+
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator
+
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_SEEK_HEAD = 0x114D9B74
+_SEEK = 0x4DBB
+_SEEK_ID = 0x53AB
+_SEEK_POSITION = 0x53AC
+_INFO = 0x1549A966
+_TITLE = 0x7BA9
+_TAGS = 0x1254C367
+_TAG = 0x7373
+_TARGETS = 0x63C0
+_TARGET_TYPE_VALUE = 0x68CA
+_SIMPLE_TAG = 0x67C8
+_TAG_NAME = 0x45A3
+_TAG_STRING = 0x4487
+_ATTACHMENTS = 0x1941A469
+_ATTACHED_FILE = 0x61A7
+_FILE_NAME = 0x466E
+_FILE_MIME_TYPE = 0x4660
+_FILE_DATA = 0x465C
+_CLUSTER = 0x1F43B675
+
+# Tags of the movie or episode itself, and of the collection it belongs to, e.g. a TV show
+_MOVIE_TARGET_TYPE = 50
+_COLLECTION_TARGET_TYPE = 70
+
+
+@dataclass(frozen=True)
+class MatroskaAttachment:
+    """File attached to a Matroska segment, its data is only read on demand"""
+
+    name: str
+    mime_type: str
+    offset: int
+    size: int
+
+
+@dataclass
+class MatroskaMetadata:
+    """Title, tags (upper case names, e.g. 'DATE_RELEASED') and attachments of a file"""
+
+    title: str = ""
+    tags: dict[str, str] = field(default_factory=dict)  # Of the movie or episode
+    collection_tags: dict[str, str] = field(default_factory=dict)  # Of the show an episode belongs to
+    attachments: list[MatroskaAttachment] = field(default_factory=list)
+
+
+def _read_vint(file: BinaryIO, keep_marker: bool) -> tuple[int, int]:
+    """Reads an EBML variable length integer, returns its value and length in bytes"""
+    first = file.read(1)
+    if not first:
+        raise EOFError("Unexpected end of Matroska file")
+    if first[0] == 0:
+        raise ValueError("Invalid EBML variable length integer")
+
+    length = 9 - first[0].bit_length()
+    data = first + file.read(length - 1)
+    if len(data) < length:
+        raise EOFError("Unexpected end of Matroska file")
+
+    value = int.from_bytes(data, "big")
+    if not keep_marker:
+        value &= (1 << (7 * length)) - 1
+    return value, length
+
+
+def _read_element_header(file: BinaryIO) -> tuple[int, int | None]:
+    """Reads an element ID and size, the size is None for elements of unknown size"""
+    element_id, _ = _read_vint(file, keep_marker=True)
+    size, length = _read_vint(file, keep_marker=False)
+    if size == (1 << (7 * length)) - 1:
+        return element_id, None
+    return element_id, size
+
+
+def _iter_children(file: BinaryIO, start: int, end: int) -> Iterator[tuple[int, int, int]]:
+    """Yields (element ID, data offset, data size) of the children in [start, end), skipping their data"""
+    position = start
+    while position < end:
+        file.seek(position)
+        try:
+            element_id, size = _read_element_header(file)
+        except EOFError:
+            return
+        data_start = file.tell()
+        if size is None:
+            # Only clusters have an unknown size in practice, nothing after them is needed
+            return
+        yield element_id, data_start, size
+        position = data_start + size
+
+
+def _read_string(file: BinaryIO, offset: int, size: int) -> str:
+    file.seek(offset)
+    return file.read(size).rstrip(b"\x00").decode("utf_8", errors="replace").strip()
+
+
+def _read_uint(file: BinaryIO, offset: int, size: int) -> int:
+    file.seek(offset)
+    return int.from_bytes(file.read(size), "big")
+
+
+def _read_tags(file: BinaryIO, offset: int, size: int, metadata: MatroskaMetadata) -> None:
+    for tag_id, tag_offset, tag_size in _iter_children(file, offset, offset + size):
+        if tag_id != _TAG:
+            continue
+
+        target_type = _MOVIE_TARGET_TYPE
+        simple_tags = []
+        for child_id, child_offset, child_size in _iter_children(file, tag_offset, tag_offset + tag_size):
+            if child_id == _TARGETS:
+                for target_id, target_offset, target_size in _iter_children(
+                    file, child_offset, child_offset + child_size
+                ):
+                    if target_id == _TARGET_TYPE_VALUE:
+                        target_type = _read_uint(file, target_offset, target_size)
+            elif child_id == _SIMPLE_TAG:
+                simple_tags.append((child_offset, child_size))
+
+        if target_type == _MOVIE_TARGET_TYPE:
+            tags = metadata.tags
+        elif target_type == _COLLECTION_TARGET_TYPE:
+            tags = metadata.collection_tags
+        else:
+            continue
+        for simple_offset, simple_size in simple_tags:
+            name, value = "", ""
+            for child_id, child_offset, child_size in _iter_children(
+                file, simple_offset, simple_offset + simple_size
+            ):
+                if child_id == _TAG_NAME:
+                    name = _read_string(file, child_offset, child_size).upper()
+                elif child_id == _TAG_STRING:
+                    value = _read_string(file, child_offset, child_size)
+            if name and value:
+                tags.setdefault(name, value)
+
+
+def _read_attachments(file: BinaryIO, offset: int, size: int, attachments: list[MatroskaAttachment]) -> None:
+    for file_id, file_offset, file_size in _iter_children(file, offset, offset + size):
+        if file_id != _ATTACHED_FILE:
+            continue
+
+        name, mime_type, data = "", "", None
+        for child_id, child_offset, child_size in _iter_children(file, file_offset, file_offset + file_size):
+            if child_id == _FILE_NAME:
+                name = _read_string(file, child_offset, child_size)
+            elif child_id == _FILE_MIME_TYPE:
+                mime_type = _read_string(file, child_offset, child_size)
+            elif child_id == _FILE_DATA:
+                data = (child_offset, child_size)
+        if data is not None:
+            attachments.append(MatroskaAttachment(name, mime_type, *data))
+
+
+def read_metadata(file_path: str) -> MatroskaMetadata:
+    """Reads the title, tags and attachment list of a Matroska file
+
+    Args:
+        file_path (str): Full path to the MKV / WebM file
+
+    Raises:
+        ValueError: If the file is not a Matroska file or is malformed
+        OSError: If the file cannot be read
+
+    Returns:
+        MatroskaMetadata: What the file holds, empty fields if it has no tags
+    """
+    metadata = MatroskaMetadata()
+    with open(file_path, "rb") as file:
+        try:
+            element_id, size = _read_element_header(file)
+            if element_id != _EBML or size is None:
+                raise ValueError(f"Not a Matroska file: {file_path}")
+            file.seek(size, os.SEEK_CUR)
+
+            element_id, size = _read_element_header(file)
+            if element_id != _SEGMENT:
+                raise ValueError(f"No segment in Matroska file: {file_path}")
+        except EOFError as exception:
+            raise ValueError(f"Truncated Matroska file: {file_path}") from exception
+
+        segment_start = file.tell()
+        file_size = os.fstat(file.fileno()).st_size
+        segment_end = min(segment_start + size, file_size) if size is not None else file_size
+
+        # Top level elements ahead of the first cluster, then whatever the SeekHead points to past it
+        found: dict[int, list[tuple[int, int]]] = {_INFO: [], _TAGS: [], _ATTACHMENTS: []}
+        seek_positions = []
+        for element_id, offset, size in _iter_children(file, segment_start, segment_end):
+            if element_id == _CLUSTER:
+                break
+            if element_id in found:
+                found[element_id].append((offset, size))
+            elif element_id == _SEEK_HEAD:
+                for seek_id, seek_offset, seek_size in _iter_children(file, offset, offset + size):
+                    if seek_id != _SEEK:
+                        continue
+                    target_id, target_position = None, None
+                    for child_id, child_offset, child_size in _iter_children(
+                        file, seek_offset, seek_offset + seek_size
+                    ):
+                        if child_id == _SEEK_ID:
+                            target_id = _read_uint(file, child_offset, child_size)
+                        elif child_id == _SEEK_POSITION:
+                            target_position = segment_start + _read_uint(file, child_offset, child_size)
+                    if target_id in found and target_position is not None:
+                        seek_positions.append((target_id, target_position))
+
+        for target_id, position in seek_positions:
+            if position >= segment_end:
+                continue
+            file.seek(position)
+            try:
+                element_id, size = _read_element_header(file)
+            except EOFError:
+                continue
+            offset = file.tell()
+            if element_id == target_id and size is not None and (offset, size) not in found[target_id]:
+                found[target_id].append((offset, size))
+
+        for offset, size in found[_INFO]:
+            for child_id, child_offset, child_size in _iter_children(file, offset, offset + size):
+                if child_id == _TITLE and not metadata.title:
+                    metadata.title = _read_string(file, child_offset, child_size)
+        for offset, size in found[_TAGS]:
+            _read_tags(file, offset, size, metadata)
+        for offset, size in found[_ATTACHMENTS]:
+            _read_attachments(file, offset, size, metadata.attachments)
+
+    return metadata
+
+
+def read_attachment(file_path: str, attachment: MatroskaAttachment) -> bytes:
+    """Reads the data of an attached file
+
+    Args:
+        file_path (str): Full path to the MKV / WebM file
+        attachment (MatroskaAttachment): Attachment listed by 'read_metadata'
+
+    Returns:
+        bytes: Content of the attached file
+    """
+    with open(file_path, "rb") as file:
+        file.seek(attachment.offset)
+        return file.read(attachment.size)
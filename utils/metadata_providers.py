@@ -0,0 +1,420 @@
+"""Local metadata sources, asked while indexing before anything goes to TMDB.
+
+Many libraries already come with Kodi style '.nfo' sidecars, tags and cover art
+embedded in the files, or 'poster.jpg' / 'folder.jpg' next to them. The
+providers listed in 'Providers' are asked in that order, cheapest first, and
+each reports how confident it is in what it found. Separately for the metadata
+and the poster, the first result at or above 'MinConfidence' wins, and the chain
+stops once both are resolved. Only what is left unresolved goes to TMDB through
+'utils.enrichment', so a well tagged library is indexed without network calls.
+"""
+import os
+import re
+import logging
+import xml.etree.ElementTree as ElementTree
+
+from dataclasses import dataclass, field
+
+import mutagen
+from mutagen.mp4 import MP4
+
+from utils import metrics, matroska
+from utils.config_service import ConfigService
+from utils.database import models
+from utils.exceptions import ConfigValidationException
+from .filename_parser import YEAR_PATTERN, RESOLUTION_PATTERN
+
+CONFIDENCE_NONE = 0
+CONFIDENCE_LOW = 1  # e.g. a title tag holding the release name, a folder.jpg shared by several movies
+CONFIDENCE_MEDIUM = 2
+CONFIDENCE_HIGH = 3  # e.g. an NFO with a title and a year, cover art embedded on purpose
+CONFIDENCE_LEVELS = {
+    "None": CONFIDENCE_NONE,
+    "Low": CONFIDENCE_LOW,
+    "Medium": CONFIDENCE_MEDIUM,
+    "High": CONFIDENCE_HIGH,
+}
+
+# Larger images are not posters, and would stall the scan on a network share
+_MAX_IMAGE_BYTES = 20 * 1024 * 1024
+_MAX_NFO_BYTES = 1024 * 1024
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+_MP4_EXTENSIONS = frozenset({".mp4", ".m4v", ".mov"})
+_MATROSKA_EXTENSIONS = frozenset({".mkv", ".webm"})
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ProviderResult:
+    """What one provider found about a video, and how confident it is"""
+
+    provider: str
+    confidence: int = CONFIDENCE_NONE  # Of the metadata fields
+    title: str = ""  # Of the show for episodes, as on TMDB
+    year: str = ""
+    overview: str = ""
+    genres: list[str] = field(default_factory=list)
+    director: str = ""
+    poster: bytes | None = None  # Image file content
+    poster_confidence: int = CONFIDENCE_NONE
+
+    def to_metadata(self) -> dict:
+        """Returns the metadata fields, JSON serializable for the scan journal"""
+        return {
+            "source": self.provider,
+            "title": self.title,
+            "year": self.year,
+            "overview": self.overview,
+            "genres": list(self.genres),
+            "director": self.director,
+        }
+
+
+class MetadataProvider:
+    """Base class of the providers, registered by config name with 'register_provider'"""
+
+    name = ""
+
+    def lookup(self, video_path: str, parsed_name: models.ParsedName, want_poster: bool) -> ProviderResult | None:
+        """Returns what the provider knows about a video
+
+        Args:
+            video_path (str): Full path to the video file
+            parsed_name (models.ParsedName): Title and episode parsed from the file name
+            want_poster (bool): False once another provider resolved the poster, skip reading images then
+
+        Raises:
+            OSError: If a file could not be read, the chain moves on to the next provider
+            ValueError: If a file is malformed, the chain moves on to the next provider
+
+        Returns:
+            Optional[ProviderResult]: None if the provider has nothing for this video
+        """
+        raise NotImplementedError
+
+
+_PROVIDERS: dict[str, MetadataProvider] = {}
+
+
+def register_provider(config_name: str, provider: MetadataProvider) -> None:
+    """Makes a provider available to the 'Providers' list of 'metadata_providers_config.yaml'
+
+    Args:
+        config_name (str): Name used in the config, e.g. 'Nfo'
+        provider (MetadataProvider): Provider instance, shared by the scan threads
+    """
+    _PROVIDERS[config_name] = provider
+
+
+def image_extension(image: bytes) -> str:
+    """Returns the file extension matching the content of an image, '.png' or '.jpg'"""
+    return ".png" if image.startswith(b"\x89PNG") else ".jpg"
+
+
+def _year(text: str) -> str:
+    match = YEAR_PATTERN.search(text or "")
+    return match.group(1) if match else ""
+
+
+def _tag_confidence(title: str, year: str, video_path: str) -> int:
+    """Confidence of a title read from tags, which often hold the release name rather than the title"""
+    file_name_no_ext = os.path.splitext(os.path.basename(video_path))[0]
+    if not title or title.casefold() == file_name_no_ext.casefold() or RESOLUTION_PATTERN.search(title):
+        return CONFIDENCE_NONE
+    return CONFIDENCE_MEDIUM if year else CONFIDENCE_LOW
+
+
+def _read_image(image_path: str) -> bytes | None:
+    if os.path.getsize(image_path) > _MAX_IMAGE_BYTES:
+        return None
+    with open(image_path, "rb") as image_f:
+        return image_f.read()
+
+
+def _split_genres(text: str) -> list[str]:
+    return [genre.strip() for genre in re.split(r"[/,;|]", text or "") if genre.strip()]
+
+
+class NfoProvider(MetadataProvider):
+    """Kodi style sidecars: '<video>.nfo' or 'movie.nfo' for movies, the show's 'tvshow.nfo' for episodes"""
+
+    name = "nfo"
+
+    # Kodi allows a scraper URL after the XML
+    _XML_END = re.compile(rb"</(?:movie|tvshow)>", re.IGNORECASE)
+
+    def lookup(self, video_path: str, parsed_name: models.ParsedName, want_poster: bool) -> ProviderResult | None:
+        folder = os.path.dirname(video_path)
+        if parsed_name.is_episode:
+            # In the show folder, or next to the episodes if they are not in season folders
+            candidates = [os.path.join(folder, "tvshow.nfo"), os.path.join(os.path.dirname(folder), "tvshow.nfo")]
+        else:
+            candidates = [os.path.splitext(video_path)[0] + ".nfo", os.path.join(folder, "movie.nfo")]
+
+        for nfo_path in candidates:
+            if not os.path.isfile(nfo_path):
+                continue
+            root = self._parse(nfo_path)
+            if root is None or root.tag not in ("movie", "tvshow"):
+                logger.debug("No movie or show in %s", nfo_path)
+                continue
+
+            title = self._text(root, "title") or self._text(root, "originaltitle")
+            year = self._text(root, "year") or _year(self._text(root, "premiered"))
+            has_id = any(
+                (unique_id.text or "").strip() for unique_id in root.iter("uniqueid")
+            ) or self._text(root, "tmdbid") or self._text(root, "imdbid")
+
+            confidence = CONFIDENCE_NONE
+            if title:
+                confidence = CONFIDENCE_HIGH if year or has_id else CONFIDENCE_MEDIUM
+            return ProviderResult(
+                provider=self.name,
+                confidence=confidence,
+                title=title,
+                year=year,
+                overview=self._text(root, "plot") or self._text(root, "outline"),
+                genres=[genre for node in root.findall("genre") for genre in _split_genres(node.text)],
+                director=self._text(root, "director"),
+            )
+        return None
+
+    @classmethod
+    def _parse(cls, nfo_path: str) -> ElementTree.Element | None:
+        with open(nfo_path, "rb") as nfo_f:
+            content = nfo_f.read(_MAX_NFO_BYTES)
+        try:
+            return ElementTree.fromstring(content)
+        except ElementTree.ParseError:
+            pass
+
+        ends = list(cls._XML_END.finditer(content))
+        if not ends:
+            return None
+        try:
+            return ElementTree.fromstring(content[: ends[-1].end()])
+        except ElementTree.ParseError as exception:
+            logger.warning("Could not parse %s: %s", nfo_path, exception)
+            return None
+
+    @staticmethod
+    def _text(root: ElementTree.Element, tag: str) -> str:
+        node = root.find(tag)
+        return (node.text or "").strip() if node is not None else ""
+
+
+class EmbeddedProvider(MetadataProvider):
+    """Tags and cover art inside the video, MP4 atoms read by mutagen, Matroska tags and attachments"""
+
+    name = "embedded"
+
+    def lookup(self, video_path: str, parsed_name: models.ParsedName, want_poster: bool) -> ProviderResult | None:
+        extension = os.path.splitext(video_path)[1].lower()
+        if extension in _MP4_EXTENSIONS:
+            return self._lookup_mp4(video_path, parsed_name, want_poster)
+        if extension in _MATROSKA_EXTENSIONS:
+            return self._lookup_matroska(video_path, parsed_name, want_poster)
+        return None
+
+    def _lookup_mp4(self, video_path: str, parsed_name: models.ParsedName, want_poster: bool) -> ProviderResult | None:
+        try:
+            tags = MP4(video_path).tags
+        except mutagen.MutagenError as exception:
+            logger.debug("Could not read the MP4 tags of %s: %s", video_path, exception)
+            return None
+        if not tags:
+            return None
+
+        def _first(key: str) -> str:
+            values = tags.get(key) or [""]
+            return str(values[0]).strip()
+
+        # Episodes carry the show name in 'tvsh', their title is the episode's
+        title = _first("tvsh") if parsed_name.is_episode else _first("\xa9nam")
+        year = _year(_first("\xa9day"))
+
+        poster, poster_confidence = None, CONFIDENCE_NONE
+        covers = tags.get("covr") if want_poster else None
+        if covers and len(covers[0]) <= _MAX_IMAGE_BYTES:
+            # An episode's cover may be a still of the episode rather than the show's poster
+            poster = bytes(covers[0])
+            poster_confidence = CONFIDENCE_MEDIUM if parsed_name.is_episode else CONFIDENCE_HIGH
+
+        return ProviderResult(
+            provider=self.name,
+            confidence=_tag_confidence(title, year, video_path),
+            title=title,
+            year=year,
+            overview=_first("ldes") or _first("desc"),
+            genres=[str(genre) for genre in tags.get("\xa9gen", [])],
+            poster=poster,
+            poster_confidence=poster_confidence,
+        )
+
+    def _lookup_matroska(
+        self, video_path: str, parsed_name: models.ParsedName, want_poster: bool
+    ) -> ProviderResult | None:
+        metadata = matroska.read_metadata(video_path)
+        if parsed_name.is_episode:
+            tags = metadata.collection_tags
+            title = tags.get("TITLE", "")
+        else:
+            tags = metadata.tags
+            title = tags.get("TITLE", "") or metadata.title
+        year = _year(tags.get("DATE_RELEASED", ""))
+
+        poster, poster_confidence = None, CONFIDENCE_NONE
+        if want_poster:
+            images = [
+                attachment
+                for attachment in metadata.attachments
+                if attachment.mime_type.startswith("image/") and attachment.size <= _MAX_IMAGE_BYTES
+            ]
+            # 'cover.jpg' is the portrait cover by the Matroska convention, unlike 'small_cover' or 'cover_land'
+            cover = next(
+                (image for image in images if os.path.splitext(image.name.lower())[0] == "cover"), None
+            )
+            if cover is not None:
+                poster_confidence = CONFIDENCE_HIGH
+            elif images:
+                cover, poster_confidence = images[0], CONFIDENCE_LOW
+            if cover is not None:
+                poster = matroska.read_attachment(video_path, cover)
+
+        return ProviderResult(
+            provider=self.name,
+            confidence=_tag_confidence(title, year, video_path),
+            title=title,
+            year=year,
+            overview=tags.get("SUMMARY") or tags.get("DESCRIPTION") or tags.get("SYNOPSIS", ""),
+            genres=_split_genres(tags.get("GENRE", "")),
+            director=tags.get("DIRECTOR", ""),
+            poster=poster,
+            poster_confidence=poster_confidence,
+        )
+
+
+class LocalPosterProvider(MetadataProvider):
+    """Poster images next to the video, '<video>-poster.jpg' first, then 'poster.jpg', 'folder.jpg' or 'cover.jpg'"""
+
+    name = "local_poster"
+
+    _SHARED_NAMES = ("poster", "folder", "cover")
+
+    def lookup(self, video_path: str, parsed_name: models.ParsedName, want_poster: bool) -> ProviderResult | None:
+        if not want_poster:
+            return None
+
+        folder = os.path.dirname(video_path)
+        file_name_no_ext = os.path.splitext(os.path.basename(video_path))[0]
+        file_names = self._list_files(folder)
+
+        # '<video>.jpg' of an episode is a still of the episode, not a poster
+        own_names = [f"{file_name_no_ext}-poster"] + ([] if parsed_name.is_episode else [file_name_no_ext])
+        image_path = self._find_image(folder, file_names, own_names)
+        if image_path is not None:
+            return self._result(image_path, CONFIDENCE_HIGH)
+
+        # A shared poster is the show's for episodes, but only one movie's if it is alone in its folder
+        if parsed_name.is_episode:
+            confidence = CONFIDENCE_MEDIUM
+            folders = [(folder, file_names), (os.path.dirname(folder), None)]
+        else:
+            accepted_extensions = ConfigService.get("accepted_extension.yaml")
+            video_count = sum(
+                os.path.splitext(file_name)[1][1:] in accepted_extensions for file_name in file_names
+            )
+            confidence = CONFIDENCE_MEDIUM if video_count <= 1 else CONFIDENCE_LOW
+            folders = [(folder, file_names)]
+
+        for search_folder, names in folders:
+            names = self._list_files(search_folder) if names is None else names
+            image_path = self._find_image(search_folder, names, self._SHARED_NAMES)
+            if image_path is not None:
+                return self._result(image_path, confidence)
+        return None
+
+    def _result(self, image_path: str, confidence: int) -> ProviderResult | None:
+        poster = _read_image(image_path)
+        if poster is None:
+            return None
+        return ProviderResult(provider=self.name, poster=poster, poster_confidence=confidence)
+
+    @staticmethod
+    def _list_files(folder: str) -> dict[str, str]:
+        """Returns lower case name -> name of the files in a folder, one listing serves every lookup"""
+        with os.scandir(folder) as entries:
+            return {entry.name.lower(): entry.name for entry in entries if entry.is_file()}
+
+    @staticmethod
+    def _find_image(folder: str, file_names: dict[str, str], base_names: list[str] | tuple[str, ...]) -> str | None:
+        for base_name in base_names:
+            for extension in _IMAGE_EXTENSIONS:
+                file_name = file_names.get(f"{base_name}{extension}".lower())
+                if file_name is not None:
+                    return os.path.join(folder, file_name)
+        return None
+
+
+register_provider("Nfo", NfoProvider())
+register_provider("Embedded", EmbeddedProvider())
+register_provider("LocalPoster", LocalPosterProvider())
+
+
+def resolve(
+    video_path: str, parsed_name: models.ParsedName
+) -> tuple[ProviderResult | None, ProviderResult | None]:
+    """Asks the configured providers, cheapest first, for the metadata and the poster of a video
+
+    Args:
+        video_path (str): Full path to the video file
+        parsed_name (models.ParsedName): Title and episode parsed from the file name
+
+    Raises:
+        ConfigValidationException: If the config names an unknown provider or confidence level
+
+    Returns:
+        tuple[Optional[ProviderResult], Optional[ProviderResult]]: Results the metadata and the poster
+            come from, None for what no provider was confident enough about
+    """
+    config = ConfigService.get("metadata_providers_config.yaml")
+    if config["MinConfidence"] not in CONFIDENCE_LEVELS:
+        raise ConfigValidationException(
+            "metadata_providers_config.yaml.MinConfidence", f"expected one of {', '.join(CONFIDENCE_LEVELS)}"
+        )
+    min_confidence = CONFIDENCE_LEVELS[config["MinConfidence"]]
+
+    metadata, poster = None, None
+    for config_name in config["Providers"]:
+        provider = _PROVIDERS.get(config_name)
+        if provider is None:
+            raise ConfigValidationException(
+                "metadata_providers_config.yaml.Providers", f"unknown provider '{config_name}'"
+            )
+
+        try:
+            with metrics.timer(f"metadata.{provider.name}"):
+                result = provider.lookup(video_path, parsed_name, want_poster=poster is None)
+        except (OSError, ValueError) as exception:
+            logger.warning("Metadata provider %s failed on %s: %s", provider.name, video_path, exception)
+            continue
+        if result is None:
+            continue
+
+        if metadata is None and result.title and result.confidence >= min_confidence:
+            metadata = result
+            metrics.increment(f"metadata.{provider.name}.metadata")
+        if poster is None and result.poster and result.poster_confidence >= min_confidence:
+            poster = result
+            metrics.increment(f"metadata.{provider.name}.poster")
+        if metadata is not None and poster is not None:
+            break
+
+    logger.debug(
+        "Local metadata of %s: %s, poster: %s",
+        video_path,
+        metadata.provider if metadata else "none",
+        poster.provider if poster else "none",
+    )
+    return metadata, poster
@@ -0,0 +1,299 @@
+"""Lightweight timers, counters and gauges for the hot paths (scan, TMDB, database, images, widgets, player).
+
+Timers are recorded as histograms with fixed buckets, so recording is a lock and a few
+additions. A summary is written periodically to the rotating log, and the raw values
+can be scraped in the Prometheus text format when the metrics server is enabled.
+"""
+import os
+import time
+import atexit
+import bisect
+import logging
+import threading
+import functools
+
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the timer histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROMETHEUS_PREFIX = "cinenomad_"
+
+
+class Histogram:
+    """Distribution of durations over fixed buckets"""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        # One extra slot for the values above the last bucket (+Inf)
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket that contains it"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for idx, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[idx] if idx < len(self.buckets) else self.max
+        return self.max
+
+
+class MetricsRegistry:
+    """Thread safe store of the counters, gauges and timer histograms"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._histograms: dict[str, Histogram] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict[str, dict]:
+        """Returns a copy of the current values
+
+        Returns:
+            dict[str, dict]: 'counters' and 'gauges' (name -> value) and 'timers'
+                (name -> count, total, avg, p95 and max, in seconds)
+        """
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timers": {
+                    name: {
+                        "count": histogram.count,
+                        "total": histogram.total,
+                        "avg": histogram.total / histogram.count if histogram.count else 0.0,
+                        "p95": histogram.quantile(0.95),
+                        "max": histogram.max,
+                    }
+                    for name, histogram in self._histograms.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}{_sanitize(name)}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+
+            for name, value in sorted(self._gauges.items()):
+                metric = f"{PROMETHEUS_PREFIX}{_sanitize(name)}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+
+            for name, histogram in sorted(self._histograms.items()):
+                metric = f"{PROMETHEUS_PREFIX}{_sanitize(name)}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum {histogram.total}")
+                lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _sanitize(name: str) -> str:
+    return "".join(char if char.isalnum() else "_" for char in name)
+
+
+registry = MetricsRegistry()
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Adds to a counter, e.g. increment("tmdb.cache_hit")"""
+    registry.increment(name, value)
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Sets a value that goes up and down, e.g. set_gauge("tasks.disk.queued", 3)"""
+    registry.set_gauge(name, value)
+
+
+def observe(name: str, seconds: float) -> None:
+    """Records one duration in a timer histogram"""
+    registry.observe(name, seconds)
+
+
+@contextmanager
+def timer(name: str):
+    """Times the enclosed block, e.g. 'with metrics.timer("scan.mediainfo"):'"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - started_at)
+
+
+def timed(name: str):
+    """Decorator version of timer"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - started_at)
+
+        return wrapper
+
+    return decorator
+
+
+def log_summary() -> None:
+    """Writes the counters, the gauges and the timer statistics to the log"""
+    snapshot = registry.snapshot()
+    if not snapshot["counters"] and not snapshot["gauges"] and not snapshot["timers"]:
+        return
+
+    for name, value in sorted(snapshot["counters"].items()):
+        logger.info("counter %s = %g", name, value)
+    for name, value in sorted(snapshot["gauges"].items()):
+        logger.info("gauge %s = %g", name, value)
+    for name, stats in sorted(snapshot["timers"].items()):
+        logger.info(
+            "timer %s: count=%d avg=%.1fms p95<=%.1fms max=%.1fms",
+            name,
+            stats["count"],
+            stats["avg"] * 1000,
+            stats["p95"] * 1000,
+            stats["max"] * 1000,
+        )
+
+
+def configure_logging(config: dict, role: str) -> None:
+    """Sends the application logs to a rotating file and to the console
+
+    Every process (GUI, indexer daemon, cron scan) writes its own file, two processes
+    rotating the same file would lose each other's lines.
+
+    Args:
+        config (dict): Content of config/metrics_config.yaml
+        role (str): Name of the process, e.g. 'gui' or the headless command, 'cinenomad.log' becomes 'cinenomad-gui.log'
+    """
+    os.makedirs(config["LogFolder"], exist_ok=True)
+    formatter = logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s")
+
+    log_name, log_extension = os.path.splitext(config["LogFile"])
+    file_handler = RotatingFileHandler(
+        os.path.join(config["LogFolder"], f"{log_name}-{role}{log_extension}"),
+        maxBytes=config["LogMaxBytes"],
+        backupCount=config["LogBackupCount"],
+        encoding="utf_8",
+    )
+    file_handler.setLevel(config["LogLevel"])
+    file_handler.setFormatter(formatter)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(config["ConsoleLogLevel"])
+    console_handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(
+        min(logging.getLevelName(config["LogLevel"]), logging.getLevelName(config["ConsoleLogLevel"]))
+    )
+    root_logger.addHandler(file_handler)
+    root_logger.addHandler(console_handler)
+
+
+def _start_summary_logging(interval_secs: float) -> None:
+    def _loop() -> None:
+        while True:
+            time.sleep(interval_secs)
+            log_summary()
+
+    threading.Thread(target=_loop, name="metrics-summary", daemon=True).start()
+    atexit.register(log_summary)
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer | None:
+    """Serves the metrics in the Prometheus text format on http://127.0.0.1:<port>/metrics
+
+    Args:
+        port (int): Local port to listen on
+
+    Returns:
+        Optional[ThreadingHTTPServer]: The running server, None if the port is not available
+    """
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            payload = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    except OSError as exception:
+        logger.warning("Could not start the metrics server on port %d: %s", port, exception)
+        return None
+
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Metrics available on http://127.0.0.1:%d/metrics", port)
+    return server
+
+
+def setup(config: dict, role: str) -> None:
+    """Configures logging, the periodic summary and, if enabled, the metrics server
+
+    Args:
+        config (dict): Content of config/metrics_config.yaml
+        role (str): Name of the process, its log file is named after it
+    """
+    configure_logging(config, role)
+    _start_summary_logging(config["SummaryIntervalSecs"])
+    if config["MetricsServerEnabled"]:
+        start_metrics_server(config["MetricsServerPort"])
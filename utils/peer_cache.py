@@ -0,0 +1,720 @@
+"""LAN cache of indexed files, one indexer node serving its metadata and posters to the others.
+
+Every indexed video is keyed by 'partial_content_hash', a hash of its size and of
+three small chunks of it, so a copy of a file is recognised on any node whatever
+its path or mtime. A node running 'PeerCacheServer' answers for the videos in its
+database, and nodes listing it in 'Peers' ask it before probing a new file or
+looking it up on TMDB.
+
+Protocol, JSON over HTTP/1.1 with keep-alive:
+    GET  /v1/entries/<hash>   One entry, 304 when 'If-None-Match' holds its current ETag
+    POST /v1/lookup           Batch lookup, '{"hashes": {"<hash>": "<ETag known or empty>"}}'
+                              answers '{"entries": {"<hash>": {...}}, "unchanged": ["<hash>"]}',
+                              unknown hashes are left out of both
+    GET  /v1/posters/<hash>   Poster image, 304 when 'If-None-Match' holds its current ETag
+
+An entry's ETag covers its poster's, so revalidating the entry is enough to know
+whether the poster changed.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import dataclasses
+import mimetypes
+import threading
+
+from dataclasses import dataclass, field
+
+import requests
+
+from utils import metrics
+from utils.config_service import ConfigService
+from utils.database import queries, models
+from utils.metadata_providers import ProviderResult, CONFIDENCE_HIGH
+
+API_PREFIX = "/v1"
+
+# Three chunks of this size are hashed, whatever the size of the file
+_CHUNK_SIZE = 64 * 1024
+# Larger request bodies are refused, a batch of 1000 hashes is about 60 KB
+_MAX_BODY_BYTES = 1024 * 1024
+_MAX_BATCH_HASHES = 1000
+_MAX_HEADERS = 100
+# Idle keep-alive connections are closed after this long
+_IDLE_TIMEOUT_SECS = 30
+# Answers remembered by the client, the oldest are forgotten first
+_MAX_REMEMBERED_ANSWERS = 20_000
+
+logger = logging.getLogger(__name__)
+
+
+def _load_config() -> dict:
+    return ConfigService.get("peer_cache_config.yaml")
+
+
+def partial_content_hash(file_path: str) -> str:
+    """Hashes the size and the first, middle and last 64 KiB of a file
+
+    At most 192 KiB are read whatever the size, identical copies hash the same on every
+    node. Files of 192 KiB or less are hashed whole.
+
+    Args:
+        file_path (str): Full path to the video file
+
+    Raises:
+        OSError: If the file cannot be read
+
+    Returns:
+        str: Hex SHA-1 digest
+    """
+    with open(file_path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        digest = hashlib.sha1(size.to_bytes(8, "big"))
+        if size <= 3 * _CHUNK_SIZE:
+            digest.update(file.read())
+        else:
+            for offset in (0, (size - _CHUNK_SIZE) // 2, size - _CHUNK_SIZE):
+                file.seek(offset)
+                digest.update(file.read(_CHUNK_SIZE))
+    return digest.hexdigest()
+
+
+def backfill_content_hashes() -> int:
+    """Hashes the videos indexed before the peer cache existed, so the server can answer for them
+
+    Returns:
+        int: Number of videos hashed
+    """
+    hashed = 0
+    for video_path in queries.get_video_paths_without_content_hash():
+        try:
+            queries.upsert_video_content_hash(video_path, partial_content_hash(video_path))
+            hashed += 1
+        except OSError as exception:
+            logger.debug("Could not hash %s: %s", video_path, exception)
+    return hashed
+
+
+@dataclass(frozen=True)
+class PeerEntry:
+    """What a peer knows about a file, and where to get its poster"""
+
+    content_hash: str
+    peer_url: str
+    etag: str
+    length: str  # format -> "%H:%M:%S.%f"
+    language: str
+    title: str = ""
+    director: str = ""
+    year: str = ""
+    overview: str = ""
+    genres: list[str] = field(default_factory=list)
+    tmdb_poster_path: str = ""
+    metadata_source: str = ""
+    poster_source: str = ""
+    poster_etag: str | None = None  # None if the peer has no poster file
+    duration_secs: float | None = None  # None if the peer did not fingerprint the file
+    frame_hashes: list[int] = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, content_hash: str, peer_url: str, etag: str, data: dict) -> "PeerEntry":
+        """Builds an entry from its wire format
+
+        Raises:
+            KeyError, TypeError, ValueError: If the entry is malformed
+        """
+        return cls(
+            content_hash=content_hash,
+            peer_url=peer_url,
+            etag=etag,
+            length=str(data["length"]),
+            language=str(data["language"]),
+            title=str(data.get("title") or ""),
+            director=str(data.get("director") or ""),
+            year=str(data.get("year") or ""),
+            overview=str(data.get("overview") or ""),
+            genres=[str(genre) for genre in data.get("genres") or []],
+            tmdb_poster_path=str(data.get("tmdb_poster_path") or ""),
+            metadata_source=str(data.get("metadata_source") or ""),
+            poster_source=str(data.get("poster_source") or ""),
+            poster_etag=data.get("poster"),
+            duration_secs=float(data["duration_secs"]) if data.get("duration_secs") is not None else None,
+            frame_hashes=[int(frame_hash, 16) for frame_hash in data.get("frame_hashes") or []],
+        )
+
+    def to_progress(self) -> dict:
+        """Returns the entry as stored in the scan journal, read back with 'from_progress'"""
+        return {
+            "content_hash": self.content_hash,
+            "peer_url": self.peer_url,
+            "etag": self.etag,
+            "entry": _entry_json(self),
+        }
+
+    @classmethod
+    def from_progress(cls, progress: dict) -> "PeerEntry":
+        return cls.from_json(progress["content_hash"], progress["peer_url"], progress["etag"], progress["entry"])
+
+    def to_fingerprint(self, video_path: str, size: int) -> models.VideoFingerprint | None:
+        """Returns the peer's fingerprint of the file, so it does not have to be computed again"""
+        if self.duration_secs is None or not self.frame_hashes:
+            return None
+        return models.VideoFingerprint(
+            full_path=video_path, duration_secs=self.duration_secs, size=size, frame_hashes=self.frame_hashes
+        )
+
+
+def _entry_json(entry: PeerEntry) -> dict:
+    return {
+        "length": entry.length,
+        "language": entry.language,
+        "title": entry.title,
+        "director": entry.director,
+        "year": entry.year,
+        "overview": entry.overview,
+        "genres": entry.genres,
+        "tmdb_poster_path": entry.tmdb_poster_path,
+        "metadata_source": entry.metadata_source,
+        "poster_source": entry.poster_source,
+        "poster": entry.poster_etag,
+        "duration_secs": entry.duration_secs,
+        "frame_hashes": [f"{frame_hash:016x}" for frame_hash in entry.frame_hashes],
+    }
+
+
+def _quoted_hash(data: bytes) -> str:
+    return '"' + hashlib.sha1(data).hexdigest()[:20] + '"'
+
+
+def _poster_etag(image_path: str) -> str | None:
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _build_entries(content_hashes: list[str]) -> dict[str, tuple[PeerEntry, str]]:
+    """Returns content hash -> (entry, poster path) for the hashes of the local videos"""
+    entries = {}
+    for content_hash, (video, fingerprint) in queries.get_videos_by_content_hash(content_hashes).items():
+        entry = PeerEntry(
+            content_hash=content_hash,
+            peer_url="",
+            etag="",
+            length=video.length,
+            language=video.language,
+            title=video.tmdb_title or "",
+            director=video.tmdb_director or "",
+            year=video.tmdb_year or "",
+            overview=video.tmdb_overview or "",
+            genres=[genre for genre in video.tmdb_genres if genre],
+            tmdb_poster_path=video.tmdb_poster_path or "",
+            metadata_source=video.metadata_source,
+            poster_source=video.poster_source,
+            poster_etag=_poster_etag(video.image_path),
+            duration_secs=fingerprint.duration_secs if fingerprint else None,
+            frame_hashes=fingerprint.frame_hashes if fingerprint else [],
+        )
+        etag = _quoted_hash(json.dumps(_entry_json(entry), sort_keys=True).encode("utf_8"))
+        entries[content_hash] = (dataclasses.replace(entry, etag=etag), video.image_path)
+    return entries
+
+
+class _BadRequest(Exception):
+    """Malformed request, the connection is answered with 'status' and closed"""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes] | None:
+    """Reads one request, None when the client closed the connection"""
+    request_line = await asyncio.wait_for(reader.readline(), _IDLE_TIMEOUT_SECS)
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin_1").split(" ", 2)
+    except ValueError as exception:
+        raise _BadRequest(400, "Malformed request line") from exception
+
+    headers = {}
+    while True:
+        line = await asyncio.wait_for(reader.readline(), _IDLE_TIMEOUT_SECS)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= _MAX_HEADERS:
+            raise _BadRequest(431, "Too many headers")
+        name, _, value = line.decode("latin_1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError as exception:
+        raise _BadRequest(400, "Malformed Content-Length") from exception
+    if length > _MAX_BODY_BYTES:
+        raise _BadRequest(413, "Request body too large")
+    body = await asyncio.wait_for(reader.readexactly(length), _IDLE_TIMEOUT_SECS) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+def _format_response(status: int, headers: dict[str, str], payload: bytes, keep_alive: bool) -> bytes:
+    reasons = {
+        200: "OK",
+        304: "Not Modified",
+        400: "Bad Request",
+        404: "Not Found",
+        405: "Method Not Allowed",
+        413: "Payload Too Large",
+        431: "Request Header Fields Too Large",
+        500: "Internal Server Error",
+    }
+    lines = [f"HTTP/1.1 {status} {reasons.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    lines += [f"Content-Length: {len(payload)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin_1") + payload
+
+
+def _json_response(status: int, body: dict, headers: dict[str, str] | None = None) -> tuple[int, dict, bytes]:
+    payload = json.dumps(body, separators=(",", ":")).encode("utf_8")
+    return status, {"Content-Type": "application/json", **(headers or {})}, payload
+
+
+class PeerCacheServer:
+    """asyncio HTTP server answering the other nodes from the local database
+
+    The database and the poster files are read on worker threads, the event loop only
+    parses requests and writes answers, so slow disks do not hold up other clients.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        """
+        Args:
+            host (str): Address to listen on, '0.0.0.0' for the whole LAN
+            port (int): Port to listen on, 0 picks a free one
+        """
+        self._host = host
+        self._port = port
+        self._server: asyncio.AbstractServer | None = None
+
+    @property
+    def port(self) -> int:
+        """Port listened on, once started"""
+        return self._server.sockets[0].getsockname()[1] if self._server is not None else self._port
+
+    async def start(self) -> None:
+        """Starts listening, then hashes the videos indexed before the peer cache existed"""
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+        logger.info("Peer cache listening on %s:%d", self._host, self.port)
+        hashed = await asyncio.to_thread(backfill_content_hashes)
+        if hashed:
+            logger.info("Hashed %d videos indexed before the peer cache", hashed)
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def run(self) -> None:
+        """Serves until interrupted, for the headless command"""
+        asyncio.run(self.serve_forever())
+
+    @classmethod
+    def start_in_background(cls, host: str, port: int) -> "PeerCacheServer | None":
+        """Serves from a daemon thread with its own event loop, e.g. next to the GUI
+
+        Returns:
+            Optional[PeerCacheServer]: The running server, None if it could not listen on the port
+        """
+        server = cls(host, port)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(server.start())
+        except OSError as exception:
+            logger.warning("Could not start the peer cache on %s:%d: %s", host, port, exception)
+            loop.close()
+            return None
+        threading.Thread(target=loop.run_forever, name="peer-cache", daemon=True).start()
+        return server
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except _BadRequest as exception:
+                    status, headers, payload = _json_response(exception.status, {"error": str(exception)})
+                    writer.write(_format_response(status, headers, payload, keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                started_at = time.perf_counter()
+                try:
+                    status, response_headers, payload = await self._answer(method, path, headers, body)
+                except Exception as exception:
+                    logger.error("Peer cache request %s %s failed: %s", method, path, exception)
+                    status, response_headers, payload = _json_response(500, {"error": "Internal error"})
+                metrics.observe("peer_cache.request", time.perf_counter() - started_at)
+                metrics.increment(f"peer_cache.status_{status}")
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(_format_response(status, response_headers, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, method: str, path: str, headers: dict[str, str], body: bytes) -> tuple[int, dict, bytes]:
+        parts = path[len(API_PREFIX):].strip("/").split("/") if path.startswith(API_PREFIX + "/") else []
+        if_none_match = headers.get("if-none-match", "")
+
+        if len(parts) == 2 and parts[0] == "entries":
+            if method != "GET":
+                return _json_response(405, {"error": "Use GET"})
+            entries = await asyncio.to_thread(_build_entries, [parts[1]])
+            if parts[1] not in entries:
+                metrics.increment("peer_cache.served_miss")
+                return _json_response(404, {"error": "Unknown content hash"})
+            metrics.increment("peer_cache.served_hit")
+            entry, _ = entries[parts[1]]
+            cache_headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+            if entry.etag == if_none_match:
+                return 304, cache_headers, b""
+            return _json_response(200, _entry_json(entry), cache_headers)
+
+        if parts == ["lookup"]:
+            if method != "POST":
+                return _json_response(405, {"error": "Use POST"})
+            try:
+                known = json.loads(body)["hashes"]
+                if isinstance(known, list):
+                    known = dict.fromkeys(known, "")
+                known = {str(content_hash): str(etag or "") for content_hash, etag in known.items()}
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return _json_response(400, {"error": "Expected {\"hashes\": {\"<hash>\": \"<ETag>\"}}"})
+            if len(known) > _MAX_BATCH_HASHES:
+                return _json_response(413, {"error": f"At most {_MAX_BATCH_HASHES} hashes per lookup"})
+
+            entries = await asyncio.to_thread(_build_entries, list(known))
+            metrics.increment("peer_cache.served_hit", len(entries))
+            metrics.increment("peer_cache.served_miss", len(known) - len(entries))
+            changed, unchanged = {}, []
+            for content_hash, (entry, _) in entries.items():
+                if entry.etag == known[content_hash]:
+                    unchanged.append(content_hash)
+                else:
+                    changed[content_hash] = {"etag": entry.etag, **_entry_json(entry)}
+            return _json_response(200, {"entries": changed, "unchanged": unchanged})
+
+        if len(parts) == 2 and parts[0] == "posters":
+            if method != "GET":
+                return _json_response(405, {"error": "Use GET"})
+            entries = await asyncio.to_thread(_build_entries, [parts[1]])
+            if parts[1] not in entries or entries[parts[1]][0].poster_etag is None:
+                return _json_response(404, {"error": "No poster for this content hash"})
+            entry, image_path = entries[parts[1]]
+            cache_headers = {"ETag": entry.poster_etag, "Cache-Control": "no-cache"}
+            if entry.poster_etag == if_none_match:
+                return 304, cache_headers, b""
+            try:
+                poster = await asyncio.to_thread(_read_file, image_path)
+            except OSError:
+                return _json_response(404, {"error": "No poster for this content hash"})
+            content_type = mimetypes.guess_type(image_path)[0] or "application/octet-stream"
+            return 200, {"Content-Type": content_type, **cache_headers}, poster
+
+        return _json_response(404, {"error": "Unknown endpoint"})
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+class PeerCache:
+    """Client side: asks the configured peers and remembers their answers
+
+    Answers, misses included, are trusted for 'CacheTtlSecs' and then revalidated with
+    their ETag, so a scan of many files costs one small request per file at most, and
+    none for the files covered by a batch lookup ('prefetch').
+    """
+
+    _session: requests.Session | None = None
+    # Content hash -> (checked at, entry or None for a miss)
+    _answers: dict[str, tuple[float, PeerEntry | None]] = {}
+    # Peer URL -> time until which it is not asked, after it failed to answer
+    _down_until: dict[str, float] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return bool(_load_config()["Peers"])
+
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        with cls._lock:
+            if cls._session is None:
+                cls._session = requests.Session()
+            return cls._session
+
+    @classmethod
+    def _live_peers(cls, config: dict) -> list[str]:
+        now = time.time()
+        with cls._lock:
+            return [
+                peer.rstrip("/") for peer in config["Peers"] if cls._down_until.get(peer.rstrip("/"), 0) <= now
+            ]
+
+    @classmethod
+    def _mark_down(cls, peer_url: str, config: dict, exception: Exception) -> None:
+        logger.warning("Peer %s did not answer, skipping it for %ss: %s", peer_url, config["PeerRetrySecs"], exception)
+        metrics.increment("peer_cache.peer_errors")
+        with cls._lock:
+            cls._down_until[peer_url] = time.time() + config["PeerRetrySecs"]
+
+    @classmethod
+    def _cached(cls, content_hash: str, config: dict) -> tuple[bool, PeerEntry | None]:
+        """Returns whether the remembered answer is still trusted, and that answer"""
+        with cls._lock:
+            answer = cls._answers.get(content_hash)
+        if answer is None:
+            return False, None
+        return time.time() - answer[0] < config["CacheTtlSecs"], answer[1]
+
+    @classmethod
+    def _remember(cls, content_hash: str, entry: PeerEntry | None) -> None:
+        with cls._lock:
+            cls._answers.pop(content_hash, None)
+            cls._answers[content_hash] = (time.time(), entry)
+            if len(cls._answers) > _MAX_REMEMBERED_ANSWERS:
+                del cls._answers[next(iter(cls._answers))]
+
+    @classmethod
+    def lookup(cls, content_hash: str) -> PeerEntry | None:
+        """Asks the peers about one file, the first one that knows it answers
+
+        Args:
+            content_hash (str): Hash computed by 'partial_content_hash'
+
+        Returns:
+            Optional[PeerEntry]: What the peer knows, None if no peer knows the file or none is configured
+        """
+        config = _load_config()
+        if not config["Peers"]:
+            return None
+        is_fresh, previous = cls._cached(content_hash, config)
+        if is_fresh:
+            metrics.increment("peer_cache.cache_hit")
+            return previous
+
+        peers = cls._live_peers(config)
+        # The peer that answered before first, it only has to confirm its ETag
+        if previous is not None and previous.peer_url in peers:
+            peers.remove(previous.peer_url)
+            peers.insert(0, previous.peer_url)
+
+        session = cls._get_session()
+        for peer_url in peers:
+            request_headers = {}
+            if previous is not None and previous.peer_url == peer_url:
+                request_headers["If-None-Match"] = previous.etag
+            try:
+                with metrics.timer("peer_cache.lookup"):
+                    response = session.get(
+                        f"{peer_url}{API_PREFIX}/entries/{content_hash}",
+                        headers=request_headers,
+                        timeout=config["TimeoutSecs"],
+                    )
+                if response.status_code == 304:
+                    cls._remember(content_hash, previous)
+                    return previous
+                if response.status_code == 404:
+                    continue
+                response.raise_for_status()
+                entry = PeerEntry.from_json(content_hash, peer_url, response.headers.get("ETag", ""), response.json())
+            except (requests.RequestException, ValueError, KeyError, TypeError) as exception:
+                cls._mark_down(peer_url, config, exception)
+                continue
+            cls._remember(content_hash, entry)
+            metrics.increment("peer_cache.hit")
+            return entry
+
+        cls._remember(content_hash, None)
+        metrics.increment("peer_cache.miss")
+        return None
+
+    @classmethod
+    def lookup_many(cls, content_hashes: list[str]) -> dict[str, PeerEntry]:
+        """Asks the peers about many files with one batch request per peer and 'BatchSize' hashes
+
+        Args:
+            content_hashes (list[str]): Hashes computed by 'partial_content_hash'
+
+        Returns:
+            dict[str, PeerEntry]: Content hash -> entry, for the files a peer knows
+        """
+        config = _load_config()
+        if not config["Peers"]:
+            return {}
+
+        found, pending, previous = {}, [], {}
+        for content_hash in dict.fromkeys(content_hashes):
+            is_fresh, entry = cls._cached(content_hash, config)
+            if is_fresh:
+                if entry is not None:
+                    found[content_hash] = entry
+            else:
+                pending.append(content_hash)
+                if entry is not None:
+                    previous[content_hash] = entry
+
+        session = cls._get_session()
+        for peer_url in cls._live_peers(config):
+            if not pending:
+                break
+            answered = set()
+            for start in range(0, len(pending), config["BatchSize"]):
+                batch = pending[start:start + config["BatchSize"]]
+                known = {
+                    content_hash: previous[content_hash].etag
+                    if content_hash in previous and previous[content_hash].peer_url == peer_url
+                    else ""
+                    for content_hash in batch
+                }
+                try:
+                    with metrics.timer("peer_cache.lookup_batch"):
+                        response = session.post(
+                            f"{peer_url}{API_PREFIX}/lookup", json={"hashes": known}, timeout=config["TimeoutSecs"]
+                        )
+                    response.raise_for_status()
+                    body = response.json()
+                    entries = {
+                        content_hash: PeerEntry.from_json(content_hash, peer_url, data["etag"], data)
+                        for content_hash, data in body["entries"].items()
+                        if content_hash in known
+                    }
+                    unchanged = [content_hash for content_hash in body["unchanged"] if known.get(content_hash)]
+                except (requests.RequestException, ValueError, KeyError, TypeError, AttributeError) as exception:
+                    cls._mark_down(peer_url, config, exception)
+                    break
+
+                for content_hash, entry in entries.items():
+                    found[content_hash] = entry
+                    cls._remember(content_hash, entry)
+                for content_hash in unchanged:
+                    found[content_hash] = previous[content_hash]
+                    cls._remember(content_hash, previous[content_hash])
+                answered.update(entries, unchanged)
+            pending = [content_hash for content_hash in pending if content_hash not in answered]
+
+        # Misses are remembered too, unless no peer could be asked at all
+        if cls._live_peers(config):
+            for content_hash in pending:
+                cls._remember(content_hash, None)
+        metrics.increment("peer_cache.hit", len(found))
+        metrics.increment("peer_cache.miss", len(pending))
+        return found
+
+    @classmethod
+    def prefetch(cls, video_paths: list[str]) -> int:
+        """Looks up indexed videos in batches, so the following 'lookup' calls are answered from memory
+
+        Args:
+            video_paths (list[str]): Full paths of indexed videos
+
+        Returns:
+            int: Number of videos a peer knows
+        """
+        if not cls.enabled():
+            return 0
+        return len(cls.lookup_many(list(queries.get_content_hashes(video_paths).values())))
+
+    @classmethod
+    def lookup_video(cls, video_path: str) -> PeerEntry | None:
+        """Looks up an indexed video by its stored content hash
+
+        Args:
+            video_path (str): Full path of the video
+
+        Returns:
+            Optional[PeerEntry]: What a peer knows, None if no peer knows it or it was never hashed
+        """
+        if not cls.enabled():
+            return None
+        content_hash = queries.get_content_hashes([video_path]).get(video_path)
+        return cls.lookup(content_hash) if content_hash is not None else None
+
+    @classmethod
+    def fetch_poster(cls, entry: PeerEntry) -> bytes | None:
+        """Downloads the poster of an entry from the peer that answered it
+
+        Args:
+            entry (PeerEntry): Entry with a poster
+
+        Returns:
+            Optional[bytes]: Image file content, None if the peer has no poster or did not answer
+        """
+        if entry.poster_etag is None:
+            return None
+        config = _load_config()
+        try:
+            with metrics.timer("peer_cache.poster_download"):
+                response = cls._get_session().get(
+                    f"{entry.peer_url}{API_PREFIX}/posters/{entry.content_hash}", timeout=config["TimeoutSecs"]
+                )
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+        except requests.RequestException as exception:
+            cls._mark_down(entry.peer_url, config, exception)
+            return None
+        return response.content
+
+    @classmethod
+    def resolve(cls, entry: PeerEntry) -> tuple[ProviderResult | None, ProviderResult | None]:
+        """Turns an entry into metadata provider results, for the indexing pipeline
+
+        The metadata counts when the peer resolved the title, the poster unless the
+        peer's is a screenshot, which is no better than taking one locally.
+
+        Args:
+            entry (PeerEntry): Entry of the file being indexed
+
+        Returns:
+            tuple: Metadata result and poster result, each None if the peer has nothing useful
+        """
+        metadata_result = None
+        if entry.title:
+            metadata_result = ProviderResult(
+                provider="peer",
+                confidence=CONFIDENCE_HIGH,
+                title=entry.title,
+                year=entry.year,
+                overview=entry.overview,
+                genres=entry.genres,
+                director=entry.director,
+            )
+
+        poster_result = None
+        if entry.poster_source not in ("", "screenshot"):
+            poster = cls.fetch_poster(entry)
+            if poster is not None:
+                poster_result = ProviderResult(provider="peer", poster=poster, poster_confidence=CONFIDENCE_HIGH)
+        return metadata_result, poster_result
+
+    @classmethod
+    def clear(cls) -> None:
+        """Forgets every answer and failed peer, e.g. after the peers were changed"""
+        with cls._lock:
+            cls._answers.clear()
+            cls._down_until.clear()
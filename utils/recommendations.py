@@ -0,0 +1,216 @@
+"""Recommendations for the "more like this" strip of the movie browser.
+
+Every title is one row of a dense float32 feature matrix: multi-hot genres and
+one-hot decade and language, each weighted by the config. Directors are far too
+many for one column each, so they are kept as an id per row and compared with
+a vectorized equality. The similarity of one title to all the others is then one
+matrix-vector product, and rows and columns grow by doubling as the library and
+the vocabulary grow.
+"""
+import logging
+
+import numpy as np
+
+from utils import metrics
+from utils.config_service import ConfigService
+from utils.database import models
+
+logger = logging.getLogger(__name__)
+
+_INITIAL_ROWS = 256
+_INITIAL_COLUMNS = 64
+
+
+def _load_config() -> dict:
+    return ConfigService.get("recommendations_config.yaml")
+
+
+def _grow(array: np.ndarray, rows: int, columns: int | None = None) -> np.ndarray:
+    """Returns a zero padded copy of 'array' with at least the given shape, sizes doubling"""
+    new_rows = len(array)
+    while new_rows < rows:
+        new_rows *= 2
+    shape = (new_rows,) if array.ndim == 1 else (new_rows, array.shape[1])
+    if columns is not None:
+        new_columns = array.shape[1]
+        while new_columns < columns:
+            new_columns *= 2
+        shape = (new_rows, new_columns)
+    if shape == array.shape:
+        return array
+
+    grown = np.full(shape, -1 if array.dtype == np.int32 else 0, dtype=array.dtype)
+    grown[tuple(slice(0, size) for size in array.shape)] = array
+    return grown
+
+
+class SimilarityIndex:
+    """Feature matrix of the library, answers nearest neighbour queries with cosine similarity
+
+    Titles are added and removed one by one, neighbour lists are cached until the library changes.
+    """
+
+    def __init__(self, config: dict | None = None) -> None:
+        """
+        Args:
+            config (dict, optional): Recommendations config, loaded from 'recommendations_config.yaml' if None
+        """
+        config = config or _load_config()
+        self._weights = config["Weights"]
+
+        # Weighted, not normalized, features, norms are kept aside so rows can be updated in place
+        self._matrix = np.zeros((_INITIAL_ROWS, _INITIAL_COLUMNS), dtype=np.float32)
+        self._norms = np.zeros(_INITIAL_ROWS, dtype=np.float32)
+        self._director_ids = np.full(_INITIAL_ROWS, -1, dtype=np.int32)
+        self._columns: dict[tuple[str, str], int] = {}
+        self._directors: dict[str, int] = {}
+
+        self._videos: list[models.VideoMetadata] = []
+        self._rows: dict[str, int] = {}
+        self._neighbours: dict[tuple[str, int], list[models.VideoMetadata]] = {}
+
+    def __len__(self) -> int:
+        return len(self._videos)
+
+    def __contains__(self, full_path: str) -> bool:
+        return full_path in self._rows
+
+    def _set_features(self, row: int, metadata: models.VideoMetadata) -> None:
+        """Writes the features of a title in its row"""
+        values = [("Genres", genre.strip().lower()) for genre in metadata.tmdb_genres]
+        year = metadata.tmdb_year[:4]
+        if year.isdigit():
+            values.append(("Decade", str(int(year) // 10)))
+        if metadata.language != "N/A":
+            values.append(("Language", metadata.language.strip().lower()))
+
+        columns = []
+        for feature, value in values:
+            if not value:
+                continue
+            if (feature, value) not in self._columns:
+                self._columns[(feature, value)] = len(self._columns)
+            columns.append((self._columns[(feature, value)], self._weights[feature]))
+        self._matrix = _grow(self._matrix, len(self._matrix), len(self._columns))
+
+        self._matrix[row] = 0
+        for column, weight in columns:
+            self._matrix[row, column] = weight
+
+        director = metadata.tmdb_director.strip().lower()
+        director_id = self._directors.setdefault(director, len(self._directors)) if director else -1
+        self._director_ids[row] = director_id
+
+        squared_norm = float(self._matrix[row] @ self._matrix[row])
+        if director_id >= 0:
+            squared_norm += self._weights["Director"] ** 2
+        self._norms[row] = np.sqrt(squared_norm)
+
+    def add(self, videos: list[models.VideoMetadata]) -> None:
+        """Adds titles to the index, a title already in it is updated
+
+        Args:
+            videos (list[models.VideoMetadata]): Titles to add
+        """
+        if not videos:
+            return
+
+        needed = len(self._videos) + len(videos)
+        self._matrix = _grow(self._matrix, needed, self._matrix.shape[1])
+        self._norms = _grow(self._norms, needed)
+        self._director_ids = _grow(self._director_ids, needed)
+
+        for metadata in videos:
+            row = self._rows.get(metadata.full_path)
+            if row is None:
+                row = len(self._videos)
+                self._rows[metadata.full_path] = row
+                self._videos.append(metadata)
+            else:
+                self._videos[row] = metadata
+            self._set_features(row, metadata)
+        self._neighbours.clear()
+
+    def remove(self, full_paths: list[str]) -> None:
+        """Drops titles from the index, unknown paths are ignored
+
+        Args:
+            full_paths (list[str]): Full paths of the titles to drop
+        """
+        for full_path in full_paths:
+            row = self._rows.pop(full_path, None)
+            if row is None:
+                continue
+
+            # The last row takes the free slot, so the used rows stay contiguous
+            last = len(self._videos) - 1
+            last_video = self._videos.pop()
+            if row != last:
+                self._videos[row] = last_video
+                self._rows[last_video.full_path] = row
+                self._matrix[row] = self._matrix[last]
+                self._norms[row] = self._norms[last]
+                self._director_ids[row] = self._director_ids[last]
+            self._matrix[last] = 0
+            self._norms[last] = 0
+            self._director_ids[last] = -1
+        self._neighbours.clear()
+
+    def sync(self, videos: list[models.VideoMetadata]) -> None:
+        """Brings the index in line with the library, only touching the titles that changed
+
+        Args:
+            videos (list[models.VideoMetadata]): Every title of the library
+        """
+        current = {metadata.full_path: metadata for metadata in videos}
+        self.remove([full_path for full_path in self._rows if full_path not in current])
+        self.add(
+            [
+                metadata
+                for full_path, metadata in current.items()
+                if full_path not in self._rows or self._videos[self._rows[full_path]] != metadata
+            ]
+        )
+        logger.debug("Similarity index holds %d titles", len(self._videos))
+
+    def similar(self, full_path: str, count: int) -> list[models.VideoMetadata]:
+        """Returns the titles closest to the given one, most similar first
+
+        Args:
+            full_path (str): Full path of the title
+            count (int): Maximum number of titles
+
+        Returns:
+            list[models.VideoMetadata]: Similar titles, empty if the title is not indexed
+        """
+        key = (full_path, count)
+        if key in self._neighbours:
+            metrics.increment("recommendations.cache_hit")
+            return self._neighbours[key]
+
+        row = self._rows.get(full_path)
+        if row is None or count <= 0:
+            return []
+
+        with metrics.timer("recommendations.query"):
+            used = len(self._videos)
+            dots = self._matrix[:used] @ self._matrix[row]
+            if self._director_ids[row] >= 0:
+                dots += (self._director_ids[:used] == self._director_ids[row]) * np.float32(
+                    self._weights["Director"] ** 2
+                )
+            # Titles without any known feature have a zero norm and never match
+            norms = self._norms[:used] * self._norms[row]
+            scores = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+            scores[row] = -1
+            count = min(count, len(self._videos) - 1)
+            if count <= 0:
+                return []
+
+            # Top 'count' in linear time, then only those get sorted
+            top = np.argpartition(-scores, count - 1)[:count]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            neighbours = [self._videos[idx] for idx in top if scores[idx] > 0]
+
+        self._neighbours[key] = neighbours
+        return neighbours
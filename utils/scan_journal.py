@@ -0,0 +1,159 @@
+"""Per file progress of indexing and enrichment, so interrupted work resumes.
+
+The app powers the machine off on close and boxes lose power mid-scan, so every
+file goes through 'STAGES' in order and the journal records, in the library
+database, the last completed stage and what the stages produced so far (probe
+results, the TMDB match, ...). A restarted scan or enrichment reads the entry
+back and skips the completed stages. The entry is dropped once the file needs
+no more work.
+
+Native code (MediaInfo, OpenCV) runs inside 'attempt', which journals a marker
+first. A segfault, or a hang the indexer client kills, leaves the marker behind,
+the next attempt counts it as a crash and a file that keeps crashing the indexer
+is quarantined instead of crashing it on every restart.
+"""
+import os
+import time
+import logging
+import threading
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from utils import metrics
+from utils.config_service import ConfigService
+from utils.database import queries, models
+from utils.exceptions import QuarantinedFileException
+
+# Indexing runs up to 'committed' (the row is in the library), enrichment does the rest.
+# 'attempting' is the entry of a file whose probe started but never finished.
+STAGES = ("attempting", "probed", "fingerprinted", "local_metadata", "screenshot", "committed", "matched", "poster")
+
+logger = logging.getLogger(__name__)
+
+# Native steps running in this process, path -> (step, time.monotonic() when it started)
+_running_attempts: dict[str, tuple[str, float]] = {}
+_running_lock = threading.Lock()
+
+
+def load(full_path: str, stat: os.stat_result | None = None) -> models.ScanJournalEntry | None:
+    """Returns the journaled progress of a file
+
+    Args:
+        full_path (str): Full path to the video file
+        stat (os.stat_result, optional): Current stat of the file, progress made on another size / mtime is discarded
+
+    Returns:
+        Optional[models.ScanJournalEntry]: Journal entry, None if there is nothing to resume
+    """
+    entry = queries.get_scan_journal_entry(full_path)
+    if entry is None:
+        return None
+
+    if stat is not None and (entry.size, entry.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        logger.debug("%s changed since its journal entry, starting over", full_path)
+        return None
+
+    # 'committed' is the usual hand over from indexing to enrichment, not an interruption
+    if entry.stage != "committed":
+        metrics.increment("scan_journal.resumed")
+        logger.info("Resuming %s after stage '%s'", full_path, entry.stage)
+    return entry
+
+
+def reached(entry: models.ScanJournalEntry | None, stage: str) -> bool:
+    """Returns True if the journal shows 'stage' (or a later one) as completed"""
+    return entry is not None and STAGES.index(entry.stage) >= STAGES.index(stage)
+
+
+def record(
+    full_path: str,
+    stage: str,
+    data: dict,
+    source_id: int | None = None,
+    stat: os.stat_result | None = None,
+) -> models.ScanJournalEntry:
+    """Records a completed stage, this is the checkpoint a restart resumes from
+
+    Args:
+        full_path (str): Full path to the video file
+        stage (str): One of 'STAGES'
+        data (dict): Everything the completed stages produced, JSON serializable
+        source_id (int, optional): Source of the file, kept from the existing entry if None
+        stat (os.stat_result, optional): Stat of the file, kept from the existing entry if None
+
+    Returns:
+        models.ScanJournalEntry: The recorded entry
+    """
+    entry = models.ScanJournalEntry(
+        full_path=full_path,
+        stage=stage,
+        data=dict(data),
+        source_id=source_id,
+        size=stat.st_size if stat is not None else None,
+        mtime_ns=stat.st_mtime_ns if stat is not None else None,
+    )
+    queries.upsert_scan_journal_entry(entry, time.time())
+    return entry
+
+
+def finish(full_path: str) -> None:
+    """Drops the entry of a file that needs no more work
+
+    Args:
+        full_path (str): Full path to the video file
+    """
+    queries.delete_scan_journal_entry(full_path)
+
+
+@contextmanager
+def attempt(
+    full_path: str, step: str, source_id: int | None = None, stat: os.stat_result | None = None
+) -> Iterator[None]:
+    """Journals that native code runs on a file, so a crash of the process is counted against the file
+
+    The stage recorded after the step clears the marker, an exception clears it too.
+
+    Args:
+        full_path (str): Full path to the video file
+        step (str): What runs, e.g. 'probe' or 'screenshot'
+        source_id (int, optional): Source of the file, kept from the existing entry if None
+        stat (os.stat_result, optional): Stat of the file, kept from the existing entry if None
+
+    Raises:
+        QuarantinedFileException: If the file crashed the indexer 'QuarantineAfterCrashes' times
+    """
+    crashes = queries.begin_scan_journal_attempt(
+        full_path,
+        step,
+        source_id,
+        stat.st_size if stat is not None else None,
+        stat.st_mtime_ns if stat is not None else None,
+        time.time(),
+    )
+    if crashes >= ConfigService.get("library_sources_config.yaml")["QuarantineAfterCrashes"]:
+        queries.end_scan_journal_attempt(full_path)
+        metrics.increment("scan_journal.quarantined")
+        raise QuarantinedFileException(full_path, crashes)
+    if crashes:
+        logger.warning("%s crashed the indexer %d times, trying '%s' again", full_path, crashes, step)
+
+    with _running_lock:
+        _running_attempts[full_path] = (step, time.monotonic())
+    try:
+        yield
+    except BaseException:
+        queries.end_scan_journal_attempt(full_path)
+        raise
+    finally:
+        with _running_lock:
+            _running_attempts.pop(full_path, None)
+
+
+def longest_attempt() -> tuple[str, str, float] | None:
+    """Returns the path, step and running time in seconds of the oldest native step still running, None if idle"""
+    with _running_lock:
+        if not _running_attempts:
+            return None
+        full_path, (step, started_at) = min(_running_attempts.items(), key=lambda item: item[1][1])
+    return full_path, step, time.monotonic() - started_at
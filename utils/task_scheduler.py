@@ -0,0 +1,383 @@
+"""Central scheduler for the background work (scans, seek previews, TMDB lookups).
+
+Tasks go to a bounded pool per resource they mostly use, CPU, disk or network,
+and run highest priority first. The player reports when a title plays: every
+pool then drops to its 'WorkersDuringPlayback' (zero pauses it) so libVLC keeps
+the CPU and disk, and once playback ends the pools ramp back up one worker every
+'RampUpStepSecs'. Long tasks call 'TaskScheduler.checkpoint()' between units of
+work, which is where they pause and where cancellation is noticed.
+
+Tasks of a pool run in parallel and write to the library database: every worker
+thread has its own connection ('AppDatabase.get_connection' is per thread), a
+task never hands a connection or an open cursor to another thread.
+
+Queue depth and running tasks are published as 'tasks.<resource>.*' gauges, the
+time spent waiting and running as timers.
+"""
+import time
+import heapq
+import logging
+import itertools
+import threading
+import functools
+
+from typing import Any, Callable, Hashable
+from concurrent.futures import Future
+
+from utils import metrics
+from utils.config_service import ConfigService
+from utils.database.connection import AppDatabase
+
+RESOURCE_CPU = "cpu"
+RESOURCE_DISK = "disk"
+RESOURCE_NETWORK = "network"
+RESOURCES = (RESOURCE_CPU, RESOURCE_DISK, RESOURCE_NETWORK)
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0  # The user is waiting on it
+PRIORITY_NORMAL = 10
+PRIORITY_BACKGROUND = 20  # Nice to have, e.g. seek previews
+
+logger = logging.getLogger(__name__)
+
+# Task run by the current thread, for 'checkpoint'
+_current = threading.local()
+
+
+def _load_config() -> dict:
+    return ConfigService.get("task_scheduler_config.yaml")
+
+
+class Task:
+    """A unit of background work, returned by 'TaskScheduler.submit'"""
+
+    def __init__(self, func: Callable, args: tuple, resource: str, priority: int, name: str, key: Hashable) -> None:
+        self.func = func
+        self.args = args
+        self.resource = resource
+        self.priority = priority
+        self.name = name
+        self.key = key
+        self.future: Future = Future()
+        self.cancel_event = threading.Event()
+        self.enqueued_at = time.monotonic()
+        # Worker slot while running, the pools pause their highest slots first
+        self.slot: int | None = None
+
+    def cancel(self) -> None:
+        """Drops the task if it did not start yet, else asks it to stop at its next checkpoint"""
+        self.cancel_event.set()
+        self.future.cancel()
+        TaskScheduler.notify(self.resource)
+
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float | None = None) -> Any:
+        """Waits for the task and returns what it returned
+
+        Raises:
+            concurrent.futures.CancelledError: If the task was cancelled before it started
+            Exception: Whatever the task raised
+        """
+        return self.future.result(timeout)
+
+    def add_done_callback(self, callback: Callable[["Task"], None]) -> None:
+        """Calls 'callback(task)' once the task finished or was cancelled, from the thread that ended it"""
+        self.future.add_done_callback(lambda _: callback(self))
+
+
+class _ResourcePool:
+    """Priority queue and worker threads of one resource class"""
+
+    def __init__(self, resource: str, config: dict, ramp_up_step_secs: float) -> None:
+        self.resource = resource
+        self.workers = config["Workers"]
+        self.workers_during_playback = min(config["WorkersDuringPlayback"], self.workers)
+        self.ramp_up_step_secs = ramp_up_step_secs
+
+        self.condition = threading.Condition()
+        self.heap: list[tuple[int, int, Task]] = []
+        self.pending_keys: dict[Hashable, Task] = {}
+        self.running = 0
+        self.stopping = False
+        self.playing = False
+        self.idle_since: float | None = None  # When playback last ended, None if it never ran
+        self._sequence = itertools.count()
+        self._threads: list[threading.Thread] = []
+
+    def limit(self) -> int:
+        """Number of workers currently allowed to run, lower while playing and right after"""
+        if self.playing:
+            return self.workers_during_playback
+        if self.idle_since is None or self.ramp_up_step_secs <= 0:
+            return self.workers
+        steps = int((time.monotonic() - self.idle_since) / self.ramp_up_step_secs)
+        return min(self.workers, self.workers_during_playback + steps)
+
+    def _wait_timeout(self) -> float | None:
+        """How long a blocked worker may sleep before the limit can grow on its own"""
+        if self.playing or self.limit() >= self.workers:
+            return None
+        elapsed = time.monotonic() - self.idle_since
+        return self.ramp_up_step_secs - elapsed % self.ramp_up_step_secs
+
+    def wait_for_slot(self, slot: int, task: Task | None = None) -> None:
+        """Blocks while 'slot' is above the limit, the caller holds the condition"""
+        while (
+            slot >= self.limit()
+            and not self.stopping
+            and not (task is not None and task.cancel_event.is_set())
+        ):
+            self.condition.wait(self._wait_timeout())
+
+    def publish(self) -> None:
+        metrics.set_gauge(f"tasks.{self.resource}.queued", len(self.heap))
+        metrics.set_gauge(f"tasks.{self.resource}.running", self.running)
+        metrics.set_gauge(f"tasks.{self.resource}.limit", self.limit())
+
+    def push(self, task: Task) -> Task:
+        with self.condition:
+            if task.key is not None:
+                pending = self.pending_keys.get(task.key)
+                if pending is not None:
+                    return pending
+                self.pending_keys[task.key] = task
+
+            heapq.heappush(self.heap, (task.priority, next(self._sequence), task))
+            self.publish()
+            self._ensure_threads()
+            self.condition.notify()
+        return task
+
+    def _ensure_threads(self) -> None:
+        while len(self._threads) < self.workers:
+            slot = len(self._threads)
+            thread = threading.Thread(
+                target=self._run, args=(slot,), name=f"task-{self.resource}-{slot}", daemon=True
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _pop(self, slot: int) -> Task | None:
+        """Waits for a task this slot may run, None when the pool stops"""
+        with self.condition:
+            while True:
+                while not self.stopping and not (self.heap and slot < self.limit()):
+                    self.condition.wait(self._wait_timeout())
+                if self.stopping:
+                    return None
+
+                _, _, task = heapq.heappop(self.heap)
+                if task.key is not None and self.pending_keys.get(task.key) is task:
+                    del self.pending_keys[task.key]
+                # False if the task was cancelled while queued
+                if task.future.set_running_or_notify_cancel():
+                    task.slot = slot
+                    self.running += 1
+                    self.publish()
+                    return task
+                self.publish()
+
+    def _run(self, slot: int) -> None:
+        while True:
+            task = self._pop(slot)
+            if task is None:
+                AppDatabase.close_connection()
+                return
+
+            started_at = time.monotonic()
+            metrics.observe(f"tasks.{self.resource}.wait", started_at - task.enqueued_at)
+            _current.task = task
+            try:
+                result = task.func(*task.args)
+            except Exception as exception:
+                logger.warning("Background task %s failed: %s", task.name, exception)
+                task.future.set_exception(exception)
+            else:
+                task.future.set_result(result)
+            finally:
+                _current.task = None
+                metrics.observe(f"tasks.{self.resource}.run", time.monotonic() - started_at)
+                metrics.increment(f"tasks.{self.resource}.completed")
+                with self.condition:
+                    self.running -= 1
+                    self.publish()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopping = True
+            for _, _, task in self.heap:
+                task.cancel_event.set()
+                task.future.cancel()
+            self.heap.clear()
+            self.pending_keys.clear()
+            self.publish()
+            self.condition.notify_all()
+
+
+class TaskScheduler:
+    """Singleton owning one pool per resource class, pools and threads are created on first use"""
+
+    _pools: dict[str, _ResourcePool] = {}
+    _lock = threading.Lock()
+    _playback_active = False
+    _idle_since: float | None = None
+
+    @classmethod
+    def _get_pool(cls, resource: str) -> _ResourcePool:
+        pool = cls._pools.get(resource)
+        if pool is not None:
+            return pool
+
+        with cls._lock:
+            if resource not in cls._pools:
+                if resource not in RESOURCES:
+                    raise ValueError(f"Unknown resource class: {resource}")
+                config = _load_config()
+                pool = _ResourcePool(
+                    resource, config["Pools"][resource.capitalize()], config["RampUpStepSecs"]
+                )
+                pool.playing, pool.idle_since = cls._playback_active, cls._idle_since
+                cls._pools[resource] = pool
+            return cls._pools[resource]
+
+    @classmethod
+    def submit(
+        cls,
+        func: Callable,
+        *args: Any,
+        resource: str,
+        priority: int = PRIORITY_NORMAL,
+        name: str | None = None,
+        key: Hashable | None = None,
+    ) -> Task:
+        """Queues 'func(*args)' on the pool of a resource class
+
+        Args:
+            func (Callable): Work to run, use functools.partial for keyword arguments
+            resource (str): RESOURCE_CPU, RESOURCE_DISK or RESOURCE_NETWORK
+            priority (int, optional): PRIORITY_* value, lower runs first. Defaults to PRIORITY_NORMAL.
+            name (str, optional): Shown in the logs, defaults to the function name
+            key (Hashable, optional): While a task with the same key is queued, that task is returned instead
+
+        Returns:
+            Task: The queued task
+        """
+        name = name or getattr(func, "__name__", repr(func))
+        return cls._get_pool(resource).push(Task(func, args, resource, priority, name, key))
+
+    @classmethod
+    def map(
+        cls, func: Callable, items: list, resource: str, priority: int = PRIORITY_NORMAL, name: str | None = None
+    ) -> list:
+        """Runs 'func' on every item on a pool and waits for all of them
+
+        Never call it from a task of the same pool, the pool could be waiting on itself.
+
+        Returns:
+            list: Results, in the order of 'items'
+
+        Raises:
+            Exception: The first exception raised by 'func'
+        """
+        tasks = [cls.submit(func, item, resource=resource, priority=priority, name=name) for item in items]
+        return [task.result() for task in tasks]
+
+    @classmethod
+    def current_task(cls) -> Task | None:
+        """Task run by the calling thread, None outside of the scheduler"""
+        return getattr(_current, "task", None)
+
+    @classmethod
+    def bind(cls, func: Callable) -> Callable:
+        """Wraps 'func' so it checkpoints as the current task, when it is run by a helper thread of that task"""
+        task = cls.current_task()
+        if task is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            _current.task = task
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current.task = None
+
+        return wrapper
+
+    @classmethod
+    def checkpoint(cls) -> bool:
+        """Pauses the current task while its pool is throttled for playback
+
+        Does nothing outside of the scheduler, e.g. in the headless scan.
+
+        Returns:
+            bool: True if the task was cancelled and should stop
+        """
+        task = cls.current_task()
+        if task is None:
+            return False
+
+        pool = cls._get_pool(task.resource)
+        with pool.condition:
+            pool.wait_for_slot(task.slot or 0, task)
+        return task.cancel_event.is_set() or pool.stopping
+
+    @classmethod
+    def is_playback_active(cls) -> bool:
+        """Returns True while a title plays, set by 'set_playback_active'"""
+        return cls._playback_active
+
+    @classmethod
+    def set_playback_active(cls, active: bool) -> None:
+        """Called by the player, throttles every pool while a title plays
+
+        Args:
+            active (bool): True when playback starts, False when it ends
+        """
+        with cls._lock:
+            cls._playback_active = active
+            if not active:
+                cls._idle_since = time.monotonic()
+            pools = list(cls._pools.values())
+
+        for pool in pools:
+            with pool.condition:
+                pool.playing, pool.idle_since = active, cls._idle_since
+                pool.publish()
+                pool.condition.notify_all()
+        logger.debug("Background tasks %s", "throttled for playback" if active else "ramping up")
+
+    @classmethod
+    def notify(cls, resource: str) -> None:
+        """Wakes the workers of a pool, e.g. after a task was cancelled"""
+        pool = cls._pools.get(resource)
+        if pool is not None:
+            with pool.condition:
+                pool.condition.notify_all()
+
+    @classmethod
+    def stats(cls) -> dict[str, dict[str, int]]:
+        """Returns 'queued', 'running', 'limit' and 'workers' of every pool in use"""
+        stats = {}
+        for resource, pool in list(cls._pools.items()):
+            with pool.condition:
+                stats[resource] = {
+                    "queued": len(pool.heap),
+                    "running": pool.running,
+                    "limit": pool.limit(),
+                    "workers": pool.workers,
+                }
+        return stats
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Cancels the queued tasks and asks the running ones to stop at their next checkpoint"""
+        with cls._lock:
+            pools = list(cls._pools.values())
+        for pool in pools:
+            pool.stop()
@@ -0,0 +1,127 @@
+import os
+import json
+import logging
+import threading
+
+from PIL import Image
+
+from utils import metrics
+from utils.file_handling import load_json_file
+
+THUMBNAILS_FOLDER = os.path.join("resources", "movie_posters", "thumbnails")
+# Sizes requested by the GUI, so the headless scan knows which ones to pre-generate
+SIZES_FILE = os.path.join(THUMBNAILS_FOLDER, "sizes.json")
+
+_sizes_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def get_thumbnail_path(image_path: str, width: int, height: int) -> str:
+    """Returns where the resized copy of a poster is stored
+
+    Args:
+        image_path (str): Path to the full size poster
+        width (int): Thumbnail width
+        height (int): Thumbnail height
+
+    Returns:
+        str: Path to the thumbnail file
+    """
+    file_name_no_ext = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(THUMBNAILS_FOLDER, f"{file_name_no_ext}_{width}x{height}.png")
+
+
+def get_thumbnail_sizes() -> list[tuple[int, int]]:
+    """Returns every (width, height) the GUI has requested so far"""
+    if not os.path.exists(SIZES_FILE):
+        return []
+    return [tuple(size) for size in load_json_file(SIZES_FILE) or []]
+
+
+def _record_thumbnail_size(width: int, height: int) -> None:
+    with _sizes_lock:
+        sizes = get_thumbnail_sizes()
+        if (width, height) in sizes:
+            return
+
+        os.makedirs(THUMBNAILS_FOLDER, exist_ok=True)
+        with open(SIZES_FILE, "w", encoding="utf_8") as sizes_f:
+            json.dump(sizes + [(width, height)], sizes_f)
+
+
+def _is_fresh(thumbnail_path: str, image_path: str) -> bool:
+    return (
+        os.path.exists(thumbnail_path)
+        and os.path.getmtime(thumbnail_path) >= os.path.getmtime(image_path)
+    )
+
+
+def generate_thumbnail(image_path: str, width: int, height: int) -> Image.Image | None:
+    """Resizes a poster and stores the result, unless an up to date thumbnail already exists
+
+    Args:
+        image_path (str): Path to the full size poster
+        width (int): Thumbnail width
+        height (int): Thumbnail height
+
+    Returns:
+        Optional[Image.Image]: The new thumbnail, None if the poster is missing or the thumbnail is up to date
+    """
+    if not os.path.exists(image_path):
+        return None
+
+    thumbnail_path = get_thumbnail_path(image_path, width, height)
+    if _is_fresh(thumbnail_path, image_path):
+        return None
+
+    os.makedirs(THUMBNAILS_FOLDER, exist_ok=True)
+    with metrics.timer("image.resize"):
+        with Image.open(image_path) as image:
+            thumbnail = image.convert("RGB").resize((width, height), Image.LANCZOS)
+        thumbnail.save(thumbnail_path)
+    return thumbnail
+
+
+def load_thumbnail(image_path: str, width: int, height: int) -> Image.Image | None:
+    """Returns the resized poster, from the thumbnail cache when possible
+
+    Args:
+        image_path (str): Path to the full size poster
+        width (int): Thumbnail width
+        height (int): Thumbnail height
+
+    Returns:
+        Optional[Image.Image]: The thumbnail, None if the poster does not exist
+    """
+    if not os.path.exists(image_path):
+        return None
+
+    thumbnail_path = get_thumbnail_path(image_path, width, height)
+    if _is_fresh(thumbnail_path, image_path):
+        metrics.increment("image.thumbnail_cache_hit")
+        with metrics.timer("image.thumbnail_load"), Image.open(thumbnail_path) as thumbnail:
+            thumbnail.load()
+            return thumbnail
+
+    _record_thumbnail_size(width, height)
+    return generate_thumbnail(image_path, width, height)
+
+
+def generate_all_thumbnails(image_paths: list[str]) -> int:
+    """Pre-generates every thumbnail size the GUI uses for the given posters
+
+    Args:
+        image_paths (list[str]): Paths to the full size posters
+
+    Returns:
+        int: Number of thumbnails written
+    """
+    generated = 0
+    for width, height in get_thumbnail_sizes():
+        for image_path in image_paths:
+            try:
+                generated += generate_thumbnail(image_path, width, height) is not None
+            except Exception as exception:
+                logger.warning("Could not generate thumbnail for %s: %s", image_path, exception)
+    return generated
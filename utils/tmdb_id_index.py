@@ -0,0 +1,252 @@
+"""Offline title -> TMDB id index, built from the TMDB daily ID exports.
+
+TMDB publishes the id of every movie and TV show daily as gzipped JSON lines,
+e.g. 'movie_ids_05_15_2024.json.gz' with one '{"id": 603, "original_title":
+"The Matrix", "popularity": 80.1, ...}' per line. 'TmdbIdIndex.import_export'
+loads such a file, downloaded by the user, into its own SQLite file keyed by the
+normalized title. Resolving a title to candidate ids is then a local B-tree
+lookup, most popular first, and TMDB is only called for the details of the
+chosen id. Titles missing from the index still go through the search endpoint.
+"""
+import os
+import re
+import gzip
+import json
+import time
+import logging
+import sqlite3
+import itertools
+import threading
+import unicodedata
+
+from typing import Iterator, TextIO
+
+from utils import metrics
+
+INDEX_PATH = os.path.join("db", "tmdb_id_index.db")
+
+KIND_MOVIE = "movie"
+KIND_TV = "tv"
+
+# Rows written per statement while importing, an export holds about a million movies
+_IMPORT_BATCH_SIZE = 50_000
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(title: str) -> str:
+    """Returns the lookup key of a title: accents dropped, case folded, punctuation collapsed
+
+    Args:
+        title (str): Title as in the export or parsed from a file name
+
+    Returns:
+        str: Normalized title, e.g. 'amelie' for 'Amélie'
+    """
+    decomposed = unicodedata.normalize("NFKD", title)
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    words = re.split(r"[\W_]+", without_accents.replace("&", " and ").casefold())
+    return " ".join(word for word in words if word)
+
+
+def _kind_from_file_name(export_path: str) -> str:
+    """Guesses the kind of an export from TMDB's file names"""
+    file_name = os.path.basename(export_path).lower()
+    if file_name.startswith("movie_ids"):
+        return KIND_MOVIE
+    if file_name.startswith("tv_series_ids"):
+        return KIND_TV
+    raise ValueError(f"Cannot tell whether {export_path} lists movies or TV shows, pass the kind")
+
+
+def _read_export(export_f: TextIO, kind: str) -> Iterator[tuple[str, str, float, int, str]]:
+    """Yields the index rows of an export, skipping adult titles and malformed lines"""
+    title_key = "original_title" if kind == KIND_MOVIE else "original_name"
+    for line in export_f:
+        try:
+            record = json.loads(line)
+            if record.get("adult"):
+                continue
+            title = record.get(title_key) or ""
+            normalized = normalize_title(title)
+            if normalized:
+                yield kind, normalized, float(record.get("popularity") or 0.0), int(record["id"]), title
+        except (ValueError, KeyError, TypeError):
+            if line.strip():
+                logger.debug("Skipping malformed export line: %s", line[:200])
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    # Clustered on the lookup key, so a lookup reads a single B-tree leaf
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tmdb_ids (
+            kind TEXT NOT NULL,
+            normalized_title TEXT NOT NULL,
+            popularity REAL NOT NULL,
+            tmdb_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            PRIMARY KEY (kind, normalized_title, popularity, tmdb_id)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tmdb_id_exports (
+            kind TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            titles INTEGER NOT NULL,
+            imported_at REAL NOT NULL
+        );
+        """
+    )
+
+
+class TmdbIdIndex:
+    """Singleton read connection to the index file, which is only opened once it exists
+
+    Queries hold the lock, they take microseconds and the connection is swapped after an import.
+    """
+
+    _conn: sqlite3.Connection | None = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def _get_connection(cls) -> sqlite3.Connection | None:
+        """Opens the index on first use, the caller holds the lock"""
+        if cls._conn is None and os.path.exists(INDEX_PATH):
+            cls._conn = sqlite3.connect(f"file:{INDEX_PATH}?mode=ro", uri=True, check_same_thread=False)
+        return cls._conn
+
+    @classmethod
+    def lookup(cls, title: str, is_tvshow: bool, limit: int = 5) -> list[int]:
+        """Returns the TMDB ids of the titles matching exactly once normalized, most popular first
+
+        Args:
+            title (str): Title of the movie or show
+            is_tvshow (bool): Indicates whether to look among the TV shows (True) or the movies (False)
+            limit (int, optional): Maximum number of ids. Defaults to 5.
+
+        Returns:
+            list[int]: Candidate ids, empty if the title or the whole index is missing
+        """
+        normalized = normalize_title(title)
+        if not normalized:
+            return []
+
+        with cls._lock, metrics.timer("tmdb_id_index.lookup"):
+            conn = cls._get_connection()
+            if conn is None:
+                return []
+            rows = conn.execute(
+                """
+                SELECT tmdb_id
+                FROM tmdb_ids
+                WHERE kind = ? AND normalized_title = ?
+                ORDER BY popularity DESC
+                LIMIT ?;
+                """,
+                [KIND_TV if is_tvshow else KIND_MOVIE, normalized, limit],
+            ).fetchall()
+        metrics.increment("tmdb_id_index.hit" if rows else "tmdb_id_index.miss")
+        return [row[0] for row in rows]
+
+    @classmethod
+    def import_export(cls, export_path: str, kind: str | None = None) -> int:
+        """Replaces the titles of one kind with the content of a TMDB ID export
+
+        The index is rebuilt next to the current one and swapped in once complete, so
+        lookups keep working during the import and an interrupted import changes nothing.
+
+        Args:
+            export_path (str): Export file, gzipped ('.json.gz') or not
+            kind (str, optional): KIND_MOVIE or KIND_TV, guessed from TMDB's file name if None
+
+        Raises:
+            ValueError: If the kind cannot be guessed
+            OSError: If the export cannot be read
+
+        Returns:
+            int: Number of titles imported
+        """
+        kind = kind or _kind_from_file_name(export_path)
+        if kind not in (KIND_MOVIE, KIND_TV):
+            raise ValueError(f"Unknown kind of TMDB export: {kind}")
+
+        tmp_path = INDEX_PATH + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        started_at = time.perf_counter()
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # Nothing to recover in a file that is thrown away unless complete
+            conn.execute("PRAGMA journal_mode = OFF;")
+            conn.execute("PRAGMA synchronous = OFF;")
+            _create_schema(conn)
+
+            # Keep the other kind, e.g. the shows when importing movies
+            if os.path.exists(INDEX_PATH):
+                conn.execute("ATTACH DATABASE ? AS previous;", [INDEX_PATH])
+                conn.execute("INSERT INTO tmdb_ids SELECT * FROM previous.tmdb_ids WHERE kind != ?;", [kind])
+                conn.execute(
+                    "INSERT INTO tmdb_id_exports SELECT * FROM previous.tmdb_id_exports WHERE kind != ?;", [kind]
+                )
+                conn.commit()
+                conn.execute("DETACH DATABASE previous;")
+
+            imported = 0
+            opener = gzip.open if export_path.endswith(".gz") else open
+            with opener(export_path, "rt", encoding="utf_8") as export_f:
+                rows = _read_export(export_f, kind)
+                while batch := list(itertools.islice(rows, _IMPORT_BATCH_SIZE)):
+                    conn.executemany("INSERT OR IGNORE INTO tmdb_ids VALUES (?, ?, ?, ?, ?);", batch)
+                    imported += len(batch)
+
+            conn.execute(
+                "INSERT INTO tmdb_id_exports VALUES (?, ?, ?, ?);",
+                [kind, os.path.basename(export_path), imported, time.time()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        # Written without syncing, flush it once before it replaces the current index
+        with open(tmp_path, "r+b") as index_f:
+            os.fsync(index_f.fileno())
+        with cls._lock:
+            cls._close()
+            os.replace(tmp_path, INDEX_PATH)
+
+        logger.info(
+            "Imported %d %s titles from %s in %.1fs",
+            imported,
+            kind,
+            export_path,
+            time.perf_counter() - started_at,
+        )
+        return imported
+
+    @classmethod
+    def close(cls) -> None:
+        """Closes the index, the next lookup opens it again"""
+        with cls._lock:
+            cls._close()
+
+    @classmethod
+    def _close(cls) -> None:
+        if cls._conn is not None:
+            cls._conn.close()
+            cls._conn = None
+
+    @classmethod
+    def get_exports(cls) -> list[dict]:
+        """Returns the 'kind', 'file_name', 'titles' and 'imported_at' of every imported export"""
+        with cls._lock:
+            conn = cls._get_connection()
+            if conn is None:
+                return []
+            rows = conn.execute(
+                "SELECT kind, file_name, titles, imported_at FROM tmdb_id_exports ORDER BY kind;"
+            ).fetchall()
+        return [dict(zip(("kind", "file_name", "titles", "imported_at"), row)) for row in rows]
@@ -1,21 +1,105 @@
 import os
 import json
+import time
+import logging
+import threading
 import requests
 
 from typing import Any
 
-from utils.file_handling import load_yaml_file
+from utils.config_service import ConfigService
+from utils.database import queries
+from utils import metrics
+
+logger = logging.getLogger(__name__)
 
 
 # Build script global values
-tmdb_settings = load_yaml_file(os.path.join("config", "tmdb_settings.yaml"))
+tmdb_settings = ConfigService.get("tmdb_settings.yaml")
 
 MOVIE_GENRE_MAP = tmdb_settings["MovieGenreMap"]
 TV_GENRE_MAP = tmdb_settings["TvGenreMap"]
-HEADERS = tmdb_settings["ApiHeaders"]
-HEADERS["Authorization"] = str(HEADERS["Authorization"]).replace(
-    "$token$", load_yaml_file(os.path.join(".", "config", "api_keys.yaml"))["TmdbApiKey"]
-)
+HEADERS = {
+    **tmdb_settings["ApiHeaders"],
+    "Authorization": str(tmdb_settings["ApiHeaders"]["Authorization"]).replace(
+        "$token$", ConfigService.get("api_keys.yaml")["TmdbApiKey"]
+    ),
+}
+CACHE_TTL_SECONDS = tmdb_settings["CacheTtlHours"] * 3600
+MAX_RETRIES = tmdb_settings["MaxRetries"]
+# Point these at a local stand-in server (benchmarks/fake_tmdb_server.py) to work offline
+API_BASE_URL = tmdb_settings["ApiBaseUrl"].rstrip("/")
+IMAGE_BASE_URL = tmdb_settings["ImageBaseUrl"].rstrip("/")
+
+# Where responses came from since startup, reported by the headless scan
+_request_stats = {"network": 0, "cache": 0}
+_request_stats_lock = threading.Lock()
+
+
+def get_request_stats() -> dict[str, int]:
+    """Returns how many TMDB API responses were served from the network and from the cache"""
+    with _request_stats_lock:
+        return dict(_request_stats)
+
+
+def _cached_get(url: str, use_cache: bool = True) -> tuple[int, str]:
+    """GET request to the TMDB API, served from the local response cache when fresh
+
+    Only successful responses are cached, so failures are retried on the next call.
+
+    Args:
+        url (str): Request URL
+        use_cache (bool, optional): Set to False to force a network request. Defaults to True.
+
+    Returns:
+        tuple[int, str]: HTTP status code and response body
+    """
+    if use_cache:
+        cached = queries.get_tmdb_cache_entry(url)
+        if cached is not None and time.time() - cached[1] < CACHE_TTL_SECONDS:
+            with _request_stats_lock:
+                _request_stats["cache"] += 1
+            metrics.increment("tmdb.cache_hit")
+            return 200, cached[0]
+
+    for attempt in range(MAX_RETRIES + 1):
+        with metrics.timer("tmdb.request"):
+            response = requests.get(url, headers=HEADERS, timeout=5)
+        with _request_stats_lock:
+            _request_stats["network"] += 1
+        metrics.increment("tmdb.network_request")
+
+        if response.status_code != 429 or attempt == MAX_RETRIES:
+            break
+
+        metrics.increment("tmdb.rate_limited")
+
+        # Rate limited, wait as long as the server asks (capped) and try again
+        try:
+            retry_after = float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            retry_after = 1
+        time.sleep(min(retry_after, 10))
+
+    if response.status_code == 200:
+        queries.upsert_tmdb_cache_entry(url, response.text, time.time())
+    return response.status_code, response.text
+
+
+def warm_tmdb_cache() -> int:
+    """Refreshes cached responses that are past half of their lifetime, so lookups never wait on the network
+
+    Returns:
+        int: Number of refreshed responses
+    """
+    refreshed = 0
+    for url in queries.get_tmdb_cache_urls_fetched_before(time.time() - CACHE_TTL_SECONDS / 2):
+        try:
+            status_code, _ = _cached_get(url, use_cache=False)
+            refreshed += status_code == 200
+        except Exception as exception:
+            logger.warning("Could not refresh cached TMDB response for %s. Exception: %s", url, exception)
+    return refreshed
 
 
 def search_crew_tmdb_api_call(tmdb_id: str, is_tvshow: bool) -> str | None:
@@ -30,17 +114,15 @@ def search_crew_tmdb_api_call(tmdb_id: str, is_tvshow: bool) -> str | None:
     """
     try:
         search_type = "tv" if is_tvshow else "movie"
-        request_url = f"https://api.themoviedb.org/3/{search_type}/{tmdb_id}/credits?language=en-US"
+        request_url = f"{API_BASE_URL}/{search_type}/{tmdb_id}/credits?language=en-US"
 
-        response = requests.get(request_url, headers=HEADERS, timeout=5)
-        if response.status_code != 200:
-            print(
-                f"Failed to get data for id: {tmdb_id}. HTTP status code: {response.status_code}"
-            )
-            print(response.text)
+        status_code, response_text = _cached_get(request_url)
+        if status_code != 200:
+            logger.warning("Failed to get data for id: %s. HTTP status code: %s", tmdb_id, status_code)
+            logger.debug(response_text)
             return None
 
-        response_dict = json.loads(response.text)
+        response_dict = json.loads(response_text)
         directors_iterator = filter(
             lambda pers: (
                 pers["job"] == "Producer" if is_tvshow else pers["job"] == "Director"
@@ -50,13 +132,13 @@ def search_crew_tmdb_api_call(tmdb_id: str, is_tvshow: bool) -> str | None:
 
         director_data = next(directors_iterator, None)
         if not director_data:
-            print(f"Failed to find director for id: {tmdb_id}")
+            logger.info("Failed to find director for id: %s", tmdb_id)
             return None
 
         return director_data["name"]
     except Exception as exception:
-        print(
-            f"Encountered unexpected exception while trying to search crew member on TMDB. Exception: {exception}"
+        logger.warning(
+            "Encountered unexpected exception while trying to search crew member on TMDB. Exception: %s", exception
         )
     return None
 
@@ -73,52 +155,83 @@ def search_movie_tmbd_api_call(movie_name: str, is_tvshow: bool) -> list[dict[st
     """
     try:
         search_type = "tv" if is_tvshow else "movie"
-        search_url = f"https://api.themoviedb.org/3/search/{search_type}?query={movie_name}&include_adult=false&language=en-US&page=1"
+        search_url = f"{API_BASE_URL}/search/{search_type}?query={movie_name}&include_adult=false&language=en-US&page=1"
 
-        response = requests.get(search_url, headers=HEADERS, timeout=5)
+        status_code, response_text = _cached_get(search_url)
 
-        if response.status_code != 200:
-            print(
-                f"Failed to get data for {movie_name}. HTTP status code: {response.status_code}"
-            )
-            print(response.text)
+        if status_code != 200:
+            logger.warning("Failed to get data for %s. HTTP status code: %s", movie_name, status_code)
+            logger.debug(response_text)
             return None
 
-        response_dict = json.loads(response.text)
+        response_dict = json.loads(response_text)
 
         if len(response_dict["results"]) == 0:
-            print(f"Query returned no data for: {movie_name}")
+            logger.info("Query returned no data for: %s", movie_name)
             return None
         return response_dict["results"]
     except Exception as exception:
-        print(
-            f"Encountered unexpected exception while trying to search movie on TMDB. Exception: {exception}"
+        logger.warning(
+            "Encountered unexpected exception while trying to search movie on TMDB. Exception: %s", exception
         )
     return None
 
 def get_movie_details_api_call(tmdb_id: str, is_tvshow: bool) -> dict[str, Any]:
     try:
         search_type = "tv" if is_tvshow else "movie"
-        details_url = f"https://api.themoviedb.org/3/{search_type}/{tmdb_id}"
+        details_url = f"{API_BASE_URL}/{search_type}/{tmdb_id}"
 
-        response = requests.get(details_url, headers=HEADERS, timeout=5)
+        status_code, response_text = _cached_get(details_url)
 
-        if response.status_code != 200:
-            print(
-                f"Failed to get details for id: {id}. HTTP status code: {response.status_code}"
-            )
-            print(response.text)
+        if status_code != 200:
+            logger.warning("Failed to get details for id: %s. HTTP status code: %s", tmdb_id, status_code)
+            logger.debug(response_text)
             return None
 
-        response_dict = json.loads(response.text)
+        response_dict = json.loads(response_text)
         return response_dict
     except Exception as exception:
-        print(
-            f"Encountered unexpected exception while trying to search details for id: {id}. Exception: {exception}"
+        logger.warning(
+            "Encountered unexpected exception while trying to search details for id: %s. Exception: %s",
+            tmdb_id,
+            exception,
         )
     return None
     
 
+def get_tv_season_api_call(tmdb_id: str, season: int) -> dict[str, Any] | None:
+    """Sends an API call to retrieve the details of a season of a tv show
+
+    Args:
+        tmdb_id (str): TMDB id of the show
+        season (int): Season number, 0 for specials
+
+    Returns:
+        Optional[dict]: Season name, overview, poster path and episodes, None if it could not be retrieved
+    """
+    try:
+        season_url = f"{API_BASE_URL}/tv/{tmdb_id}/season/{season}"
+
+        status_code, response_text = _cached_get(season_url)
+
+        if status_code != 200:
+            logger.warning(
+                "Failed to get season %s of id: %s. HTTP status code: %s", season, tmdb_id, status_code
+            )
+            logger.debug(response_text)
+            return None
+
+        return json.loads(response_text)
+    except Exception as exception:
+        logger.warning(
+            "Encountered unexpected exception while trying to get season %s of id: %s. Exception: %s",
+            season,
+            tmdb_id,
+            exception,
+        )
+    return None
+
+
 def get_tmdb_metadata(movie_data: dict, is_tvshow: bool) -> dict:
     empty_output = {
         "title": "",
@@ -153,8 +266,9 @@ def get_tmdb_metadata(movie_data: dict, is_tvshow: bool) -> dict:
         }
         return tmdb_metadata
     except Exception as exception:
-        print(
-            f"Encountered unexpected exception while trying to retrieve needed metadata from TMDB data. Exception: {exception}"
+        logger.warning(
+            "Encountered unexpected exception while trying to retrieve needed metadata from TMDB data. Exception: %s",
+            exception,
         )
     return empty_output
 
@@ -166,20 +280,18 @@ def get_tmdb_configuration() -> dict | list | None:
         Optional[requests.Response]: TMDB configuration call response object
     """
     try:
-        config_url = "https://api.themoviedb.org/3/configuration"
-        response = requests.get(config_url, headers=HEADERS, timeout=5)
+        config_url = f"{API_BASE_URL}/configuration"
+        status_code, response_text = _cached_get(config_url)
 
-        if response.status_code != 200:
-            print(
-                f"Failed to fetch configuration. HTTP status code: {response.status_code}"
-            )
-            print(response.text)
+        if status_code != 200:
+            logger.warning("Failed to fetch configuration. HTTP status code: %s", status_code)
+            logger.debug(response_text)
             return None
 
-        return response.json()
+        return json.loads(response_text)
     except Exception as exception:
-        print(
-            f"Encountered unexpected exception while trying to retrieve tmdb configuration. Exception: {exception}"
+        logger.warning(
+            "Encountered unexpected exception while trying to retrieve tmdb configuration. Exception: %s", exception
         )
     return None
 
@@ -200,23 +312,24 @@ def download_tmdb_poster(poster_path: str, download_location: str, tmdb_configur
         size = poster_sizes[-2]  # Choose the second largest available size
 
         # Build the image URL
-        base_url = "https://image.tmdb.org/t/p/"
-        poster_url = f"{base_url}{size}{poster_path}"
+        poster_url = f"{IMAGE_BASE_URL}/{size}{poster_path}"
 
         # Download the image
-        response = requests.get(poster_url, timeout=5)
+        with metrics.timer("tmdb.poster_request"):
+            response = requests.get(poster_url, timeout=5)
+        metrics.increment("tmdb.poster_request")
 
         if response.status_code != 200:
-            print(
-                f"Failed to download poster. HTTP status code: {response.status_code}"
-            )
-            print(response.text)
+            logger.warning("Failed to download poster. HTTP status code: %s", response.status_code)
+            logger.debug(response.text)
             return
 
-        with open(download_location, "wb") as file:
+        # Write then rename, a power cut never leaves a truncated poster. Versions of a title share
+        # their poster, the temp file is per thread so concurrent enrichments of them do not collide.
+        temp_location = f"{download_location}.{threading.get_ident()}.tmp"
+        with open(temp_location, "wb") as file:
             file.write(response.content)
-            print(f"Poster saved to: {download_location}")
+        os.replace(temp_location, download_location)
+        logger.debug("Poster saved to: %s", download_location)
     except Exception as exception:
-        print(
-            f"Encountered unexpected exception while trying to save poster. Exception: {exception}"
-        )
+        logger.warning("Encountered unexpected exception while trying to save poster. Exception: %s", exception)
@@ -0,0 +1,228 @@
+"""Seek preview ("trickplay") thumbnails.
+
+Every title gets one JPEG sprite sheet with a small frame every 'IntervalSecs',
+laid out row by row, and a JSON index describing the grid. The player crops the
+tile for the hovered time, so previews never touch the video file.
+"""
+import os
+import json
+import math
+import hashlib
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from PIL import Image
+
+from utils import metrics
+from utils.file_handling import load_json_file
+from utils.config_service import ConfigService
+from utils.task_scheduler import TaskScheduler, RESOURCE_CPU, PRIORITY_BACKGROUND
+
+TRICKPLAY_FOLDER = os.path.join("resources", "trickplay")
+
+logger = logging.getLogger(__name__)
+
+
+def _load_config() -> dict:
+    return ConfigService.get("trickplay_config.yaml")
+
+
+def get_trickplay_paths(video_path: str) -> tuple[str, str]:
+    """Returns where the sprite sheet and the index of a video are stored
+
+    Args:
+        video_path (str): Full path to the video file
+
+    Returns:
+        tuple[str, str]: Sprite sheet path, index path
+    """
+    key = hashlib.sha1(video_path.encode("utf-8")).hexdigest()
+    return os.path.join(TRICKPLAY_FOLDER, f"{key}.jpg"), os.path.join(TRICKPLAY_FOLDER, f"{key}.json")
+
+
+def _read_index(video_path: str) -> dict | None:
+    """Returns the index of the video if it exists and matches the file on disk"""
+    sheet_path, index_path = get_trickplay_paths(video_path)
+    if not (os.path.exists(index_path) and os.path.exists(sheet_path)):
+        return None
+
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+
+    index = load_json_file(index_path)
+    if not index or (index.get("size"), index.get("mtime_ns")) != (stat.st_size, stat.st_mtime_ns):
+        return None
+    return index
+
+
+def has_trickplay(video_path: str) -> bool:
+    """Returns True if an up to date sprite sheet exists for the video"""
+    return _read_index(video_path) is not None
+
+
+def generate_trickplay(video_path: str, stop_event: threading.Event | None = None) -> bool:
+    """Extracts the preview frames of a video into a sprite sheet, unless an up to date one exists
+
+    Args:
+        video_path (str): Full path to the video file
+        stop_event (threading.Event, optional): Set it to abandon the extraction early
+
+    Returns:
+        bool: True if a new sprite sheet was written
+    """
+    if has_trickplay(video_path):
+        return False
+
+    config = _load_config()
+    tile_width, tile_height, columns = config["TileWidth"], config["TileHeight"], config["Columns"]
+
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        logger.warning("Could not open %s for trickplay extraction", video_path)
+        return False
+
+    try:
+        stat = os.stat(video_path)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        if not fps:
+            return False
+        duration_secs = video.get(cv2.CAP_PROP_FRAME_COUNT) / fps
+
+        # Long videos get a wider interval so the sheet stays within 'MaxTiles'
+        interval = max(config["IntervalSecs"], math.ceil(duration_secs / config["MaxTiles"]))
+        count = max(int(duration_secs // interval), 1)
+        rows = math.ceil(count / columns)
+        sheet = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+
+        with metrics.timer("trickplay.generate"):
+            for idx in range(count):
+                # Also where generation pauses for playback
+                if TaskScheduler.checkpoint() or (stop_event is not None and stop_event.is_set()):
+                    return False
+
+                # Seeking lands on the nearest keyframe, which is all a preview needs
+                video.set(cv2.CAP_PROP_POS_MSEC, idx * interval * 1000)
+                res, frame = video.read()
+                if not res:
+                    count = idx
+                    break
+
+                row, column = divmod(idx, columns)
+                sheet[
+                    row * tile_height : (row + 1) * tile_height,
+                    column * tile_width : (column + 1) * tile_width,
+                ] = cv2.resize(frame, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+    finally:
+        video.release()
+
+    if count == 0:
+        return False
+
+    sheet_path, index_path = get_trickplay_paths(video_path)
+    os.makedirs(TRICKPLAY_FOLDER, exist_ok=True)
+
+    # Write then rename, so a reader never sees a half written sheet
+    rows_used = math.ceil(count / columns)
+    cv2.imwrite(
+        sheet_path + ".tmp.jpg",
+        sheet[: rows_used * tile_height],
+        [cv2.IMWRITE_JPEG_QUALITY, config["JpegQuality"]],
+    )
+    os.replace(sheet_path + ".tmp.jpg", sheet_path)
+    with open(index_path + ".tmp", "w", encoding="utf_8") as index_f:
+        json.dump(
+            {
+                "interval": interval,
+                "count": count,
+                "columns": columns,
+                "tile_width": tile_width,
+                "tile_height": tile_height,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            },
+            index_f,
+        )
+    os.replace(index_path + ".tmp", index_path)
+    return True
+
+
+class TrickplaySheet:
+    """A loaded sprite sheet, gives the preview tile for any time in the video"""
+
+    def __init__(self, sheet: Image.Image, index: dict) -> None:
+        self._sheet = sheet
+        self._index = index
+
+    @property
+    def tile_size(self) -> tuple[int, int]:
+        return self._index["tile_width"], self._index["tile_height"]
+
+    def get_tile(self, seconds: float) -> Image.Image:
+        """Returns the preview closest to (at or before) the given time
+
+        Args:
+            seconds (float): Position in the video
+
+        Returns:
+            Image.Image: Preview tile
+        """
+        idx = min(max(int(seconds // self._index["interval"]), 0), self._index["count"] - 1)
+        row, column = divmod(idx, self._index["columns"])
+        width, height = self.tile_size
+        return self._sheet.crop((column * width, row * height, (column + 1) * width, (row + 1) * height))
+
+
+def load_trickplay(video_path: str) -> TrickplaySheet | None:
+    """Loads the sprite sheet of a video
+
+    Args:
+        video_path (str): Full path to the video file
+
+    Returns:
+        Optional[TrickplaySheet]: The sheet, None if it was not generated yet or is out of date
+    """
+    index = _read_index(video_path)
+    if index is None:
+        return None
+
+    sheet_path, _ = get_trickplay_paths(video_path)
+    try:
+        with Image.open(sheet_path) as sheet:
+            sheet.load()
+            return TrickplaySheet(sheet, index)
+    except OSError as exception:
+        logger.warning("Could not load trickplay sheet of %s: %s", video_path, exception)
+    return None
+
+
+def _generate_if_present(video_path: str) -> bool:
+    if not os.path.exists(video_path):
+        return False
+    generated = generate_trickplay(video_path)
+    if generated:
+        logger.debug("Generated trickplay sheet for %s", video_path)
+    return generated
+
+
+def schedule_trickplay(video_paths: list[str]) -> None:
+    """Queues sprite sheet generation on the background scheduler, videos already queued are skipped
+
+    Generation pauses while a video plays, so it never competes with playback for disk and CPU.
+
+    Args:
+        video_paths (list[str]): Full paths to the video files
+    """
+    for video_path in video_paths:
+        TaskScheduler.submit(
+            _generate_if_present,
+            video_path,
+            resource=RESOURCE_CPU,
+            priority=PRIORITY_BACKGROUND,
+            name="trickplay",
+            key=("trickplay", video_path),
+        )
@@ -0,0 +1,114 @@
+"""Show and season entries of the browser, built over the series hierarchy kept by the database.
+
+Triggers file every indexed episode under its show ('tv_show', one per parsed
+title) and season ('tv_season'), and keep their episode counts, total runtime,
+watched counts and next unwatched episode materialized as files are indexed,
+removed or played. The browser shows a series as one entry and drills down into
+its seasons, then its episodes. Show and season entries are VideoMetadata built
+here so the card and the carousel render them like any title, their 'tvshow://'
+paths never reach the player: playing one plays its next unwatched episode.
+"""
+import dataclasses
+
+from utils.database import models
+
+ENTRY_SCHEME = "tvshow://"
+
+
+def entry_path(show_id: int, season: int | None = None) -> str:
+    """Path of the entry of a show, or of one of its seasons"""
+    if season is None:
+        return f"{ENTRY_SCHEME}{show_id}"
+    return f"{ENTRY_SCHEME}{show_id}/{season}"
+
+
+def parse_entry_path(path: str) -> tuple[int, int | None] | None:
+    """Returns the show id and season (None for the show itself) of an entry path, None for any other path"""
+    if not path.startswith(ENTRY_SCHEME):
+        return None
+    show_id, _, season = path[len(ENTRY_SCHEME):].partition("/")
+    return int(show_id), int(season) if season else None
+
+
+def season_name(season: models.TvSeason) -> str:
+    """Name of a season from TMDB, e.g. 'Season 2' or 'Specials' when it was not fetched"""
+    if season.name:
+        return season.name
+    return "Specials" if season.season == 0 else f"Season {season.season}"
+
+
+def format_runtime(runtime_secs: int) -> str:
+    """Total runtime of several episodes, e.g. '12h 05m'"""
+    return f"{runtime_secs // 3600}h {runtime_secs // 60 % 60:02d}m"
+
+
+def _watched_summary(watched_count: int, episode_count: int, runtime_secs: int, next_episode: str) -> str:
+    summary = f"{watched_count}/{episode_count} watched | {format_runtime(runtime_secs)}"
+    return f"{summary} | Next {next_episode}" if next_episode else summary
+
+
+def show_entry(show: models.TvShow, episode: models.VideoMetadata) -> models.VideoMetadata:
+    """Builds the entry of a show
+
+    Args:
+        show (models.TvShow): The show
+        episode (models.VideoMetadata): Episode it plays, its fields stand in for what TMDB did not return
+
+    Returns:
+        models.VideoMetadata: Entry, with the show poster, title and overview
+    """
+    return dataclasses.replace(
+        episode,
+        full_path=entry_path(show.id),
+        full_sub_path="",
+        image_path=show.image_path or episode.image_path,
+        tmdb_title=show.tmdb_title or episode.tmdb_title or show.title,
+        tmdb_director=show.tmdb_director or episode.tmdb_director,
+        tmdb_year=show.tmdb_year or episode.tmdb_year,
+        tmdb_overview=show.tmdb_overview or episode.tmdb_overview,
+        tmdb_genres=show.tmdb_genres or episode.tmdb_genres,
+        parsed_name=None,
+    )
+
+
+def show_summary(show: models.TvShow, next_episode: str = "") -> str:
+    """Seasons, watched episodes, total runtime and next episode label of a show, shown on its card"""
+    seasons = f"{show.season_count} season{'s' if show.season_count != 1 else ''}"
+    return f"{seasons} | " + _watched_summary(
+        show.watched_count, show.episode_count, show.runtime_secs, next_episode
+    )
+
+
+def episode_entry(show: models.TvShow, episode: models.VideoMetadata) -> models.VideoMetadata:
+    """Returns an episode as listed in its season, titled after its show until TMDB matched it"""
+    if episode.tmdb_title:
+        return episode
+    return dataclasses.replace(episode, tmdb_title=show.tmdb_title or show.title)
+
+
+def season_entry(
+    show: models.TvShow, season: models.TvSeason, episode: models.VideoMetadata
+) -> models.VideoMetadata:
+    """Builds the entry of a season
+
+    Args:
+        show (models.TvShow): Show of the season
+        season (models.TvSeason): The season
+        episode (models.VideoMetadata): Episode it plays, its fields stand in for what TMDB did not return
+
+    Returns:
+        models.VideoMetadata: Entry, with the season poster and overview, or those of the show
+    """
+    entry = show_entry(show, episode)
+    return dataclasses.replace(
+        entry,
+        full_path=entry_path(show.id, season.season),
+        image_path=season.image_path or entry.image_path,
+        tmdb_title=f"{entry.tmdb_title} - {season_name(season)}",
+        tmdb_overview=season.overview or entry.tmdb_overview,
+    )
+
+
+def season_summary(season: models.TvSeason, next_episode: str = "") -> str:
+    """Watched episodes, total runtime and next episode label of a season, shown on its card"""
+    return _watched_summary(season.watched_count, season.episode_count, season.runtime_secs, next_episode)
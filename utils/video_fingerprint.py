@@ -0,0 +1,223 @@
+"""Detects several versions (encodes, copies) of the same title.
+
+A fingerprint is the video duration, the file size and a 64 bit perceptual hash
+(DCT hash) of a few frames sampled at fixed fractions of the duration. Two files
+with about the same duration and close frame hashes are versions of one title:
+they share the TMDB metadata and poster, and the browser shows them as one card.
+"""
+import os
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from utils import metrics
+from utils.config_service import ConfigService
+from utils.database import queries, models
+
+logger = logging.getLogger(__name__)
+
+_FRAME_SIZE = 32
+_HASH_SIZE = 8
+
+# Fingerprint lookup and insert must be atomic, or two versions indexed at once both start a group
+_grouping_lock = threading.Lock()
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix, 'D @ X @ D.T' is the 2D DCT of X"""
+    k = np.arange(size)[:, None]
+    i = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT_MATRIX = _dct_matrix(_FRAME_SIZE)
+
+
+def _load_config() -> dict:
+    return ConfigService.get("duplicate_detection_config.yaml")
+
+
+def perceptual_hashes(frames: np.ndarray) -> np.ndarray:
+    """Computes the DCT hash of a batch of frames at once
+
+    Args:
+        frames (np.ndarray): Grayscale frames, shape (n, 32, 32)
+
+    Returns:
+        np.ndarray: One uint64 hash per frame
+    """
+    coefficients = _DCT_MATRIX @ frames.astype(np.float32) @ _DCT_MATRIX.T
+    low_frequencies = coefficients[:, :_HASH_SIZE, :_HASH_SIZE].reshape(len(frames), -1)
+    # The DC term (overall brightness) is left out of the median
+    medians = np.median(low_frequencies[:, 1:], axis=1, keepdims=True)
+    bits = np.packbits(low_frequencies > medians, axis=1)
+    return bits.view(">u8").ravel().astype(np.uint64)
+
+
+def hamming_distances(hashes: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Number of differing bits between hashes, broadcasting like any NumPy operation
+
+    Args:
+        hashes (np.ndarray): uint64 hashes
+        other (np.ndarray): uint64 hashes
+
+    Returns:
+        np.ndarray: Bit distances
+    """
+    differences = np.bitwise_xor(hashes, other)
+    bits = np.unpackbits(differences[..., None].view(np.uint8), axis=-1)
+    return bits.sum(axis=-1)
+
+
+def compute_fingerprint(video_path: str, sample_count: int) -> models.VideoFingerprint | None:
+    """Samples frames of a video and builds its fingerprint
+
+    Args:
+        video_path (str): Full path to the video file
+        sample_count (int): Number of frames to hash
+
+    Returns:
+        Optional[models.VideoFingerprint]: Fingerprint, None if the video could not be read
+    """
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        logger.warning("Could not open %s to fingerprint it", video_path)
+        return None
+
+    try:
+        fps = video.get(cv2.CAP_PROP_FPS)
+        frame_count = video.get(cv2.CAP_PROP_FRAME_COUNT)
+        if not fps or not frame_count:
+            return None
+
+        # Evenly spread, skipping the very start and end (logos, black frames, credits)
+        frames = []
+        for fraction in np.linspace(0, 1, sample_count + 2)[1:-1]:
+            video.set(cv2.CAP_PROP_POS_FRAMES, int(frame_count * fraction))
+            res, frame = video.read()
+            if not res:
+                return None
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frames.append(cv2.resize(gray, (_FRAME_SIZE, _FRAME_SIZE), interpolation=cv2.INTER_AREA))
+    finally:
+        video.release()
+
+    return models.VideoFingerprint(
+        full_path=video_path,
+        duration_secs=frame_count / fps,
+        size=os.path.getsize(video_path),
+        frame_hashes=[int(frame_hash) for frame_hash in perceptual_hashes(np.stack(frames))],
+    )
+
+
+def _find_matching_group(fingerprint: models.VideoFingerprint, config: dict) -> models.VideoFingerprint | None:
+    """Returns the closest stored fingerprint within the duration and hash tolerances"""
+    tolerance = config["DurationToleranceSecs"]
+    candidates = [
+        candidate
+        for candidate in queries.get_fingerprints_by_duration(
+            fingerprint.duration_secs - tolerance, fingerprint.duration_secs + tolerance
+        )
+        if candidate.full_path != fingerprint.full_path
+    ]
+    if not candidates:
+        return None
+
+    # Fingerprints taken with another 'SampleFrames' setting are compared on their common frames
+    hash_count = min(len(fingerprint.frame_hashes), *(len(c.frame_hashes) for c in candidates))
+    candidate_hashes = np.array([c.frame_hashes[:hash_count] for c in candidates], dtype=np.uint64)
+    own_hashes = np.array(fingerprint.frame_hashes[:hash_count], dtype=np.uint64)
+
+    mean_distances = hamming_distances(candidate_hashes, own_hashes).mean(axis=1)
+    best = int(np.argmin(mean_distances))
+    if mean_distances[best] > config["MaxHammingDistance"]:
+        return None
+    return candidates[best]
+
+
+def add_to_version_group(
+    video_path: str, fingerprint: models.VideoFingerprint | None = None
+) -> models.VideoMetadata | None:
+    """Fingerprints a video, stores it and joins the group of a matching title
+
+    Args:
+        video_path (str): Full path to the video file
+        fingerprint (models.VideoFingerprint, optional): Fingerprint known already, e.g. from a LAN peer
+
+    Returns:
+        Optional[models.VideoMetadata]: An already indexed version of the same title, None if there is none
+    """
+    config = _load_config()
+    if not config["Enabled"]:
+        return None
+
+    if fingerprint is None:
+        with metrics.timer("scan.fingerprint"):
+            fingerprint = compute_fingerprint(video_path, config["SampleFrames"])
+    if fingerprint is None:
+        return None
+
+    with _grouping_lock:
+        match = _find_matching_group(fingerprint, config)
+        queries.insert_video_fingerprint(fingerprint, match.group_id if match else None)
+
+    if match is None:
+        return None
+
+    metrics.increment("scan.version_matched")
+    for member in queries.get_fingerprints_by_group(match.group_id):
+        video = queries.get_video_by_path(member.full_path)
+        if video is not None:
+            logger.info("%s is another version of %s", video_path, member.full_path)
+            return video
+    return None
+
+
+def fingerprint_missing_videos() -> int:
+    """Fingerprints and groups the videos indexed before duplicate detection existed
+
+    Returns:
+        int: Number of videos fingerprinted
+    """
+    fingerprinted = 0
+    for video_path in queries.get_video_paths_without_fingerprint():
+        if os.path.exists(video_path):
+            add_to_version_group(video_path)
+            fingerprinted += 1
+    return fingerprinted
+
+
+def group_versions(
+    metadata_list: list[models.VideoMetadata],
+) -> tuple[list[models.VideoMetadata], dict[str, list[models.VideoMetadata]]]:
+    """Collapses versions of the same title, keeping the order of the list
+
+    Args:
+        metadata_list (list[models.VideoMetadata]): Every indexed video
+
+    Returns:
+        tuple: One video per title, and full path of that video -> all its versions (largest file first)
+    """
+    fingerprints = queries.get_fingerprints_by_path()
+
+    titles, versions_by_group = [], {}
+    for metadata in metadata_list:
+        fingerprint = fingerprints.get(metadata.full_path)
+        group_key = fingerprint.group_id if fingerprint else metadata.full_path
+        if group_key not in versions_by_group:
+            versions_by_group[group_key] = []
+            titles.append(metadata)
+        versions_by_group[group_key].append(metadata)
+
+    def _size(metadata: models.VideoMetadata) -> int:
+        fingerprint = fingerprints.get(metadata.full_path)
+        return fingerprint.size if fingerprint else 0
+
+    versions = {}
+    for title, group_key in zip(titles, versions_by_group):
+        versions[title.full_path] = sorted(versions_by_group[group_key], key=_size, reverse=True)
+    return titles, versions
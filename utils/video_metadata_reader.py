@@ -1,122 +1,62 @@
 import os
-import re
 import copy
+import time
+import logging
+import sqlite3
+import dataclasses
 
-from datetime import datetime
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 
 from pymediainfo import MediaInfo
 from langcodes import Language, LanguageTagError
-from torrent_name_parser import TorrentNameParser as TNP
 
-from utils.file_handling import load_yaml_file
+from utils.config_service import ConfigService
+from utils.task_scheduler import TaskScheduler
 from utils.database import queries, models
+from . import metrics, enrichment, scan_journal, metadata_providers, peer_cache
 from .exceptions import FolderNotFoundException
-from .tmdb_utils import (
-    search_movie_tmbd_api_call,
-    get_tmdb_metadata,
-    get_movie_details_api_call,
-    download_tmdb_poster,
-    search_crew_tmdb_api_call,
-    get_tmdb_configuration,
-)
+from .directory_scanner import scan_video_entries
+from .filename_parser import parse_file_name
+from .video_fingerprint import add_to_version_group
+
+POSTERS_FOLDER = os.path.join("resources", "movie_posters")
+
+logger = logging.getLogger(__name__)
 
 
 class VideoMetadataReader:
     """Utility class for retrieving metadata from a multimedia file stored locally and storing the info in the database"""
 
-    def __init__(self, folder_path: str) -> None:
-        self._folder_path = folder_path
-        self._accepted_extensions = load_yaml_file(os.path.join(".", "config", "accepted_extension.yaml"))
-        # Full paths
-        self._file_names = self._read_video_file_names()
-        self._tmdb_configuration = get_tmdb_configuration()
+    def __init__(self, source: models.Source) -> None:
+        self._source = source
+        self._folder_path = source.path
+        self._accepted_extensions = frozenset(
+            ConfigService.get("accepted_extension.yaml")
+        )
 
-    def _read_video_file_names(self) -> list[str] | None:
-        """Retrieves all file names from 'self._folder_path' filtered by the 'self._accepted_extensions'
+    @property
+    def accepted_extensions(self) -> frozenset[str]:
+        """Video file extensions (lowercase, without the dot) picked up by the reader"""
+        return self._accepted_extensions
 
-        Returns:
-            list: List containing valid file names
-        """
-        file_names = []
-        try:
-            for dirpath, _, filenames in os.walk(self._folder_path):
-                for file in filenames:
-                    full_path = os.path.join(dirpath, file)
-                    if os.path.isfile(full_path):
-                        file_names.append(full_path)
-
-            # Filter using the accepted extensions list
-            file_names = [
-                file_name
-                for file_name in file_names
-                if file_name.split(".")[-1].lower() in self._accepted_extensions
-            ]
-        except FolderNotFoundException as exception:
-            print(f"Folder path: {self._folder_path} not found: {exception}")
-        except Exception as exception:
-            print(
-                f"Unexpected exception caught while retrieved file names from folder: {self._folder_path}, exception: {exception}"
-            )
-        return file_names
+    def _read_video_file_entries(self) -> Iterator[os.DirEntry]:
+        """Streams all files from 'self._folder_path' filtered by the 'self._accepted_extensions'
 
-    def _get_tmdb_movie_metadata(self, file_name: str, runtime_mins: int) -> dict[str, str]:
-        """Preprocessing and API call to TMDB to retrieve data about the movie / show
+        Raises:
+            FolderNotFoundException: If the library folder is missing (e.g. an unmounted share)
 
-        Args:
-            file_name (str): Original local media file name
-            runtime_mins (int): Video length in minutes
-            
         Returns:
-            dict: Extracted data from TMDB
+            Iterator[os.DirEntry]: Entries of the valid files, yielded while the folder is being walked
         """
-
-        # Extract movie name from file_name
-        tnp = TNP()
-        movie_name = tnp.parse(file_name).title
-        print(movie_name)
-
-        season_episode = re.search("[sS][0-9]{1,2}[eE][0-9]{1,2}", file_name)
-        is_tvshow = bool(season_episode)
-
-        # API Call to  get info about movie / show
-        movie_search_results = search_movie_tmbd_api_call(movie_name, is_tvshow)
-        
-        # Filter based on runtime
-        movie_data = None
-        runtime_key = "episode_run_time" if is_tvshow else "runtime"
-
-        if movie_search_results is not None and len(movie_search_results) > 0:
-            for search_result in movie_search_results:
-                if is_tvshow:
-                    movie_data = search_result
-                    break
-
-                details = get_movie_details_api_call(search_result["id"], is_tvshow)
-
-                try:
-                    tmdb_runtime = details[runtime_key][0] if is_tvshow else details[runtime_key]
-                except Exception as e:
-                    print(f"{e}, id: {search_result['id']}")
-                    tmdb_runtime = 0
-
-                if abs(int(tmdb_runtime) - runtime_mins) <= 1:
-                    movie_data = search_result
-                    break
-
-        # Return dict with needed data
-        metadata = get_tmdb_metadata(movie_data, is_tvshow)
-
-        # API Call for Director name
-        director = ""
-        if metadata["id"] != "":
-            director = search_crew_tmdb_api_call(metadata["id"], is_tvshow)
-
-        metadata["director"] = director
-
-        return metadata
+        if not os.path.isdir(self._folder_path):
+            raise FolderNotFoundException(self._folder_path)
+        return scan_video_entries(
+            self._folder_path, self._accepted_extensions, self._source.max_workers
+        )
 
     def _get_video_file_metadata(self, video_file_path: str) -> dict[str, str]:
         """Uses MediaInfo wrapper to get local video file metadata:
@@ -127,17 +67,19 @@ class VideoMetadataReader:
         Returns:
             dict: Local video file metada dictionary
         """
-        media_info = MediaInfo.parse(video_file_path)
+        with metrics.timer("scan.mediainfo"):
+            media_info = MediaInfo.parse(video_file_path)
 
         general_track = list(
             filter(lambda track: track.track_type == "General", media_info.tracks)
         )[0]
-        audio_track = list(
-            filter(lambda track: track.track_type == "Audio", media_info.tracks)
-        )[0]
+        audio_track = next(
+            filter(lambda track: track.track_type == "Audio", media_info.tracks), None
+        )
 
+        # Files without an audio track (e.g. screen recordings) have no language
         language = ""
-        if "language" in audio_track.to_data().keys():
+        if audio_track is not None and "language" in audio_track.to_data().keys():
             language = audio_track.to_data()["language"]
 
         metadata = copy.deepcopy(general_track.to_data())
@@ -157,7 +99,7 @@ class VideoMetadataReader:
         """
         video = cv2.VideoCapture(video_file_path)
         if not video.isOpened():
-            print(f"Could not open: {video_file_path}")
+            logger.warning("Could not open: %s", video_file_path)
             return None
 
         # Get position where to capture the screenshot
@@ -172,99 +114,318 @@ class VideoMetadataReader:
 
         res, frame = video.read()
         if not res:
-            print(f"Could not get screenshot of: {video_file_path}")
+            logger.warning("Could not get screenshot of: %s", video_file_path)
             return None
 
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         return frame
 
-    # TODO: Calculate set() difference and iterate through that to get the lists
-    def update_metadata_db(self) -> None:
-        db_metadata_list = queries.get_all_videos()
-        db_full_paths = [db_metadata.full_path for db_metadata in db_metadata_list]
+    def update_metadata_db(self, index_workers: int = 1, dry_run: bool = False) -> dict[str, int]:
+        """Incremental reconcile of the source: indexes new or changed files and drops deleted ones
 
-        # Remove metadata from the database that is not in the folder
-        for db_full_path in db_full_paths:
-            if not db_full_path in self._file_names:
-                queries.delete_video_by_path(db_full_path)
-                print(f"Deleted: {db_full_path} from database")
+        A file counts as unchanged when its size and mtime match the stored scan state.
+        Within the source's 'fingerprint_ttl_mins' a known file is trusted without even
+        a stat, which saves one round trip per file on network shares.
 
-        for file_name in self._file_names:
-            # If video metadata already exists
-            if file_name in db_full_paths:
+        Args:
+            index_workers (int, optional): Number of files indexed concurrently. Defaults to 1.
+            dry_run (bool, optional): Only count what would change, without writing anything. Defaults to False.
+
+        Returns:
+            dict[str, int]: Counts of 'seen', 'trusted', 'unchanged', 'added', 'failed' and 'removed' files
+        """
+        stats = dict.fromkeys(("seen", "trusted", "unchanged", "added", "failed", "removed"), 0)
+        source_id = self._source.id
+        known_files = queries.get_source_files(source_id)
+        db_full_paths = queries.get_video_paths_by_source(source_id)
+        trust_seconds = self._source.fingerprint_ttl_mins * 60
+        scan_started_at = time.time()
+
+        seen, unchanged, index_futures = set(), [], []
+        executor = ThreadPoolExecutor(max_workers=index_workers, thread_name_prefix="index")
+        try:
+            # New files get indexed while the rest of the tree is still being walked
+            for entry in self._read_video_file_entries():
+                seen.add(entry.path)
+                known = known_files.get(entry.path)
+                is_indexed = known is not None and entry.path in db_full_paths
+
+                if is_indexed and scan_started_at - known.checked_at < trust_seconds:
+                    stats["trusted"] += 1
+                    continue
+
+                stat = entry.stat()
+                if is_indexed and (known.size, known.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    unchanged.append(
+                        models.SourceFile(entry.path, stat.st_size, stat.st_mtime_ns, scan_started_at)
+                    )
+                    continue
+
+                if dry_run:
+                    stats["added"] += 1
+                else:
+                    index_futures.append(executor.submit(TaskScheduler.bind(self.update_paths), [entry.path], []))
+        except FolderNotFoundException as exception:
+            # Do not wipe the library because a share is not mounted
+            logger.warning("Skipping update of source %s: %s", self._source.name, exception)
+            return stats
+        finally:
+            executor.shutdown(wait=True)
+
+        for future in index_futures:
+            try:
+                indexed = future.result()
+            except Exception as exception:
+                logger.warning("Indexing job of source %s failed: %s", self._source.name, exception)
+                indexed = 0
+            stats["added"] += indexed
+            stats["failed"] += 1 - indexed
+
+        removed = sorted((db_full_paths | known_files.keys()) - seen)
+        stats["seen"] = len(seen)
+        stats["unchanged"] = len(unchanged)
+        stats["removed"] = len(removed)
+        metrics.observe("scan.source", time.time() - scan_started_at)
+        for name, count in stats.items():
+            metrics.increment(f"scan.files_{name}", count)
+        if dry_run:
+            return stats
+
+        try:
+            queries.upsert_source_files(source_id, unchanged)
+        except sqlite3.Error as exception:
+            # Only costs a stat of these files on the next scan
+            logger.warning("Could not store the scan state of %d unchanged files: %s", len(unchanged), exception)
+        self.update_paths(added=[], removed=removed)
+        queries.update_source_last_scan(source_id, scan_started_at)
+        self._source.last_scan_at = scan_started_at
+        return stats
+
+    def update_paths(self, added: list[str], removed: list[str]) -> int:
+        """Incremental update: only processes the given paths
+
+        Args:
+            added (list[str]): New or changed video files to (re)index
+            removed (list[str]): Deleted files or folders, everything under a removed folder is dropped
+
+        Returns:
+            int: Number of added files that were indexed successfully
+        """
+        indexed = 0
+        source_id = self._source.id
+
+        if removed:
+            known_paths = queries.get_video_paths_by_source(source_id) | queries.get_source_files(
+                source_id
+            ).keys()
+            deleted_paths = []
+            for removed_path in removed:
+                if removed_path in known_paths:
+                    deleted_paths.append(removed_path)
+                else:
+                    # Not a known file, drop everything under it in case it was a folder
+                    folder_prefix = os.path.join(removed_path, "")
+                    deleted_paths.extend(
+                        known_path for known_path in known_paths if known_path.startswith(folder_prefix)
+                    )
+
+            for deleted_path in deleted_paths:
+                queries.delete_video_by_path(deleted_path)
+                logger.debug("Deleted: %s from database", deleted_path)
+            queries.delete_source_files(source_id, deleted_paths)
+
+        for file_name in added:
+            # Paused here while a video plays, when run by the background scheduler
+            if TaskScheduler.checkpoint():
+                logger.info("Indexing cancelled, %s is left for the next scan", file_name)
+                break
+
+            try:
+                stat = os.stat(file_name)
+                # Resumes where an interrupted scan stopped, else a changed file is re-indexed from scratch
+                journal_entry = scan_journal.load(file_name, stat)
+                if journal_entry is None:
+                    queries.delete_video_by_path(file_name)
+
+                with metrics.timer("scan.index_file"):
+                    self._index_file(file_name, stat, journal_entry)
+
+                queries.upsert_source_files(
+                    source_id,
+                    [models.SourceFile(file_name, stat.st_size, stat.st_mtime_ns, time.time())],
+                )
+            except Exception as exception:
+                # No scan state is stored, so the file is retried on the next scan
+                logger.warning("Could not index: %s, exception: %s", file_name, exception)
                 continue
-            
-            # Get file name without extension
-            file_name_no_ext = os.path.splitext(os.path.basename(file_name))[0]
-            
-            sub_path = os.path.join(
-                self._folder_path,
-                f"{file_name_no_ext}.srt",
-            )
 
-            # Get data
-            extracted_metadata = self._get_video_file_metadata(file_name)
-            
-            time_obj = datetime.strptime(extracted_metadata["other_duration"][3], "%H:%M:%S.%f")
-            runtime_mins = int(
-                time_obj.hour * 60
-                + time_obj.minute
-                + time_obj.second / 3600
-                + time_obj.microsecond / 1_000_000
-            )
-            tmdb_metadata = self._get_tmdb_movie_metadata(file_name_no_ext, runtime_mins)
-
-            # Language value priority is as follows:
-            #   1. language extracted from the local file metadata
-            #   2. language extracted from tmdb
-            if (
-                "language" in extracted_metadata.keys()
-                and extracted_metadata["language"] != ""
-            ):
-                try:
-                    language = Language.get(extracted_metadata["language"]).display_name()
-                except LanguageTagError as e:
-                    print(e)
-                    language = extracted_metadata["language"]
-            elif tmdb_metadata["original_language"] != "":
-                language = Language.get(
-                    tmdb_metadata["original_language"]
-                ).display_name()
-            else:
-                language = "N/A"
+            indexed += 1
+
+        return indexed
 
-            # Download poster from TMDB
-            poster_download_path = os.path.join(
-                "resources",
-                "movie_posters",
-                f"{file_name_no_ext}.jpg",
+    def _index_file(
+        self,
+        file_name: str,
+        stat: os.stat_result,
+        journal_entry: models.ScanJournalEntry | None = None,
+    ) -> None:
+        """Extracts the local metadata of one video file and inserts it in the database
+
+        Only local work happens here, so the file shows up in the browser right away.
+        A LAN peer that indexed a copy of the file is asked first, then sidecar NFOs,
+        embedded tags and poster files, what they do not resolve is queued for the
+        TMDB lookup and poster download of 'utils.enrichment'.
+        Every stage is journaled, a file interrupted mid-way resumes after its last completed stage.
+
+        Args:
+            file_name (str): Full path to the video file
+            stat (os.stat_result): Stat of the file, stored with the journal entry
+            journal_entry (models.ScanJournalEntry, optional): Progress of an interrupted run to resume
+        """
+        if scan_journal.reached(journal_entry, "committed"):
+            return
+        progress = dict(journal_entry.data) if journal_entry is not None else {}
+
+        # Get file name without extension
+        file_name_no_ext = os.path.splitext(os.path.basename(file_name))[0]
+
+        sub_path = os.path.join(
+            os.path.dirname(file_name),
+            f"{file_name_no_ext}.srt",
+        )
+
+        # Get data, a peer that knows the file saves probing it
+        if not scan_journal.reached(journal_entry, "probed"):
+            progress["content_hash"] = peer_cache.partial_content_hash(file_name)
+            peer_entry = peer_cache.PeerCache.lookup(progress["content_hash"])
+            progress["peer"] = peer_entry.to_progress() if peer_entry is not None else None
+            if peer_entry is not None:
+                progress["length"], progress["language"] = peer_entry.length, ""
+            else:
+                # A corrupt file can crash or hang MediaInfo, the journal counts it against the file
+                with scan_journal.attempt(file_name, "probe", self._source.id, stat):
+                    extracted_metadata = self._get_video_file_metadata(file_name)
+                progress["length"] = extracted_metadata["other_duration"][3]
+                progress["language"] = extracted_metadata.get("language", "")
+            journal_entry = scan_journal.record(file_name, "probed", progress, self._source.id, stat)
+        peer_entry = peer_cache.PeerEntry.from_progress(progress["peer"]) if progress.get("peer") else None
+
+        parsed_name = parse_file_name(file_name)
+        logger.debug("Parsed %s from %s", parsed_name, file_name)
+
+        # Another version of an indexed title shares its TMDB metadata and poster
+        if not scan_journal.reached(journal_entry, "fingerprinted"):
+            other_version = add_to_version_group(
+                file_name, peer_entry.to_fingerprint(file_name, stat.st_size) if peer_entry is not None else None
             )
-            download_tmdb_poster(
-                tmdb_metadata["poster_path"],
-                poster_download_path,
-                self._tmdb_configuration,
+            progress["other_version"] = other_version.full_path if other_version is not None else None
+            journal_entry = scan_journal.record(file_name, "fingerprinted", progress)
+        elif progress["other_version"] is not None:
+            other_version = queries.get_video_by_path(progress["other_version"])
+        else:
+            other_version = None
+
+        # Language from the local file metadata, TMDB's original language is used if there is none
+        if progress["language"] != "":
+            try:
+                language = Language.get(progress["language"]).display_name()
+            except LanguageTagError as e:
+                logger.warning("Unknown language tag in %s: %s", file_name, e)
+                language = progress["language"]
+        elif peer_entry is not None and peer_entry.language:
+            language = peer_entry.language
+        elif other_version is not None:
+            language = other_version.language
+        else:
+            language = "N/A"
+
+        # NFO sidecars, embedded tags and local poster files, another version already has its metadata
+        if not scan_journal.reached(journal_entry, "local_metadata"):
+            progress["local_metadata"], progress["poster_source"] = None, ""
+            if other_version is None:
+                local_metadata, local_poster = None, None
+                if peer_entry is not None:
+                    with metrics.timer("scan.peer_metadata"):
+                        local_metadata, local_poster = peer_cache.PeerCache.resolve(peer_entry)
+                if local_metadata is None or local_poster is None:
+                    with metrics.timer("scan.local_metadata"):
+                        provider_metadata, provider_poster = metadata_providers.resolve(file_name, parsed_name)
+                    local_metadata, local_poster = local_metadata or provider_metadata, local_poster or provider_poster
+                if local_metadata is not None:
+                    progress["local_metadata"] = local_metadata.to_metadata()
+                if local_poster is not None:
+                    poster_path = os.path.join(
+                        POSTERS_FOLDER, file_name_no_ext + metadata_providers.image_extension(local_poster.poster)
+                    )
+                    # Write then rename, a power cut never leaves a truncated poster
+                    with open(poster_path + ".tmp", "wb") as poster_f:
+                        poster_f.write(local_poster.poster)
+                    os.replace(poster_path + ".tmp", poster_path)
+                    progress["poster_path"], progress["poster_source"] = poster_path, local_poster.provider
+            journal_entry = scan_journal.record(file_name, "local_metadata", progress)
+
+        # Without a local poster, and until TMDB is asked, the poster is a screenshot from the video
+        if not scan_journal.reached(journal_entry, "screenshot"):
+            if not progress.get("poster_source"):
+                poster_path, poster_source = os.path.join(POSTERS_FOLDER, f"{file_name_no_ext}.jpg"), "screenshot"
+                if other_version is not None and os.path.exists(other_version.image_path):
+                    poster_path, poster_source = other_version.image_path, other_version.poster_source
+                elif not os.path.exists(poster_path):
+                    # The screenshot a peer took of the same file saves decoding it
+                    peer_poster = peer_cache.PeerCache.fetch_poster(peer_entry) if peer_entry is not None else None
+                    if peer_poster is not None:
+                        with open(poster_path + ".tmp", "wb") as poster_f:
+                            poster_f.write(peer_poster)
+                        os.replace(poster_path + ".tmp", poster_path)
+                    else:
+                        with metrics.timer("scan.screenshot"), scan_journal.attempt(file_name, "screenshot"):
+                            poster_image = self._get_video_file_screenshot(file_name)
+                        if poster_image is not None:
+                            cv2.imwrite(poster_path + ".tmp.jpg", poster_image)
+                            os.replace(poster_path + ".tmp.jpg", poster_path)
+                progress["poster_path"], progress["poster_source"] = poster_path, poster_source
+            journal_entry = scan_journal.record(file_name, "screenshot", progress)
+
+        # Add metadata to the database
+        metadata = models.VideoMetadata(
+            language=language,
+            length=progress["length"],
+            image_path=progress["poster_path"],
+            full_path=file_name,
+            full_sub_path=sub_path,
+            tmdb_title=other_version.tmdb_title if other_version else "",
+            tmdb_director=other_version.tmdb_director if other_version else "",
+            tmdb_year=other_version.tmdb_year if other_version else "",
+            tmdb_overview=other_version.tmdb_overview if other_version else "",
+            tmdb_genres=other_version.tmdb_genres if other_version else [],
+            tmdb_poster_path=other_version.tmdb_poster_path if other_version else "",
+            source_id=self._source.id,
+            parsed_name=parsed_name,
+            metadata_source=other_version.metadata_source if other_version else "",
+            poster_source=progress.get("poster_source", ""),
+        )
+        local_metadata = progress.get("local_metadata")
+        if local_metadata is not None:
+            metadata = dataclasses.replace(
+                metadata,
+                tmdb_title=local_metadata["title"],
+                tmdb_director=local_metadata["director"],
+                tmdb_year=local_metadata["year"],
+                tmdb_overview=local_metadata["overview"],
+                tmdb_genres=local_metadata["genres"],
+                metadata_source=local_metadata["source"],
             )
+        # Inserted before a power cut that came ahead of the checkpoint
+        if queries.get_video_by_path(file_name) is None:
+            queries.insert_video(metadata, time.time())
+        # Journals of older versions resume without it
+        queries.upsert_video_content_hash(
+            file_name, progress.get("content_hash") or peer_cache.partial_content_hash(file_name)
+        )
 
-            # If poster download did not work save a screenshot from the video instead
-            if not os.path.exists(poster_download_path):
-                poster_image = self._get_video_file_screenshot(
-                    os.path.join(self._folder_path, file_name)
-                )
-                if poster_image is not None:
-                    cv2.imwrite(poster_download_path, poster_image)
-
-            # Add metadata to the database
-            metadata = models.VideoMetadata(
-                language=language,
-                length=extracted_metadata["other_duration"][3],
-                image_path=poster_download_path,
-                full_path=file_name,
-                full_sub_path=sub_path,
-                tmdb_title=tmdb_metadata["title"],
-                tmdb_director=tmdb_metadata["director"],
-                tmdb_year=tmdb_metadata["year"],
-                tmdb_overview=tmdb_metadata["overview"],
-                tmdb_genres=tmdb_metadata["genres"],
-                tmdb_poster_path=tmdb_metadata["poster_path"],
-            )
-            queries.insert_video(metadata)
+        if metadata.tmdb_title:
+            scan_journal.finish(file_name)
+        else:
+            # Enrichment carries on from this checkpoint
+            scan_journal.record(file_name, "committed", progress)
+            enrichment.enqueue([file_name])